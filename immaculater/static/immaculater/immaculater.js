@@ -44,12 +44,15 @@ createOption('all_even_deleted', 'Truly all, even deleted', currentlySelected) +
 '</div></form>';
 }
 
-function pjaxifyForms() {
-    $('.i-pjax-form').submit(function(event) {
+// root, if given, limits this to the forms inside root, e.g. to those added
+// after the page was loaded.
+function pjaxifyForms(root) {
+    var $root = root ? $(root) : $(document);
+    $root.find('.i-pjax-form').submit(function(event) {
         $.pjax.submit(event, '#main', {type: "POST", push: false, cache: false});
     });
     
-    $('.i-submits-when-changed').change(function(event) {
+    $root.find('.i-submits-when-changed').change(function(event) {
         $(this).closest('form').submit();
     });
 }
@@ -0,0 +1,51 @@
+"""Compares benchmark results (see run.py) against a baseline."""
+
+import collections
+
+Regression = collections.namedtuple(
+  'Regression', ['name', 'baseline_seconds', 'seconds', 'ratio'])
+
+
+def Regressions(baseline, results, tolerance, min_seconds):
+  """Returns the benchmarks that got slower.
+
+  A benchmark regressed if its median is more than (1 + tolerance) times the
+  baseline's and also at least min_seconds slower, the latter because tiny
+  timings are noisy. Benchmarks missing from either side are ignored.
+
+  Args:
+    baseline: dict  # run.py's JSON output
+    results: dict  # ditto
+    tolerance: float  # e.g., 0.2 for 20%
+    min_seconds: float
+  Returns:
+    [Regression]  # sorted by name
+  """
+  regressions = []
+  old = baseline['results']
+  for name, timing in sorted(results['results'].items()):
+    if name not in old:
+      continue
+    before, after = old[name]['median'], timing['median']
+    if after > before * (1 + tolerance) and after - before >= min_seconds:
+      regressions.append(Regression(
+        name=name, baseline_seconds=before, seconds=after,
+        ratio=after / before if before else float('inf')))
+  return regressions
+
+
+def Report(regressions):
+  """Returns a human-readable report.
+
+  Args:
+    regressions: [Regression]
+  Returns:
+    str
+  """
+  if not regressions:
+    return 'No regressions.'
+  lines = ['%d regression(s):' % len(regressions)]
+  for r in regressions:
+    lines.append('REGRESSION %s: %.6fs -> %.6fs (%.2fx)'
+                 % (r.name, r.baseline_seconds, r.seconds, r.ratio))
+  return '\n'.join(lines)
@@ -0,0 +1,30 @@
+"""Unittests for module 'compare'."""
+
+from pyatdllib.core import unitjest
+from pyatdllib.benchmarks import compare
+
+
+def _Results(**medians):
+  return {'meta': {},
+          'results': dict((name, {'min': m, 'median': m})
+                          for name, m in medians.items())}
+
+
+# pylint: disable=missing-docstring,too-many-public-methods
+class CompareTestCase(unitjest.TestCase):
+
+  def testRegressions(self):
+    baseline = _Results(load=1.0, save=1.0, txt=0.001, gone=1.0)
+    results = _Results(load=1.3, save=1.1, txt=0.002, new=5.0)
+    regressions = compare.Regressions(baseline, results, tolerance=0.2,
+                                      min_seconds=0.005)
+    self.assertEqual([r.name for r in regressions], ['load'])
+    self.assertAlmostEqual(regressions[0].ratio, 1.3)
+    self.assertEqual(
+      compare.Report(regressions),
+      '1 regression(s):\nREGRESSION load: 1.000000s -> 1.300000s (1.30x)')
+    self.assertEqual(compare.Report([]), 'No regressions.')
+
+
+if __name__ == '__main__':
+  unitjest.main()
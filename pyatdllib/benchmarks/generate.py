@@ -0,0 +1,181 @@
+"""Deterministically generates large to-do lists for benchmarking.
+
+Each shape (see SHAPES) stresses something different; 'realistic' mixes them.
+The same shape, size, and seed always produce the same protobuf, so results
+are comparable across runs and across machines.
+"""
+
+import collections
+import random
+
+from pyatdllib.core import pyatdl_pb2
+
+# Every timestamp is this plus a millisecond per item, in microseconds since
+# the epoch:
+_EPOCH_MICROSECONDS = 1500000000 * 10**6
+
+# Folders nest at most this deep; protobuf decoders limit message nesting:
+_MAX_FOLDER_DEPTH = 30
+
+_WORDS = (
+  'buy call email file fix plan read review schedule write '
+  'budget car dentist garden invoice lawn mortgage report taxes website '
+  'quickly today soon weekly monthly urgently carefully maybe').split()
+
+# Fractions are of the total number of items:
+Shape = collections.namedtuple(
+  'Shape',
+  ['folder_fraction',
+   'project_fraction',
+   'min_contexts',
+   'context_fraction',
+   'inbox_fraction',  # of actions, when there are projects
+   'completed_fraction',  # of actions
+   'deleted_fraction',  # of actions
+   'with_context_fraction',  # of actions
+   'with_note_fraction',  # of actions
+   'note_words',
+   'nest_folders'])  # True means a chain of folders, False means a bushy tree
+
+_REALISTIC = Shape(folder_fraction=0.005, project_fraction=0.05,
+                   min_contexts=20, context_fraction=0.0, inbox_fraction=0.05,
+                   completed_fraction=0.3, deleted_fraction=0.02,
+                   with_context_fraction=0.5, with_note_fraction=0.05,
+                   note_words=20, nest_folders=False)
+
+SHAPES = {
+  'realistic': _REALISTIC,
+  'wide_inbox': _REALISTIC._replace(folder_fraction=0.0,
+                                    project_fraction=0.0),
+  'deep_folders': _REALISTIC._replace(folder_fraction=0.02,
+                                      nest_folders=True),
+  'many_contexts': _REALISTIC._replace(context_fraction=0.2,
+                                       with_context_fraction=0.95),
+  'long_notes': _REALISTIC._replace(with_note_fraction=0.5, note_words=300),
+  'mostly_completed': _REALISTIC._replace(completed_fraction=0.9,
+                                          deleted_fraction=0.05),
+}
+
+
+class _Builder(object):
+  """Builds a pyatdl_pb2.ToDoList with contiguous UIDs.
+
+  Args:
+    seed: int
+  """
+
+  def __init__(self, seed):
+    self.random = random.Random(seed)
+    self._last_uid = 0
+    self._now = _EPOCH_MICROSECONDS
+    self.pb = pyatdl_pb2.ToDoList()
+    self._SetCommon(self.pb.inbox.common, 'inbox')
+    self.pb.inbox.is_active = True
+    self._SetCommon(self.pb.root.common, '')
+    self._SetCommon(self.pb.ctx_list.common, 'Contexts')
+
+  def _SetCommon(self, common, name, note=None, is_deleted=False):
+    self._last_uid += 1
+    self._now += 1000
+    common.uid = self._last_uid
+    common.is_deleted = is_deleted
+    common.metadata.name = name
+    if note is not None:
+      common.metadata.note = note
+    common.timestamp.ctime = self._now
+    common.timestamp.mtime = self._now
+    common.timestamp.dtime = self._now if is_deleted else -1
+
+  def Words(self, n):
+    return ' '.join(self.random.choice(_WORDS) for _ in range(n))
+
+  def Context(self):
+    pb = self.pb.ctx_list.contexts.add()
+    self._SetCommon(pb.common, '@%s %d' % (self.Words(1), self._last_uid + 1))
+    pb.is_active = True
+    return pb
+
+  def Folder(self, parent):
+    pb = parent.folders.add()
+    self._SetCommon(pb.common, 'F%d %s' % (self._last_uid + 1, self.Words(1)))
+    return pb
+
+  def Project(self, parent):
+    pb = parent.projects.add()
+    self._SetCommon(pb.common, 'P%d %s' % (self._last_uid + 1, self.Words(2)))
+    pb.is_active = True
+    return pb
+
+  def Action(self, project, shape, contexts):
+    pb = project.actions.add()
+    note = None
+    if self.random.random() < shape.with_note_fraction:
+      note = self.Words(shape.note_words)
+    is_deleted = self.random.random() < shape.deleted_fraction
+    self._SetCommon(pb.common, self.Words(3), note=note,
+                    is_deleted=is_deleted)
+    pb.is_complete = self.random.random() < shape.completed_fraction
+    if contexts and self.random.random() < shape.with_context_fraction:
+      pb.ctx.common.uid = self.random.choice(contexts).common.uid
+    return pb
+
+
+def ToDoList(shape_name, num_items, seed=0):
+  """Returns a to-do list of roughly the given size.
+
+  Args:
+    shape_name: str  # a key of SHAPES
+    num_items: int  # actions, projects, folders, and contexts all count
+    seed: int
+  Returns:
+    pyatdl_pb2.ToDoList
+  """
+  shape = SHAPES[shape_name]
+  builder = _Builder(seed)
+  num_folders = int(num_items * shape.folder_fraction)
+  num_projects = int(num_items * shape.project_fraction)
+  num_contexts = max(shape.min_contexts,
+                     int(num_items * shape.context_fraction))
+  num_actions = max(0, num_items - num_folders - num_projects - num_contexts)
+  contexts = [builder.Context() for _ in range(num_contexts)]
+  folders = []
+  for i in range(num_folders):
+    if shape.nest_folders:
+      parent = folders[-1] if i % _MAX_FOLDER_DEPTH else builder.pb.root
+    else:
+      parent = builder.random.choice([builder.pb.root] + folders[-10:])
+    folders.append(builder.Folder(parent))
+  projects = [builder.Project(builder.random.choice([builder.pb.root] + folders))
+              for _ in range(num_projects)]
+  for _ in range(num_actions):
+    if not projects or builder.random.random() < shape.inbox_fraction:
+      project = builder.pb.inbox
+    else:
+      project = builder.random.choice(projects)
+    builder.Action(project, shape, contexts)
+  return builder.pb
+
+
+def SampleUIDs(pb):
+  """Returns UIDs of typical items, for commands that take uid=N.
+
+  Args:
+    pb: pyatdl_pb2.ToDoList  # from ToDoList
+  Returns:
+    {'action': int, 'project': int, 'context': int|None}
+  """
+  projects = []
+  folders = [pb.root]
+  while folders:
+    folder = folders.pop()
+    projects.extend(folder.projects)
+    folders.extend(folder.folders)
+  projects.sort(key=lambda p: -len(p.actions))
+  project = projects[0] if projects else pb.inbox
+  if not project.actions:
+    project = pb.inbox
+  contexts = pb.ctx_list.contexts
+  return {'action': project.actions[len(project.actions) // 2].common.uid,
+          'project': project.common.uid,
+          'context': (contexts[len(contexts) // 2].common.uid
+                      if contexts else None)}
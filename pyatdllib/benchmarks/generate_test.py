@@ -0,0 +1,44 @@
+"""Unittests for module 'generate'."""
+
+from pyatdllib.core import tdl
+from pyatdllib.core import uid
+from pyatdllib.core import unitjest
+from pyatdllib.benchmarks import generate
+
+
+# pylint: disable=missing-docstring,too-many-public-methods
+class GenerateTestCase(unitjest.TestCase):
+
+  def testDeterministic(self):
+    self.assertEqual(generate.ToDoList('realistic', 300, seed=7),
+                     generate.ToDoList('realistic', 300, seed=7))
+    self.assertNotEqual(generate.ToDoList('realistic', 300, seed=7),
+                        generate.ToDoList('realistic', 300, seed=8))
+
+  def testEachShapeIsWellFormed(self):
+    for shape in sorted(generate.SHAPES):
+      pb = generate.ToDoList(shape, 500)
+      uid.singleton_factory = uid.Factory()
+      todolist = tdl.ToDoList.DeserializedProtobuf(pb.SerializeToString())
+      todolist.CheckIsWellFormed()
+      uids = generate.SampleUIDs(pb)
+      self.assertIsNotNone(todolist.ActionByUID(uids['action']), shape)
+      self.assertIsNotNone(todolist.ProjectByUID(uids['project']), shape)
+      self.assertIsNotNone(todolist.ContextByUID(uids['context']), shape)
+      num_items = len(pb.ctx_list.contexts) - 1  # sans /inbox
+      for project, unused_path in todolist.Projects():
+        num_items += 1 + len(project.items)
+      self.assertLessEqual(num_items, 500, shape)
+
+  def testDeepFolders(self):
+    pb = generate.ToDoList('deep_folders', 2000)
+    depth = 0
+    folder = pb.root
+    while folder.folders:
+      folder = folder.folders[0]
+      depth += 1
+    self.assertEqual(depth, 30)
+
+
+if __name__ == '__main__':
+  unitjest.main()
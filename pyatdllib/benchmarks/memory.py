@@ -0,0 +1,322 @@
+#!/usr/bin/python
+
+"""Measures how much memory a to-do list takes.
+
+For generated lists (see generate.py) or a real save file (--blob), reports
+
+- bytes per Action, Prj, Folder, Ctx, and note, according to sys.getsizeof
+  applied to the object, its __dict__, and everything reachable from those
+  except other items (an Action's Ctx counts toward the Ctx, not the Action),
+- the peak memory used while deserializing and while serializing, and
+- how many bytes go to duplicates: equal names, notes, and timestamps held
+  by distinct objects. Sharing one object per value would save that much.
+
+Peaks come from tracemalloc where it exists (Python 3). Otherwise each peak is
+measured in a forked child process as the growth of its maximum resident set
+size, which is coarser.
+
+Uses run.py's --sizes, --shapes, --seed, and --output. E.g.:
+
+  cd /path/to/immaculater && python -m pyatdllib.benchmarks.memory \\
+    --sizes=1000,100000 --shapes=realistic
+
+  python -m pyatdllib.benchmarks.memory --blob=/path/to/save_file --anonymize
+
+Results are JSON like so:
+
+  {'meta': {...},
+   'results': {'realistic/1000': {
+     'objects': {'action': {'count': int, 'bytes': int,
+                            'bytes_per_object': float}, ...},
+     'duplicates': {'name': {'objects': int, 'distinct_values': int,
+                             'bytes': int, 'duplicate_bytes': int}, ...},
+     'peak_bytes': {'deserialize': int, 'serialize': int},
+     'peak_method': 'tracemalloc'|'ru_maxrss',
+     'retained_bytes': int,
+     'serialized_bytes': int}}}
+"""
+
+from __future__ import print_function
+
+import gc
+import hashlib
+import json
+import os
+import platform
+import sys
+import time
+import traceback
+import types
+
+import gflags as flags  # https://code.google.com/p/python-gflags/
+
+from google.apputils import app
+
+from pyatdllib.benchmarks import generate
+from pyatdllib.benchmarks import run
+from pyatdllib.core import action
+from pyatdllib.core import auditable_object
+from pyatdllib.core import ctx
+from pyatdllib.core import folder
+from pyatdllib.core import prj
+from pyatdllib.ui import anonymize
+from pyatdllib.ui import immaculater
+from pyatdllib.ui import serialization
+
+try:
+  import tracemalloc  # pylint: disable=import-error
+except ImportError:
+  tracemalloc = None
+  import resource
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('blob', None, 'Instead of generated to-do lists, measure '
+                    'this save file (see --database_filename)')
+flags.DEFINE_bool('anonymize', False, 'With --blob, replace names and notes '
+                  'with gibberish of the same length first; equal strings '
+                  'stay equal')
+
+_KINDS = (('action', action.Action),
+          ('project', prj.Prj),
+          ('folder', folder.Folder),
+          ('context', ctx.Ctx))
+
+# Groups of attributes whose duplicated values DuplicateBytes measures:
+_DUPLICATE_GROUPS = (('name', ('name',)),
+                     ('note', ('note',)),
+                     ('timestamp', ('ctime', 'mtime', 'dtime')))
+
+_NOT_WALKED = (type, types.ModuleType, types.FunctionType, types.MethodType,
+               types.BuiltinFunctionType)
+
+
+def _Gibberish(s):
+  if not s:
+    return s
+  prefix = '@' if s.startswith('@') else ''
+  digest = hashlib.sha1(s.encode('utf-8')).hexdigest()
+  length = len(s) - len(prefix)
+  return prefix + (digest * (length // len(digest) + 1))[:length]
+
+
+def Anonymized(pb):
+  """Replaces names and notes with gibberish, in place.
+
+  Each string becomes one with the same number of characters, and equal
+  strings remain equal, so the footprint barely changes.
+
+  Args:
+    pb: pyatdl_pb2.ToDoList
+  Returns:
+    pyatdl_pb2.ToDoList  # pb
+  """
+  return anonymize.AnonymizedProtobuf(pb, _Gibberish)
+
+
+def _Bytes(obj, seen, other_items=False):
+  """Returns the bytes used by obj and what it references.
+
+  Args:
+    obj: object
+    seen: set(int)  # ids of objects already counted; updated
+    other_items: bool  # include items besides obj, e.g. an Action's Ctx?
+  Returns:
+    int
+  """
+  total = 0
+  stack = [obj]
+  while stack:
+    o = stack.pop()
+    if id(o) in seen or isinstance(o, _NOT_WALKED):
+      continue
+    if (not other_items and o is not obj and
+        isinstance(o, auditable_object.AuditableObject)):
+      continue
+    seen.add(id(o))
+    total += sys.getsizeof(o)
+    if isinstance(o, dict):
+      for k, v in o.items():
+        stack.append(k)
+        stack.append(v)
+    elif isinstance(o, (list, tuple, set, frozenset)):
+      stack.extend(o)
+    elif hasattr(o, '__dict__'):
+      stack.append(o.__dict__)
+  return total
+
+
+def _Items(todolist):
+  """Yields every Action, Prj, Folder, and Ctx."""
+  for item in todolist.Items():
+    if not isinstance(item, ctx.CtxList):
+      yield item
+
+
+def ObjectBytes(todolist):
+  """Returns bytes per kind of item; see the module docstring.
+
+  A note's bytes also count toward its item's.
+
+  Args:
+    todolist: tdl.ToDoList  # deserialized eagerly
+  Returns:
+    {str: {'count': int, 'bytes': int, 'bytes_per_object': float}}
+  """
+  result = dict((kind, {'count': 0, 'bytes': 0}) for kind, _ in _KINDS)
+  result['note'] = {'count': 0, 'bytes': 0}
+  seen = set()
+  for item in _Items(todolist):
+    for kind, cls in _KINDS:
+      if isinstance(item, cls):
+        result[kind]['count'] += 1
+        result[kind]['bytes'] += _Bytes(item, seen)
+        break
+    if item.note:
+      result['note']['count'] += 1
+      result['note']['bytes'] += sys.getsizeof(item.note)
+  for name, text in todolist.note_list.notes.items():
+    result['note']['count'] += 1
+    result['note']['bytes'] += sys.getsizeof(name) + sys.getsizeof(text)
+  for stats in result.values():
+    stats['bytes_per_object'] = (float(stats['bytes']) / stats['count']
+                                 if stats['count'] else 0.0)
+  return result
+
+
+def DuplicateBytes(todolist):
+  """Returns how much equal-but-distinct names, notes, and timestamps cost.
+
+  Args:
+    todolist: tdl.ToDoList
+  Returns:
+    {str: {'objects': int, 'distinct_values': int, 'bytes': int,
+           'duplicate_bytes': int}}
+  """
+  result = {}
+  for group, attributes in _DUPLICATE_GROUPS:
+    seen = set()
+    first_by_value = {}
+    stats = {'objects': 0, 'bytes': 0, 'duplicate_bytes': 0}
+    for item in _Items(todolist):
+      for attribute in attributes:
+        value = getattr(item, attribute, None)
+        if value is None or value == '' or id(value) in seen:
+          continue
+        seen.add(id(value))
+        size = sys.getsizeof(value)
+        stats['objects'] += 1
+        stats['bytes'] += size
+        if value in first_by_value:
+          stats['duplicate_bytes'] += size
+        else:
+          first_by_value[value] = value
+    stats['distinct_values'] = len(first_by_value)
+    result[group] = stats
+  return result
+
+
+def PeakBytes(function):
+  """Calls function() and returns the peak memory used meanwhile.
+
+  Without tracemalloc, function() runs in a forked child process, so any
+  side effects are lost.
+
+  Args:
+    function: function()->object
+  Returns:
+    (int, str)  # (bytes, 'tracemalloc'|'ru_maxrss')
+  Raises:
+    RuntimeError  # function raised in the child process
+  """
+  gc.collect()
+  if tracemalloc is not None:
+    tracemalloc.start()
+    try:
+      function()
+      return tracemalloc.get_traced_memory()[1], 'tracemalloc'
+    finally:
+      tracemalloc.stop()
+  read_fd, write_fd = os.pipe()
+  pid = os.fork()
+  if pid == 0:  # the child
+    status = 1
+    try:
+      os.close(read_fd)
+      before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+      function()
+      after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+      os.write(write_fd, str(after - before).encode('ascii'))
+      status = 0
+    except:  # pylint: disable=bare-except
+      traceback.print_exc()
+    finally:
+      os._exit(status)  # pylint: disable=protected-access
+  os.close(write_fd)
+  with os.fdopen(read_fd) as f:
+    output = f.read()
+  _, status = os.waitpid(pid, 0)
+  if status != 0 or not output:
+    raise RuntimeError('Measuring the peak failed; see stderr')
+  # Linux reports kibibytes, macOS bytes:
+  units = 1 if sys.platform == 'darwin' else 1024
+  return int(output) * units, 'ru_maxrss'
+
+
+def Measure(pb):
+  """Measures the given to-do list.
+
+  Args:
+    pb: pyatdl_pb2.ToDoList
+  Returns:
+    dict  # see 'results' in the module docstring
+  """
+  contents = run.Serialized(pb)
+  deserialize_peak, method = PeakBytes(lambda: run.Load(contents, lazy=False))
+  todolist = run.Load(contents, lazy=False)
+  serialize_peak, _ = PeakBytes(
+    lambda: serialization.SerializeToDoList2(todolist, run.Writer()))
+  return {'objects': ObjectBytes(todolist),
+          'duplicates': DuplicateBytes(todolist),
+          'peak_bytes': {'deserialize': deserialize_peak,
+                         'serialize': serialize_peak},
+          'peak_method': method,
+          'retained_bytes': _Bytes(todolist, set(), other_items=True),
+          'serialized_bytes': len(contents)}
+
+
+def main(argv):
+  if len(argv) != 1:
+    raise app.UsageError('Unexpected arguments: %s' % ' '.join(argv[1:]))
+  FLAGS.seed_upon_creation = False
+  FLAGS.database_filename = None
+  results = {}
+  if FLAGS.blob is not None:
+    pb = serialization.GetRawProtobuf(FLAGS.blob)
+    if FLAGS.anonymize:
+      Anonymized(pb)
+    results['blob'] = Measure(pb)
+  else:
+    for shape in FLAGS.shapes:
+      if shape not in generate.SHAPES:
+        raise app.UsageError('No such shape "%s"; see generate.SHAPES' % shape)
+      for size in [int(s) for s in FLAGS.sizes]:
+        print('%s/%d' % (shape, size), file=sys.stderr)
+        results['%s/%d' % (shape, size)] = Measure(
+          generate.ToDoList(shape, size, seed=FLAGS.seed))
+  serialized = json.dumps({'meta': {'python': platform.python_version(),
+                                    'platform': platform.platform(),
+                                    'time': time.time()},
+                           'results': results},
+                          indent=2, sort_keys=True)
+  if FLAGS.output is None:
+    print(serialized)
+  else:
+    with open(FLAGS.output, 'w') as f:
+      f.write(serialized + '\n')
+  return 0
+
+
+if __name__ == '__main__':
+  immaculater.RegisterUICmds(cloud_only=False)
+  app.run()
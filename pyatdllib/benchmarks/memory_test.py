@@ -0,0 +1,54 @@
+"""Unittests for module 'memory'."""
+
+from pyatdllib.benchmarks import generate
+from pyatdllib.benchmarks import memory
+from pyatdllib.benchmarks import run
+from pyatdllib.core import unitjest
+from pyatdllib.ui import immaculater
+immaculater.RegisterUICmds(cloud_only=False)
+
+
+# pylint: disable=missing-docstring,too-many-public-methods
+class MemoryTestCase(unitjest.TestCase):
+
+  def setUp(self):
+    super(MemoryTestCase, self).setUp()
+    self._pb = generate.ToDoList('realistic', 400)
+    self._todolist = run.Load(run.Serialized(self._pb), lazy=False)
+
+  def testObjectBytes(self):
+    objects = memory.ObjectBytes(self._todolist)
+    self.assertEqual(objects['context']['count'],
+                     len(self._pb.ctx_list.contexts))
+    self.assertEqual(objects['project']['count'],
+                     len(list(self._todolist.Projects())))
+    self.assertEqual(objects['action']['count'],
+                     len(list(self._todolist.Actions())))
+    for kind in ('action', 'project', 'folder', 'context', 'note'):
+      self.assertGreater(objects[kind]['bytes_per_object'], 0, kind)
+
+  def testDuplicateBytes(self):
+    actions = [a for a, _ in self._todolist.Actions()]
+    actions[0].name = u'same'
+    actions[1].name = u''.join([u'sa', u'me'])  # equal but not identical
+    duplicates = memory.DuplicateBytes(self._todolist)
+    self.assertGreater(duplicates['name']['duplicate_bytes'], 0)
+    self.assertLess(duplicates['name']['distinct_values'],
+                    duplicates['name']['objects'])
+
+  def testAnonymized(self):
+    names = [c.common.metadata.name for c in self._pb.ctx_list.contexts]
+    memory.Anonymized(self._pb)
+    anonymized = [c.common.metadata.name for c in self._pb.ctx_list.contexts]
+    self.assertEqual([len(n) for n in anonymized], [len(n) for n in names])
+    self.assertTrue(all(n.startswith('@') for n in anonymized))
+    self.assertFalse(set(names) & set(anonymized))
+    self.assertEqual(self._pb.inbox.common.metadata.name, 'inbox')
+
+  def testPeakBytes(self):
+    peak, unused_method = memory.PeakBytes(lambda: ' ' * (64 * 2**20))
+    self.assertGreater(peak, 32 * 2**20)
+
+
+if __name__ == '__main__':
+  unitjest.main()
@@ -0,0 +1,211 @@
+#!/usr/bin/python
+
+"""Replays recorded batches of commands and reports their latencies.
+
+The Django app records anonymized batches when IMMACULATER_RECORD_DIR is set;
+see todo/recording.py. Copy that directory somewhere and run, e.g.:
+
+  cd /path/to/immaculater && python -m pyatdllib.benchmarks.replay \\
+    --recording=/tmp/recording --speed=0
+
+Each user's to-do list starts out as their snapshot in the lists/
+subdirectory and evolves, in memory, as the batches run in the order they were
+recorded. Batches run one at a time, as in a gunicorn sync worker.
+--speed=1 keeps the recorded pace, 2 goes twice as fast, and 0 goes as fast as
+possible.
+
+The report (JSON on stdout or in --output, a table on stderr) gives latency
+percentiles overall, for read-only and read-write batches, and for each kind
+of batch (its first command besides cd, view, sort, and echo), alongside
+those recorded in production.
+"""
+
+from __future__ import print_function
+
+import cgi
+import glob
+import json
+import math
+import os
+import pipes
+import StringIO
+import sys
+import time
+
+import gflags as flags  # https://code.google.com/p/python-gflags/
+
+from google.apputils import app
+
+from pyatdllib.benchmarks import run
+from pyatdllib.core import pyatdl_pb2
+from pyatdllib.ui import immaculater
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('recording', None, 'Directory written by the Django app '
+                    'given IMMACULATER_RECORD_DIR')
+flags.DEFINE_float('speed', 0, 'Multiple of the recorded pace; 0 means as '
+                   'fast as possible', lower_bound=0)
+
+# Commands that the web UI prepends to batches; see
+# todo.views._apply_batch_of_commands:
+_PREAMBLE_COMMANDS = frozenset(['cd', 'view', 'sort', 'echo'])
+
+
+def LoadRecording(directory):
+  """Reads the snapshots and batches recorded in the given directory.
+
+  Args:
+    directory: str
+  Returns:
+    ({str: (int, pyatdl_pb2.ToDoList)},  # user: (version, to-do list)
+     [dict])  # records sorted by time; see todo/recording.py
+  """
+  snapshots = {}
+  for path in glob.glob(os.path.join(directory, 'lists', '*.pb')):
+    user, _, version = os.path.basename(path)[:-len('.pb')].rpartition('-')
+    if user in snapshots and snapshots[user][0] <= int(version):
+      continue
+    with open(path, 'rb') as f:
+      snapshots[user] = (int(version), pyatdl_pb2.ToDoList.FromString(f.read()))
+  records = []
+  for path in glob.glob(os.path.join(directory, 'commands-*.jsonl')):
+    with open(path) as f:
+      records.extend(json.loads(line) for line in f if line.strip())
+  records.sort(key=lambda r: r['time'])
+  return snapshots, records
+
+
+def _Kind(batch):
+  for argv in batch:
+    if argv and argv[0] not in _PREAMBLE_COMMANDS:
+      return argv[0]
+  return batch[0][0] if batch and batch[0] else '<empty>'
+
+
+def _Percentile(sorted_values, fraction):
+  index = int(math.ceil(fraction * len(sorted_values))) - 1
+  return sorted_values[min(max(index, 0), len(sorted_values) - 1)]
+
+
+def _Stats(seconds):
+  seconds = sorted(seconds)
+  if not seconds:
+    return {'count': 0}
+  return {'count': len(seconds),
+          'mean': sum(seconds) / len(seconds),
+          'p50': _Percentile(seconds, 0.5),
+          'p90': _Percentile(seconds, 0.9),
+          'p99': _Percentile(seconds, 0.99),
+          'max': seconds[-1]}
+
+
+def Replay(directory, speed, sleep=time.sleep):
+  """Replays the recording in the given directory.
+
+  Args:
+    directory: str
+    speed: float  # see --speed
+    sleep: function(float)->None
+  Returns:
+    dict  # see the module docstring
+  """
+  snapshots, records = LoadRecording(directory)
+  contents = dict((user, run.Serialized(pb))
+                  for user, (_, pb) in snapshots.items())
+  samples = []  # (kind, read_only, seconds, recorded_seconds)
+  skipped = failed = failed_when_recorded = 0
+  errors = {}
+  start = time.time()
+  for record in records:
+    user = record['user']
+    if user not in contents or (record['version'] or 0) < snapshots[user][0]:
+      skipped += 1  # recorded before the snapshot
+      continue
+    if speed > 0:
+      delay = start + (record['time'] - records[0]['time']) / speed - time.time()
+      if delay > 0:
+        sleep(delay)
+    lines = u''.join(u' '.join(pipes.quote(arg) for arg in argv) + u'\n'
+                     for argv in record['batch'])
+    writer = run.Writer()
+    batch_start = time.time()
+    try:
+      immaculater.ApplyBatchOfCommands(
+        StringIO.StringIO(lines), printer=lambda _: None,
+        reader=run.Reader(contents[user]), writer=writer,
+        html_escaper=lambda s: cgi.escape(s, quote=True))
+    except Exception as e:  # pylint: disable=broad-except
+      failed += 1
+      name = type(e).__name__
+      errors[name] = errors.get(name, 0) + 1
+    seconds = time.time() - batch_start
+    failed_when_recorded += bool(record['failed'])
+    if not record['read_only'] and writer.contents is not None:
+      contents[user] = writer.contents
+    samples.append((_Kind(record['batch']), record['read_only'], seconds,
+                    record['seconds']))
+
+  def Latencies(predicate):
+    chosen = [s for s in samples if predicate(s)]
+    return {'replayed': _Stats([s[2] for s in chosen]),
+            'recorded': _Stats([s[3] for s in chosen])}
+
+  return {'batches': len(samples),
+          'skipped': skipped,
+          'failed': failed,
+          'failed_when_recorded': failed_when_recorded,
+          'errors': errors,
+          'users': len(contents),
+          'seconds': time.time() - start,
+          'latency': Latencies(lambda _: True),
+          'read_only_latency': Latencies(lambda s: s[1]),
+          'read_write_latency': Latencies(lambda s: not s[1]),
+          'latency_by_kind': dict(
+            (kind, Latencies(lambda s, kind=kind: s[0] == kind))
+            for kind in set(s[0] for s in samples))}
+
+
+def _PrintTable(report, out):
+  out.write('%-24s %7s %11s %11s %11s %11s\n'
+            % ('kind', 'count', 'p50_ms', 'p90_ms', 'p99_ms', 'recorded_p50'))
+  rows = sorted(report['latency_by_kind'].items()) + [
+    ('TOTAL', report['latency'])]
+  for kind, latencies in rows:
+    replayed, recorded = latencies['replayed'], latencies['recorded']
+    if not replayed['count']:
+      continue
+    out.write('%-24s %7d %11.1f %11.1f %11.1f %11.1f\n'
+              % (kind, replayed['count'], 1000 * replayed['p50'],
+                 1000 * replayed['p90'], 1000 * replayed['p99'],
+                 1000 * recorded['p50']))
+  out.write('%d batches (%d failed, %d failed when recorded), %d skipped\n'
+            % (report['batches'], report['failed'],
+               report['failed_when_recorded'], report['skipped']))
+
+
+def main(argv):
+  if len(argv) != 1:
+    raise app.UsageError('Unexpected arguments: %s' % ' '.join(argv[1:]))
+  if FLAGS.recording is None:
+    raise app.UsageError('--recording is required')
+  # As in todo/views.py:
+  FLAGS.pyatdl_show_uid = True
+  FLAGS.database_filename = None
+  FLAGS.seed_upon_creation = False
+  FLAGS.no_context_display_string = 'Actions Without Context'
+  FLAGS.pyatdl_lazy_deserialization = True
+  report = Replay(FLAGS.recording, FLAGS.speed)
+  _PrintTable(report, sys.stderr)
+  serialized = json.dumps(report, indent=2, sort_keys=True)
+  if FLAGS.output is None:
+    print(serialized)
+  else:
+    with open(FLAGS.output, 'w') as f:
+      f.write(serialized + '\n')
+  return 0
+
+
+if __name__ == '__main__':
+  immaculater.RegisterUICmds(cloud_only=False)
+  app.run()
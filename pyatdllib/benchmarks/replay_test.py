@@ -0,0 +1,99 @@
+"""Unittests for module 'replay'."""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import gflags as flags  # https://code.google.com/p/python-gflags/
+
+from pyatdllib.benchmarks import replay
+from pyatdllib.core import tdl
+from pyatdllib.core import uid
+from pyatdllib.core import unitjest
+from pyatdllib.ui import anonymize
+from pyatdllib.ui import immaculater
+from pyatdllib.ui import lexer
+from pyatdllib.ui import state
+from pyatdllib.ui import uicmd
+immaculater.RegisterUICmds(cloud_only=False)
+
+FLAGS = flags.FLAGS
+
+
+def _Rename(name):
+  return anonymize.Renamed(
+    name, lambda n: hashlib.sha1(n.encode('utf-8')).hexdigest()[:8])
+
+
+def _Record(user, when, line, read_only=False, version=3):
+  return {'user': user, 'time': when, 'seconds': 0.01,
+          'read_only': read_only, 'failed': False, 'version': version,
+          'batch': [anonymize.AnonymizedArgv(
+            lexer.SplitCommandLineIntoArgv(line), _Rename)]}
+
+
+# pylint: disable=missing-docstring,too-many-public-methods
+class ReplayTestCase(unitjest.TestCase):
+
+  def setUp(self):
+    super(ReplayTestCase, self).setUp()
+    uid.singleton_factory = uid.Factory()
+    FLAGS.pyatdl_separator = '/'
+    FLAGS.pyatdl_paranoia = True
+    FLAGS.pyatdl_show_uid = True
+    FLAGS.database_filename = None
+    FLAGS.seed_upon_creation = False
+    FLAGS.no_context_display_string = '<none>'
+    self._dir = tempfile.mkdtemp()
+    the_state = state.State(lambda _: None, tdl.ToDoList(),
+                            uicmd.APP_NAMESPACE)
+    for line in ('mkctx @home', 'mkdir /F', 'mkprj /F/P', 'mkact /F/P/a'):
+      uicmd.ParsePyatdlPromptAndExecute(the_state, line)
+    os.mkdir(os.path.join(self._dir, 'lists'))
+    pb = anonymize.AnonymizedProtobuf(the_state.ToDoList().AsProto(), _Rename)
+    with open(os.path.join(self._dir, 'lists', 'u1-3.pb'), 'wb') as f:
+      f.write(pb.SerializeToString())
+    uid.singleton_factory = uid.Factory()
+
+  def tearDown(self):
+    shutil.rmtree(self._dir)
+    super(ReplayTestCase, self).tearDown()
+
+  def _WriteRecords(self, records):
+    with open(os.path.join(self._dir, 'commands-7.jsonl'), 'w') as f:
+      for record in records:
+        f.write(json.dumps(record) + '\n')
+
+  def testReplay(self):
+    # Out of order on purpose; the second batch needs the first's action.
+    self._WriteRecords([
+      _Record('u1', 1002.0, 'chctx @home /F/P/b'),
+      _Record('u1', 1001.0, 'mkact /F/P/b'),
+      _Record('u1', 1003.0, 'ls /F/P', read_only=True),
+      _Record('u1', 1000.0, 'complete /F/P/a', version=2),
+      _Record('u2', 1004.0, 'ls'),
+    ])
+    slept = []
+    report = replay.Replay(self._dir, speed=2, sleep=slept.append)
+    self.assertEqual(report['batches'], 3)
+    self.assertEqual(report['skipped'], 2)
+    self.assertEqual(report['failed'], 0, report['errors'])
+    self.assertEqual(report['latency']['replayed']['count'], 3)
+    self.assertEqual(report['read_only_latency']['replayed']['count'], 1)
+    self.assertEqual(sorted(report['latency_by_kind']),
+                     ['chctx', 'ls', 'mkact'])
+    self.assertLessEqual(len(slept), 3)
+    for seconds in slept:
+      self.assertLessEqual(seconds, 1.5)
+
+  def testFailure(self):
+    self._WriteRecords([_Record('u1', 1000.0, 'chctx @home /F/P/nonesuch')])
+    report = replay.Replay(self._dir, speed=0)
+    self.assertEqual(report['failed'], 1)
+    self.assertEqual(list(report['errors'].values()), [1])
+
+
+if __name__ == '__main__':
+  unitjest.main()
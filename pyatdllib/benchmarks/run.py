@@ -0,0 +1,270 @@
+#!/usr/bin/python
+
+"""Benchmarks pyatdl on large generated to-do lists.
+
+For each shape (see generate.SHAPES) and size, times loading (eagerly and
+lazily), saving, CheckIsWellFormed, and the common UICmds including the JSON
+listings and the TaskPaper and hypertext renderings. E.g.:
+
+  cd /path/to/immaculater && python -m pyatdllib.benchmarks.run \\
+    --sizes=1000,10000 --output=/tmp/new.json --baseline=/tmp/old.json
+
+Results are JSON like so:
+
+  {'meta': {'sizes': [int], 'shapes': [str], 'repetitions': int, ...},
+   'results': {'realistic/1000/load': {'min': float, 'median': float}, ...}}
+
+With --baseline, exits with status 1 if anything regressed; see
+compare.Regressions. With --input, compares saved results instead of running
+the benchmarks anew.
+
+A size of 1000000 is supported but takes minutes and gigabytes per shape.
+"""
+
+from __future__ import print_function
+
+import cgi
+import gc
+import json
+import platform
+import sys
+import time
+
+import gflags as flags  # https://code.google.com/p/python-gflags/
+
+from google.apputils import app
+
+from pyatdllib.benchmarks import compare
+from pyatdllib.benchmarks import generate
+from pyatdllib.core import tdl
+from pyatdllib.core import uid
+from pyatdllib.ui import immaculater
+from pyatdllib.ui import serialization
+from pyatdllib.ui import state
+from pyatdllib.ui import uicmd
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_list('sizes', ['1000', '10000', '100000'],
+                  'Numbers of items in the generated to-do lists')
+flags.DEFINE_list('shapes', sorted(generate.SHAPES),
+                  'Shapes of the generated to-do lists; see generate.SHAPES')
+flags.DEFINE_integer('seed', 0, 'Seed for the generators')
+flags.DEFINE_integer('repetitions', 3, 'Runs of each benchmark; we report the '
+                     'minimum and the median', lower_bound=1)
+flags.DEFINE_string('output', None, 'Where to write the results as JSON; '
+                    'stdout if unset')
+flags.DEFINE_string('input', None, 'Read results from this JSON file instead '
+                    'of running the benchmarks; useful with --baseline')
+flags.DEFINE_string('baseline', None, 'JSON results from a previous run to '
+                    'compare against')
+flags.DEFINE_float('regression_tolerance', 0.2, 'With --baseline, a median '
+                   'this much slower (0.2 means 20%) is a regression')
+flags.DEFINE_float('regression_min_seconds', 0.005, 'With --baseline, a median '
+                   'must also be this many seconds slower to be a regression')
+
+# Run in this order on one state.State. PROJECT, CONTEXT, and ACTION become
+# UIDs; see generate.SampleUIDs. The mutations come last:
+COMMANDS = (
+  'ls --recursive --show_all /',
+  'lsact --json uid=ACTION',
+  'lsctx --json',
+  'lsprj --json',
+  'inctx --json uid=CONTEXT',
+  'inprj --json uid=PROJECT',
+  'needsreview --json',
+  'pagedata projects',
+  'pagedata project uid=PROJECT',
+  'todo',
+  'txt',
+  'hypertext /todo/',
+  'mkact /inbox/Benchmark',
+  'complete uid=ACTION',
+  'uncomplete uid=ACTION',
+  'rename uid=ACTION Renamed',
+  'chctx uid=CONTEXT uid=ACTION',
+  'mv uid=ACTION /inbox',
+  'mkprj /Benchmark',
+  'deletecompleted',
+)
+
+
+class Reader(object):
+  """Reads a serialized to-do list from memory."""
+  name = 'benchmark'
+
+  def __init__(self, contents):
+    self._contents = contents
+
+  def read(self):
+    return self._contents
+
+
+class Writer(object):
+  """Keeps the latest serialized to-do list in memory."""
+
+  def __init__(self):
+    self.contents = None
+
+  def write(self, contents):
+    self.contents = contents
+
+
+def _Timed(function):
+  """Returns (seconds, result) after calling function()."""
+  gc.collect()
+  start = time.time()
+  result = function()
+  return time.time() - start, result
+
+
+def Load(contents, lazy):
+  """Deserializes the to-do list.
+
+  Args:
+    contents: bytes  # written by Writer
+    lazy: bool  # see --pyatdl_lazy_deserialization
+  Returns:
+    tdl.ToDoList
+  """
+  saved = FLAGS.pyatdl_lazy_deserialization
+  FLAGS.pyatdl_lazy_deserialization = lazy
+  try:
+    return serialization.DeserializeToDoList2(Reader(contents),
+                                              tdl_factory=uicmd.NewToDoList)
+  finally:
+    FLAGS.pyatdl_lazy_deserialization = saved
+
+
+def Serialized(pb):
+  """Returns what SerializeToDoList2 writes given a pyatdl_pb2.ToDoList."""
+  uid.singleton_factory = uid.Factory()
+  writer = Writer()
+  serialization.SerializeToDoList2(
+    tdl.ToDoList.DeserializedProtobuf(pb.SerializeToString()), writer)
+  return writer.contents
+
+
+def _Command(template, uids):
+  return (template.replace('PROJECT', str(uids['project']))
+          .replace('CONTEXT', str(uids['context']))
+          .replace('ACTION', str(uids['action'])))
+
+
+def _RunOnce(contents, uids):
+  """Runs each benchmark once.
+
+  Args:
+    contents: bytes  # the serialized to-do list
+    uids: dict  # see generate.SampleUIDs
+  Returns:
+    [(str, float)]  # (name, seconds)
+  """
+  timings = []
+  seconds, _ = _Timed(lambda: Load(contents, lazy=True))
+  timings.append(('load_lazy', seconds))
+  seconds, todolist = _Timed(lambda: Load(contents, lazy=False))
+  timings.append(('load', seconds))
+  seconds, _ = _Timed(todolist.CheckIsWellFormed)
+  timings.append(('check_is_well_formed', seconds))
+  seconds, _ = _Timed(
+    lambda: serialization.SerializeToDoList2(todolist, Writer()))
+  timings.append(('save', seconds))
+  # Like django.utils.html.escape, which the web UI uses:
+  the_state = state.State(lambda _: None, todolist, uicmd.APP_NAMESPACE,
+                          html_escaper=lambda s: cgi.escape(s, quote=True))
+  for template in COMMANDS:
+    command = _Command(template, uids)
+    seconds, _ = _Timed(
+      lambda: uicmd.ParsePyatdlPromptAndExecute(the_state, command))
+    timings.append(('cmd ' + template, seconds))
+  return timings
+
+
+def _Median(values):
+  values = sorted(values)
+  middle = len(values) // 2
+  if len(values) % 2:
+    return values[middle]
+  return (values[middle - 1] + values[middle]) / 2.0
+
+
+def RunBenchmarks(shapes, sizes, seed, repetitions, log=None):
+  """Runs all benchmarks.
+
+  Args:
+    shapes: [str]
+    sizes: [int]
+    seed: int
+    repetitions: int
+    log: function(str)->None|None
+  Returns:
+    dict  # see the module docstring
+  """
+  results = {}
+  for shape in shapes:
+    for size in sizes:
+      if log is not None:
+        log('%s/%d' % (shape, size))
+      pb = generate.ToDoList(shape, size, seed=seed)
+      uids = generate.SampleUIDs(pb)
+      contents = Serialized(pb)
+      del pb
+      runs = {}
+      for _ in range(repetitions):
+        for name, seconds in _RunOnce(contents, uids):
+          runs.setdefault(name, []).append(seconds)
+      for name, seconds in runs.items():
+        results['%s/%d/%s' % (shape, size, name)] = {
+          'min': min(seconds), 'median': _Median(seconds)}
+  return {'meta': {'shapes': list(shapes),
+                   'sizes': list(sizes),
+                   'seed': seed,
+                   'repetitions': repetitions,
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'time': time.time()},
+          'results': results}
+
+
+def _Log(message):
+  print(message, file=sys.stderr)
+
+
+def main(argv):
+  if len(argv) != 1:
+    raise app.UsageError('Unexpected arguments: %s' % ' '.join(argv[1:]))
+  if FLAGS.input is not None:
+    with open(FLAGS.input) as f:
+      results = json.load(f)
+  else:
+    for shape in FLAGS.shapes:
+      if shape not in generate.SHAPES:
+        raise app.UsageError('No such shape "%s"; see generate.SHAPES' % shape)
+    FLAGS.pyatdl_show_uid = True
+    FLAGS.seed_upon_creation = False
+    FLAGS.database_filename = None
+    results = RunBenchmarks(FLAGS.shapes, [int(s) for s in FLAGS.sizes],
+                            FLAGS.seed, FLAGS.repetitions, log=_Log)
+  serialized = json.dumps(results, indent=2, sort_keys=True)
+  if FLAGS.output is None:
+    if FLAGS.input is None:
+      print(serialized)
+  else:
+    with open(FLAGS.output, 'w') as f:
+      f.write(serialized + '\n')
+  if FLAGS.baseline is not None:
+    with open(FLAGS.baseline) as f:
+      baseline = json.load(f)
+    regressions = compare.Regressions(baseline, results,
+                                      FLAGS.regression_tolerance,
+                                      FLAGS.regression_min_seconds)
+    _Log(compare.Report(regressions))
+    if regressions:
+      return 1
+  return 0
+
+
+if __name__ == '__main__':
+  immaculater.RegisterUICmds(cloud_only=False)
+  app.run()
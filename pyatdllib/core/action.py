@@ -81,6 +81,7 @@ class Action(auditable_object.AuditableObject):
             name=pb.common.metadata.name,
             note=pb.common.metadata.note,
             context=the_context)
-    a.SetFieldsBasedOnProtobuf(pb.common)
     a.is_complete = pb.is_complete
+    # Last so that deserializing does not bump mtime:
+    a.SetFieldsBasedOnProtobuf(pb.common)
     return a
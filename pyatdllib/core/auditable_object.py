@@ -39,6 +39,19 @@ def _Int64Timestamp(float_time):
   return int(float_time * 1e6)
 
 
+def TimestampsFromProtobuf(pb):
+  """Returns the timestamps just as SetFieldsBasedOnProtobuf would set them.
+
+  Args:
+    pb: pyatdl_pb2.Timestamp
+  Returns:
+    (float, float, float|None)  # ctime, mtime, dtime
+  """
+  return (_FloatingPointTimestamp(pb.ctime),
+          _FloatingPointTimestamp(pb.mtime),
+          _FloatingPointTimestamp(pb.dtime))
+
+
 class Error(Exception):
   """Base class for this module's exceptions."""
 
@@ -74,11 +74,14 @@ class Folder(container.Container):
     return pb
 
   @classmethod
-  def DeserializedProtobuf(cls, bytestring):
+  def DeserializedProtobuf(cls, bytestring, lazy=False, fetch_projects=None):
     """Deserializes a Folder from the given protocol buffer.
 
     Args:
       bytestring: str
+      lazy: bool  # see prj.Prj.LazilyDeserializedProtobuf
+      fetch_projects: see the 'fetch' argument to
+        prj.Prj.LazilyDeserializedProtobuf; placeholders imply lazy
     Returns:
       Folder
     """
@@ -90,9 +93,14 @@ class Folder(container.Container):
     p.SetFieldsBasedOnProtobuf(pb.common)
     for pb_folder in pb.folders:
       p.items.append(
-        cls.DeserializedProtobuf(pb_folder.SerializeToString()))
+        cls.DeserializedProtobuf(pb_folder.SerializeToString(), lazy=lazy,
+                                 fetch_projects=fetch_projects))
     for pb_project in pb.projects:
-      p.items.append(
-        prj.Prj.DeserializedProtobuf(pb_project.SerializeToString()))
+      if lazy or prj.IsPlaceholder(pb_project):
+        p.items.append(prj.Prj.LazilyDeserializedProtobuf(
+          pb_project, fetch=fetch_projects))
+      else:
+        p.items.append(
+          prj.Prj.DeserializedProtobuf(pb_project.SerializeToString()))
     p.items.sort(key=lambda i: i.uid)
     return p
@@ -0,0 +1,388 @@
+"""Exports and imports a to-do list as JSON Lines, one object per line.
+
+Unlike the protocol buffer, which is one message that must be built or parsed
+in its entirety, this format can be written and read an object at a time, so
+it suits backups and migrations of large to-do lists. Export is a generator;
+Import consumes any iterable of lines.
+
+The first line describes the to-do list:
+
+  {"type": "todolist", "format": 1, "has_never_purged_deleted": bool}
+
+Each other line is one of the following, with parents preceding children:
+
+  {"type": "context_list"|"context"|"folder"|"project"|"action",
+   "uid": int, "name": str, "is_deleted": bool,
+   "note": str,  # except for the context_list
+   "ctime": float, "mtime": float, "dtime": float|null,  # seconds since
+                                                          # the epoch
+   # context:
+   "is_active": bool,
+   # folder, project, action:
+   "parent": int|null,  # the UID of the containing Folder or Project; null
+                        # for the root Folder and the Inbox
+   # project:
+   "is_complete": bool, "is_active": bool,
+   "max_seconds_before_review": float, "last_review_epoch_sec": float,
+   "default_context_uid": int|null,
+   "archived_uids": [int],  # archived actions Export could not load
+   # action:
+   "is_complete": bool,
+   "context": int|null}  # the UID of the Context
+
+  {"type": "note", "name": str, "note": str}  # see note.NoteList
+
+UIDs are preserved, so reset uid.singleton_factory before calling Import.
+"""
+
+import json
+
+import gflags as flags
+
+from . import action
+from . import auditable_object
+from . import ctx
+from . import folder
+from . import note
+from . import prj
+from . import tdl
+from . import timing
+from . import uid
+
+FLAGS = flags.FLAGS
+
+FORMAT = 1
+
+
+class Error(Exception):
+  """Base class for this module's exceptions."""
+
+
+class FormatError(Error):
+  """The input is not what Export writes."""
+
+
+def _Line(record):
+  # Without sort_keys, json uses its C encoder:
+  return json.dumps(record) + '\n'
+
+
+def _Common(object_type, obj):
+  """Returns the fields every AuditableObject has, plus name and note."""
+  record = {'type': object_type,
+            'uid': obj.uid,
+            'name': obj.name,
+            'is_deleted': obj.is_deleted,
+            'ctime': obj.ctime,
+            'mtime': obj.mtime,
+            'dtime': obj.dtime}
+  if object_type != 'context_list':  # CtxList has no note
+    record['note'] = obj.note
+  return record
+
+
+def _CommonFromProtobuf(object_type, pb):
+  """Returns what _Common would given the deserialized pyatdl_pb2.Common."""
+  ctime, mtime, dtime = auditable_object.TimestampsFromProtobuf(pb.timestamp)
+  return {'type': object_type,
+          'uid': pb.uid,
+          'name': pb.metadata.name,
+          'note': pb.metadata.note,
+          'is_deleted': pb.is_deleted,
+          'ctime': ctime,
+          'mtime': mtime,
+          'dtime': dtime}
+
+
+def _Uid(a):
+  """Returns the UID of the action.Action or pyatdl_pb2.Action."""
+  return a.uid if isinstance(a, action.Action) else a.common.uid
+
+
+def _ActionLine(a, project_uid):
+  """Returns the line for the action.Action or pyatdl_pb2.Action."""
+  if isinstance(a, action.Action):
+    record = _Common('action', a)
+    record.update(parent=project_uid,
+                  is_complete=a.is_complete,
+                  context=None if a.ctx is None else a.ctx.uid)
+  else:
+    record = _CommonFromProtobuf('action', a.common)
+    record.update(parent=project_uid,
+                  is_complete=a.is_complete,
+                  context=a.ctx.common.uid if a.HasField('ctx') else None)
+  return _Line(record)
+
+
+def _WithArchived(items, archived_uids, archived):
+  """Returns the items and those archived actions that we have, in the order
+  ToDoList.LoadArchive would give them.
+
+  Args:
+    items: [action.Action|pyatdl_pb2.Action]
+    archived_uids: [int]  # the Project's
+    archived: {int: action.Action|pyatdl_pb2.Action}  # see _ArchivedActions
+  Returns:
+    [action.Action|pyatdl_pb2.Action]
+  """
+  result = list(items)
+  for the_uid in sorted(u for u in archived_uids if u in archived):
+    i = 0
+    while i < len(result) and _Uid(result[i]) < the_uid:
+      i += 1
+    result.insert(i, archived[the_uid])
+  return result
+
+
+def _UndecodedProjectLines(pb, parent_uid, archived):
+  """Yields what _ProjectLines would without decoding the pyatdl_pb2.Project.
+
+  Decoding is several times slower, and the Prj would stay decoded.
+  """
+  archived_uids = [a.common.uid for a in pb.actions
+                   if prj.IsArchivedActionStub(a)]
+  record = _CommonFromProtobuf('project', pb.common)
+  record.update(
+    parent=parent_uid,
+    is_complete=pb.is_complete,
+    is_active=pb.is_active,
+    max_seconds_before_review=(
+      pb.max_seconds_before_review if pb.HasField('max_seconds_before_review')
+      else prj.DEFAULT_MAX_SECONDS_BEFORE_REVIEW),
+    last_review_epoch_sec=pb.last_review_epoch_seconds,
+    default_context_uid=pb.default_context_uid or None,
+    archived_uids=[u for u in archived_uids if u not in archived])
+  yield _Line(record)
+  live = [a for a in pb.actions if not prj.IsArchivedActionStub(a)]
+  for a in _WithArchived(live, archived_uids, archived):
+    yield _ActionLine(a, pb.common.uid)
+
+
+def _ProjectLines(p, parent_uid, archived, fetch):
+  """Yields the lines for the Project and its Actions, archived or not.
+
+  Args:
+    p: prj.Prj
+    parent_uid: None|int
+    archived: {int: action.Action|pyatdl_pb2.Action}  # see _ArchivedActions
+    fetch: see ToDoList.ProjectFetcher
+  """
+  if not p.IsFetched():
+    pb = fetch([p.uid])[p.uid]
+    if hasattr(fetch, 'Forget'):
+      fetch.Forget([p.uid])
+    for line in _UndecodedProjectLines(pb, parent_uid, archived):
+      yield line
+    return
+  if not p.IsDecoded():
+    for line in _UndecodedProjectLines(p.AsProto(), parent_uid, archived):
+      yield line
+    return
+  record = _Common('project', p)
+  record.update(parent=parent_uid,
+                is_complete=p.is_complete,
+                is_active=p.is_active,
+                max_seconds_before_review=p.max_seconds_before_review,
+                last_review_epoch_sec=p.TimeOfLastReview(),
+                default_context_uid=p.default_context_uid,
+                archived_uids=[u for u in p.archived_uids
+                               if u not in archived])
+  yield _Line(record)
+  for a in _WithArchived(p.items, p.archived_uids, archived):
+    yield _ActionLine(a, p.uid)
+
+
+def _ArchivedActions(todolist):
+  """Returns ToDoList.ArchivedActions, reading the archive only if some
+  Project has archived actions."""
+  if not any(p.ArchivedActionUIDs() for p, unused_path in todolist.Projects()):
+    return {}
+  return todolist.ArchivedActions()
+
+
+def Export(todolist):
+  """Yields the to-do list, including the archive, as lines of JSON.
+
+  Builds one Project at a time. Lazily deserialized Projects stay undecoded,
+  unfetched ones stay unfetched (see ToDoList.FetchProjects; each is fetched in
+  turn, and then forgotten if the fetcher has a Forget(self, uids) method), and
+  archived actions come straight from the archive instead of via
+  ToDoList.LoadArchive.
+
+  Args:
+    todolist: tdl.ToDoList
+  Yields:
+    str  # ends with a newline
+  """
+  archived = _ArchivedActions(todolist)
+  fetch = todolist.ProjectFetcher()
+  yield _Line({'type': 'todolist',
+               'format': FORMAT,
+               'has_never_purged_deleted': todolist.HasNeverPurgedDeleted()})
+  yield _Line(_Common('context_list', todolist.ctx_list))
+  for c in todolist.ctx_list.items:
+    record = _Common('context', c)
+    record['is_active'] = c.is_active
+    yield _Line(record)
+  for line in _ProjectLines(todolist.inbox, None, archived, fetch):
+    yield line
+  stack = [(todolist.root, None)]
+  while stack:
+    item, parent_uid = stack.pop()
+    if isinstance(item, prj.Prj):
+      for line in _ProjectLines(item, parent_uid, archived, fetch):
+        yield line
+    else:
+      record = _Common('folder', item)
+      record['parent'] = parent_uid
+      yield _Line(record)
+      stack.extend((child, item.uid) for child in reversed(item.items))
+  for name in sorted(todolist.note_list.notes):
+    yield _Line({'type': 'note',
+                 'name': name,
+                 'note': todolist.note_list.notes[name]})
+
+
+class _Importer(object):
+  """Builds a ToDoList a line at a time; see Import."""
+
+  def __init__(self):
+    self.header = None
+    self.ctx_list = None
+    self.inbox = None
+    self.root = None
+    self.note_list = note.NoteList()
+    self._contexts = {}  # uid: Ctx
+    self._containers = {}  # uid: Folder|Prj
+
+  def Add(self, record):
+    """Handles the given object, raising FormatError if it is amiss."""
+    if self.header is None:
+      if record.get('type') != 'todolist':
+        raise FormatError('The first line must be of type "todolist"')
+      if record['format'] != FORMAT:
+        raise FormatError('Unsupported format %s' % record['format'])
+      self.header = record
+      return
+    object_type = record['type']
+    if object_type == 'note':
+      self.note_list.notes[record['name']] = record['note']
+      return
+    handler = {'context_list': self._AddContextList,
+               'context': self._AddContext,
+               'folder': self._AddFolder,
+               'project': self._AddProject,
+               'action': self._AddAction}.get(object_type)
+    if handler is None:
+      raise FormatError('Unknown type "%s"' % object_type)
+    obj = handler(record)
+    # Last so that constructing obj does not bump mtime:
+    obj.__dict__.update(is_deleted=record['is_deleted'],
+                        ctime=record['ctime'],
+                        mtime=record['mtime'],
+                        dtime=record['dtime'])
+
+  def _Parent(self, record, cls):
+    parent = self._containers.get(record['parent'])
+    if not isinstance(parent, cls):
+      raise FormatError('No %s with UID %s precedes this %s'
+                        % (cls.__name__, record['parent'], record['type']))
+    return parent
+
+  def _AddContextList(self, record):
+    if self.ctx_list is not None:
+      raise FormatError('There are two context lists')
+    self.ctx_list = ctx.CtxList(the_uid=record['uid'], name=record['name'])
+    return self.ctx_list
+
+  def _AddContext(self, record):
+    if self.ctx_list is None:
+      raise FormatError('A context precedes the context list')
+    c = ctx.Ctx(the_uid=record['uid'], name=record['name'],
+                is_active=record['is_active'], note=record['note'])
+    self.ctx_list.items.append(c)
+    self._contexts[c.uid] = c
+    return c
+
+  def _AddFolder(self, record):
+    f = folder.Folder(the_uid=record['uid'], name=record['name'],
+                      note=record['note'])
+    if record['parent'] is None:
+      if self.root is not None:
+        raise FormatError('There are two root folders')
+      self.root = f
+    else:
+      self._Parent(record, folder.Folder).items.append(f)
+    self._containers[f.uid] = f
+    return f
+
+  def _AddProject(self, record):
+    p = prj.Prj(the_uid=record['uid'], name=record['name'],
+                note=record['note'],
+                max_seconds_before_review=record['max_seconds_before_review'],
+                is_complete=record['is_complete'],
+                is_active=record['is_active'],
+                last_review_epoch_sec=record['last_review_epoch_sec'],
+                default_context_uid=record['default_context_uid'])
+    for archived_uid in record['archived_uids']:
+      p.archived_uids.append(archived_uid)
+      uid.singleton_factory.NoteExistingUID(archived_uid)
+    if record['parent'] is None:
+      if self.inbox is not None:
+        raise FormatError('There are two inboxes')
+      self.inbox = p
+    else:
+      self._Parent(record, folder.Folder).items.append(p)
+    self._containers[p.uid] = p
+    return p
+
+  def _AddAction(self, record):
+    context = None
+    if record['context'] is not None:
+      context = self._contexts.get(record['context'])
+      if context is None:
+        raise FormatError('No context with UID %s precedes this action'
+                          % record['context'])
+    a = action.Action(the_uid=record['uid'], name=record['name'],
+                      context=context, note=record['note'])
+    a.is_complete = record['is_complete']
+    self._Parent(record, prj.Prj).items.append(a)
+    return a
+
+
+def Import(lines):
+  """Returns the ToDoList that Export wrote.
+
+  Args:
+    lines: iterable of str|unicode  # e.g. an open file
+  Returns:
+    tdl.ToDoList
+  Raises:
+    FormatError
+  """
+  importer = _Importer()
+  with timing.Phase('import_jsonlines'):
+    for line_number, line in enumerate(lines, 1):
+      if not line.strip():
+        continue
+      try:
+        importer.Add(json.loads(line))
+      except (FormatError, ValueError, TypeError, AttributeError,
+              auditable_object.IllegalNameError) as e:
+        raise FormatError('Line %d: %s' % (line_number, e))
+      except KeyError as e:
+        raise FormatError('Line %d: Missing %s' % (line_number, e))
+  if importer.header is None:
+    raise FormatError('Empty input')
+  for name in ('ctx_list', 'inbox', 'root'):
+    if getattr(importer, name) is None:
+      raise FormatError('Missing %s' % name)
+  todolist = tdl.ToDoList(
+    inbox=importer.inbox, root=importer.root, ctx_list=importer.ctx_list,
+    note_list=importer.note_list,
+    has_never_purged_deleted=importer.header['has_never_purged_deleted'])
+  try:
+    todolist.CheckIsWellFormed()
+  except AssertionError as e:
+    raise FormatError('Not well-formed: %s' % e)
+  return todolist
@@ -0,0 +1,133 @@
+"""Unittests for module 'jsonlines'."""
+
+import json
+
+import gflags as flags
+
+from pyatdllib.core import action
+from pyatdllib.core import ctx
+from pyatdllib.core import folder
+from pyatdllib.core import jsonlines
+from pyatdllib.core import prj
+from pyatdllib.core import tdl
+from pyatdllib.core import uid
+from pyatdllib.core import unitjest
+
+FLAGS = flags.FLAGS
+
+
+def _ToDoList():
+  lst = tdl.ToDoList()
+  home = ctx.Ctx(name=u'@home', note=u'ctx note')
+  away = ctx.Ctx(name=u'@away', is_active=False)
+  lst.ctx_list.items.extend([home, away])
+  lst.inbox.items.append(action.Action(name=u'in inbox', context=away))
+  outer = folder.Folder(name=u'outer', note=u'folder note')
+  inner = folder.Folder(name=u'inner')
+  p = prj.Prj(name=u'P', note=u'line 1\nline 2', is_active=False,
+              max_seconds_before_review=60.0, last_review_epoch_sec=5.0,
+              default_context_uid=home.uid)
+  done = action.Action(name=u'done', context=home, note=u'n\xf6te')
+  done.is_complete = True
+  deleted = action.Action(name=u'deleted')
+  deleted.is_deleted = True
+  p.items.extend([done, deleted])
+  inner.items.append(p)
+  outer.items.extend([inner, prj.Prj(name=u'Q')])
+  lst.root.items.extend([prj.Prj(name=u'first'), outer])
+  lst.note_list.notes[u':__weekly_review'] = u'review note'
+  lst.CheckIsWellFormed()
+  return lst
+
+
+def _Imported(lines):
+  uid.singleton_factory = uid.Factory()
+  return jsonlines.Import(lines)
+
+
+# pylint: disable=missing-docstring,too-many-public-methods
+class JsonLinesTestCase(unitjest.TestCase):
+
+  def setUp(self):
+    super(JsonLinesTestCase, self).setUp()
+    uid.singleton_factory = uid.Factory()
+    FLAGS.pyatdl_show_uid = True
+    FLAGS.pyatdl_lazy_deserialization = False
+
+  def testRoundTrip(self):
+    lst = _ToDoList()
+    lines = list(jsonlines.Export(lst))
+    self.assertTrue(all(line.endswith('\n') for line in lines))
+    records = [json.loads(line) for line in lines]
+    self.assertEqual(
+      [r['type'] for r in records],
+      ['todolist', 'context_list', 'context', 'context', 'project', 'action',
+       'folder', 'project', 'folder', 'folder', 'project', 'action', 'action',
+       'project', 'note'])
+    self.assertEqual(records[11]['parent'], records[10]['uid'])
+    self.assertEqual(records[11]['context'], records[2]['uid'])
+    imported = _Imported(lines)
+    self.assertEqual(imported.AsProto(), lst.AsProto())
+    self.assertEqual(str(imported), str(lst))
+    self.assertEqual(list(jsonlines.Export(imported)), lines)
+
+  def testLazilyDeserializedProjectsStayThatWay(self):
+    lst = _ToDoList()
+    FLAGS.pyatdl_lazy_deserialization = True
+    uid.singleton_factory = uid.Factory()
+    lazy = tdl.ToDoList.DeserializedProtobuf(lst.AsProto().SerializeToString())
+    lines = list(jsonlines.Export(lazy))
+    self.assertFalse(any(p.IsDecoded() for p, _ in lazy.Projects()))
+    imported = _Imported(lines)
+    self.assertEqual(imported.AsProto(), lazy.AsProto())
+    for p, _ in lazy.Projects():
+      p.note  # pylint: disable=pointless-statement
+    self.assertEqual([json.loads(line) for line in jsonlines.Export(lazy)],
+                     [json.loads(line) for line in lines])
+
+  def testArchive(self):
+    lst = _ToDoList()
+    self.assertEqual(lst.Archive(cutoff=float('inf')), 2)
+    imported = _Imported(jsonlines.Export(lst))
+    self.assertEqual(
+      sorted(a.name for a, _ in imported.Actions()),
+      [u'deleted', u'done', u'in inbox'])
+    imported.CheckIsWellFormed()
+
+  def testArchivedActionsThatCannotBeLoaded(self):
+    lst = _ToDoList()
+    p = lst.root.items[0]
+    p.archived_uids.append(uid.singleton_factory.NextUID())
+    lst.CheckIsWellFormed()
+    imported = _Imported(jsonlines.Export(lst))
+    self.assertEqual(imported.AsProto(), lst.AsProto())
+
+  def testFormatErrors(self):
+    lines = list(jsonlines.Export(_ToDoList()))
+    action_index = 5
+    bad_parent = json.loads(lines[action_index])
+    bad_parent['parent'] = 999
+    bad_context = json.loads(lines[action_index])
+    bad_context['context'] = 999
+    missing_field = json.loads(lines[action_index])
+    del missing_field['is_complete']
+    for bad_lines, message in [
+        ([], 'Empty input'),
+        (lines[1:], 'Line 1: The first line must be of type "todolist"'),
+        (lines[:1] + ['{"type": "x"}\n'], 'Line 2: Unknown type "x"'),
+        (lines[:3] + ['not json\n'], 'Line 4: No JSON object'),
+        (lines[:action_index] + [json.dumps(bad_parent)],
+         'Line 6: No Prj with UID 999 precedes this action'),
+        (lines[:action_index] + [json.dumps(bad_context)],
+         'Line 6: No context with UID 999 precedes this action'),
+        (lines[:action_index] + [json.dumps(missing_field)],
+         "Line 6: Missing 'is_complete'"),
+        (lines[:6], 'Missing root'),
+        (lines[:12] + lines[13:], 'Not well-formed'),
+        ]:
+      with self.assertRaisesRegexp(jsonlines.FormatError, message):
+        _Imported(bad_lines)
+
+
+if __name__ == '__main__':
+  unitjest.main()
@@ -8,11 +8,68 @@ from . import action
 from . import common
 from . import container
 from . import pyatdl_pb2
+from . import uid
 
 FLAGS = flags.FLAGS
 DEFAULT_MAX_SECONDS_BEFORE_REVIEW = 3600 * 24 * 7.0
 
 
+def IsArchivedActionStub(pb_action):
+  """Returns True iff the action is a placeholder for an archived action.
+
+  Real actions always have a name, timestamps, etc.
+
+  Args:
+    pb_action: pyatdl_pb2.Action
+  Returns:
+    bool
+  """
+  return ([f.name for f, _ in pb_action.ListFields()] == ['common'] and
+          [f.name for f, _ in pb_action.common.ListFields()] == ['uid'])
+
+
+def PlaceholderFor(pb_project):
+  """Returns the placeholder that stands in for the project until it is fetched.
+
+  It holds the project's UID and, for each action, a stub holding the action's
+  UID and, unless the action is archived, its is_complete field. That is
+  enough for ActionUIDs, ArchivedActionUIDs, and uid.Factory.
+
+  Args:
+    pb_project: pyatdl_pb2.Project
+  Returns:
+    pyatdl_pb2.Project
+  """
+  placeholder = pyatdl_pb2.Project()
+  placeholder.common.uid = pb_project.common.uid
+  for pb_action in pb_project.actions:
+    stub = placeholder.actions.add()
+    stub.common.uid = pb_action.common.uid
+    if not IsArchivedActionStub(pb_action):
+      stub.is_complete = pb_action.is_complete
+  return placeholder
+
+
+def IsPlaceholder(pb_project):
+  """Returns True iff the project is a placeholder; see PlaceholderFor.
+
+  Real projects always have a name, timestamps, etc.
+
+  Args:
+    pb_project: pyatdl_pb2.Project
+  Returns:
+    bool
+  """
+  if ([f.name for f, _ in pb_project.common.ListFields()] != ['uid'] or
+      any(f.name not in ('common', 'actions')
+          for f, _ in pb_project.ListFields())):
+    return False
+  return all([f.name for f, _ in a.common.ListFields()] == ['uid'] and
+             all(f.name in ('common', 'is_complete')
+                 for f, _ in a.ListFields())
+             for a in pb_project.actions)
+
+
 class Prj(container.Container):
   """A project -- anything with two or more actions.
 
@@ -29,9 +86,15 @@ class Prj(container.Container):
     is_deleted: bool
     is_active: bool
     default_context_uid: int|None  # New actions are created in this context
+    archived_uids: [int]  # UIDs of actions moved to the archive; see
+                          # tdl.ToDoList.Archive
 
   If you touch a field, you touch this object.  Use copy.deepcopy if
   you do not want to mutate the project.
+
+  A Prj from LazilyDeserializedProtobuf knows only its UID until you touch
+  any other field, at which point it deserializes itself, first fetching itself
+  if it was deserialized from a placeholder (see PlaceholderFor).
   """
 
   __pychecker__ = 'unusednames=cls'
@@ -55,6 +118,20 @@ class Prj(container.Container):
     self.is_complete = is_complete
     self.is_active = is_active
     self.default_context_uid = None if default_context_uid == 0 else default_context_uid
+    self.archived_uids = []
+
+  def __getattr__(self, name):
+    # Called only for missing attributes, i.e. for a typo or for any field
+    # except uid of a lazily deserialized Prj.
+    if name.startswith('__') or '_undecoded_pb' not in self.__dict__:
+      raise AttributeError(name)
+    self._Decode()
+    return getattr(self, name)
+
+  def __setattr__(self, name, value):
+    if '_undecoded_pb' in self.__dict__:
+      self._Decode()
+    super(Prj, self).__setattr__(name, value)
 
   def __str__(self):
     return unicode(self).encode('utf-8')
@@ -189,10 +266,51 @@ class Prj(container.Container):
     """Override."""
     yield (self, [])
 
+  def ContainersPreorder(self):
+    """Override. Actions are not Containers, so we need not look at (or
+    deserialize) self.items.
+    """
+    yield (self, [])
+
+  def CheckIsWellFormed(self):
+    """Override."""
+    if self.IsDecoded():
+      super(Prj, self).CheckIsWellFormed()
+
+  def IsDecoded(self):
+    """Returns False iff this is a lazily deserialized Prj nobody has touched."""
+    return '_undecoded_pb' not in self.__dict__
+
+  def ActionUIDs(self):
+    """Returns the UIDs of self.items without deserializing them.
+
+    Returns:
+      [int]
+    """
+    if self.IsDecoded():
+      return [a.uid for a in self.items]
+    return [a.common.uid for a in self.__dict__['_undecoded_pb'].actions
+            if not IsArchivedActionStub(a)]
+
+  def ArchivedActionUIDs(self):
+    """Returns self.archived_uids without deserializing this Prj.
+
+    Returns:
+      [int]
+    """
+    if self.IsDecoded():
+      return list(self.archived_uids)
+    return [a.common.uid for a in self.__dict__['_undecoded_pb'].actions
+            if IsArchivedActionStub(a)]
+
   def AsProto(self, pb=None):
+    """Override. Returns the placeholder if this Prj is unfetched; see Fetch."""
     # pylint: disable=maybe-no-member
     if pb is None:
       pb = pyatdl_pb2.Project()
+    if not self.IsDecoded():
+      pb.CopyFrom(self.__dict__['_undecoded_pb'])
+      return pb
     super(Prj, self).AsProto(pb.common)
     pb.common.metadata.name = self.name
     if self.note:
@@ -208,6 +326,8 @@ class Prj(container.Container):
     for a in self.items:
       pba = pb.actions.add()
       a.AsProto(pba)
+    for archived_uid in self.archived_uids:
+      pb.actions.add().common.uid = archived_uid
     return pb
 
   @classmethod
@@ -221,6 +341,7 @@ class Prj(container.Container):
     """
     assert bytestring
     pb = pyatdl_pb2.Project.FromString(bytestring)  # pylint: disable=no-member
+    assert not IsPlaceholder(pb), pb.common.uid
     max_seconds_before_review = None if not pb.HasField('max_seconds_before_review') else pb.max_seconds_before_review
     p = cls(the_uid=pb.common.uid,
             name=pb.common.metadata.name,
@@ -232,6 +353,59 @@ class Prj(container.Container):
             last_review_epoch_sec=pb.last_review_epoch_seconds)
     p.SetFieldsBasedOnProtobuf(pb.common)
     for pb_action in pb.actions:
+      if IsArchivedActionStub(pb_action):
+        uid.singleton_factory.NoteExistingUID(pb_action.common.uid)
+        p.archived_uids.append(pb_action.common.uid)
+        continue
       p.items.append(action.Action.DeserializedProtobuf(
         pb_action.SerializeToString()))
     return p
+
+  @classmethod
+  def LazilyDeserializedProtobuf(cls, pb, fetch=None):
+    """Returns a Prj that defers deserializing pb until a field other than uid
+    is touched. Until then, AsProto returns a copy of pb.
+
+    Args:
+      pb: pyatdl_pb2.Project  # Do not mutate it afterwards.
+      fetch: None|callable function ([int])->{int: pyatdl_pb2.Project}  # the
+        projects with the given UIDs; required iff pb is a placeholder (see
+        PlaceholderFor)
+    Returns:
+      Prj
+    """
+    p = cls.__new__(cls)
+    p.__dict__['uid'] = pb.common.uid
+    p.__dict__['_undecoded_pb'] = pb
+    if IsPlaceholder(pb):
+      assert fetch is not None, pb.common.uid
+      p.__dict__['_fetch'] = fetch
+    # Make sure new UIDs do not collide with the ones in pb:
+    uid.singleton_factory.NoteExistingUID(pb.common.uid)
+    for pb_action in pb.actions:
+      uid.singleton_factory.NoteExistingUID(pb_action.common.uid)
+    return p
+
+  def IsFetched(self):
+    """Returns False iff this Prj still holds only a placeholder; see Fetch."""
+    return '_fetch' not in self.__dict__
+
+  def Fetch(self):
+    """Replaces the placeholder, if any, with the project, still undecoded.
+
+    Raises:
+      whatever the fetch argument to LazilyDeserializedProtobuf raises
+    """
+    if self.IsFetched():
+      return
+    pb = self.__dict__['_fetch']([self.uid])[self.uid]
+    assert pb.common.uid == self.uid, (pb.common.uid, self.uid)
+    self.__dict__['_undecoded_pb'] = pb
+    del self.__dict__['_fetch']
+
+  def _Decode(self):
+    """Turns a lazily deserialized Prj into an ordinary one."""
+    self.Fetch()
+    pb = self.__dict__.pop('_undecoded_pb')
+    decoded = self.DeserializedProtobuf(pb.SerializeToString())
+    self.__dict__.update(decoded.__dict__)
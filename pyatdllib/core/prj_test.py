@@ -1,8 +1,10 @@
 """Unittests for module 'prj'."""
 
+import copy
 import time
 
 from pyatdllib.core import prj
+from pyatdllib.core import uid
 from pyatdllib.core import unitjest
 
 
@@ -94,6 +96,47 @@ actions {
     finally:
       time.time = saved_time
 
+  def testLazilyDeserializedProtobuf(self):
+    uid.singleton_factory = uid.Factory()
+    pb = unitjest.FullPrj().AsProto()
+    serialized = pb.SerializeToString()
+    uid.singleton_factory = uid.Factory()
+    project = prj.Prj.LazilyDeserializedProtobuf(pb)
+    self.assertFalse(project.IsDecoded())
+    self.assertEqual(project.uid, 4)
+    self.assertEqual(project.ActionUIDs(), [2, 3])
+    project.CheckIsWellFormed()
+    self.assertEqual(list(project.ContainersPreorder()), [(project, [])])
+    self.assertEqual(project.AsProto().SerializeToString(), serialized)
+    self.assertFalse(project.IsDecoded())
+    self.assertEqual(uid.singleton_factory.NextUID(), 5)
+
+    self.assertEqual(project.name, 'myname')
+    self.assertTrue(project.IsDecoded())
+    self.assertEqual([a.name for a in project.items], ['Buy milk', 'Oranges'])
+    self.assertEqual(project.ActionUIDs(), [2, 3])
+    self.assertEqual(project.AsProto().SerializeToString(), serialized)
+    with self.assertRaises(AttributeError):
+      project.no_such_field  # pylint: disable=pointless-statement
+
+  def testLazilyDeserializedProtobufMutation(self):
+    pb = unitjest.FullPrj().AsProto()
+    project = prj.Prj.LazilyDeserializedProtobuf(pb)
+    project.is_complete = True
+    self.assertTrue(project.IsDecoded())
+    self.assertTrue(project.AsProto().is_complete)
+    self.assertEqual(project.name, 'myname')
+    self.assertEqual(len(project.items), 2)
+
+  def testLazilyDeserializedProtobufDeepcopy(self):
+    project = prj.Prj.LazilyDeserializedProtobuf(
+      unitjest.FullPrj().AsProto())
+    clone = copy.deepcopy(project)
+    self.assertFalse(clone.IsDecoded())
+    clone.name = 'clone'
+    self.assertEqual(project.name, 'myname')
+    self.assertEqual(clone.name, 'clone')
+
 
 if __name__ == '__main__':
   unitjest.main()
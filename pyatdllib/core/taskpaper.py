@@ -0,0 +1,318 @@
+"""Imports TaskPaper text, the inverse of tdl.ToDoList.AsTaskPaper.
+
+Given text like
+
+  inbox:
+  	- call mom @phone
+
+  @done /Home/Garage/Clean garage:
+  The note for the project
+  	- buy a broom	note: the wide kind	not the narrow kind @done
+
+we make the Folders Home and Home/Garage (or reuse undeleted Folders of those
+names), the complete Project "Clean garage", its Action "buy a broom" (whose
+note is two lines), and the Context @phone unless a Context by that name
+exists. A project's header may begin with @inactive, @done, and @deleted; an
+action's line may end with its Context, @done, and @deleted, in that order.
+Since AsTaskPaper replaces spaces in Context names with underscores, @at_home
+finds the Context "at home". Actions preceding any project go into the Inbox.
+
+Within a Project, only tab-indented lines beginning with "- " are Actions,
+and a header must follow a blank line, just as AsTaskPaper writes them;
+other lines are the Project's note.
+
+Every line is parsed and every name checked before anything changes. Then the
+Folders, Projects, Actions, and Contexts are constructed directly, and the
+to-do list is checked for well-formedness once at the end, which is much
+faster than running a mkdir, mkprj, or mkact command per line.
+
+Some things do not survive the trip through TaskPaper: UIDs, timestamps,
+Folders' notes, empty Folders, and the Context of an Action whose name
+already mentions it (AsTaskPaper omits it, so "call @home" imports as "call"
+with Context @home).
+"""
+
+import collections
+import re
+
+import gflags as flags
+
+from . import action
+from . import ctx
+from . import folder
+from . import prj
+from . import timing
+
+FLAGS = flags.FLAGS
+
+# What Import returns:
+ImportCounts = collections.namedtuple(
+  'ImportCounts', ['folders', 'projects', 'actions', 'contexts'])
+
+_PROJECT_TAGS = (u'@inactive', u'@done', u'@deleted')
+_DELETED_SUFFIX = u' @deleted'
+_DONE_RE = re.compile(r'\s@done(\([^)]*\))?$')  # TaskPaper's @done(2017-01-31)
+_CONTEXT_RE = re.compile(r'\s(@[^\s()]+)$', re.UNICODE)
+_NOTE_SEPARATOR = u'\tnote: '
+
+
+class Error(Exception):
+  """Base class for this module's exceptions."""
+
+
+class IllegalNameError(Error):
+  """A name is empty or would be mistaken for a UID."""
+
+
+def _Tag(context_name):
+  """Returns how AsTaskPaper refers to the named Context."""
+  tag = context_name.replace(u' ', u'_')
+  return tag if tag.startswith(u'@') else u'@' + tag
+
+
+def _CheckName(name, line_number, allow_empty=False):
+  """Raises IllegalNameError before we waste a UID on an illegal name."""
+  if not name and not allow_empty:
+    raise IllegalNameError('Line %d: Missing name' % line_number)
+  if name.startswith(u'uid='):
+    raise IllegalNameError(
+      'Line %d: Names starting with "uid=" are prohibited: %s'
+      % (line_number, name))
+
+
+# An Action's line, parsed; see _ParsedAction:
+_ParsedActionLine = collections.namedtuple(
+  '_ParsedActionLine',
+  ['name', 'note', 'context_tag', 'is_complete', 'is_deleted'])
+
+
+def _ParsedHeader(header, inbox_name, line_number):
+  """Returns (tags, path components) for a Project's header sans ':'.
+
+  The path components are None for the Inbox.
+
+  Raises:
+    IllegalNameError
+  """
+  tags = set()
+  while True:
+    for tag in _PROJECT_TAGS:
+      if header.startswith(tag + u' '):
+        tags.add(tag)
+        header = header[len(tag) + 1:]
+        break
+    else:
+      break
+  if header == inbox_name:
+    return tags, None
+  separator = FLAGS.pyatdl_separator
+  if header.startswith(separator):
+    components = header[len(separator):].split(separator)
+  else:
+    components = [header]
+  for component in components:
+    _CheckName(component, line_number)
+  return tags, components
+
+
+def _ParsedAction(text, line_number):
+  """Returns the _ParsedActionLine for an Action's line sans '- '.
+
+  Raises:
+    IllegalNameError
+  """
+  is_deleted = text.endswith(_DELETED_SUFFIX)
+  if is_deleted:
+    text = text[:-len(_DELETED_SUFFIX)]
+  done = _DONE_RE.search(text)
+  if done:
+    text = text[:done.start()]
+  context_tag = _CONTEXT_RE.search(text)
+  if context_tag:
+    text = text[:context_tag.start()]
+  name, _, note = text.partition(_NOTE_SEPARATOR)
+  _CheckName(name, line_number, allow_empty=True)
+  return _ParsedActionLine(
+    name=name, note=note.replace(u'\t', u'\n'),
+    context_tag=context_tag.group(1) if context_tag else None,
+    is_complete=bool(done), is_deleted=is_deleted)
+
+
+def _Parsed(lines, inbox_name):
+  """Parses every line, checking every name, so that Import can fail before
+  it changes anything.
+
+  Within a Project, as AsTaskPaper writes them, only tab-indented lines are
+  Actions and a header follows a blank line; anything else is part of the
+  Project's note.
+
+  Args:
+    lines: iterable of unicode
+    inbox_name: unicode
+  Returns:
+    [(str, object)]  # ('blank', None), ('note', unicode),
+                     # ('header', (tags, path components)), or
+                     # ('action', _ParsedActionLine), one per line
+  Raises:
+    IllegalNameError
+  """
+  result = []
+  previous_kind = None
+  in_project = False
+  for line_number, line in enumerate(lines, 1):
+    line = line.rstrip(u'\r\n')
+    stripped = line.strip()
+    if not stripped:
+      parsed = ('blank', None)
+    elif ((line.startswith(u'\t') or not in_project)
+          and (stripped == u'-' or stripped.startswith(u'- '))):
+      parsed = ('action', _ParsedAction(stripped[2:], line_number))
+    elif (line.endswith(u':') and not line[0].isspace()
+          and previous_kind in (None, 'blank')):
+      parsed = ('header', _ParsedHeader(line[:-1], inbox_name, line_number))
+      in_project = True
+    else:
+      parsed = ('note', line)
+    result.append(parsed)
+    previous_kind = parsed[0]
+  return result
+
+
+class _Importer(object):
+  """Builds the to-do list from _Parsed lines; see Import."""
+
+  def __init__(self, todolist):
+    self._todolist = todolist
+    self._num_folders = self._num_projects = 0
+    self._num_actions = self._num_contexts = 0
+    self._contexts = {}  # tag: Ctx, preferring undeleted Contexts
+    for c in todolist.ctx_list.items:
+      tag = _Tag(c.name)
+      if tag not in self._contexts or self._contexts[tag].is_deleted:
+        self._contexts[tag] = c
+    self._folders = {(): todolist.root}  # (name,): Folder
+    self._project = todolist.inbox
+    self._note_lines = []  # the current Project's, until its first Action
+    self._has_actions = False
+
+  def Add(self, kind, value):
+    """Handles one of the lines that _Parsed returns."""
+    if kind == 'blank':
+      if not self._has_actions:
+        self._note_lines.append(u'')
+    elif kind == 'action':
+      self._AddAction(value)
+    elif kind == 'header':
+      self._StartProject(*value)
+    else:
+      self._note_lines.append(value)
+
+  def Finish(self):
+    """Returns ImportCounts after the last line."""
+    self._FinishProject()
+    if self._num_contexts:
+      self._todolist.ctx_list.NoteModification()
+    return ImportCounts(folders=self._num_folders,
+                        projects=self._num_projects,
+                        actions=self._num_actions,
+                        contexts=self._num_contexts)
+
+  def _FinishNote(self):
+    """Appends the pending note lines to the current Project's note."""
+    if self._note_lines:
+      note = u'\n'.join(self._note_lines)
+      self._note_lines = []
+      if note.strip():
+        p = self._project
+        p.note = p.note + u'\n' + note if p.note else note
+
+  def _FinishProject(self):
+    # AsTaskPaper precedes each Project with a blank line:
+    if self._note_lines and not self._note_lines[-1]:
+      self._note_lines.pop()
+    self._FinishNote()
+    if self._has_actions:
+      self._project.NoteModification()
+
+  def _Folder(self, path):
+    """Returns the Folder with the given path, making it if need be."""
+    if path in self._folders:
+      return self._folders[path]
+    parent = self._Folder(path[:-1])
+    found = None
+    for item in parent.items:
+      if (isinstance(item, folder.Folder) and item.name == path[-1]
+          and not item.is_deleted):
+        found = item
+        break
+    if found is None:
+      found = folder.Folder(name=path[-1])
+      parent.items.append(found)
+      parent.NoteModification()
+      self._num_folders += 1
+    self._folders[path] = found
+    return found
+
+  def _StartProject(self, tags, components):
+    self._FinishProject()
+    self._has_actions = False
+    if components is None:
+      self._project = self._todolist.inbox
+      return
+    parent = self._Folder(tuple(components[:-1]))
+    p = prj.Prj(name=components[-1],
+                is_complete=u'@done' in tags,
+                is_active=u'@inactive' not in tags)
+    if u'@deleted' in tags:
+      p.is_deleted = True
+    parent.items.append(p)
+    parent.NoteModification()
+    self._project = p
+    self._num_projects += 1
+
+  def _Context(self, tag):
+    """Returns the Context with the given tag, making it if need be."""
+    if tag not in self._contexts:
+      c = ctx.Ctx(name=tag)
+      self._todolist.ctx_list.items.append(c)
+      self._contexts[tag] = c
+      self._num_contexts += 1
+    return self._contexts[tag]
+
+  def _AddAction(self, parsed):
+    if not self._has_actions:
+      self._FinishNote()
+      self._has_actions = True
+    context = None
+    if parsed.context_tag is not None:
+      context = self._Context(parsed.context_tag)
+    a = action.Action(name=parsed.name, context=context, note=parsed.note)
+    if parsed.is_complete:
+      a.is_complete = True
+    if parsed.is_deleted:
+      a.is_deleted = True
+    self._project.items.append(a)
+    self._num_actions += 1
+
+
+def Import(todolist, lines):
+  """Adds the contents of TaskPaper text to the given to-do list.
+
+  See the module docstring.
+
+  Args:
+    todolist: tdl.ToDoList
+    lines: iterable of unicode  # e.g. a file opened with codecs.open
+  Returns:
+    ImportCounts  # how many objects we made
+  Raises:
+    IllegalNameError  # the to-do list is unchanged
+  """
+  with timing.Phase('import_taskpaper'):
+    parsed = _Parsed(lines, todolist.inbox.name)
+    importer = _Importer(todolist)
+    for kind, value in parsed:
+      importer.Add(kind, value)
+    counts = importer.Finish()
+  todolist.CheckIsWellFormed()
+  return counts
@@ -0,0 +1,150 @@
+"""Unittests for module 'taskpaper'."""
+
+import gflags as flags
+
+from pyatdllib.core import action
+from pyatdllib.core import ctx
+from pyatdllib.core import folder
+from pyatdllib.core import prj
+from pyatdllib.core import taskpaper
+from pyatdllib.core import tdl
+from pyatdllib.core import uid
+from pyatdllib.core import unitjest
+
+FLAGS = flags.FLAGS
+
+
+def _TaskPaper(todolist):
+  lines = []
+  todolist.AsTaskPaper(lines)
+  return lines
+
+
+# pylint: disable=missing-docstring,too-many-public-methods
+class TaskPaperTestCase(unitjest.TestCase):
+
+  def setUp(self):
+    super(TaskPaperTestCase, self).setUp()
+    uid.singleton_factory = uid.Factory()
+    FLAGS.pyatdl_separator = '/'
+    FLAGS.pyatdl_show_uid = True
+
+  def testImport(self):
+    lst = tdl.ToDoList()
+    counts = taskpaper.Import(lst, u"""
+- before any project @phone
+
+inbox:
+\t- call mom @phone
+
+@inactive @done /Home/Garage/Clean garage:
+The note
+
+for the project
+\t- buy a broom\tnote: the wide kind\tnot the narrow kind @done
+\t- toss junk @at_home @done @deleted
+
+/Home/Empty:
+
+Work:
+\t- - dashes - are fine @done(2017-01-31)
+""".split(u'\n'))
+    self.assertEqual(counts, taskpaper.ImportCounts(
+      folders=2, projects=3, actions=5, contexts=2))
+    self.assertEqual([a.name for a in lst.inbox.items],
+                     [u'before any project', u'call mom'])
+    self.assertEqual([c.name for c in lst.ctx_list.items],
+                     [u'@phone', u'@at_home'])
+    home = lst.root.items[0]
+    self.assertEqual(home.name, u'Home')
+    garage, empty = home.items
+    self.assertEqual(empty.name, u'Empty')
+    self.assertEqual(empty.items, [])
+    p = garage.items[0]
+    self.assertEqual(p.name, u'Clean garage')
+    self.assertEqual(p.note, u'The note\n\nfor the project')
+    self.assertTrue(p.is_complete)
+    self.assertFalse(p.is_active)
+    self.assertFalse(p.is_deleted)
+    broom, junk = p.items
+    self.assertEqual(broom.note, u'the wide kind\nnot the narrow kind')
+    self.assertTrue(broom.is_complete)
+    self.assertIsNone(broom.ctx)
+    self.assertEqual(junk.name, u'toss junk')
+    self.assertIs(junk.ctx, lst.ctx_list.items[1])
+    self.assertTrue(junk.is_deleted)
+    work = lst.root.items[1]
+    self.assertEqual(work.name, u'Work')
+    self.assertEqual(work.items[0].name, u'- dashes - are fine')
+    self.assertTrue(work.items[0].is_complete)
+
+  def testRoundTrip(self):
+    lst = tdl.ToDoList()
+    home = ctx.Ctx(name=u'at home')
+    lst.ctx_list.items.append(home)
+    lst.inbox.items.append(action.Action(name=u'alive', context=home))
+    outer = folder.Folder(name=u'outer')
+    inner = folder.Folder(name=u'inner')
+    outer.items.append(inner)
+    lst.root.items.append(outer)
+    p = prj.Prj(name=u'deep', note=u'a_note\n\nanother note\nwith lines\n')
+    inner.items.append(p)
+    done = action.Action(name=u'done', note=u'done_note\nmore', context=home)
+    done.is_complete = True
+    deleted = action.Action(name=u'deleted')
+    deleted.is_complete = True
+    deleted.is_deleted = True
+    p.items.extend([done, deleted, action.Action(name=u'plain')])
+    inactive = prj.Prj(name=u'inactive', is_active=False)
+    inactive.is_deleted = True
+    lst.root.items.append(inactive)
+    lst.CheckIsWellFormed()
+    exported = _TaskPaper(lst)
+
+    uid.singleton_factory = uid.Factory()
+    imported = tdl.ToDoList()
+    taskpaper.Import(imported, exported)
+    self._AssertEqualWithDiff(exported, _TaskPaper(imported))
+    self.assertEqual(imported.root.items[0].items[0].items[0].note, p.note)
+
+  def testNoteLinesThatLookLikeActionsOrHeaders(self):
+    lst = tdl.ToDoList()
+    p = prj.Prj(name=u'P', note=u'- not an action\nnot a project:\n - nor this')
+    p.items.append(action.Action(name=u'a'))
+    lst.root.items.append(p)
+    lst.CheckIsWellFormed()
+    exported = _TaskPaper(lst)
+    uid.singleton_factory = uid.Factory()
+    imported = tdl.ToDoList()
+    self.assertEqual(taskpaper.Import(imported, exported),
+                     taskpaper.ImportCounts(
+                       folders=0, projects=1, actions=1, contexts=0))
+    self.assertEqual(imported.root.items[0].note, p.note)
+    self._AssertEqualWithDiff(exported, _TaskPaper(imported))
+
+  def testReusesFoldersAndContexts(self):
+    lst = tdl.ToDoList()
+    lst.AddContext(u'@home')
+    lst.AddProjectOrFolder(folder.Folder(name=u'F'))
+    counts = taskpaper.Import(lst, [u'/F/P:', u'\t- a @home'])
+    self.assertEqual(counts, taskpaper.ImportCounts(
+      folders=0, projects=1, actions=1, contexts=0))
+    self.assertEqual(len(lst.root.items), 1)
+    self.assertEqual(lst.root.items[0].items[0].items[0].ctx.uid,
+                     lst.ContextByName(u'@home').uid)
+
+  def testIllegalName(self):
+    lst = tdl.ToDoList()
+    with self.assertRaisesRegexp(taskpaper.IllegalNameError, 'Line 2'):
+      taskpaper.Import(lst, [u'P:', u'\t- uid=7'])
+    with self.assertRaisesRegexp(taskpaper.IllegalNameError, 'Missing name'):
+      taskpaper.Import(lst, [u'//P:'])
+    with self.assertRaisesRegexp(taskpaper.IllegalNameError, 'Line 4'):
+      taskpaper.Import(lst, [u'/F/P:', u'\t- a @home', u'', u'uid=3:'])
+    lst.CheckIsWellFormed()
+    self.assertEqual(_TaskPaper(lst), ['', 'inbox:'])
+    self.assertEqual(lst.ctx_list.items, [])
+
+
+if __name__ == '__main__':
+  unitjest.main()
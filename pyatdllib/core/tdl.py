@@ -15,6 +15,7 @@ from . import folder
 from . import note
 from . import prj
 from . import pyatdl_pb2
+from . import timing
 from . import uid
 
 flags.DEFINE_string('inbox_project_name', 'inbox',
@@ -26,6 +27,10 @@ flags.DEFINE_bool(
     'such checks, you may not be able to deserialize (i.e., load) it later.')
 flags.DEFINE_string('pyatdl_separator', '/',
                     'In Folder names, which character separates parent from child?')
+flags.DEFINE_bool(
+    'pyatdl_lazy_deserialization', False,
+    'Upon loading the to-do list, defer deserializing each project until it '
+    'is first used? This helps commands that touch few projects.')
 
 FLAGS = flags.FLAGS
 
@@ -46,6 +51,24 @@ class DuplicateContextError(Error):
   """A Context by that name already exists."""
 
 
+def _ArchiveAsProto(archived):
+  """Returns the archive; see ToDoList.ArchiveAsProtos.
+
+  Args:
+    archived: {int: (int, pyatdl_pb2.Action)}
+  Returns:
+    pyatdl_pb2.ToDoList
+  """
+  pb = pyatdl_pb2.ToDoList()
+  by_project = {}
+  for the_uid, (project_uid, pb_action) in sorted(archived.items()):
+    if project_uid not in by_project:
+      by_project[project_uid] = pb.root.projects.add()
+      by_project[project_uid].common.uid = project_uid
+    by_project[project_uid].actions.add().CopyFrom(pb_action)
+  return pb
+
+
 class ToDoList(object):
   """The totality of one end user's data, their projects and actions.
 
@@ -54,6 +77,10 @@ class ToDoList(object):
     inbox: Prj
     ctx_list: CtxList
     note_list: NoteList  # every auditable object has its own note; these are global
+
+  Completed and deleted actions may live in a separate archive that is loaded
+  only when needed; see Archive and LoadArchive. Each Prj remembers the UIDs
+  of its archived actions.
   """
 
   def __init__(self, inbox=None, root=None, ctx_list=None, note_list=None, has_never_purged_deleted=True):
@@ -62,6 +89,17 @@ class ToDoList(object):
     self.ctx_list = ctx_list if ctx_list is not None else ctx.CtxList(name='Contexts')
     self.note_list = note_list if note_list is not None else note.NoteList()
     self._has_never_purged_deleted = has_never_purged_deleted
+    self._archive_loader = None
+    # None until the archive is loaded, then {action UID: (Prj UID, Action)}
+    # for each action that is archived:
+    self._archived = None
+    # {action UID: (Prj UID, pyatdl_pb2.Action)} for the archive as last loaded
+    # or saved:
+    self._archived_at_load = {}
+    # {action UID: mtime} for the actions LoadArchive brought back:
+    self._reloaded = {}
+    self._history = None
+    self._project_fetcher = None
 
   def __str__(self):
     return unicode(self).encode('utf-8')
@@ -125,16 +163,210 @@ class ToDoList(object):
                     html_escaper=html_escaper)
 
   def PurgeDeleted(self):
+    self.LoadArchive()
     self.inbox.PurgeDeleted()
     self.root.PurgeDeleted()
     self.ctx_list.PurgeDeleted()
     self._has_never_purged_deleted = False
 
+  def HasNeverPurgedDeleted(self):
+    """Returns False if PurgeDeleted may have left gaps between UIDs."""
+    return self._has_never_purged_deleted
+
   def DeleteCompleted(self):
+    self.LoadArchive()
     self.inbox.DeleteCompleted()
     self.root.DeleteCompleted()
     self.ctx_list.DeleteCompleted()  # a nop for now; contexts cannot be completed
 
+  def SetArchiveLoader(self, loader):
+    """Tells us how to load the archive, which LoadArchive does only on demand.
+
+    Args:
+      loader: callable ()->None|pyatdl_pb2.ToDoList  # see ArchiveAsProtos
+    """
+    self._archive_loader = loader
+
+  def ArchiveLoader(self):
+    """Returns the argument to SetArchiveLoader, or None."""
+    return self._archive_loader
+
+  def SetHistory(self, history):
+    """Tells us where past versions of this to-do list are kept.
+
+    Args:
+      history: None|ui.history.History
+    """
+    self._history = history
+
+  def History(self):
+    """Returns the argument to SetHistory, or None."""
+    return self._history
+
+  def ProjectFetcher(self):
+    """Returns the fetch_projects argument to DeserializedProtobuf, or None."""
+    return self._project_fetcher
+
+  def FetchProjects(self):
+    """Fetches, all at once, every Prj that holds only a placeholder.
+
+    See prj.Prj.Fetch. The Prjs stay undecoded.
+    """
+    unfetched = [p for p, unused_path in self.Projects() if not p.IsFetched()]
+    if not unfetched:
+      return
+    with timing.Phase('fetch_projects'):
+      self._project_fetcher([p.uid for p in unfetched])
+      for p in unfetched:
+        p.Fetch()
+
+  def ArchivedActions(self):
+    """Returns the archived actions by UID, leaving them archived.
+
+    Unless LoadArchive or Archive has, this reads the archive, without
+    deserializing it.
+
+    Returns:
+      {int: action.Action|pyatdl_pb2.Action}
+    """
+    if self._archived is not None:
+      return dict((the_uid, a)
+                  for the_uid, (unused_project_uid, a) in self._archived.items())
+    pb = self._archive_loader() if self._archive_loader is not None else None
+    if pb is None:
+      return {}
+    return dict((pb_action.common.uid, pb_action)
+                for pb_project in pb.root.projects
+                for pb_action in pb_project.actions)
+
+  def LoadArchive(self):
+    """Moves every archived action back into its Prj.
+
+    Those that are unchanged and still complete or deleted return to the
+    archive upon ArchiveAsProtos.
+    """
+    if self._archived is None:
+      self._archived = {}
+      pb = self._archive_loader() if self._archive_loader is not None else None
+      if pb is not None:
+        for pb_project in pb.root.projects:
+          for pb_action in pb_project.actions:
+            self._archived_at_load[pb_action.common.uid] = (
+              pb_project.common.uid, pb_action)
+            self._archived[pb_action.common.uid] = (
+              pb_project.common.uid,
+              action.Action.DeserializedProtobuf(pb_action.SerializeToString()))
+    if not self._archived:
+      return
+    projects = dict((p.uid, p) for p, unused_path in self.Projects())
+    for the_uid, (project_uid, a) in sorted(self._archived.items()):
+      project = projects.get(project_uid)
+      if project is None or the_uid not in project.archived_uids:
+        # The action is live already (see ArchiveAsProtos), so we drop it
+        # from the archive.
+        continue
+      project.archived_uids.remove(the_uid)
+      i = 0
+      while i < len(project.items) and project.items[i].uid < the_uid:
+        i += 1
+      project.items.insert(i, a)
+      self._reloaded[the_uid] = a.mtime
+    self._archived = {}
+
+  def Archive(self, cutoff, only_decoded=False):
+    """Moves actions completed or deleted before cutoff to the archive.
+
+    Args:
+      cutoff: float  # seconds since the epoch; compared with mtime
+      only_decoded: bool  # skip lazily deserialized projects nobody touched?
+    Returns:
+      int  # the number of actions archived
+    """
+    def Archivable():  # pylint: disable=missing-docstring
+      for p, unused_path in self.Projects():
+        if only_decoded and not p.IsDecoded():
+          continue
+        for a in p.items:
+          if (a.is_complete or a.is_deleted) and a.mtime < cutoff:
+            yield a, p
+
+    if next(Archivable(), None) is None:
+      return 0
+    self.LoadArchive()
+    archivable = list(Archivable())
+    for a, p in archivable:
+      self._MoveToArchive(a, p)
+      self._reloaded.pop(a.uid, None)
+    return len(archivable)
+
+  def Unarchive(self):
+    """Moves every archived action back into its Prj to stay.
+
+    Returns:
+      int  # the number of actions unarchived
+    """
+    self.LoadArchive()
+    for the_uid in self._reloaded:
+      a, unused_project = self.ActionByUID(the_uid)
+      a.NoteModification()  # so that --pyatdl_archive_after_days waits
+    n = len(self._reloaded)
+    self._reloaded = {}
+    return n
+
+  def _MoveToArchive(self, a, project):
+    """Args: a: Action; project: Prj"""
+    project.items.remove(a)
+    project.archived_uids.append(a.uid)
+    self._archived[a.uid] = (project.uid, a)
+
+  def ArchiveAsProtos(self, force=False):
+    """Returns the archive to save before and after saving the rest.
+
+    Actions that LoadArchive brought back return to the archive first, if they
+    are unchanged and still complete or deleted.
+
+    Nothing is lost if we crash between the saves: An archived action is saved
+    to the archive before its placeholder replaces it, and an unarchived action
+    leaves the archive only after it is saved elsewhere.
+
+    Args:
+      force: bool  # return the archive even if it is unchanged?
+    Returns:
+      (None|pyatdl_pb2.ToDoList, None|pyatdl_pb2.ToDoList)  # None if there is
+        nothing to save. root.projects[i] holds the archived actions of the
+        Prj with UID root.projects[i].common.uid.
+    """
+    if force:
+      self.LoadArchive()
+    if self._archived is None:
+      return None, None
+    for the_uid, mtime in sorted(self._reloaded.items()):
+      found = self.ActionByUID(the_uid)
+      if found is None:  # purged
+        continue
+      a, project = found
+      if a.mtime == mtime and (a.is_complete or a.is_deleted):
+        self._MoveToArchive(a, project)
+    self._reloaded = {}
+    added = frozenset(self._archived).difference(self._archived_at_load)
+    removed = frozenset(self._archived_at_load).difference(self._archived)
+    if not (added or removed or force):
+      return None, None
+    archived = {}
+    for the_uid, (project_uid, a) in self._archived.items():
+      archived[the_uid] = (project_uid, a.AsProto())
+    before = after = None
+    if removed:
+      after = _ArchiveAsProto(archived)
+      if added:
+        superset = dict(self._archived_at_load)
+        superset.update(archived)
+        before = _ArchiveAsProto(superset)
+    else:
+      before = _ArchiveAsProto(archived)
+    self._archived_at_load = archived
+    return before, after
+
   def Projects(self):
     """Returns all projects, including the /inbox project.
 
@@ -213,13 +445,18 @@ class ToDoList(object):
     Yields:
       Action/Ctx/Folder/Prj
     """
+    for i in self._ItemsExceptActions():
+      yield i
+    for i, unused_prj in self.Actions():
+      yield i
+
+  def _ItemsExceptActions(self):
+    """Yields: CtxList/Ctx/Folder/Prj"""
     yield self.ctx_list
     for i in self.ctx_list.items:
       yield i
     for i, unused_path in self.ContainersPreorder():
       yield i
-    for i, unused_prj in self.Actions():
-      yield i
 
   def RemoveReferencesToContext(self, ctx_uid):
     """Ensures that nothing references the specified context.
@@ -274,9 +511,12 @@ class ToDoList(object):
     Returns:
       None|(Action, Prj)
     """
-    for a, project in self.Actions():
-      if a.uid == the_uid:
-        return (a, project)
+    for project, unused_path in self.Projects():
+      # ActionUIDs() lets us skip deserializing lazily deserialized projects.
+      if the_uid in project.ActionUIDs():
+        for a in project.items:
+          if a.uid == the_uid:
+            return (a, project)
     return None
 
   def ProjectByUID(self, project_uid):
@@ -386,6 +626,11 @@ class ToDoList(object):
     """
     if FLAGS.pyatdl_break_glass_and_skip_wellformedness_check:
       return
+    with timing.Phase('validate'):
+      self._CheckIsWellFormed()
+
+  def _CheckIsWellFormed(self):
+    """Does the work of CheckIsWellFormed."""
     def SelfStr():  # pylint: disable=missing-docstring
       saved_value = FLAGS.pyatdl_show_uid
       FLAGS.pyatdl_show_uid = True
@@ -399,11 +644,19 @@ class ToDoList(object):
     # Verify that UIDs are unique and that no ID maps to two or more object
     # types.
     objecttype_and_uid = set()
-    for item in self.Items():
+    for item in self._ItemsExceptActions():
       if not item.uid:
         raise AssertionError(
           'Missing UID for item "%s". self=%s' % (str(item), SelfStr()))
       objecttype_and_uid.add((type(item), item.uid))
+    # Avoid deserializing lazily deserialized projects:
+    for p, unused_path in self.Projects():
+      for the_uid in p.ActionUIDs() + p.ArchivedActionUIDs():
+        if not the_uid:
+          raise AssertionError(
+            'Missing UID for an action in project "%s". self=%s'
+            % (str(p), SelfStr()))
+        objecttype_and_uid.add((action.Action, the_uid))
     uids_seen = {}
     for (objecttype, the_uid) in objecttype_and_uid:
       if the_uid in uids_seen:
@@ -423,48 +676,65 @@ class ToDoList(object):
              sorted(uids_seen),
              SelfStr()))
 
-  def AsProto(self, pb=None):
+  def AsProto(self, pb=None, fetch=True):
     """Serializes this object to a protocol buffer.
 
     Args:
       pb: None|pyatdl_pb2.ToDoList  # If not None, pb will be mutated and returned.
+      fetch: bool  # False leaves placeholders for unfetched projects; see
+                   # FetchProjects
     Returns:
       pyatdl_pb2.ToDoList
     """
+    if fetch:
+      self.FetchProjects()
     if pb is None:
       pb = pyatdl_pb2.ToDoList()
     # pylint: disable=maybe-no-member
-    self.inbox.AsProto(pb.inbox)
-    self.root.AsProto(pb.root)
-    self.ctx_list.AsProto(pb.ctx_list)
-    self.note_list.AsProto(pb.note_list)
+    with timing.Phase('as_proto'):
+      self.inbox.AsProto(pb.inbox)
+      self.root.AsProto(pb.root)
+      self.ctx_list.AsProto(pb.ctx_list)
+      self.note_list.AsProto(pb.note_list)
     assert self.ctx_list.uid == pb.ctx_list.common.uid
     pb.has_never_purged_deleted = self._has_never_purged_deleted
     assert pb.ctx_list.common.metadata.name, 'X23 %s' % str(pb.ctx_list)
     return pb
 
   @classmethod
-  def DeserializedProtobuf(cls, bytestring):
+  def DeserializedProtobuf(cls, bytestring, fetch_projects=None):
     """Deserializes a ToDoList from the given protocol buffer.
 
     Args:
       bytestring: str
+      fetch_projects: None|callable function ([int])->{int: pyatdl_pb2.Project}
+        # fetches the projects for which bytestring holds placeholders (see
+        # prj.PlaceholderFor); see FetchProjects
     Returns:
       ToDoList
     """
     assert bytestring
-    pb = pyatdl_pb2.ToDoList.FromString(bytestring)  # pylint: disable=no-member
-    inbox = prj.Prj.DeserializedProtobuf(
-      pb.inbox.SerializeToString())
-    root = folder.Folder.DeserializedProtobuf(
-      pb.root.SerializeToString())
-    serialized_ctx_list = pb.ctx_list.SerializeToString()
-    ctx_list = ctx.CtxList.DeserializedProtobuf(
-      serialized_ctx_list)
-    serialized_note_list = pb.note_list.SerializeToString()
-    note_list = note.NoteList.DeserializedProtobuf(
-      serialized_note_list)
-    rv = cls(inbox=inbox, root=root, ctx_list=ctx_list, note_list=note_list,
-             has_never_purged_deleted=pb.has_never_purged_deleted)
+    with timing.Phase('parse') as phase:
+      phase.num_bytes = len(bytestring)
+      pb = pyatdl_pb2.ToDoList.FromString(bytestring)  # pylint: disable=no-member
+    with timing.Phase('build'):
+      if FLAGS.pyatdl_lazy_deserialization or prj.IsPlaceholder(pb.inbox):
+        inbox = prj.Prj.LazilyDeserializedProtobuf(pb.inbox,
+                                                   fetch=fetch_projects)
+      else:
+        inbox = prj.Prj.DeserializedProtobuf(
+          pb.inbox.SerializeToString())
+      root = folder.Folder.DeserializedProtobuf(
+        pb.root.SerializeToString(), lazy=FLAGS.pyatdl_lazy_deserialization,
+        fetch_projects=fetch_projects)
+      serialized_ctx_list = pb.ctx_list.SerializeToString()
+      ctx_list = ctx.CtxList.DeserializedProtobuf(
+        serialized_ctx_list)
+      serialized_note_list = pb.note_list.SerializeToString()
+      note_list = note.NoteList.DeserializedProtobuf(
+        serialized_note_list)
+      rv = cls(inbox=inbox, root=root, ctx_list=ctx_list, note_list=note_list,
+               has_never_purged_deleted=pb.has_never_purged_deleted)
+      rv._project_fetcher = fetch_projects  # pylint: disable=protected-access
     rv.CheckIsWellFormed()
     return rv
@@ -0,0 +1,180 @@
+"""Cheap timing of the phases of a request, e.g. for Server-Timing headers.
+
+Code that does something worth timing says
+
+  with timing.Phase('decompress') as phase:
+    payload = zlib.decompress(compressed)
+    phase.num_bytes = len(payload)
+
+Nothing is timed unless a Recorder is active in this thread (see Recording),
+so the cost otherwise is a function call and a thread-local lookup.
+
+Phases may nest. Each phase is charged only for the time not spent in the
+phases nested within it, so the durations of all phases add up to no more than
+the total. Phases with the same name are summed.
+"""
+
+import collections
+import json
+import re
+import threading
+import time
+
+_local = threading.local()
+
+# Server-Timing metric names are HTTP tokens:
+_NOT_A_TOKEN_CHAR = re.compile(r"[^!#$%&'*+.^_`|~0-9A-Za-z-]")
+
+# name: str
+# seconds: float  # exclusive of nested phases
+# count: int  # how many times the phase began
+# num_bytes: None|int  # summed over the phases that set num_bytes
+PhaseInfo = collections.namedtuple(
+  'PhaseInfo', ['name', 'seconds', 'count', 'num_bytes'])
+
+
+class _NullPhase(object):
+  """What Phase returns when nothing is recording."""
+  num_bytes = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *unused_args):
+    return False
+
+  def __setattr__(self, name, value):
+    pass  # discards num_bytes
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+  """A phase being timed."""
+  __slots__ = ('_recorder', '_name', '_start', 'nested_seconds', 'num_bytes')
+
+  def __init__(self, recorder, name):
+    self._recorder = recorder
+    self._name = name
+    self._start = None
+    self.nested_seconds = 0.0
+    self.num_bytes = None
+
+  def __enter__(self):
+    self._recorder._stack.append(self)  # pylint: disable=protected-access
+    self._start = time.time()
+    return self
+
+  def __exit__(self, *unused_args):
+    elapsed = time.time() - self._start
+    stack = self._recorder._stack  # pylint: disable=protected-access
+    stack.pop()
+    if stack:
+      stack[-1].nested_seconds += elapsed
+    self._recorder.Add(self._name, elapsed - self.nested_seconds,
+                       self.num_bytes)
+    return False
+
+
+class Recorder(object):
+  """Accumulates the phases of one request."""
+
+  def __init__(self):
+    self._start = time.time()
+    self._phases = collections.OrderedDict()  # name => [seconds, count, bytes]
+    self._stack = []
+
+  def Add(self, name, seconds, num_bytes=None):
+    """Records a phase that took the given number of seconds."""
+    info = self._phases.setdefault(name, [0.0, 0, None])
+    info[0] += seconds
+    info[1] += 1
+    if num_bytes is not None:
+      info[2] = (info[2] or 0) + num_bytes
+
+  def Phases(self):
+    """Returns [PhaseInfo], in the order in which each phase first finished."""
+    return [PhaseInfo(name, seconds, count, num_bytes)
+            for name, (seconds, count, num_bytes) in self._phases.items()]
+
+  def TotalSeconds(self):
+    """Returns the seconds since this Recorder was created."""
+    return time.time() - self._start
+
+  def ServerTimingHeader(self):
+    """Returns the value of a Server-Timing HTTP header, with a 'total' metric.
+
+    See https://www.w3.org/TR/server-timing/
+    """
+    metrics = []
+    for p in self.Phases():
+      metric = '%s;dur=%.1f' % (_NOT_A_TOKEN_CHAR.sub('_', p.name),
+                                p.seconds * 1000)
+      details = []
+      if p.count > 1:
+        details.append('%dx' % p.count)
+      if p.num_bytes is not None:
+        details.append('%dB' % p.num_bytes)
+      if details:
+        metric += ';desc="%s"' % ' '.join(details)
+      metrics.append(metric)
+    metrics.append('total;dur=%.1f' % (self.TotalSeconds() * 1000))
+    return ', '.join(metrics)
+
+  def AsJson(self, **extra):
+    """Returns a single line of JSON suitable for a structured log.
+
+    Args:
+      **extra: more things to log, e.g. the request path
+    Returns:
+      str
+    """
+    rv = dict(extra)
+    rv['total_ms'] = round(self.TotalSeconds() * 1000, 1)
+    rv['phases'] = dict(
+      (p.name, dict([('ms', round(p.seconds * 1000, 1)), ('count', p.count)] +
+                    ([] if p.num_bytes is None else [('bytes', p.num_bytes)])))
+      for p in self.Phases())
+    return json.dumps(rv, sort_keys=True, separators=(',', ':'))
+
+
+class Recording(object):
+  """Context manager that makes a new Recorder active in this thread.
+
+  Returns the Recorder. Nested Recordings each get their own Recorder.
+  """
+
+  def __init__(self):
+    self._recorder = Recorder()
+    self._saved = None
+
+  def __enter__(self):
+    self._saved = getattr(_local, 'recorder', None)
+    _local.recorder = self._recorder
+    return self._recorder
+
+  def __exit__(self, *unused_args):
+    _local.recorder = self._saved
+    return False
+
+
+def ActiveRecorder():
+  """Returns the Recorder active in this thread, or None."""
+  return getattr(_local, 'recorder', None)
+
+
+def Phase(name):
+  """Returns a context manager that times the named phase.
+
+  Set num_bytes on the value of the 'with' statement to record a byte count.
+
+  Args:
+    name: str  # e.g., 'decompress'
+  Returns:
+    object
+  """
+  recorder = getattr(_local, 'recorder', None)
+  if recorder is None:
+    return _NULL_PHASE
+  return _Phase(recorder, name)
@@ -0,0 +1,91 @@
+"""Unittests for module 'timing'."""
+
+import json
+import time
+
+from pyatdllib.core import timing
+from pyatdllib.core import unitjest
+
+
+# pylint: disable=missing-docstring,too-many-public-methods
+class TimingTestCase(unitjest.TestCase):
+
+  def setUp(self):
+    super(TimingTestCase, self).setUp()
+    self._now = 1000.0
+    time.time = lambda: self._now
+
+  def _Sleep(self, seconds):
+    self._now += seconds
+
+  def testNothingRecording(self):
+    self.assertIsNone(timing.ActiveRecorder())
+    with timing.Phase('x') as phase:
+      phase.num_bytes = 3
+    self.assertIsNone(phase.num_bytes)
+
+  def testNestedPhases(self):
+    with timing.Recording() as recorder:
+      self.assertIs(timing.ActiveRecorder(), recorder)
+      with timing.Phase('db_read') as phase:
+        self._Sleep(0.010)
+        phase.num_bytes = 100
+        with timing.Phase('decrypt') as inner:
+          self._Sleep(0.002)
+          inner.num_bytes = 100
+      with timing.Phase('decrypt') as phase:
+        self._Sleep(0.001)
+        phase.num_bytes = 20
+      with timing.Phase('cmd.ls'):
+        self._Sleep(0.0005)
+      self._Sleep(0.001)
+    self.assertIsNone(timing.ActiveRecorder())
+    self.assertEqual(
+      [(p.name, round(p.seconds, 4), p.count, p.num_bytes)
+       for p in recorder.Phases()],
+      [('decrypt', 0.003, 2, 120),
+       ('db_read', 0.01, 1, 100),
+       ('cmd.ls', 0.0005, 1, None)])
+    self.assertEqual(
+      recorder.ServerTimingHeader(),
+      'decrypt;dur=3.0;desc="2x 120B", db_read;dur=10.0;desc="100B", '
+      'cmd.ls;dur=0.5, total;dur=14.5')
+    self.assertEqual(
+      json.loads(recorder.AsJson(path='/todo')),
+      {u'path': u'/todo', u'total_ms': 14.5,
+       u'phases': {u'decrypt': {u'ms': 3.0, u'count': 2, u'bytes': 120},
+                   u'db_read': {u'ms': 10.0, u'count': 1, u'bytes': 100},
+                   u'cmd.ls': {u'ms': 0.5, u'count': 1}}})
+
+  def testExceptions(self):
+    with timing.Recording() as recorder:
+      try:
+        with timing.Phase('outer'):
+          with timing.Phase('inner'):
+            self._Sleep(1)
+            raise ValueError()
+      except ValueError:
+        pass
+      with timing.Phase('after'):
+        self._Sleep(1)
+    self.assertEqual([(p.name, p.seconds) for p in recorder.Phases()],
+                     [('inner', 1), ('outer', 0), ('after', 1)])
+
+  def testHeaderNamesAreTokens(self):
+    recorder = timing.Recorder()
+    recorder.Add('cmd.a b', 0.001)
+    self.assertEqual(recorder.ServerTimingHeader(),
+                     'cmd.a_b;dur=1.0, total;dur=0.0')
+
+  def testNestedRecordings(self):
+    with timing.Recording() as outer:
+      with timing.Recording() as inner:
+        with timing.Phase('x'):
+          pass
+      self.assertIs(timing.ActiveRecorder(), outer)
+    self.assertEqual([p.name for p in inner.Phases()], ['x'])
+    self.assertEqual(outer.Phases(), [])
+
+
+if __name__ == '__main__':
+  unitjest.main()
@@ -0,0 +1,133 @@
+"""Replaces the names and notes in to-do lists and commands with stand-ins.
+
+The structure survives: equal names get equal stand-ins, whether in a
+pyatdl_pb2.ToDoList or in a command's argv, so commands recorded against a
+to-do list still work against the anonymized to-do list. UIDs, flag names,
+numeric flag values, and keywords like view filter names are kept. Other
+numbers are names like any other, e.g. an action named '1040'.
+"""
+
+import re
+
+import gflags as flags  # https://code.google.com/p/python-gflags/
+
+from ..core import view_filter
+from . import state
+from . import uicmd  # pylint: disable=unused-import  # defines FLAGS.no_context_display_string
+
+FLAGS = flags.FLAGS
+
+_NUMBER_RE = re.compile(r'^-?[0-9]+(\.[0-9]*)?$')
+_UID_RE = re.compile(r'^uid=-?[0-9]+$')
+
+# Positional arguments that are not names; see 'help pagedata' and 'help todo':
+_OTHER_KEYWORDS = frozenset(['action', 'context', 'project', 'projects', 'now'])
+
+
+def _Keywords():
+  return (frozenset(view_filter.CLS_BY_UI_NAME) | state.State.AllSortingOptions() |
+          _OTHER_KEYWORDS |
+          frozenset(['', '.', '..', 'inbox', FLAGS.no_context_display_string]))
+
+
+def Renamed(name, digest):
+  """Returns the stand-in for a name.
+
+  Keywords and UIDs are kept, and a leading '@' (conventional for contexts)
+  survives.
+
+  Args:
+    name: unicode
+    digest: function(unicode)->str  # e.g. a keyed hash; the same for equal
+                                    # names
+  Returns:
+    unicode
+  """
+  if name in _Keywords() or _UID_RE.match(name):
+    return name
+  prefix = u'@' if name.startswith(u'@') else u''
+  return prefix + u'x' + digest(name)
+
+
+def AnonymizedProtobuf(pb, rename, rename_note=None):
+  """Renames every item and note, in place.
+
+  The names of /inbox, the root folder, and the context list are kept, as are
+  the names of notes reserved for the Django UI.
+
+  Args:
+    pb: pyatdl_pb2.ToDoList
+    rename: function(unicode)->unicode  # for names
+    rename_note: function(unicode)->unicode|None  # None means rename
+  Returns:
+    pyatdl_pb2.ToDoList  # pb
+  """
+  if rename_note is None:
+    rename_note = rename
+
+  def Anonymize(common):
+    common.metadata.name = rename(common.metadata.name)
+    if common.metadata.HasField('note'):
+      common.metadata.note = rename_note(common.metadata.note)
+
+  projects = [pb.inbox]
+  folders = [pb.root]
+  while folders:
+    f = folders.pop()
+    for p in f.projects:
+      Anonymize(p.common)
+      projects.append(p)
+    for child in f.folders:
+      Anonymize(child.common)
+      folders.append(child)
+  for p in projects:
+    for a in p.actions:
+      Anonymize(a.common)
+  for c in pb.ctx_list.contexts:
+    Anonymize(c.common)
+  for n in pb.note_list.notes:
+    if not n.name.startswith(':__'):  # reserved for the Django UI
+      n.name = rename(n.name)
+    n.note = rename_note(n.note)
+  return pb
+
+
+def _AnonymizedArg(arg, rename):
+  if FLAGS.pyatdl_separator in arg:
+    return FLAGS.pyatdl_separator.join(
+      rename(c) for c in arg.split(FLAGS.pyatdl_separator))
+  return rename(arg)
+
+
+def AnonymizedArgv(argv, rename):
+  """Returns argv with names renamed but the command and flag names intact.
+
+  Each component of a path is renamed separately, so '/a/b' and 'a' agree. A
+  number is kept only as a flag's value, e.g. '--days=30' or '--days 30'.
+
+  Args:
+    argv: [unicode]  # see lexer.SplitCommandLineIntoArgv
+    rename: function(unicode)->unicode  # e.g. using Renamed
+  Returns:
+    [unicode]
+  """
+  result = list(argv[:1])
+  follows_flag = False
+  for i, arg in enumerate(argv[1:]):
+    if arg == '--':  # the rest are not flags
+      result.append(arg)
+      result.extend(_AnonymizedArg(a, rename) for a in argv[i+2:])
+      break
+    if arg.startswith('-') and not _NUMBER_RE.match(arg):
+      name, equals, value = arg.partition('=')
+      if equals and not _NUMBER_RE.match(value):
+        value = _AnonymizedArg(value, rename)
+      result.append(name + equals + value)
+      follows_flag = not equals
+      continue
+    if follows_flag and _NUMBER_RE.match(arg):
+      result.append(arg)
+    else:
+      result.append(_AnonymizedArg(arg, rename))
+    follows_flag = False
+  return result
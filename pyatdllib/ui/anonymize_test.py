@@ -0,0 +1,84 @@
+"""Unittests for module 'anonymize'."""
+
+import hashlib
+
+import gflags as flags  # https://code.google.com/p/python-gflags/
+
+from pyatdllib.core import tdl
+from pyatdllib.core import uid
+from pyatdllib.core import unitjest
+from pyatdllib.ui import anonymize
+from pyatdllib.ui import immaculater
+from pyatdllib.ui import lexer
+from pyatdllib.ui import state
+from pyatdllib.ui import uicmd
+immaculater.RegisterUICmds(cloud_only=False)
+
+FLAGS = flags.FLAGS
+
+
+def _Digest(name):
+  return hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]
+
+
+def _Rename(name):
+  return anonymize.Renamed(name, _Digest)
+
+
+# pylint: disable=missing-docstring,too-many-public-methods
+class AnonymizeTestCase(unitjest.TestCase):
+
+  def setUp(self):
+    super(AnonymizeTestCase, self).setUp()
+    uid.singleton_factory = uid.Factory()
+    FLAGS.pyatdl_separator = '/'
+    FLAGS.pyatdl_paranoia = True
+    FLAGS.seed_upon_creation = False
+    FLAGS.no_context_display_string = '<none>'
+
+  def testRenamed(self):
+    for kept in ('inbox', 'all', 'alpha', 'uid=42', '<none>', ''):
+      self.assertEqual(_Rename(kept), kept)
+    self.assertEqual(_Rename(u'1040'), u'x' + _Digest(u'1040'))
+    self.assertEqual(_Rename(u'@home'), u'@x' + _Digest(u'@home'))
+    self.assertEqual(_Rename(u'secret'), u'x' + _Digest(u'secret'))
+
+  def testAnonymizedArgv(self):
+    self.assertEqual(
+      anonymize.AnonymizedArgv(
+        lexer.SplitCommandLineIntoArgv(
+          'mkact --context=@home -a "/inbox/buy milk" uid=4 --limit 50'),
+        _Rename),
+      ['mkact', '--context=' + _Rename(u'@home'), '-a',
+       '/inbox/' + _Rename(u'buy milk'), 'uid=4', '--limit', '50'])
+    self.assertEqual(
+      anonymize.AnonymizedArgv(
+        lexer.SplitCommandLineIntoArgv('archive --days=30 -- 1040 /P/7'),
+        _Rename),
+      ['archive', '--days=30', '--', _Rename(u'1040'),
+       '/' + _Rename(u'P') + '/' + _Rename(u'7')])
+
+  def testCommandsWorkAfterward(self):
+    printed = []
+    the_state = state.State(printed.append, tdl.ToDoList(), uicmd.APP_NAMESPACE)
+    for line in ('mkctx @home', 'mkdir /F', 'mkprj /F/P', 'mkact /F/P/a',
+                 'chctx @home /F/P/a'):
+      uicmd.ParsePyatdlPromptAndExecute(the_state, line)
+    pb = anonymize.AnonymizedProtobuf(the_state.ToDoList().AsProto(), _Rename)
+    self.assertNotIn('home', str(pb))
+    uid.singleton_factory = uid.Factory()
+    the_state = state.State(printed.append,
+                            tdl.ToDoList.DeserializedProtobuf(
+                              pb.SerializeToString()),
+                            uicmd.APP_NAMESPACE)
+    for line in ('mkact /F/P/b', 'chctx @home /F/P/b', 'complete /F/P/a',
+                 'cd /F/P', 'ls'):
+      argv = anonymize.AnonymizedArgv(lexer.SplitCommandLineIntoArgv(line),
+                                      _Rename)
+      uicmd.APP_NAMESPACE.FindCmdAndExecute(the_state, argv)
+    self.assertEqual(len(printed), 2, printed)
+    self.assertIn(_Rename(u'b'), printed[-1])
+
+
+if __name__ == '__main__':
+  unitjest.main()
@@ -13,6 +13,8 @@ import gflags as flags
 from google.apputils import app
 from google.apputils import appcommands  # https://code.google.com/p/google-apputils-python/
 
+from ..core import timing
+from . import slowlog
 from . import undoutil
 
 
@@ -243,13 +245,19 @@ class Namespace(object):
     FLAGS.pyatdl_internal_state = the_state
     saved_usage = appcommands.AppcommandsUsage
     appcommands.AppcommandsUsage = _GenAppcommandsUsage(cmd, the_state.Print)
+    start = time.time()
+    checked = ran = None  # the times the precheck and the command finished
+    failed = True
     try:
       if FLAGS.pyatdl_paranoia:
         try:
           the_state.ToDoList().CheckIsWellFormed()
         except AssertionError as e:
           raise AssertionError('precheck: argv=%s error=%s' % (argv, unicode(e)))
-      rv = self._RunCommand(the_state, cmd, argv)
+      checked = time.time()
+      with timing.Phase('cmd.' + self._cmd_alias_list[argv[0]]):
+        rv = self._RunCommand(the_state, cmd, argv)
+      ran = time.time()
       if rv is not None and generate_undo_info:
         the_state.RegisterUndoableCommand(rv)
       if FLAGS.pyatdl_paranoia:
@@ -257,7 +265,13 @@ class Namespace(object):
           the_state.ToDoList().CheckIsWellFormed()
         except AssertionError as e:
           raise AssertionError('postcheck: %s' % unicode(e))
+      failed = False
     finally:
+      end = time.time()
+      checked = end if checked is None else checked
+      ran = end if ran is None else ran
+      slowlog.NoteCommand(the_state, argv, checked - start, ran - checked,
+                          end - ran, failed=failed)
       if hasattr(FLAGS, 'pyatdl_internal_state'):  # see above about undo/redo
         delattr(FLAGS, 'pyatdl_internal_state')
       appcommands.AppcommandsUsage = saved_usage
@@ -0,0 +1,166 @@
+"""What changed in a to-do list since a point in time, for sync clients.
+
+If the to-do list has a history (see module history) that goes back far
+enough, we compare the current version with the version saved at that time.
+That finds everything, even objects removed via 'purgedeleted' or 'archive'.
+
+Otherwise we rely on the timestamps of each object: ctime tells us what was
+created, dtime what was deleted, and mtime what was modified. Removed objects
+are then invisible.
+"""
+
+import collections
+
+from . import merge
+
+CREATED = 'created'
+MODIFIED = 'modified'
+DELETED = 'deleted'
+REMOVED = 'removed'
+
+# change: CREATED|MODIFIED|DELETED|REMOVED
+# kind: 'folder'|'project'|'action'|'context'
+# uid: int
+# parent_uid: int  # UID of the Folder, Project, or ContextList
+# pb: pyatdl_pb2.Folder|Project|Action|Context  # sans children; for REMOVED,
+#     # the copy from the earlier version
+Change = collections.namedtuple(
+  'Change', ['change', 'kind', 'uid', 'parent_uid', 'pb'])
+
+
+def _Seconds(microseconds):
+  """Converts a pyatdl_pb2.Timestamp field to seconds since the epoch."""
+  return None if microseconds == -1 else microseconds / 1e6
+
+
+def _Mtime(change):
+  return change.pb.common.timestamp.mtime
+
+
+def _Objects(pb):
+  """Returns {uid: merge.Item} for all but /inbox, /, and the ContextList."""
+  items, unused_children = merge.Flattened(pb)
+  return dict((u, item) for u, item in items.items() if item.parent is not None)
+
+
+def _ChangeFor(change, u, item):
+  """Returns a Change."""
+  return Change(change=change, kind=item.kind, uid=u,
+                parent_uid=item.parent, pb=item.pb)
+
+
+def _ChangesByTimestamp(objects, since):
+  """Returns [Change] for the objects timestamped after the given time.
+
+  Args:
+    objects: {int: merge.Item}
+    since: float  # seconds since the epoch
+  Returns:
+    [Change]
+  """
+  result = []
+  for u, item in objects.items():
+    ts = item.pb.common.timestamp
+    if _Seconds(ts.mtime) <= since:
+      continue  # ctime <= mtime and dtime <= mtime
+    if _Seconds(ts.ctime) > since:
+      change = CREATED
+    elif item.pb.common.is_deleted and _Seconds(ts.dtime) > since:
+      change = DELETED
+    else:
+      change = MODIFIED
+    result.append(_ChangeFor(change, u, item))
+  return result
+
+
+def _ChangesByComparison(objects, earlier_objects):
+  """Returns [Change] that turn the earlier objects into the current ones.
+
+  Args:
+    objects: {int: merge.Item}
+    earlier_objects: {int: merge.Item}
+  Returns:
+    [Change]
+  """
+  result = []
+  for u, item in objects.items():
+    earlier = earlier_objects.get(u)
+    if earlier is None or earlier.kind != item.kind:
+      change = CREATED
+    elif earlier == item:
+      continue
+    elif item.pb.common.is_deleted and not earlier.pb.common.is_deleted:
+      change = DELETED
+    else:
+      change = MODIFIED
+    result.append(_ChangeFor(change, u, item))
+  for u, earlier in earlier_objects.items():
+    item = objects.get(u)
+    if item is None or earlier.kind != item.kind:
+      result.append(_ChangeFor(REMOVED, u, earlier))
+  return result
+
+
+def Changes(pb, since, earlier_pb=None):
+  """Returns what changed since the given time.
+
+  Args:
+    pb: pyatdl_pb2.ToDoList
+    since: None|float  # seconds since the epoch; ignored if earlier_pb is given
+    earlier_pb: None|pyatdl_pb2.ToDoList  # the version current at that time,
+                                          # if known
+  Returns:
+    ([Change],  # REMOVED only if earlier_pb is given. Oldest mtime first, then
+                # the REMOVED
+     float)  # the latest mtime of any object, i.e. the next call's since
+  """
+  objects = _Objects(pb)
+  if earlier_pb is None:
+    result = _ChangesByTimestamp(objects, since)
+  else:
+    result = _ChangesByComparison(objects, _Objects(earlier_pb))
+  result.sort(key=lambda c: (c.change == REMOVED, _Mtime(c), c.uid))
+  latest = max([item.pb.common.timestamp.mtime for item in objects.values()] +
+               [0])
+  return result, _Seconds(latest)
+
+
+def VersionAt(history_versions, since):
+  """Returns the number of the version current at the given time, or None.
+
+  Args:
+    history_versions: [history.VersionInfo]  # oldest first
+    since: float  # seconds since the epoch
+  Returns:
+    None|int  # None if the history does not reach back that far
+  """
+  result = None
+  for v in history_versions:
+    if v.timestamp > since:
+      break
+    result = v.number
+  return result
+
+
+def JsonForChange(change):
+  """Returns a JSON-friendly dict describing the given Change."""
+  pb = change.pb
+  ts = pb.common.timestamp
+  rv = {
+    'change': change.change,
+    'kind': change.kind,
+    'uid': change.uid,
+    'parent_uid': change.parent_uid,
+    'name': pb.common.metadata.name,
+    'ctime': _Seconds(ts.ctime),
+    'mtime': _Seconds(ts.mtime),
+    'dtime': _Seconds(ts.dtime) if pb.common.is_deleted else None,
+    'is_deleted': pb.common.is_deleted,
+  }
+  if change.kind in ('project', 'action'):
+    rv['is_complete'] = pb.is_complete
+  if change.kind in ('project', 'context'):
+    rv['is_active'] = pb.is_active
+  if change.kind == 'action':
+    rv['in_context_uid'] = pb.ctx.common.uid if pb.HasField('ctx') else None
+  return rv
@@ -0,0 +1,127 @@
+"""Unittests for module 'changes'."""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import gflags as flags  # https://code.google.com/p/python-gflags/
+
+from pyatdllib.core import uid
+from pyatdllib.core import unitjest
+from pyatdllib.ui import appcommandsutil
+from pyatdllib.ui import lexer
+from pyatdllib.ui import serialization
+from pyatdllib.ui import state
+from pyatdllib.ui import uicmd
+uicmd.RegisterAppcommands(False, uicmd.APP_NAMESPACE)
+
+FLAGS = flags.FLAGS
+
+
+# pylint: disable=missing-docstring,too-many-public-methods
+class ChangesTestCase(unitjest.TestCase):
+
+  def setUp(self):
+    super(ChangesTestCase, self).setUp()
+    self._now = 1000
+    time.time = lambda: self._now
+    uid.singleton_factory = uid.Factory()
+    FLAGS.pyatdl_show_uid = True
+    FLAGS.pyatdl_separator = '/'
+    FLAGS.seed_upon_creation = False
+    self._printed = []
+    self._the_state = state.State(
+      self._printed.append, uicmd.NewToDoList(), uicmd.APP_NAMESPACE)
+    self._Run('mkctx @home',
+              'mkact /inbox/i0',
+              'mkdir /F0',
+              'mkprj /F0/P0',
+              'mkprj /P1',
+              'mkact --context=@home /P1/a0',
+              'mkact /P1/a1')
+
+  def _Run(self, *argvs):
+    del self._printed[:]
+    for argv in argvs:
+      uicmd.APP_NAMESPACE.FindCmdAndExecute(
+        self._the_state, lexer.SplitCommandLineIntoArgv(argv))
+    return list(self._printed)
+
+  def _Edit(self):
+    self._now = 2000
+    self._Run('complete /P1/a0', 'rmact /P1/a1', 'mkact /F0/P0/a2',
+              'rename /F0 Folder0')
+
+  def testTimestamps(self):
+    self._Edit()
+    self.assertEqual(
+      self._Run('changes --since 1500'),
+      [u'modified --folder-- uid=6 Folder0',
+       u'modified --project-- uid=7 P0',
+       u'modified --action-- uid=9 a0',
+       u'deleted --action-- uid=10 a1',
+       u'created --action-- uid=11 a2'])
+    self.assertEqual(self._Run('changes --since 2000'), [])
+    page = json.loads(self._Run('changes --json --since 1999.5')[0])
+    self.assertEqual(page['next_since'], 2000)
+    self.assertFalse(page['includes_removed'])
+    self.assertEqual(page['changes'][2], {
+      u'change': u'modified', u'kind': u'action', u'uid': 9,
+      u'parent_uid': 8, u'name': u'a0', u'ctime': 1000, u'mtime': 2000,
+      u'dtime': None, u'is_deleted': False, u'is_complete': True,
+      u'in_context_uid': 4})
+    page = json.loads(self._Run('changes --json --since 3000')[0])
+    self.assertEqual(page, {u'changes': [], u'includes_removed': False,
+                            u'next_since': 3000})
+
+  def testHistory(self):
+    tmpdir = tempfile.mkdtemp()
+    try:
+      path = os.path.join(tmpdir, 'x.dat')
+      serialization.SerializeToDoList(self._the_state.ToDoList(), path)
+      for edit in [None, self._Edit]:
+        self._the_state.SetToDoList(
+          serialization.DeserializeToDoList(path, lambda: None))
+        if edit is not None:
+          edit()
+          self._Run('purgedeleted')
+        serialization.SerializeToDoList(self._the_state.ToDoList(), path)
+      self._the_state.SetToDoList(
+        serialization.DeserializeToDoList(path, lambda: None))
+      expected = [u'modified --folder-- uid=6 Folder0',
+                  u'modified --project-- uid=7 P0',
+                  u'modified --project-- uid=8 P1',
+                  u'modified --action-- uid=9 a0',
+                  u'created --action-- uid=11 a2',
+                  u'removed --action-- uid=10 a1']
+      self.assertEqual(self._Run('changes --since 1500'), expected)
+      self.assertEqual(self._Run('changes --since v1'), expected)
+      self.assertEqual(self._Run('changes --since v2'), [])
+      page = json.loads(self._Run('changes --json --since v1')[0])
+      self.assertTrue(page['includes_removed'])
+      self.assertEqual(page['next_since'], 2000)
+      # Before the history began:
+      self.assertEqual(self._Run('changes --since 999')[-1],
+                       u'created --action-- uid=11 a2')
+      with self.assertRaisesRegexp(appcommandsutil.InvalidUsageError,
+                                   r'No version 3'):
+        self._Run('changes --since v3')
+    finally:
+      shutil.rmtree(tmpdir)
+
+  def testBadArgs(self):
+    with self.assertRaisesRegexp(appcommandsutil.InvalidUsageError,
+                                 r'Specify --since'):
+      self._Run('changes')
+    with self.assertRaisesRegexp(appcommandsutil.InvalidUsageError,
+                                 r'Invalid --since yesterday'):
+      self._Run('changes --since yesterday')
+    with self.assertRaisesRegexp(appcommandsutil.InvalidUsageError,
+                                 r'not stored with a history'):
+      self._Run('changes --since v1')
+
+
+if __name__ == '__main__':
+  unitjest.main()
@@ -0,0 +1,487 @@
+"""Point-in-time history of a to-do list, stored compactly.
+
+Each version is either a keyframe, i.e. a compressed copy of the serialized
+pyatdl_pb2.ToDoList, or a compressed binary delta against the version just
+before it. Consecutive versions usually differ by a few bytes, so deltas are
+tiny. Every --pyatdl_history_keyframe_interval versions we store a keyframe so
+that restoring a version never replays more than that many deltas.
+
+Where the versions live is up to the store, which is any object with these
+methods:
+
+  Versions(self): returns [VersionInfo] sorted by number
+  Read(self, numbers): returns {int: bytes}
+  Append(self, version_info, data): returns None
+  Delete(self, numbers): returns None
+
+FileStore is one such store.
+
+Snapshots hold only placeholders for archived actions, so a History may keep
+the archive's versions, too, in a second store; see History.ArchiveAt.
+"""
+
+import collections
+import hashlib
+import os
+import time
+import zlib
+
+import gflags as flags  # https://code.google.com/p/python-gflags/
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer(
+  'pyatdl_history_max_versions',
+  100,
+  'How many versions of the to-do list to keep for the "history" and '
+  '"restore" commands. (We may keep up to '
+  '--pyatdl_history_keyframe_interval more.) Zero disables history.',
+  lower_bound=0)
+flags.DEFINE_integer(
+  'pyatdl_history_keyframe_interval',
+  20,
+  'In the history of the to-do list, store a full copy instead of a delta '
+  'this often. Restoring a version costs time proportional to this.',
+  lower_bound=1)
+
+# The lengths of the blocks of the old snapshot that Delta looks for in the new
+# one:
+_BLOCK_SIZE = 32
+
+_COPY = b'\x00'
+_INSERT = b'\x01'
+
+
+class Error(Exception):
+  """Base class for this module's exceptions."""
+
+
+class NoSuchVersionError(Error):
+  """The version is not (or is no longer) in the history."""
+
+
+class CorruptHistoryError(Error):
+  """The history cannot produce the version it claims to have."""
+
+
+# number: int  # increases by one with each version
+# timestamp: float  # seconds since the epoch
+# is_keyframe: bool  # True iff the data is a full copy, not a delta
+# sha1: str  # hexadecimal SHA1 checksum of the serialized to-do list
+# size: int  # length of the data in bytes
+VersionInfo = collections.namedtuple(
+  'VersionInfo', ['number', 'timestamp', 'is_keyframe', 'sha1', 'size'])
+
+
+def _Sha1(b):
+  return hashlib.sha1(b).hexdigest()
+
+
+def _Varint(n):
+  """Returns the base-128 encoding of the nonnegative integer n."""
+  result = bytearray()
+  while True:
+    low_bits = n & 0x7f
+    n >>= 7
+    if n:
+      result.append(low_bits | 0x80)
+    else:
+      result.append(low_bits)
+      return bytes(result)
+
+
+def _ParseVarint(b, i):
+  """Inverts _Varint.
+
+  Args:
+    b: bytes
+    i: int  # position in b of the first byte of the encoding
+  Returns:
+    (int, int)  # the integer and the position of the following byte
+  Raises:
+    CorruptHistoryError
+  """
+  n = 0
+  shift = 0
+  while True:
+    if i >= len(b):
+      raise CorruptHistoryError('Truncated delta')
+    byte = ord(b[i])
+    i += 1
+    n |= (byte & 0x7f) << shift
+    shift += 7
+    if not byte & 0x80:
+      return n, i
+
+
+def _MatchLength(a, i, b, j):
+  """Returns the length of the longest common prefix of a[i:] and b[j:].
+
+  Compares big chunks first so that long matches cost little.
+  """
+  k = 0
+  step = 4096
+  while step:
+    chunk = a[i + k:i + k + step]
+    if chunk and chunk == b[j + k:j + k + len(chunk)]:
+      k += len(chunk)
+    else:
+      step //= 2
+  return k
+
+
+def Delta(old, new):
+  """Returns a compact description of new in terms of old; see Patch.
+
+  The description is a sequence of instructions, each either 'copy these
+  bytes of old' or 'insert these bytes', all zlib-compressed.
+
+  Args:
+    old: bytes
+    new: bytes
+  Returns:
+    bytes
+  """
+  index = {}
+  for j in xrange(0, len(old) - _BLOCK_SIZE + 1, _BLOCK_SIZE):
+    index.setdefault(old[j:j + _BLOCK_SIZE], j)
+  pieces = []
+
+  def Insert(start, end):  # pylint: disable=missing-docstring
+    if start < end:
+      pieces.extend([_INSERT, _Varint(end - start), new[start:end]])
+
+  literal_start = 0
+  i = 0
+  while i + _BLOCK_SIZE <= len(new):
+    j = index.get(new[i:i + _BLOCK_SIZE])
+    if j is None:
+      i += 1
+      continue
+    while i > literal_start and j > 0 and new[i - 1] == old[j - 1]:
+      i -= 1
+      j -= 1
+    length = _MatchLength(new, i, old, j)
+    Insert(literal_start, i)
+    pieces.extend([_COPY, _Varint(j), _Varint(length)])
+    i += length
+    literal_start = i
+  Insert(literal_start, len(new))
+  return zlib.compress(b''.join(pieces))
+
+
+def Patch(old, delta):
+  """Inverts Delta.
+
+  Args:
+    old: bytes
+    delta: bytes  # Delta(old, new)
+  Returns:
+    bytes  # new
+  Raises:
+    CorruptHistoryError
+  """
+  try:
+    ops = zlib.decompress(delta)
+  except zlib.error as e:
+    raise CorruptHistoryError('Cannot decompress delta: %s' % e)
+  pieces = []
+  i = 0
+  while i < len(ops):
+    op = ops[i]
+    i += 1
+    if op == _COPY:
+      start, i = _ParseVarint(ops, i)
+      length, i = _ParseVarint(ops, i)
+      if start + length > len(old):
+        raise CorruptHistoryError('Delta copies beyond the end')
+      pieces.append(old[start:start + length])
+    elif op == _INSERT:
+      length, i = _ParseVarint(ops, i)
+      if i + length > len(ops):
+        raise CorruptHistoryError('Truncated delta')
+      pieces.append(ops[i:i + length])
+      i += length
+    else:
+      raise CorruptHistoryError('Unknown delta instruction %r' % op)
+  return b''.join(pieces)
+
+
+class History(object):
+  """The versions of one to-do list and, optionally, of its archive.
+
+  Snapshots hold only placeholders for archived actions (see
+  tdl.ToDoList.Archive), so we also keep each version of the archive that
+  existed when some version of the to-do list did; see ArchiveAt.
+
+  Fields:
+    store: see the module docstring
+    archive_store: None|object like store  # holds the archive's versions,
+                                           # numbered like the to-do list's
+  """
+  def __init__(self, store, archive_store=None):
+    self.store = store
+    self.archive_store = archive_store
+    self._base = None  # the payload upon which the next version builds
+    self._archive_base = None  # likewise for the archive
+
+  def SetBase(self, payload, archive=None):
+    """Tells us the current version, e.g. right after it is loaded.
+
+    Args:
+      payload: None|bytes|callable function ()->bytes  # serialized
+        pyatdl_pb2.ToDoList; if callable, called only if Record needs it
+      archive: None|bytes|callable function ()->bytes  # the archive,
+        likewise; see RecordArchive
+    """
+    self._base = payload
+    self._archive_base = archive
+
+  def Record(self, payload):
+    """Adds a version unless it is the same as the latest version.
+
+    Stores a delta against the base (see SetBase) if the base is the latest
+    version, else a keyframe. Then discards old versions per
+    --pyatdl_history_max_versions.
+
+    Args:
+      payload: bytes  # serialized pyatdl_pb2.ToDoList
+    """
+    if not FLAGS.pyatdl_history_max_versions:
+      return
+    versions = self.store.Versions()
+    latest = versions[-1] if versions else None
+    number = 1 if latest is None else latest.number + 1
+    info = _Append(self.store, versions, self._base, payload, number)
+    if info is not None:
+      self._Prune(versions + [info])
+    self._base = payload
+
+  def RecordArchive(self, archive):
+    """Notes that the archive changed with the latest version; see ArchiveAt.
+
+    Args:
+      archive: bytes  # the archive as stored; empty if it is empty
+    """
+    if not FLAGS.pyatdl_history_max_versions or self.archive_store is None:
+      return
+    versions = self.store.Versions()
+    if not versions:
+      return
+    archive_versions = self.archive_store.Versions()
+    if archive_versions and archive_versions[-1].number >= versions[-1].number:
+      # Two archives for one version of the to-do list; keep the first.
+      return
+    _Append(self.archive_store, archive_versions, self._archive_base, archive,
+            versions[-1].number)
+    self._archive_base = archive
+
+  def _Prune(self, versions):
+    """Discards the oldest chains (keyframe and deltas) beyond the limit.
+
+    Args:
+      versions: [VersionInfo]
+    """
+    keyframe_indices = [i for i, v in enumerate(versions) if v.is_keyframe]
+    doomed = 0
+    for i in keyframe_indices:
+      if len(versions) - i < FLAGS.pyatdl_history_max_versions:
+        break
+      doomed = i
+    if not doomed:
+      return
+    self.store.Delete([v.number for v in versions[:doomed]])
+    if self.archive_store is None:
+      return
+    # Keep the archive as of the oldest version that remains:
+    oldest = versions[doomed].number
+    archive_versions = self.archive_store.Versions()
+    keep = [v for v in archive_versions if v.number <= oldest]
+    if not keep:
+      return
+    keyframes = [v for v in keep if v.is_keyframe]
+    if keyframes:
+      self.archive_store.Delete(
+        [v.number for v in archive_versions if v.number < keyframes[-1].number])
+
+  def Versions(self):
+    """Returns [VersionInfo], oldest first."""
+    return self.store.Versions()
+
+  def Snapshot(self, number):
+    """Returns the given version.
+
+    Args:
+      number: int
+    Returns:
+      bytes  # serialized pyatdl_pb2.ToDoList
+    Raises:
+      NoSuchVersionError
+      CorruptHistoryError
+    """
+    return _Snapshot(self.store, self.store.Versions(), number)
+
+  def ArchiveAt(self, number):
+    """Returns the archive as it was when the given version was current.
+
+    Args:
+      number: int  # see Snapshot
+    Returns:
+      None|bytes  # None if unknown, e.g. if the archive has not changed since
+                  # we began keeping its versions
+    Raises:
+      CorruptHistoryError
+    """
+    if self.archive_store is None:
+      return None
+    archive_versions = self.archive_store.Versions()
+    earlier = [v.number for v in archive_versions if v.number <= number]
+    if not earlier:
+      return None
+    try:
+      return _Snapshot(self.archive_store, archive_versions, earlier[-1])
+    except NoSuchVersionError:
+      return None
+
+
+def _Append(store, versions, base, payload, number):
+  """Does the work of History.Record.
+
+  Args:
+    store: see the module docstring
+    versions: [VersionInfo]  # store.Versions()
+    base: see History.SetBase
+    payload: bytes
+    number: int  # for the new version
+  Returns:
+    None|VersionInfo  # None iff payload is the same as the latest version
+  """
+  sha1 = _Sha1(payload)
+  latest = versions[-1] if versions else None
+  if latest is not None and latest.sha1 == sha1:
+    return None
+  if callable(base):
+    base = base()
+  since_keyframe = 0
+  for v in reversed(versions):
+    if v.is_keyframe:
+      break
+    since_keyframe += 1
+  is_keyframe = (
+    latest is None or
+    base is None or
+    since_keyframe + 1 >= FLAGS.pyatdl_history_keyframe_interval or
+    latest.sha1 != _Sha1(base))
+  if is_keyframe:
+    data = zlib.compress(payload)
+  else:
+    data = Delta(base, payload)
+  info = VersionInfo(number=number,
+                     timestamp=time.time(),
+                     is_keyframe=is_keyframe,
+                     sha1=sha1,
+                     size=len(data))
+  store.Append(info, data)
+  return info
+
+
+def _Snapshot(store, versions, number):
+  """Does the work of History.Snapshot.
+
+  Args:
+    store: see the module docstring
+    versions: [VersionInfo]  # store.Versions()
+    number: int
+  Returns:
+    bytes
+  Raises:
+    NoSuchVersionError
+    CorruptHistoryError
+  """
+  chain = []
+  for v in versions:
+    if v.number > number:
+      break
+    if v.is_keyframe:
+      chain = []
+    chain.append(v)
+  if not chain or chain[-1].number != number:
+    raise NoSuchVersionError('No version %s in the history' % number)
+  if not chain[0].is_keyframe:
+    raise CorruptHistoryError('No keyframe before version %s' % number)
+  data = store.Read([v.number for v in chain])
+  try:
+    payload = zlib.decompress(data[chain[0].number])
+  except zlib.error as e:
+    raise CorruptHistoryError('Cannot decompress version %s: %s'
+                              % (chain[0].number, e))
+  for v in chain[1:]:
+    payload = Patch(payload, data[v.number])
+  if _Sha1(payload) != chain[-1].sha1:
+    raise CorruptHistoryError('Checksum mismatch for version %s' % number)
+  return payload
+
+
+class FileStore(object):
+  """Stores each version in its own file in the named directory.
+
+  The file's name holds the VersionInfo.
+
+  Fields:
+    dirname: str
+  """
+  def __init__(self, dirname):
+    self.dirname = dirname
+
+  def _Filename(self, info):
+    return os.path.join(
+      self.dirname,
+      '%d.%s.%d.%s' % (info.number, 'k' if info.is_keyframe else 'd',
+                       int(info.timestamp), info.sha1))
+
+  def _Infos(self):
+    """Returns {number: (VersionInfo, filename)}."""
+    result = {}
+    try:
+      names = os.listdir(self.dirname)
+    except OSError:
+      return result
+    for name in names:
+      parts = name.split('.')
+      if len(parts) != 4 or parts[1] not in ('k', 'd'):
+        continue  # e.g., a temporary file
+      filename = os.path.join(self.dirname, name)
+      info = VersionInfo(number=int(parts[0]),
+                         timestamp=float(parts[2]),
+                         is_keyframe=parts[1] == 'k',
+                         sha1=parts[3],
+                         size=os.path.getsize(filename))
+      result[info.number] = (info, filename)
+    return result
+
+  def Versions(self):  # pylint: disable=missing-docstring
+    infos = self._Infos()
+    return [infos[number][0] for number in sorted(infos)]
+
+  def Read(self, numbers):  # pylint: disable=missing-docstring
+    infos = self._Infos()
+    result = {}
+    for number in numbers:
+      if number in infos:
+        with open(infos[number][1], 'rb') as f:
+          result[number] = f.read()
+    return result
+
+  def Append(self, info, data):  # pylint: disable=missing-docstring
+    if not os.path.exists(self.dirname):
+      os.makedirs(self.dirname)
+    filename = self._Filename(info)
+    with open(filename + '.tmp', 'wb') as f:
+      f.write(data)
+    os.rename(filename + '.tmp', filename)
+
+  def Delete(self, numbers):  # pylint: disable=missing-docstring
+    infos = self._Infos()
+    for number in numbers:
+      if number in infos:
+        os.remove(infos[number][1])
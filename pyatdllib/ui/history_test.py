@@ -0,0 +1,169 @@
+"""Unittests for module 'history'."""
+
+import random
+import shutil
+import tempfile
+import zlib
+
+import gflags as flags  # https://code.google.com/p/python-gflags/
+
+from pyatdllib.core import unitjest
+from pyatdllib.ui import history
+
+FLAGS = flags.FLAGS
+
+
+class _Store(object):
+  def __init__(self):
+    self.infos = []
+    self.data = {}
+    self.numbers_read = []
+
+  def Versions(self):
+    return list(self.infos)
+
+  def Read(self, numbers):
+    self.numbers_read.extend(numbers)
+    return dict((n, self.data[n]) for n in numbers if n in self.data)
+
+  def Append(self, info, data):
+    self.infos.append(info)
+    self.data[info.number] = data
+
+  def Delete(self, numbers):
+    self.infos = [i for i in self.infos if i.number not in numbers]
+    for n in numbers:
+      del self.data[n]
+
+
+# pylint: disable=missing-docstring,too-many-public-methods
+class HistoryTestCase(unitjest.TestCase):
+
+  def setUp(self):
+    super(HistoryTestCase, self).setUp()
+    FLAGS.pyatdl_history_max_versions = 100
+    FLAGS.pyatdl_history_keyframe_interval = 20
+    self._random = random.Random(37)
+
+  def _RandomBytes(self, n):
+    return b''.join(chr(self._random.randrange(256)) for _ in xrange(n))
+
+  def _Edited(self, b):
+    while True:
+      i = self._random.randrange(len(b))
+      j = min(len(b), i + self._random.randrange(20))
+      edited = b[:i] + self._RandomBytes(self._random.randrange(20)) + b[j:]
+      if edited != b:
+        return edited
+
+  def testDeltaAndPatch(self):
+    old = self._RandomBytes(100000)
+    for unused_i in xrange(20):
+      new = self._Edited(old)
+      delta = history.Delta(old, new)
+      self.assertEqual(history.Patch(old, delta), new)
+      self.assertLess(len(delta), 200)
+      old = new
+    for old, new in [(b'', b''), (b'', b'abc'), (b'abc', b''),
+                     (b'a' * 100, b'a' * 1000), (b'x' * 64, b'y' * 64)]:
+      self.assertEqual(history.Patch(old, history.Delta(old, new)), new)
+
+  def testPatchRejectsGarbage(self):
+    with self.assertRaises(history.CorruptHistoryError):
+      history.Patch(b'abc', b'not zlib')
+    with self.assertRaises(history.CorruptHistoryError):
+      history.Patch(b'abc', zlib.compress(b'\x00\x02\x05'))
+    with self.assertRaises(history.CorruptHistoryError):
+      history.Patch(b'abc', zlib.compress(b'\x07'))
+
+  def testRecordAndSnapshot(self):
+    store = _Store()
+    h = history.History(store)
+    h.SetBase(None)
+    snapshots = [self._RandomBytes(5000)]
+    for unused_i in xrange(44):
+      snapshots.append(self._Edited(snapshots[-1]))
+    for s in snapshots:
+      h.Record(s)
+      h.Record(s)  # a no-op
+    versions = h.Versions()
+    self.assertEqual([v.number for v in versions], range(1, 46))
+    self.assertEqual([v.number for v in versions if v.is_keyframe],
+                     [1, 21, 41])
+    for i, s in enumerate(snapshots):
+      store.numbers_read = []
+      self.assertEqual(h.Snapshot(i + 1), s)
+      self.assertEqual(len(store.numbers_read), i % 20 + 1)
+    with self.assertRaises(history.NoSuchVersionError):
+      h.Snapshot(46)
+
+  def testUnknownBaseMeansKeyframe(self):
+    store = _Store()
+    h = history.History(store)
+    h.Record(b'x' * 100)
+    h = history.History(store)
+    h.SetBase(b'y' * 100)  # e.g., written while history was off
+    h.Record(b'z' * 100)
+    self.assertEqual([v.is_keyframe for v in h.Versions()], [True, True])
+    h.Record(b'z' * 99)
+    self.assertEqual([v.is_keyframe for v in h.Versions()], [True, True, False])
+
+  def testRetention(self):
+    FLAGS.pyatdl_history_max_versions = 5
+    FLAGS.pyatdl_history_keyframe_interval = 3
+    store = _Store()
+    h = history.History(store)
+    for i in xrange(20):
+      h.Record(b'%d' % i)
+      self.assertGreaterEqual(len(h.Versions()), min(i + 1, 5))
+      self.assertLessEqual(len(h.Versions()), 5 + 3)
+      self.assertTrue(h.Versions()[0].is_keyframe)
+    self.assertEqual(h.Snapshot(20), b'19')
+    self.assertEqual(sorted(store.data), [v.number for v in h.Versions()])
+
+  def testArchive(self):
+    FLAGS.pyatdl_history_max_versions = 5
+    FLAGS.pyatdl_history_keyframe_interval = 3
+    store = _Store()
+    archive_store = _Store()
+    h = history.History(store, archive_store=archive_store)
+    h.RecordArchive(b'a0')  # no version yet
+    self.assertEqual(archive_store.infos, [])
+    for i in xrange(20):
+      h.Record(b'%d' % i)
+      if i % 4 == 0:
+        h.RecordArchive(b'a%d' % i)
+        h.RecordArchive(b'ignored')
+    self.assertEqual(h.ArchiveAt(20), b'a16')
+    self.assertEqual(h.ArchiveAt(16), b'a12')
+    oldest = h.Versions()[0].number
+    self.assertEqual(h.ArchiveAt(oldest), b'a%d' % ((oldest - 1) // 4 * 4))
+    self.assertLessEqual(len(archive_store.infos), 4)
+    self.assertIsNone(history.History(store).ArchiveAt(20))
+
+  def testDisabled(self):
+    FLAGS.pyatdl_history_max_versions = 0
+    store = _Store()
+    history.History(store).Record(b'abc')
+    self.assertEqual(store.infos, [])
+
+  def testFileStore(self):
+    tmpdir = tempfile.mkdtemp()
+    try:
+      h = history.History(history.FileStore(tmpdir + '/h'))
+      self.assertEqual(h.Versions(), [])
+      h.Record(b'a' * 1000)
+      h.Record(b'a' * 1000 + b'b')
+      h = history.History(history.FileStore(tmpdir + '/h'))
+      self.assertEqual([(v.number, v.is_keyframe) for v in h.Versions()],
+                       [(1, True), (2, False)])
+      self.assertEqual(h.Snapshot(2), b'a' * 1000 + b'b')
+      h.store.Delete([1])
+      with self.assertRaises(history.CorruptHistoryError):
+        h.Snapshot(2)
+    finally:
+      shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+  unitjest.main()
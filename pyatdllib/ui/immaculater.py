@@ -30,7 +30,9 @@ from google.apputils import app
 from google.apputils import appcommands  # https://code.google.com/p/google-apputils-python/
 from google.protobuf import text_format
 
+from . import profiling
 from . import serialization
+from . import slowlog
 from . import state
 from . import uicmd
 
@@ -60,6 +62,18 @@ flags.DEFINE_string(
     'pyatdl_prompt',
     'immaculater> ',
     'During interactive use, what text do you want to appear as the command line prompt (like bash\'s $PS1)?')
+flags.DEFINE_string(
+    'profile_output',
+    None,
+    'If set, the "batch" command saves a cProfile profile (see module '
+    'profiling) of its run here. If this is a directory, the profile goes in '
+    'a new file within it and the oldest profiles there are deleted; see '
+    '--profile_max_files.')
+flags.DEFINE_integer(
+    'profile_max_files',
+    100,
+    'How many profiles a --profile_output directory keeps.',
+    lower_bound=1)
 flags.ADOPT_module_key_flags(state)
 flags.ADOPT_module_key_flags(uicmd)
 
@@ -185,9 +199,19 @@ def ApplyBatchOfCommands(input_file, printer=None, reader=None, writer=None,
                          html_escaper=None):
   """Reads commands, one per line, from the named file, and performs them.
 
+  Before the first command, merges in the actions queued by the reader's
+  'read_captures(self)' method, if it has one, which returns [uicmd.Capture].
+  The writer's 'note_merged_captures(self, captures)' method, if it has one,
+  learns of them before the to-do list is written so that it can dequeue them
+  along with the write.
+
+  Slow commands and slow batches are logged; see module slowlog.
+
   Args:
     input_file: file
-    writer: None|object with 'write(bytes)' method
+    reader: None|object; see serialization.DeserializeToDoList2
+    writer: None|object with 'write(bytes)' method; see
+      serialization.SerializeToDoList2
     html_escaper: lambda unicode: unicode
   Returns:
     {'view': str,  # e.g., 'default'
@@ -196,6 +220,14 @@ def ApplyBatchOfCommands(input_file, printer=None, reader=None, writer=None,
   Raises:
     Error
   """
+  with slowlog.Batch() as batch:
+    return _ApplyBatchOfCommands(input_file, printer, reader, writer,
+                                 html_escaper, batch)
+
+
+def _ApplyBatchOfCommands(input_file, printer, reader, writer, html_escaper,
+                          batch):
+  """Does the work of ApplyBatchOfCommands, telling batch of the state."""
   if not printer:
     printer = _Print
   if FLAGS.database_filename is None:
@@ -209,6 +241,15 @@ def ApplyBatchOfCommands(input_file, printer=None, reader=None, writer=None,
     tdl,
     uicmd.APP_NAMESPACE,
     html_escaper)
+  batch.SetState(the_state)
+  captures = []
+  if FLAGS.database_filename is None and hasattr(reader, 'read_captures'):
+    captures = reader.read_captures()
+  if captures:
+    uicmd.MergeCaptures(the_state, captures)
+    # Undoing the first command must not undo the merge:
+    the_state.SetToDoList(the_state.ToDoList())
+    the_state.ResetUndoStack()
   the_state.ToDoList().CheckIsWellFormed()
   for line in input_file:
     line = line.strip()
@@ -222,14 +263,19 @@ def ApplyBatchOfCommands(input_file, printer=None, reader=None, writer=None,
         raise BadArgsForCommandError(str(e))
       continue
   the_state.ToDoList().CheckIsWellFormed()
+  # Before the write because this may fetch a project (see
+  # tdl.ToDoList.FetchProjects), which the write may render stale:
+  result = {'view': the_state.ViewFilter().ViewFilterUINames()[0],
+            'cwc': the_state.CurrentWorkingContainerString(),
+            'cwc_uid': the_state.CurrentWorkingContainer().uid}
   if FLAGS.database_filename is None:
+    if captures and hasattr(writer, 'note_merged_captures'):
+      writer.note_merged_captures(captures)
     serialization.SerializeToDoList2(the_state.ToDoList(), writer)
   else:
     serialization.SerializeToDoList(
       the_state.ToDoList(), FLAGS.database_filename)
-  return {'view': the_state.ViewFilter().ViewFilterUINames()[0],
-          'cwc': the_state.CurrentWorkingContainerString(),
-          'cwc_uid': the_state.CurrentWorkingContainer().uid}
+  return result
 
 
 class Batch(Cmd):  # pylint: disable=too-few-public-methods
@@ -251,13 +297,25 @@ class Batch(Cmd):  # pylint: disable=too-few-public-methods
       raise app.UsageError('File specified does not exist: %s' % argv[-1])
     try:
       with open(argv[-1]) as input_file:
-        ApplyBatchOfCommands(input_file)
+        if FLAGS.profile_output is None:
+          ApplyBatchOfCommands(input_file)
+        else:
+          with profiling.Profiled(_ProfilePath):
+            ApplyBatchOfCommands(input_file)
     except serialization.DeserializationError as e:
       _Print(e)
       _Print('Aborting.')
       return 1
 
 
+def _ProfilePath():
+  """Returns where to save the profile given --profile_output."""
+  if os.path.isdir(FLAGS.profile_output):
+    return profiling.PathInDirectory(FLAGS.profile_output, 'batch',
+                                     FLAGS.profile_max_files)
+  return FLAGS.profile_output
+
+
 class ResetDatabase(Cmd):  # pylint: disable=too-few-public-methods
   """Erase the current database and replace it with a brand-new one.
 
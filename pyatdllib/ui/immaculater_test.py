@@ -1,6 +1,7 @@
 """Unittests for module 'immaculater'."""
 
 import copy
+import json
 import os
 import pipes
 import random
@@ -14,6 +15,8 @@ from gflags import _helpers
 from google.protobuf import message
 
 from pyatdllib.ui import immaculater
+from pyatdllib.ui import serialization
+from pyatdllib.ui import uicmd
 from pyatdllib.core import tdl
 from pyatdllib.core import uid
 from pyatdllib.core import unitjest
@@ -98,6 +101,16 @@ class ImmaculaterTestCase(unitjest.TestCase):
       inputs: [basestring]
       golden_outputs: [basestring]
     """
+    self._AssertEqualWithDiff(golden_outputs, self._Printed(inputs))
+
+  def _Printed(self, inputs):
+    """Feeds the inputs to the beast and returns what it printed.
+
+    Args:
+      inputs: [basestring]
+    Returns:
+      [unicode]
+    """
     inputs = copy.copy(inputs)
 
     def MyRawInput(unused_prompt=''):  # pylint: disable=unused-argument
@@ -117,7 +130,7 @@ class ImmaculaterTestCase(unitjest.TestCase):
       return s.replace('&nbsp;', '&amp;nbsp;')
 
     immaculater.MutateToDoListLoop(self.todolist, html_escaper=HTMLEscaper)
-    self._AssertEqualWithDiff(golden_outputs, printed)
+    return printed
 
   def testBase64RandomSlug(self):
     random.seed(37)
@@ -794,6 +807,163 @@ dump""")))
       ]
     self.helpTest(inputs, golden_printed)
 
+  def testPagination(self):
+    inputs = ['chclock 1137',
+              'reset --annihilate',
+              'mkctx c1',
+              'mkctx b2',
+              'mkctx a3',
+              'mkact -c c1 /inbox/z',
+              'mkact -c c1 /inbox/y',
+              'mkact -c c1 /inbox/x',
+              'mkprj p0',
+              'inctx --json --limit 2 c1',
+              'echo after first page uid',
+              'inctx --json --limit 2 --cursor Wzhd c1',
+              'echo after second page uid',
+              'lsctx --json --limit 2',
+              'echo after lsctx uid',
+              'sort alpha',
+              'lsctx --json --limit 2',
+              'echo after lsctx alpha',
+              'lsctx --json --limit 2 --cursor WyJiMiIsNV0=',
+              'echo after lsctx alpha second page',
+              'inctx --json --limit 2 c1',
+              'echo after inctx alpha',
+              'inctx --json --cursor WyJ5Iiw4XQ== c1',
+              'echo after inctx alpha --cursor without --limit',
+              'inprj --json --limit 2 /inbox',
+              'echo after inprj alpha',
+              'lsprj --json --limit 1 --cursor WyIiLDFd',
+              'echo after lsprj alpha',
+              'inctx --json --limit 2 --cursor WzZd c1',
+              'echo after cursor from another sorting',
+              'lsctx --limit 2',
+              'echo after --nojson',
+              'lsctx --json --limit 0',
+              'echo after --limit 0',
+              'lsctx --json --cursor junk',
+              'echo after junk',
+              'lsctx --json --limit 2 c1',
+              'echo after lsctx with an argument',
+              ]
+    golden_printed = [
+      'Reset complete.',
+      '{"items":[{"ctime":1137.0,"dtime":null,"in_context":"c1","in_context_uid":4,"in_prj":"inbox","is_complete":false,"is_deleted":false,"mtime":1137.0,"name":"z","number_of_items":1,"uid":7},{"ctime":1137.0,"dtime":null,"in_context":"c1","in_context_uid":4,"in_prj":"inbox","is_complete":false,"is_deleted":false,"mtime":1137.0,"name":"y","number_of_items":1,"uid":8}],"next_cursor":"Wzhd"}',
+      'after first page uid',
+      '{"items":[{"ctime":1137.0,"dtime":null,"in_context":"c1","in_context_uid":4,"in_prj":"inbox","is_complete":false,"is_deleted":false,"mtime":1137.0,"name":"x","number_of_items":1,"uid":9}],"next_cursor":null}',
+      'after second page uid',
+      '{"items":[{"ctime":0,"dtime":null,"is_active":true,"is_complete":false,"is_deleted":false,"mtime":0,"name":"<none>","number_of_items":0,"uid":0},{"ctime":1137.0,"dtime":null,"is_active":true,"is_complete":false,"is_deleted":false,"mtime":1137.0,"name":"c1","number_of_items":3,"uid":4}],"next_cursor":"WzRd"}',
+      'after lsctx uid',
+      '{"items":[{"ctime":0,"dtime":null,"is_active":true,"is_complete":false,"is_deleted":false,"mtime":0,"name":"<none>","number_of_items":0,"uid":0},{"ctime":1137.0,"dtime":null,"is_active":true,"is_complete":false,"is_deleted":false,"mtime":1137.0,"name":"a3","number_of_items":0,"uid":6}],"next_cursor":"WyJhMyIsNl0="}',
+      'after lsctx alpha',
+      '{"items":[{"ctime":1137.0,"dtime":null,"is_active":true,"is_complete":false,"is_deleted":false,"mtime":1137.0,"name":"c1","number_of_items":3,"uid":4}],"next_cursor":null}',
+      'after lsctx alpha second page',
+      '{"items":[{"ctime":1137.0,"dtime":null,"in_context":"c1","in_context_uid":4,"in_prj":"inbox","is_complete":false,"is_deleted":false,"mtime":1137.0,"name":"x","number_of_items":1,"uid":9},{"ctime":1137.0,"dtime":null,"in_context":"c1","in_context_uid":4,"in_prj":"inbox","is_complete":false,"is_deleted":false,"mtime":1137.0,"name":"y","number_of_items":1,"uid":8}],"next_cursor":"WyJ5Iiw4XQ=="}',
+      'after inctx alpha',
+      '{"items":[{"ctime":1137.0,"dtime":null,"in_context":"c1","in_context_uid":4,"in_prj":"inbox","is_complete":false,"is_deleted":false,"mtime":1137.0,"name":"z","number_of_items":1,"uid":7}],"next_cursor":null}',
+      'after inctx alpha --cursor without --limit',
+      '{"items":[{"ctime":1137.0,"dtime":null,"in_context":"c1","in_context_uid":4,"is_complete":false,"is_deleted":false,"mtime":1137.0,"name":"x","number_of_items":1,"uid":9},{"ctime":1137.0,"dtime":null,"in_context":"c1","in_context_uid":4,"is_complete":false,"is_deleted":false,"mtime":1137.0,"name":"y","number_of_items":1,"uid":8}],"next_cursor":"WyJ5Iiw4XQ=="}',
+      'after inprj alpha',
+      '{"items":[{"ctime":1137.0,"default_context_uid":0,"dtime":null,"is_active":true,"is_complete":false,"is_deleted":false,"mtime":1137.0,"name":"p0","needsreview":false,"number_of_items":0,"path":"/","uid":10}],"next_cursor":null}',
+      'after lsprj alpha',
+      '--cursor is from a page sorted differently; see "help sort"',
+      'after cursor from another sorting',
+      '--limit and --cursor require --json',
+      'after --nojson',
+      '--limit must be positive',
+      'after --limit 0',
+      'Invalid --cursor junk',
+      'after junk',
+      '--limit and --cursor require zero arguments',
+      'after lsctx with an argument',
+      ]
+    self.helpTest(inputs, golden_printed)
+
+  def testPagedata(self):
+    setup = ['chclock 1137',
+             'reset --annihilate',
+             'mkctx c0',
+             'mkctx c1',
+             'deactivatectx c1',
+             'mkdir /d0',
+             'mkprj /d0/p0',
+             'mkprj /p1',
+             'mkact -c c0 /d0/p0/a0',
+             'mkact -c c1 /d0/p0/a1',
+             'mkact /d0/p0/a2',
+             'mkact -c c0 /p1/a3',
+             'complete /p1/a3',
+             'rmact /d0/p0/a2',
+             'note uid=7 "a note on p0"',
+             'note :__actions_without_context "no context"',
+             'chclock 9999999',
+             ]
+    # Each page's old batch of commands, keyed by pagedata's sections:
+    pages = [
+      ('pagedata project uid=7',
+       {'inprj': 'inprj --json uid=7',
+        'needsreview': 'needsreview --json',
+        'lsprj': 'lsprj --json uid=7',
+        'note': 'note uid=7',
+        'undeleted_lsctx': 'lsctx --json'}),
+      ('pagedata action uid=9',
+       {'lsact': 'lsact --json uid=9',
+        'undeleted_lsctx': 'lsctx --json',
+        'undeleted_lsprj': 'lsprj --json',
+        'note': 'note uid=9'}),
+      ('pagedata context uid=4',
+       {'inctx': 'inctx --sort_by uid --json uid=4',
+        'lsctx': 'lsctx --json uid=4',
+        'note': 'note uid=4'}),
+      ('pagedata context uid=0',
+       {'inctx': 'inctx --sort_by uid --json uid=0',
+        'note': 'note :__actions_without_context'}),
+      ('pagedata projects',
+       {'lsprj': 'lsprj --json',
+        'needsreview': 'needsreview --json'}),
+      ]
+    setup_lengths = {}  # how many lines setup prints, by the commands after it
+    for view in ('all', 'actionable', 'all_even_deleted', 'incomplete'):
+      for sorting in ('alpha', 'chrono'):
+        for pagedata, sections in pages:
+          prefix = ['view %s' % view, 'sort %s' % sorting]
+          printed = self._Printed(setup + prefix + [pagedata])
+          pagedata_json = json.loads(printed[-1])
+          for section, command in sorted(sections.items()):
+            if section.startswith('undeleted_'):
+              cmd_prefix = ['view incomplete', 'sort alpha']
+            else:
+              cmd_prefix = prefix
+            if tuple(cmd_prefix) not in setup_lengths:
+              setup_lengths[tuple(cmd_prefix)] = len(
+                self._Printed(setup + cmd_prefix))
+            printed = self._Printed(setup + cmd_prefix + [command])
+            printed = printed[setup_lengths[tuple(cmd_prefix)]:]
+            if section == 'note':
+              expected = u'\n'.join(printed)
+            else:
+              self.assertEqual(1, len(printed), printed)
+              expected = json.loads(printed[0])
+            self.assertEqual(expected, pagedata_json[section],
+                             '%s %s %s %s' % (view, sorting, pagedata, section))
+    self.helpTest(
+      setup + ['pagedata --limit 1 context uid=4',
+               'pagedata',
+               'pagedata project',
+               'pagedata project uid=1000',
+               'pagedata action uid=6',
+               'pagedata --limit 1 projects',
+               ],
+      ['Reset complete.',
+       '{"inctx":{"items":[{"ctime":1137.0,"dtime":null,"in_context":"c0","in_context_uid":4,"in_prj":"p0","is_complete":false,"is_deleted":false,"mtime":1137.0,"name":"a0","number_of_items":1,"uid":9}],"next_cursor":"Wzld"},"lsctx":{"ctime":1137.0,"dtime":null,"is_active":true,"is_complete":false,"is_deleted":false,"mtime":1137.0,"name":"c0","number_of_items":2,"uid":4},"note":""}',
+       'Needs a page kind, one of action, context, project, projects',
+       'Needs 2 positional arguments; found these: [u\'project\']',
+       'No Project exists with UID 1000',
+       'No Action with UID 6 exists.',
+       '--limit and --cursor apply only to context pages',
+       ])
+
   def testMv(self):
     FLAGS.pyatdl_show_uid = True
     save_path = _CreateTmpFile('')
@@ -3303,10 +3473,12 @@ r"""<todolist>
   * ?
   * activatectx
   * activateprj
+  * archive
   * aspire
   * astaskpaper
   * cat
   * cd
+  * changes
   * chclock
   * chctx
   * chdefaultctx
@@ -3324,10 +3496,13 @@ r"""<todolist>
   * echolines
   * exit
   * help
+  * history
   * hypertext
+  * importtaskpaper
   * inctx
   * inprj
   * load
+  * loadjsonl
   * loadtest
   * ls
   * lsact
@@ -3341,6 +3516,7 @@ r"""<todolist>
   * mv
   * needsreview
   * note
+  * pagedata
   * prjify
   * purgedeleted
   * pwd
@@ -3349,6 +3525,7 @@ r"""<todolist>
   * rename
   * renamectx
   * reset
+  * restore
   * rm
   * rmact
   * rmctx
@@ -3356,11 +3533,13 @@ r"""<todolist>
   * rmprj
   * roll
   * save
+  * savejsonl
   * seed
   * sort
   * todo
   * touch
   * txt
+  * unarchive
   * uncomplete
   * undo
   * unicorn
@@ -4865,6 +5044,75 @@ r"""<todolist>
     ]
     self.helpTest(inputs, golden_printed)
 
+  def testSavejsonlAndLoadjsonl(self):
+    FLAGS.pyatdl_show_uid = True
+    save_path = _CreateTmpFile('')
+    inputs = ['mkctx @home',
+              'mkprj /P',
+              'mkact -c @home /P/a',
+              'complete /P/a',
+              'savejsonl %s' % pipes.quote(save_path),
+              'rmact /P/a',
+              'rmprj /P',
+              'loadjsonl %s' % pipes.quote(save_path),
+              'loadjsonl /nonexistent/file',
+              'ls -R -a /',
+              ]
+    golden_printed = [
+      'Save complete.',
+      'Load complete.',
+      'Cannot read /nonexistent/file: No such file or directory',
+      '--folder--- uid=2 .',
+      '--folder--- uid=2 ..',
+      '--project-- uid=1 --incomplete-- ---active--- inbox',
+      '--project-- uid=5 --incomplete-- ---active--- P',
+      '',
+      '/inbox:',
+      '--project-- uid=1 --incomplete-- ---active--- .',
+      '--folder--- uid=2 ..',
+      '',
+      '/P:',
+      '--project-- uid=5 --incomplete-- ---active--- .',
+      '--folder--- uid=2 ..',
+      '--action--- uid=6 ---COMPLETE--- a --in-context-- @home',
+    ]
+    self.helpTest(inputs, golden_printed)
+
+  def testImporttaskpaper(self):
+    FLAGS.pyatdl_show_uid = True
+    path = _CreateTmpFile(
+      '\n'.join([
+        'inbox:',
+        '\t- call mom @phone',
+        '',
+        '@done /F/P:',
+        'a note',
+        '\t- buy a broom\tnote: wide @home @done',
+        '\t- toss junk @done @deleted',
+        '']))
+    inputs = ['mkctx @home',
+              'importtaskpaper %s' % pipes.quote(path),
+              'importtaskpaper /nonexistent/file',
+              'view all_even_deleted',
+              'astaskpaper',
+              'lsctx',
+              ]
+    golden_printed = [
+      'Imported 1 Folders, 1 Projects, 3 Actions, and 1 Contexts.',
+      'Cannot read /nonexistent/file: No such file or directory',
+      'inbox:',
+      '\t- call mom @phone',
+      '',
+      '@done /F/P:',
+      'a note',
+      '\t- buy a broom\tnote: wide @home @done',
+      '\t- toss junk @done @deleted',
+      '--context-- uid=0 ---active--- \'<none>\'',
+      '--context-- uid=4 ---active--- @home',
+      '--context-- uid=5 ---active--- @phone',
+    ]
+    self.helpTest(inputs, golden_printed)
+
   def testPurgeDeleted(self):
     FLAGS.pyatdl_show_uid = True
     save_path = _CreateTmpFile('')
@@ -5630,7 +5878,7 @@ r"""<todolist>
       "Load complete.",
       "ls after save/load:"] + subgolden + [
       "and is dtime set correctly?",
-      "--action--- mtime=1969/12/31-19:00:38 ctime=1969/12/31-19:00:37 --incomplete-- foo --in-context-- '<none>'",
+      "--action--- mtime=1969/12/31-19:00:37 ctime=1969/12/31-19:00:37 --incomplete-- foo --in-context-- '<none>'",
       "--action--- --DELETED-- mtime=1969/12/31-19:00:38 ctime=1969/12/31-19:00:37 dtime=1969/12/31-19:00:38 ---COMPLETE--- bar --in-context-- '<none>'",
     ]
     self.helpTest(inputs, golden_printed)
@@ -5745,6 +5993,90 @@ r"""<todolist>
     self.helpTest(inputs, golden_printed)
 
 
+  def testCaptures(self):
+    self.assertEqual(uicmd.ParseCapture(u'do buy milk'), ('do', u'buy milk'))
+    self.assertEqual(uicmd.ParseCapture(u'maybe "learn Go"'),
+                     ('maybe', u'learn Go'))
+    for command_line in [u'do', u'do ""', u'do --help', u'do uid=3',
+                         u'do "Work: uid=5"', u'do +Work uid=5', u'do "P:"',
+                         u'do "unterminated', u'touch x', u'cd /inbox']:
+      self.assertIsNone(uicmd.ParseCapture(command_line), command_line)
+
+    class Reader(object):
+      def __init__(self, b, captures):
+        self.b = b
+        self.captures = captures
+        self.name = 'test reader'
+
+      def read(self):
+        return self.b
+
+      def read_captures(self):
+        return self.captures
+
+    class Writer(object):
+      written = None
+      merged = None
+
+      def write(self, b):
+        self.written = b
+
+      def note_merged_captures(self, captures):
+        self.merged = captures
+
+    printed = []
+    saved_database_filename = FLAGS.database_filename
+    FLAGS.database_filename = None
+    try:
+      FLAGS.pyatdl_show_uid = True
+      w = Writer()
+      immaculater.ApplyBatchOfCommands(
+        open(_CreateTmpFile('mkprj /P0\nmkctx @home\nmkact /inbox/i0')),
+        printed.append, Reader('', []), w)
+      self.assertIsNone(w.merged)
+      before = serialization.DeserializeToDoList2(
+        Reader(w.written, []), lambda: None)
+      captures = [uicmd.Capture('k0', 100.0, 'do', u'walk the dog @home'),
+                  uicmd.Capture('k1', 200.0, 'maybe', u'P0: learn Go'),
+                  uicmd.Capture('k2', 300.0, 'do', u'a/b'),
+                  uicmd.Capture('k3', 400.0, 'complete', u'uid=6'),
+                  uicmd.Capture('k4', 500.0, 'complete', u'uid=99'),
+                  uicmd.Capture('k5', 600.0, 'complete', u'uid=9'),
+                  uicmd.Capture('k6', 700.0, 'uncomplete', u'uid=9'),
+                  # Queued by an older version that let these through:
+                  uicmd.Capture('k7', 800.0, 'do', u'P0: uid=5'),
+                  uicmd.Capture('k8', 900.0, 'maybe', u'P0: uid=5')]
+      reader = Reader(w.written, captures)
+      w = Writer()
+      immaculater.ApplyBatchOfCommands(
+        open(_CreateTmpFile('undo\nls -R /')), printed.append, reader, w)
+      self.assertEqual(w.merged, captures)
+      self.assertEqual(
+        printed,
+        ['There are no more operations to undo',
+         '--project-- uid=1 --incomplete-- ---active--- inbox',
+         '--project-- uid=4 --incomplete-- ---active--- P0',
+         '',
+         '/inbox:',
+         '--action--- uid=6 ---COMPLETE--- i0 --in-context-- \'<none>\'',
+         '--action--- uid=7 --incomplete-- \'walk the dog @home\' --in-context-- @home',
+         '--action--- uid=9 --incomplete-- a/b --in-context-- \'<none>\'',
+         '--action--- uid=10 --incomplete-- \'P0: uid=5\' --in-context-- \'<none>\'',
+         '--action--- uid=11 --incomplete-- \'P0: uid=5\' --in-context-- \'<none>\'',
+         '',
+         '/P0:',
+         '--action--- uid=8 --incomplete-- \'learn Go\' --in-context-- \'<none>\''])
+      todolist = serialization.DeserializeToDoList2(
+        Reader(w.written, []), lambda: None)
+      self.assertEqual([todolist.ActionByUID(u)[0].ctime for u in (7, 8, 9)],
+                       [100.0, 200.0, 300.0])
+      # The toggles are as of 400.0, earlier than anything else:
+      self.assertEqual(todolist.ActionByUID(6)[0].mtime,
+                       before.ActionByUID(6)[0].mtime)
+    finally:
+      FLAGS.database_filename = saved_database_filename
+
+
 if __name__ == '__main__':
   unitjest.main()
 
@@ -0,0 +1,438 @@
+"""Three-way merge of to-do lists, for concurrent writers.
+
+Two writers that read the same version of a to-do list (the base) and then
+edit it produce two new versions (ours and theirs). Merge combines the edits
+object by object, matching Folders, Projects, Actions, and Contexts by UID, so
+that neither writer's changes vanish. Where both writers changed the same field
+of the same object, the copy with the later Common.timestamp.mtime wins.
+
+Everything here works on pyatdl_pb2.ToDoList, not tdl.ToDoList, so that a
+writer can merge without deserializing.
+"""
+
+import collections
+
+from google.protobuf import descriptor
+
+from ..core import pyatdl_pb2
+
+_FOLDER = 'folder'
+_PROJECT = 'project'
+_ACTION = 'action'
+_CONTEXT = 'context'
+_CONTEXT_LIST = 'context list'
+
+# The kind of parent each kind of object must have:
+_PARENT_KIND = {
+  _FOLDER: _FOLDER,
+  _PROJECT: _FOLDER,
+  _ACTION: _PROJECT,
+  _CONTEXT: _CONTEXT_LIST,
+}
+
+# The repeated fields holding an object's children, which Flattened clears:
+_CHILD_FIELDS = {
+  _FOLDER: ('folders', 'projects'),
+  _PROJECT: ('actions',),
+  _ACTION: (),
+  _CONTEXT: (),
+  _CONTEXT_LIST: ('contexts',),
+}
+
+# kind: one of the above
+# parent: None|int  # UID of the parent; None for /inbox, /, and the
+#                   # ContextList, whose places are fixed
+# pb: pyatdl_pb2.Folder|Project|Action|Context|ContextList  # sans children
+Item = collections.namedtuple('Item', ['kind', 'parent', 'pb'])
+
+
+def Flattened(pb):
+  """Returns the objects in pb and the order of each object's children.
+
+  Args:
+    pb: None|pyatdl_pb2.ToDoList
+  Returns:
+    ({int: Item},  # by UID
+     {(int, str): [int]})  # (parent UID, kind of child) => child UIDs in order
+  """
+  items = {}
+  children = collections.defaultdict(list)
+  if pb is None:
+    return items, children
+
+  def Add(kind, parent, child):  # pylint: disable=missing-docstring
+    flat = type(child)()
+    flat.CopyFrom(child)
+    for field_name in _CHILD_FIELDS[kind]:
+      flat.ClearField(field_name)
+    items[child.common.uid] = Item(kind, parent, flat)
+    if parent is not None:
+      children[(parent, kind)].append(child.common.uid)
+
+  def AddProject(project, parent):  # pylint: disable=missing-docstring
+    Add(_PROJECT, parent, project)
+    for a in project.actions:
+      Add(_ACTION, project.common.uid, a)
+
+  def AddFolder(folder, parent):  # pylint: disable=missing-docstring
+    Add(_FOLDER, parent, folder)
+    for f in folder.folders:
+      AddFolder(f, folder.common.uid)
+    for p in folder.projects:
+      AddProject(p, folder.common.uid)
+
+  if pb.HasField('inbox'):
+    AddProject(pb.inbox, None)
+  if pb.HasField('root'):
+    AddFolder(pb.root, None)
+  if pb.HasField('ctx_list'):
+    Add(_CONTEXT_LIST, None, pb.ctx_list)
+    for c in pb.ctx_list.contexts:
+      Add(_CONTEXT, pb.ctx_list.common.uid, c)
+  return items, children
+
+
+def _Renumbered(items, children, new_uids):
+  """Gives objects new UIDs, updating all references to them.
+
+  Args:
+    items: {int: Item}
+    children: {(int, str): [int]}
+    new_uids: {int: int}  # old UID => new UID
+  Returns:
+    ({int: Item}, {(int, str): [int]})
+  """
+  def New(u):  # pylint: disable=missing-docstring
+    return new_uids.get(u, u)
+
+  renumbered_items = {}
+  for u, item in items.items():
+    pb = item.pb
+    if u in new_uids:
+      pb.common.uid = new_uids[u]
+    if item.kind == _ACTION and pb.HasField('ctx'):
+      pb.ctx.common.uid = New(pb.ctx.common.uid)
+    if item.kind == _PROJECT and pb.default_context_uid:
+      pb.default_context_uid = New(pb.default_context_uid)
+    renumbered_items[New(u)] = item._replace(
+      parent=None if item.parent is None else New(item.parent))
+  renumbered_children = collections.defaultdict(list)
+  for (parent, kind), uids in children.items():
+    renumbered_children[(New(parent), kind)] = [New(u) for u in uids]
+  return renumbered_items, renumbered_children
+
+
+def _Chosen(base, ours, theirs, ours_wins):
+  """The three-way merge of a single value.
+
+  Args:
+    base: object
+    ours: object
+    theirs: object
+    ours_wins: bool  # whether ours prevails if both changed
+  Returns:
+    object  # ours or theirs
+  """
+  if ours == base:
+    return theirs
+  if theirs == base:
+    return ours
+  return ours if ours_wins else theirs
+
+
+def _MergedMessage(base, ours, theirs, ours_wins):
+  """Merges messages field by field, recursing into submessages.
+
+  Repeated fields are treated as single values. Unknown fields and extensions
+  come from ours.
+
+  Args:
+    base: None|protobuf message
+    ours: protobuf message
+    theirs: protobuf message  # of the same type as ours
+    ours_wins: bool  # whether ours prevails if both changed a field
+  Returns:
+    protobuf message
+  """
+  result = type(ours)()
+  result.CopyFrom(ours)
+  for field in ours.DESCRIPTOR.fields:
+    name = field.name
+    if field.label == descriptor.FieldDescriptor.LABEL_REPEATED:
+      values = [None if m is None else list(getattr(m, name))
+                for m in (base, ours, theirs)]
+      chosen = _Chosen(values[0], values[1], values[2], ours_wins)
+      if chosen is not values[1]:
+        result.ClearField(name)
+        getattr(result, name).extend(chosen)
+      continue
+    has = [m is not None and m.HasField(name) for m in (base, ours, theirs)]
+    if field.type == descriptor.FieldDescriptor.TYPE_MESSAGE and all(has[1:]):
+      getattr(result, name).CopyFrom(
+        _MergedMessage(getattr(base, name) if has[0] else None,
+                       getattr(ours, name), getattr(theirs, name), ours_wins))
+      continue
+    values = [(h, getattr(m, name) if h else None)
+              for h, m in zip(has, (base, ours, theirs))]
+    chosen = _Chosen(values[0], values[1], values[2], ours_wins)
+    if chosen is values[1]:
+      continue
+    if not chosen[0]:
+      result.ClearField(name)
+    elif field.type == descriptor.FieldDescriptor.TYPE_MESSAGE:
+      getattr(result, name).CopyFrom(chosen[1])
+    else:
+      setattr(result, name, chosen[1])
+  return result
+
+
+def _MergedItem(base, ours, theirs):
+  """Merges two changed copies of the same object.
+
+  Args:
+    base: None|Item
+    ours: Item
+    theirs: Item
+  Returns:
+    Item
+  """
+  ours_ts = ours.pb.common.timestamp
+  theirs_ts = theirs.pb.common.timestamp
+  ours_wins = ours_ts.mtime >= theirs_ts.mtime
+  parent = _Chosen(None if base is None else base.parent,
+                   ours.parent, theirs.parent, ours_wins)
+  pb = _MergedMessage(None if base is None else base.pb,
+                      ours.pb, theirs.pb, ours_wins)
+  ts = pb.common.timestamp
+  ts.mtime = max(ours_ts.mtime, theirs_ts.mtime)
+  ts.ctime = min(ours_ts.ctime, theirs_ts.ctime)
+  if not pb.common.is_deleted:
+    ts.dtime = -1  # see auditable_object._Int64Timestamp
+  return Item(ours.kind, parent, pb)
+
+
+def _MergedOrder(key, base_children, ours_children, theirs_children, members):
+  """Returns the order of the children of one parent.
+
+  If ours reordered or added children, ours' order prevails and theirs'
+  additions go after the child they followed in theirs. Otherwise, theirs'
+  order prevails.
+
+  Args:
+    key: (int, str)  # (parent UID, kind of child)
+    base_children: {(int, str): [int]}
+    ours_children: {(int, str): [int]}
+    theirs_children: {(int, str): [int]}
+    members: set(int)  # UIDs of the merged children
+  Returns:
+    [int]
+  """
+  b = base_children.get(key, [])
+  o = ours_children.get(key, [])
+  t = theirs_children.get(key, [])
+  first, second = (t, o) if o == b else (o, t)
+  result = [u for u in first if u in members]
+  placed = set(result)
+  for i, u in enumerate(second):
+    if u not in members or u in placed:
+      continue
+    position = 0
+    for predecessor in reversed(second[:i]):
+      if predecessor in placed:
+        position = result.index(predecessor) + 1
+        break
+    result.insert(position, u)
+    placed.add(u)
+  for u in sorted(members):
+    if u not in placed:
+      result.append(u)
+      placed.add(u)
+  return result
+
+
+def _MergedNotes(base, ours, theirs):
+  """Merges pyatdl_pb2.NoteLists note by note, matching notes by name.
+
+  Notes have no mtime, so ours prevails if both changed a note.
+
+  Args:
+    base: None|pyatdl_pb2.NoteList
+    ours: pyatdl_pb2.NoteList
+    theirs: pyatdl_pb2.NoteList
+  Returns:
+    pyatdl_pb2.NoteList
+  """
+  def ByName(note_list):  # pylint: disable=missing-docstring
+    if note_list is None:
+      return {}
+    return dict((n.name, n.note) for n in note_list.notes)
+
+  b, o, t = ByName(base), ByName(ours), ByName(theirs)
+  result = pyatdl_pb2.NoteList()
+  names = [n.name for n in ours.notes]
+  names.extend(n.name for n in theirs.notes if n.name not in o)
+  for name in names:
+    note = _Chosen(b.get(name), o.get(name), t.get(name), True)
+    if note is not None:
+      result.notes.add(name=name, note=note)
+  return result
+
+
+def _IsSingleton(item):
+  return item.parent is None
+
+
+def _Identity(item):
+  """Returns what two objects that two writers created must share to be one.
+
+  E.g., two writers that merged the same queued capture (see
+  uicmd.MergeCaptures) each created the same action.
+
+  Args:
+    item: Item
+  Returns:
+    tuple
+  """
+  return (item.kind, item.pb.common.metadata.name,
+          item.pb.common.timestamp.ctime)
+
+
+def Merge(base, ours, theirs):
+  """Merges two edited versions of a to-do list.
+
+  An object that both created, i.e. one of the same kind with the same name and
+  ctime, becomes one object. Other objects that ours created get new UIDs if
+  theirs created objects with the same UIDs. An object that one side removed (e.g. via 'purgedeleted') stays
+  removed unless the other side changed it. An object whose parent is gone
+  moves to /inbox (Actions) or / (Projects and Folders); so does a Folder that
+  the merge would otherwise place inside itself. References to deleted or
+  removed Contexts are removed as 'rmctx' would.
+
+  Args:
+    base: None|pyatdl_pb2.ToDoList  # None if neither side began with a list
+    ours: pyatdl_pb2.ToDoList
+    theirs: pyatdl_pb2.ToDoList
+  Returns:
+    pyatdl_pb2.ToDoList
+  """
+  base_items, base_children = Flattened(base)
+  ours_items, ours_children = Flattened(ours)
+  theirs_items, theirs_children = Flattened(theirs)
+  theirs_created = dict((_Identity(item), u)
+                        for u, item in sorted(theirs_items.items())
+                        if u not in base_items and not _IsSingleton(item))
+  new_uids = {}  # ours' UID => theirs' UID for the same object
+  for u, item in sorted(ours_items.items()):
+    if u in base_items or _IsSingleton(item):
+      continue
+    same = theirs_created.pop(_Identity(item), None)
+    if same is not None and same != u:
+      new_uids[u] = same
+  collisions = sorted(u for u, item in ours_items.items()
+                      if u not in base_items and u in theirs_items
+                      and u not in new_uids and not _IsSingleton(item)
+                      and _Identity(item) != _Identity(theirs_items[u]))
+  if collisions:
+    next_uid = max(set(theirs_items) | (set(ours_items) - set(new_uids)
+                                        - set(collisions))) + 1
+    new_uids.update((u, next_uid + i) for i, u in enumerate(collisions))
+  if new_uids:
+    ours_items, ours_children = _Renumbered(ours_items, ours_children,
+                                            new_uids)
+
+  merged = {}
+  for u in set(ours_items) | set(theirs_items):
+    b = base_items.get(u)
+    o = ours_items.get(u)
+    t = theirs_items.get(u)
+    if o is not None and t is not None:
+      if o == t:
+        merged[u] = o
+      elif o == b:
+        merged[u] = t
+      elif t == b:
+        merged[u] = o
+      else:
+        merged[u] = _MergedItem(b, o, t)
+    else:
+      survivor = o if t is None else t
+      if b is None or survivor != b:  # created or changed, not just removed
+        merged[u] = survivor
+
+  singletons = dict((item.kind, u) for u, item in merged.items()
+                    if _IsSingleton(item))
+  inbox_uid = singletons.get(_PROJECT)
+  root_uid = singletons.get(_FOLDER)
+  for u, item in merged.items():
+    if _IsSingleton(item):
+      continue
+    parent = merged.get(item.parent)
+    if parent is None or parent.kind != _PARENT_KIND[item.kind]:
+      new_parent = {_ACTION: inbox_uid,
+                    _CONTEXT: singletons.get(_CONTEXT_LIST)}.get(item.kind,
+                                                                 root_uid)
+      merged[u] = item._replace(parent=new_parent)
+  for u in sorted(merged):
+    if merged[u].kind != _FOLDER or _IsSingleton(merged[u]):
+      continue
+    ancestors = set([u])
+    parent = merged[u].parent
+    while parent != root_uid:
+      if parent == u:
+        merged[u] = merged[u]._replace(parent=root_uid)
+        break
+      if parent in ancestors:
+        break  # a cycle above u, which we'll break when we get there
+      ancestors.add(parent)
+      parent = merged[parent].parent
+
+  live_contexts = set(u for u, item in merged.items()
+                      if item.kind == _CONTEXT and not item.pb.common.is_deleted)
+  for item in merged.values():
+    if item.kind == _ACTION and item.pb.HasField('ctx'):
+      if item.pb.ctx.common.uid not in live_contexts:
+        item.pb.ClearField('ctx')
+    if item.kind == _PROJECT and item.pb.HasField('default_context_uid'):
+      if item.pb.default_context_uid not in live_contexts:
+        item.pb.ClearField('default_context_uid')
+
+  members = collections.defaultdict(set)
+  for u, item in merged.items():
+    if not _IsSingleton(item):
+      members[(item.parent, item.kind)].add(u)
+
+  def Children(parent, kind):  # pylint: disable=missing-docstring
+    key = (parent, kind)
+    return _MergedOrder(key, base_children, ours_children, theirs_children,
+                        members[key])
+
+  def FillProject(pb, u):  # pylint: disable=missing-docstring
+    pb.CopyFrom(merged[u].pb)
+    for a in Children(u, _ACTION):
+      pb.actions.add().CopyFrom(merged[a].pb)
+
+  def FillFolder(pb, u):  # pylint: disable=missing-docstring
+    pb.CopyFrom(merged[u].pb)
+    for f in Children(u, _FOLDER):
+      FillFolder(pb.folders.add(), f)
+    for p in Children(u, _PROJECT):
+      FillProject(pb.projects.add(), p)
+
+  result = pyatdl_pb2.ToDoList()
+  if inbox_uid is not None:
+    FillProject(result.inbox, inbox_uid)
+  if root_uid is not None:
+    FillFolder(result.root, root_uid)
+  ctx_list_uid = singletons.get(_CONTEXT_LIST)
+  if ctx_list_uid is not None:
+    result.ctx_list.CopyFrom(merged[ctx_list_uid].pb)
+    for c in Children(ctx_list_uid, _CONTEXT):
+      result.ctx_list.contexts.add().CopyFrom(merged[c].pb)
+  result.has_never_purged_deleted = _Chosen(
+    None if base is None else base.has_never_purged_deleted,
+    ours.has_never_purged_deleted, theirs.has_never_purged_deleted, True)
+  if ours.HasField('note_list') or theirs.HasField('note_list'):
+    result.note_list.CopyFrom(
+      _MergedNotes(base.note_list if base is not None else None,
+                   ours.note_list, theirs.note_list))
+  return result
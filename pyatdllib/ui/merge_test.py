@@ -0,0 +1,179 @@
+"""Unittests for module 'merge'."""
+
+import time
+
+import gflags as flags  # https://code.google.com/p/python-gflags/
+
+from pyatdllib.core import tdl
+from pyatdllib.core import uid
+from pyatdllib.core import unitjest
+from pyatdllib.ui import lexer
+from pyatdllib.ui import merge
+from pyatdllib.ui import state
+from pyatdllib.ui import uicmd
+uicmd.RegisterAppcommands(False, uicmd.APP_NAMESPACE)
+
+FLAGS = flags.FLAGS
+
+
+# pylint: disable=missing-docstring,too-many-public-methods
+class MergeTestCase(unitjest.TestCase):
+
+  def setUp(self):
+    super(MergeTestCase, self).setUp()
+    self._now = 1000
+    time.time = lambda: self._now
+    uid.singleton_factory = uid.Factory()
+    FLAGS.pyatdl_show_uid = True
+    FLAGS.pyatdl_separator = '/'
+    FLAGS.seed_upon_creation = False
+    the_state = state.State(
+      lambda _: None, uicmd.NewToDoList(), uicmd.APP_NAMESPACE)
+    self._Run(the_state,
+              ['mkctx @home',
+               'mkact /inbox/i0',
+               'mkdir /F0',
+               'mkdir /F1',
+               'mkprj /F0/P0',
+               'mkprj /P1',
+               'mkact --context=@home /P1/a0',
+               'mkact /P1/a1'])
+    self._base = the_state.ToDoList().AsProto()
+
+  def _Run(self, the_state, argvs):
+    for argv in argvs:
+      uicmd.APP_NAMESPACE.FindCmdAndExecute(
+        the_state, lexer.SplitCommandLineIntoArgv(argv))
+
+  def _Edited(self, argvs, when):
+    """Returns the base after the given commands run at the given time."""
+    self._now = when
+    uid.singleton_factory = uid.Factory()
+    the_state = state.State(
+      lambda _: None,
+      tdl.ToDoList.DeserializedProtobuf(self._base.SerializeToString()),
+      uicmd.APP_NAMESPACE)
+    self._Run(the_state, argvs)
+    return the_state.ToDoList().AsProto()
+
+  def _Merged(self, ours, theirs):
+    """Returns the well-formed merge as a tdl.ToDoList."""
+    pb = merge.Merge(self._base, ours, theirs)
+    uid.singleton_factory = uid.Factory()
+    lst = tdl.ToDoList.DeserializedProtobuf(pb.SerializeToString())
+    lst.CheckIsWellFormed()
+    return lst
+
+  def _Names(self, project):
+    return [(a.uid, a.name) for a in project.items]
+
+  def testNoChanges(self):
+    self.assertEqual(merge.Merge(self._base, self._base, self._base),
+                     self._base)
+    ours = self._Edited(['complete /P1/a0'], 2000)
+    self.assertEqual(merge.Merge(self._base, ours, self._base), ours)
+    self.assertEqual(merge.Merge(self._base, self._base, ours), ours)
+
+  def testDisjointChanges(self):
+    ours = self._Edited(['complete /P1/a0', 'rename /P1 Project1'], 2000)
+    theirs = self._Edited(['rename uid=11 A1', 'chctx @home /inbox/i0'], 3000)
+    lst = self._Merged(ours, theirs)
+    a0, p1 = lst.ActionByUID(10)
+    self.assertTrue(a0.is_complete)
+    self.assertEqual(p1.name, 'Project1')
+    self.assertEqual(self._Names(p1), [(10, 'a0'), (11, 'A1')])
+    self.assertEqual(lst.ActionByUID(5)[0].ctx.uid, 4)
+
+  def testConflictingChangesLatestWins(self):
+    ours = self._Edited(['rename uid=10 ours'], 2000)
+    theirs = self._Edited(['rename uid=10 theirs'], 3000)
+    self.assertEqual(self._Merged(ours, theirs).ActionByUID(10)[0].name,
+                     'theirs')
+    self.assertEqual(self._Merged(theirs, ours).ActionByUID(10)[0].name,
+                     'theirs')
+
+  def testConcurrentCreation(self):
+    ours = self._Edited(['mkact /inbox/ours0', 'mkact /P1/ours1'], 2000)
+    theirs = self._Edited(['mkact /inbox/theirs0'], 3000)
+    lst = self._Merged(ours, theirs)
+    self.assertEqual(self._Names(lst.inbox),
+                     [(5, 'i0'), (12, 'theirs0'), (14, 'ours0')])
+    self.assertEqual(self._Names(lst.ActionByUID(10)[1]),
+                     [(10, 'a0'), (11, 'a1'), (13, 'ours1')])
+
+  def testSameCreation(self):
+    ours = self._Edited(['mkact /inbox/ours0', 'mkact /inbox/dog'], 2000)
+    theirs = self._Edited(['mkact /inbox/dog', 'mkact /inbox/theirs0'], 2000)
+    self.assertEqual(self._Names(self._Merged(ours, theirs).inbox),
+                     [(5, 'i0'), (14, 'ours0'), (12, 'dog'), (13, 'theirs0')])
+    ours = self._Edited(['mkact /inbox/dog'], 2000)
+    self.assertEqual(self._Names(self._Merged(ours, theirs).inbox),
+                     [(5, 'i0'), (12, 'dog'), (13, 'theirs0')])
+    # Created at different times, these are two objects:
+    ours = self._Edited(['mkact /inbox/dog'], 3000)
+    self.assertEqual(self._Names(self._Merged(ours, theirs).inbox),
+                     [(5, 'i0'), (12, 'dog'), (13, 'theirs0'), (14, 'dog')])
+
+  def testReparenting(self):
+    ours = self._Edited(['mv /P1/a0 /inbox', 'mv /P1 /F0'], 2000)
+    theirs = self._Edited(['rename uid=10 A0', 'mkact /P1/a2'], 3000)
+    lst = self._Merged(ours, theirs)
+    self.assertEqual(self._Names(lst.inbox), [(5, 'i0'), (10, 'A0')])
+    self.assertEqual(self._Names(lst.ProjectByUID(9)[0]),
+                     [(11, 'a1'), (12, 'a2')])
+    self.assertEqual(lst.ProjectByUID(9)[1][0].name, 'F0')
+
+  def testFolderCycle(self):
+    ours = self._Edited(['mv /F0 /F1'], 2000)
+    theirs = self._Edited(['mv /F1 /F0'], 3000)
+    lst = self._Merged(ours, theirs)
+    self.assertEqual(sorted(f.name for f in lst.root.items
+                            if not hasattr(f, 'default_context_uid')),
+                     ['F0'])
+    self.assertEqual([f.name for f in lst.root.items[0].items
+                      if not hasattr(f, 'default_context_uid')], ['F1'])
+
+  def testRemoval(self):
+    ours = self._Edited(['rmact /P1/a1', 'purgedeleted'], 2000)
+    self.assertIsNone(self._Merged(ours, self._base).ActionByUID(11))
+    theirs = self._Edited(['rename uid=11 keep'], 3000)
+    self.assertEqual(self._Merged(ours, theirs).ActionByUID(11)[0].name,
+                     'keep')
+    theirs = self._Edited(['mkact /P1/a2'], 3000)
+    lst = self._Merged(ours, theirs)
+    self.assertIsNone(lst.ActionByUID(11))
+    self.assertEqual(self._Names(lst.ActionByUID(10)[1]),
+                     [(10, 'a0'), (12, 'a2')])
+
+  def testRemovedParent(self):
+    ours = self._Edited(['rmact /P1/a0', 'rmact /P1/a1', 'rmprj /P1',
+                         'purgedeleted'], 2000)
+    theirs = self._Edited(['mkact /P1/a2'], 3000)
+    lst = self._Merged(ours, theirs)
+    self.assertEqual(self._Names(lst.inbox), [(5, 'i0')])
+    theirs = self._Edited(['rename uid=11 A1'], 3000)
+    lst = self._Merged(ours, theirs)
+    self.assertIsNone(lst.ProjectByUID(9))
+    self.assertEqual(self._Names(lst.inbox), [(5, 'i0'), (11, 'A1')])
+
+  def testContextRemoval(self):
+    ours = self._Edited(['rmctx @home'], 2000)
+    theirs = self._Edited(['chctx @home /P1/a1', 'mkact -c @home /inbox/i1'],
+                          3000)
+    lst = self._Merged(ours, theirs)
+    self.assertTrue(lst.ctx_list.items[0].is_deleted)
+    for the_uid in (10, 11, 12):
+      self.assertIsNone(lst.ActionByUID(the_uid)[0].ctx, the_uid)
+
+  def testNotes(self):
+    ours = self._Edited(['note :__home ours', 'note :__weekly_review w'],
+                        2000)
+    theirs = self._Edited(['note :__home theirs', 'note :__other o'], 3000)
+    lst = self._Merged(ours, theirs)
+    self.assertEqual(sorted(lst.note_list.notes.items()),
+                     [(':__home', 'ours'), (':__other', 'o'),
+                      (':__weekly_review', 'w')])
+
+
+if __name__ == '__main__':
+  unitjest.main()
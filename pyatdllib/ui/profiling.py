@@ -0,0 +1,72 @@
+"""Profiles a batch of commands with cProfile.
+
+Profiles are pstats files; view one with 'python -m pstats FILE', or with a
+tool like snakeviz or gprof2dot.
+"""
+
+import cProfile
+import os
+import sys
+import time
+
+# Files in a profile directory (see PathInDirectory) end with this:
+SUFFIX = '.prof'
+
+
+class Profiled(object):
+  """Context manager that profiles its body and saves the profile.
+
+  Args:
+    path: str|function()->str  # where to save; a function is called only
+                               # when it is time to save
+  """
+
+  def __init__(self, path):
+    self._path = path
+    self._profiler = None
+
+  def __enter__(self):
+    self._profiler = cProfile.Profile()
+    self._profiler.enable()
+    return self
+
+  def __exit__(self, *unused_args):
+    self._profiler.disable()
+    path = self._path
+    try:
+      if callable(path):
+        path = path()
+      self._profiler.dump_stats(path)
+    except (IOError, OSError) as e:
+      # A profile is not worth failing the profiled commands.
+      sys.stderr.write('Cannot save profile to %s: %s\n'
+                       % (path if not callable(path) else '?', e))
+    return False
+
+
+def PathInDirectory(directory, name, max_files):
+  """Returns a path for a new profile in the given directory.
+
+  Deletes the oldest profiles there so that at most max_files remain once
+  the new one is saved. Creates the directory if necessary.
+
+  Args:
+    directory: str
+    name: str  # part of the filename, e.g. a user ID
+    max_files: int  # positive
+  Returns:
+    str
+  """
+  assert max_files > 0, max_files
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+  # Filenames sort by creation time:
+  existing = sorted(f for f in os.listdir(directory) if f.endswith(SUFFIX))
+  for f in existing[:max(0, len(existing) - max_files + 1)]:
+    try:
+      os.remove(os.path.join(directory, f))
+    except OSError:
+      pass  # A concurrent pruning got it first.
+  return os.path.join(
+    directory,
+    '%015.3f-%s-%d%s' % (time.time(), name, os.getpid(), SUFFIX))
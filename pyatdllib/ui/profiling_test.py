@@ -0,0 +1,62 @@
+"""Unittests for module 'profiling'."""
+
+import os
+import pstats
+import shutil
+import tempfile
+import time
+
+from pyatdllib.core import unitjest
+from pyatdllib.ui import profiling
+
+
+def _Fibonacci(n):
+  return n if n < 2 else _Fibonacci(n - 1) + _Fibonacci(n - 2)
+
+
+# pylint: disable=missing-docstring,too-many-public-methods
+class ProfilingTestCase(unitjest.TestCase):
+
+  def setUp(self):
+    super(ProfilingTestCase, self).setUp()
+    self._tmpdir = tempfile.mkdtemp()
+    self._now = 1000.0
+    time.time = lambda: self._now
+
+  def tearDown(self):
+    shutil.rmtree(self._tmpdir)
+    super(ProfilingTestCase, self).tearDown()
+
+  def testProfiled(self):
+    path = os.path.join(self._tmpdir, 'x.prof')
+    with profiling.Profiled(path):
+      _Fibonacci(5)
+    stats = pstats.Stats(path)
+    self.assertIn('_Fibonacci',
+                  [func for _, _, func in stats.stats])  # pylint: disable=no-member
+
+  def testSaveErrors(self):
+    not_a_directory = os.path.join(self._tmpdir, 'file')
+    open(not_a_directory, 'w').close()
+    with profiling.Profiled(os.path.join(not_a_directory, 'x.prof')):
+      pass
+    with profiling.Profiled(
+        lambda: profiling.PathInDirectory(not_a_directory, 'u7', 2)):
+      pass
+
+  def testPathInDirectory(self):
+    directory = os.path.join(self._tmpdir, 'profiles')
+    paths = []
+    for _ in range(4):
+      self._now += 1
+      paths.append(profiling.PathInDirectory(directory, 'u7', 2))
+      with profiling.Profiled(lambda: paths[-1]):
+        pass
+    self.assertEqual(sorted(os.listdir(directory)),
+                     [os.path.basename(p) for p in paths[-2:]])
+    self.assertTrue(os.path.basename(paths[-1]).startswith(
+      '00000001004.000-u7-'), paths[-1])
+
+
+if __name__ == '__main__':
+  unitjest.main()
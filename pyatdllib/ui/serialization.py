@@ -2,14 +2,19 @@
 
 import hashlib
 import os
+import time
 import zlib
 
 import gflags as flags  # https://code.google.com/p/python-gflags/
 from google.protobuf import message
 
+from ..core import prj
 from ..core import pyatdl_pb2
 from ..core import tdl
+from ..core import timing
 from ..core import uid
+from . import history
+from . import merge
 
 FLAGS = flags.FLAGS
 
@@ -25,6 +30,31 @@ flags.DEFINE_integer(
   upper_bound=9)
 
 
+flags.DEFINE_integer(
+  'pyatdl_max_merges_per_write',
+  3,
+  'When saving the to-do list finds that someone else saved it first, we '
+  'merge in their changes and try again, at most this many times.',
+  lower_bound=0)
+
+flags.DEFINE_integer(
+  'pyatdl_archive_after_days',
+  0,
+  'If positive, then upon saving, completed and deleted actions unmodified '
+  'for this many days move to the archive, which is loaded only when needed. '
+  'With --pyatdl_lazy_deserialization, only projects that were used are '
+  'considered; see the "archive" command.',
+  lower_bound=0)
+
+# The archive that goes with a save file lives in a file with this suffix:
+_ARCHIVE_SUFFIX = '.archive'
+# The history (see module history) of a save file lives in a directory with
+# this suffix:
+_HISTORY_SUFFIX = '.history'
+# ... and that of its archive in this subdirectory thereof:
+_ARCHIVE_HISTORY_DIRNAME = 'archive'
+
+
 class Error(Exception):
   """Base class for this module's exceptions."""
 
@@ -33,6 +63,32 @@ class DeserializationError(Error):
   """Failed to load to-do list."""
 
 
+class WriteConflictError(Error):
+  """Raised by a writer whose stored to-do list changed since it was read.
+
+  SerializeToDoList2 handles it by merging; see module merge.
+
+  Fields:
+    base: None|object like the argument to DeserializeToDoList2 that reads the
+      to-do list as it was read; None if there was no to-do list then
+    latest: object like the argument to DeserializeToDoList2 that reads the
+      to-do list as it is now stored
+  """
+  def __init__(self, base, latest):
+    super(WriteConflictError, self).__init__(
+      'The to-do list changed after it was read')
+    self.base = base
+    self.latest = latest
+
+
+class StaleReadError(Error):
+  """Raised by a reader's 'read_shards' method if the to-do list changed since
+  'read' read the root, so the shards would not match it.
+
+  Read again from the start.
+  """
+
+
 def _Sha1Checksum(payload):
   """Returns the SHA1 checksum of the given byte sequence.
 
@@ -72,7 +128,10 @@ def _GetPayloadAfterVerifyingChecksum(file_contents, path):
     raise DeserializationError(
       'Invalid save file %s: Checksum mismatch' % (path,))
   if pb.payload_is_zlib_compressed:
-    return zlib.decompress(pb.payload)
+    with timing.Phase('decompress') as phase:
+      payload = zlib.decompress(pb.payload)
+      phase.num_bytes = len(payload)
+    return payload
   return pb.payload
 
 
@@ -89,8 +148,10 @@ def _SerializedWithChecksum(payload):
   assert 0 <= FLAGS.pyatdl_zlib_compression_level <= 9
   if FLAGS.pyatdl_zlib_compression_level:
     pb.payload_is_zlib_compressed = True
-    payload = zlib.compress(
-      payload, FLAGS.pyatdl_zlib_compression_level)
+    with timing.Phase('compress') as phase:
+      payload = zlib.compress(
+        payload, FLAGS.pyatdl_zlib_compression_level)
+      phase.num_bytes = len(payload)
   pb.payload = payload
   pb.payload_length = len(payload)
   pb.sha1_checksum = _Sha1Checksum(payload)
@@ -98,17 +159,473 @@ def _SerializedWithChecksum(payload):
   return pb.SerializeToString()  # pylint: disable=no-member
 
 
+def _ProjectsOf(pb):
+  """Yields every project in the given to-do list, the inbox first.
+
+  Args:
+    pb: pyatdl_pb2.ToDoList
+  Yields:
+    pyatdl_pb2.Project
+  """
+  yield pb.inbox
+  folders = [pb.root]
+  while folders:
+    f = folders.pop()
+    for p in f.projects:
+      yield p
+    folders.extend(f.folders)
+
+
+def SplitIntoShards(pb):
+  """Splits a to-do list into a root and one shard per project.
+
+  The root is what remains of pb after each project is replaced by its
+  placeholder (see prj.PlaceholderFor), so the root retains the folders,
+  contexts, and notes as well as the order of everything and every UID.
+
+  Args:
+    pb: pyatdl_pb2.ToDoList  # mutated to become the root
+  Returns:
+    {int: bytes}  # serialized pyatdl_pb2.Project for each project UID
+  """
+  shards = {}
+  for p in _ProjectsOf(pb):
+    project_uid = p.common.uid
+    assert project_uid not in shards, project_uid
+    shards[project_uid] = p.SerializeToString()
+    p.CopyFrom(prj.PlaceholderFor(p))
+  return shards
+
+
+def JoinShards(pb, shards):
+  """Inverts SplitIntoShards.
+
+  Args:
+    pb: pyatdl_pb2.ToDoList  # the root; mutated
+    shards: {int: bytes}  # serialized pyatdl_pb2.Project for each stub's UID
+  Returns:
+    None
+  Raises:
+    DeserializationError
+  """
+  for p in _ProjectsOf(pb):
+    if not prj.IsPlaceholder(p):
+      continue
+    project_uid = p.common.uid
+    if project_uid not in shards:
+      raise DeserializationError(
+        'Data corruption: Missing shard for project with UID %s'
+        % project_uid)
+    p.Clear()
+    try:
+      p.MergeFromString(shards[project_uid])
+    except message.DecodeError:
+      raise DeserializationError(
+        'Data corruption: Cannot load shard for project with UID %s'
+        % project_uid)
+
+
+def ShardUIDs(pb):
+  """Returns the UIDs of the projects that are stubs in the given root.
+
+  Args:
+    pb: pyatdl_pb2.ToDoList
+  Returns:
+    [int]
+  """
+  return [p.common.uid for p in _ProjectsOf(pb) if prj.IsPlaceholder(p)]
+
+
+def ItemCounts(pb):
+  """Returns how many of each kind of item the to-do list holds.
+
+  Deleted items count; archived actions do not.
+
+  Args:
+    pb: pyatdl_pb2.ToDoList
+  Returns:
+    {'actions': int, 'projects': int, 'contexts': int}  # 'projects' excludes
+                                                         # the inbox
+  """
+  num_actions = num_projects = 0
+  for p in _ProjectsOf(pb):
+    num_projects += 1
+    num_actions += len(p.actions)
+  return {'actions': num_actions,
+          'projects': num_projects - 1,
+          'contexts': len(pb.ctx_list.contexts)}
+
+
+def _ParsedArchive(file_contents, name):
+  """Returns the archive (see tdl.ToDoList.ArchiveAsProtos) or None if empty.
+
+  Args:
+    file_contents: bytes  # serialized form of ChecksumAndData
+    name: str  # used only in error messages
+  Returns:
+    None|pyatdl_pb2.ToDoList
+  Raises:
+    DeserializationError
+  """
+  if not file_contents:
+    return None
+  payload = _GetPayloadAfterVerifyingChecksum(file_contents, name)
+  try:
+    return pyatdl_pb2.ToDoList.FromString(payload)  # pylint: disable=no-member
+  except message.DecodeError:
+    raise DeserializationError('Data corruption: Cannot load from %s' % name)
+
+
+def _SerializedArchive(pb):
+  """Inverts _ParsedArchive.
+
+  Args:
+    pb: pyatdl_pb2.ToDoList
+  Returns:
+    bytes  # empty if the archive is empty
+  """
+  if not pb.root.projects:
+    return b''
+  return _SerializedWithChecksum(pb.SerializeToString())
+
+
+def _JoinArchive(pb, archive):
+  """Replaces the placeholders for archived actions with the actions.
+
+  Args:
+    pb: pyatdl_pb2.ToDoList  # mutated
+    archive: pyatdl_pb2.ToDoList
+  """
+  archived = {}
+  for pb_project in archive.root.projects:
+    for pb_action in pb_project.actions:
+      archived[pb_action.common.uid] = pb_action
+  for p in _ProjectsOf(pb):
+    if not any(prj.IsArchivedActionStub(a) for a in p.actions):
+      continue
+    actions = list(p.actions)
+    del p.actions[:]
+    for a in actions:
+      if prj.IsArchivedActionStub(a) and a.common.uid in archived:
+        p.actions.add().CopyFrom(archived[a.common.uid])
+      else:
+        p.actions.add().CopyFrom(a)
+
+
+class _FileArchiveLoader(object):
+  """The archive loader for a save file; see tdl.ToDoList.SetArchiveLoader."""
+  def __init__(self, path):
+    self.path = path
+
+  def __call__(self):
+    return _ParsedArchive(_ReadFile(self.path), self.path)
+
+
+def _ReadFile(path):
+  """Returns the named file's contents, empty if there is no such file."""
+  try:
+    with open(path) as f:
+      return f.read()
+  except IOError:
+    return b''
+
+
+def _ArchivesToSave(todolist, force=False):
+  """Returns the archive to save before and after the rest; see ArchiveAsProtos.
+
+  Args:
+    todolist: tdl.ToDoList
+    force: bool  # save the archive even if unchanged?
+  Returns:
+    (None|bytes, None|bytes)
+  """
+  if FLAGS.pyatdl_archive_after_days:
+    todolist.Archive(time.time() - FLAGS.pyatdl_archive_after_days * 24 * 3600,
+                     only_decoded=True)
+  return tuple(None if pb is None else _SerializedArchive(pb)
+               for pb in todolist.ArchiveAsProtos(force=force))
+
+
+class _ShardFetcher(object):
+  """Fetches shards from a reader only as needed; see prj.Prj.Fetch.
+
+  Each shard is read at most once unless forgotten; see Forget.
+  """
+  def __init__(self, reader, root_payload):
+    """Init.
+
+    Args:
+      reader: see _ReadPayload
+      root_payload: bytes  # serialized root; see SplitIntoShards
+    """
+    self._reader = reader
+    self._root_payload = root_payload
+    self._projects = {}  # {int: pyatdl_pb2.Project}
+
+  def __call__(self, uids):
+    """Returns {int: pyatdl_pb2.Project} for the given project UIDs.
+
+    Raises:
+      DeserializationError
+      StaleReadError
+    """
+    missing = [u for u in uids if u not in self._projects]
+    if missing:
+      shards = self._reader.read_shards(missing)
+      for project_uid in missing:
+        if project_uid not in shards:
+          raise DeserializationError(
+            'Data corruption: Missing shard for project with UID %s'
+            % project_uid)
+        payload = _GetPayloadAfterVerifyingChecksum(
+          shards[project_uid], '%s (shard %s)' % (self._reader.name,
+                                                  project_uid))
+        try:
+          self._projects[project_uid] = pyatdl_pb2.Project.FromString(  # pylint: disable=no-member
+            payload)
+        except message.DecodeError:
+          raise DeserializationError(
+            'Data corruption: Cannot load shard for project with UID %s'
+            % project_uid)
+    return dict((u, self._projects[u]) for u in uids)
+
+  def Forget(self, uids):
+    """Drops the given projects so that memory use does not grow with each
+    shard fetched; see jsonlines.Export. A later call reads them again.
+
+    Args:
+      uids: [int]  # project UIDs
+    """
+    for project_uid in uids:
+      self._projects.pop(project_uid, None)
+
+  def Payload(self):
+    """Returns the whole to-do list, fetching every shard, as JoinShards would.
+
+    Returns:
+      bytes  # serialized pyatdl_pb2.ToDoList
+    """
+    pb = pyatdl_pb2.ToDoList.FromString(self._root_payload)  # pylint: disable=no-member
+    self(ShardUIDs(pb))
+    for p in _ProjectsOf(pb):
+      if prj.IsPlaceholder(p):
+        p.CopyFrom(self._projects[p.common.uid])
+    return pb.SerializeToString()
+
+
+def _ReadRootPayload(reader):
+  """Reads and verifies the to-do list, leaving placeholders for its shards.
+
+  Args:
+    reader: see _ReadPayload
+  Returns:
+    (None|bytes, [int])  # the payload, None if there is no to-do list yet, and
+                         # the UIDs of the shards it lacks
+  Raises:
+    DeserializationError
+    IOError
+    EOFError
+  """
+  file_contents = reader.read()
+  if not file_contents:
+    return None, []
+  payload = _GetPayloadAfterVerifyingChecksum(file_contents, reader.name)
+  if not hasattr(reader, 'read_shards'):
+    return payload, []
+  try:
+    pb = pyatdl_pb2.ToDoList.FromString(payload)  # pylint: disable=no-member
+  except message.DecodeError:
+    raise DeserializationError(
+      'Data corruption: Cannot load from %s' % reader.name)
+  return payload, ShardUIDs(pb)
+
+
+def _ReadPayload(reader):
+  """Reads and verifies the to-do list, fetching shards if necessary.
+
+  Args:
+    reader: object with 'read(self)' method and 'name' attribute and optionally
+      a 'read_shards(self, uids)' method returning {int: bytes} where each
+      value is a serialized ChecksumAndData wrapping a pyatdl_pb2.Project
+  Returns:
+    None|bytes  # None if there is no to-do list yet
+  Raises:
+    DeserializationError
+    StaleReadError
+    IOError
+    EOFError
+  """
+  payload, uids = _ReadRootPayload(reader)
+  if not uids:
+    return payload
+  return _ShardFetcher(reader, payload).Payload()
+
+
+def GetSingleBlob(reader):
+  """Returns the to-do list in the single-blob format regardless of the format
+  in which the reader stores it.
+
+  This is the format that SerializeToDoList writes and the 'load' command
+  reads.
+
+  Args:
+    reader: object like the argument to DeserializeToDoList2
+  Returns:
+    bytes  # empty if there is no to-do list yet
+  Raises:
+    DeserializationError
+  """
+  if not hasattr(reader, 'read_shards') and not hasattr(reader, 'read_archive'):
+    return reader.read()
+  payload = _ReadPayload(reader)
+  if payload is None:
+    return b''
+  if hasattr(reader, 'read_archive'):
+    archive = _ParsedArchive(reader.read_archive(),
+                             reader.name + _ARCHIVE_SUFFIX)
+    if archive is not None:
+      pb = pyatdl_pb2.ToDoList.FromString(payload)  # pylint: disable=no-member
+      _JoinArchive(pb, archive)
+      payload = pb.SerializeToString()
+  return _SerializedWithChecksum(payload)
+
+
+def _ProtobufFrom(reader):
+  """Returns the to-do list the reader reads, sans archive, or None.
+
+  Args:
+    reader: None|object like the argument to DeserializeToDoList2
+  Returns:
+    None|pyatdl_pb2.ToDoList
+  Raises:
+    DeserializationError
+  """
+  payload = None if reader is None else _ReadPayload(reader)
+  if payload is None:
+    return None
+  try:
+    return pyatdl_pb2.ToDoList.FromString(payload)  # pylint: disable=no-member
+  except message.DecodeError:
+    raise DeserializationError(
+      'Data corruption: Cannot load from %s' % reader.name)
+
+
+def _Write(writer, pb):
+  """Writes pb, sharded if the writer supports that, leaving pb alone.
+
+  Args:
+    writer: see SerializeToDoList2
+    pb: pyatdl_pb2.ToDoList
+  Returns:
+    None|bytes  # the serialized pb if we serialized it whole
+  Raises:
+    WriteConflictError
+  """
+  if hasattr(writer, 'write_shards'):
+    with timing.Phase('serialize'):
+      root = pyatdl_pb2.ToDoList()
+      root.CopyFrom(pb)
+      # An unfetched project is unchanged, so its shard is None:
+      unfetched = frozenset(
+        p.common.uid for p in _ProjectsOf(root) if prj.IsPlaceholder(p))
+      shards = SplitIntoShards(root)
+      serialized_root = _SerializedWithChecksum(root.SerializeToString())
+      serialized_shards = dict(
+        (project_uid,
+         None if project_uid in unfetched else _SerializedWithChecksum(shard))
+        for project_uid, shard in shards.items())
+    writer.write_shards(serialized_root, serialized_shards)
+    return None
+  with timing.Phase('serialize') as phase:
+    payload = pb.SerializeToString()
+    phase.num_bytes = len(payload)
+    serialized = _SerializedWithChecksum(payload)
+  writer.write(serialized)
+  return payload
+
+
 def SerializeToDoList2(todolist, writer):
   """Saves a serialized copy of todolist to the named file.
 
+  If the writer has a 'write_shards' method, each project is serialized
+  separately; see SplitIntoShards.
+
+  If the writer has a 'write_archive' method, the archive (see
+  tdl.ToDoList.Archive) is written, if it changed, before and/or after the
+  rest. Otherwise the archive is left alone.
+
+  If the writer has a true 'keeps_history' attribute and
+  --pyatdl_history_max_versions is nonzero, the new version is recorded in
+  todolist.History(), if any.
+
+  If the writer has a 'note_item_counts(self, counts)' method, it learns the
+  ItemCounts of what was written.
+
+  Unfetched projects are fetched first (see tdl.ToDoList.FetchProjects)
+  unless the writer has a true 'accepts_placeholders' attribute, in which case
+  write(self, bytes) may receive placeholders for them (see
+  prj.PlaceholderFor) and write_shards(self, bytes, {int: None|bytes}) receives
+  None in place of their shards, which are unchanged. Merging and recording
+  history need the whole to-do list, so they fetch regardless.
+
+  If the writer raises WriteConflictError, we merge our changes with the
+  stored to-do list (see module merge) and write the result instead, up to
+  --pyatdl_max_merges_per_write times. todolist itself is left alone.
+
   Args:
     todolist: tdl.ToDoList
-    writer: object with write(self, bytes) method
+    writer: object with write(self, bytes) method or
+      write_shards(self, bytes, {int: None|bytes}) method and optionally
+      write_archive(self, bytes) method
   Returns:
     None
+  Raises:
+    WriteConflictError
+    DeserializationError
+    StaleReadError
   """
+  the_history = todolist.History()
+  if (not getattr(writer, 'keeps_history', False) or
+      not FLAGS.pyatdl_history_max_versions):
+    the_history = None
+  fetch = (the_history is not None or
+           not getattr(writer, 'accepts_placeholders', False))
+  if fetch:
+    todolist.FetchProjects()
   todolist.CheckIsWellFormed()
-  writer.write(_SerializedWithChecksum(todolist.AsProto().SerializeToString()))
+  archive_before = archive_after = None
+  if hasattr(writer, 'write_archive'):
+    archive_before, archive_after = _ArchivesToSave(todolist)
+  if archive_before is not None:
+    writer.write_archive(archive_before)
+  pb = todolist.AsProto(fetch=fetch)
+  merges = 0
+  while True:
+    try:
+      payload = _Write(writer, pb)
+      break
+    except WriteConflictError as e:
+      if merges >= FLAGS.pyatdl_max_merges_per_write:
+        raise
+      merges += 1
+      if not fetch:
+        # This raises StaleReadError if the shards we did not read are gone:
+        pb = todolist.AsProto()
+        fetch = True
+      base = _ProtobufFrom(e.base)
+      theirs = _ProtobufFrom(e.latest)
+      if theirs is not None:
+        pb = merge.Merge(base, pb, theirs)
+        # Better to fail than to save a list that we cannot load:
+        tdl.ToDoList.DeserializedProtobuf(
+          pb.SerializeToString()).CheckIsWellFormed()
+  if archive_after is not None:
+    writer.write_archive(archive_after)
+  if the_history is not None:
+    the_history.Record(pb.SerializeToString() if payload is None else payload)
+    _RecordArchive(the_history, archive_before, archive_after)
+  if hasattr(writer, 'note_item_counts'):
+    writer.note_item_counts(ItemCounts(pb))
 
 
 def SerializeToDoList(todolist, path):
@@ -124,8 +641,18 @@ def SerializeToDoList(todolist, path):
   dirname = os.path.dirname(tmp_path)
   if dirname and not os.path.exists(dirname):
     os.makedirs(os.path.dirname(tmp_path))
+  archive_path = path + _ARCHIVE_SUFFIX
+  # When saving somewhere new, the archive must come along:
+  archive_before, archive_after = _ArchivesToSave(
+    todolist,
+    force=getattr(todolist.ArchiveLoader(), 'path', None) != archive_path)
+  todolist.SetArchiveLoader(_FileArchiveLoader(archive_path))
+  if archive_before is not None:
+    _WriteAtomically(archive_path, archive_before)
+  todolist.CheckIsWellFormed()
+  payload = todolist.AsProto().SerializeToString()
   with open(tmp_path, 'w') as tmp_file:
-    SerializeToDoList2(todolist, tmp_file)
+    tmp_file.write(_SerializedWithChecksum(payload))
   try:
     os.remove(path + '.bak')
   except OSError:
@@ -139,27 +666,121 @@ def SerializeToDoList(todolist, path):
   except OSError:
     pass
   os.rename(tmp_path, path)
+  if archive_after is not None:
+    _WriteAtomically(archive_path, archive_after)
+  the_history = todolist.History()
+  if (the_history is not None and
+      getattr(the_history.store, 'dirname', None) == path + _HISTORY_SUFFIX):
+    the_history.Record(payload)
+    _RecordArchive(the_history, archive_before, archive_after)
+
+
+def _RecordArchive(the_history, archive_before, archive_after):
+  """Records the archive in the history if we just saved it.
+
+  Args:
+    the_history: history.History
+    archive_before, archive_after: see _ArchivesToSave
+  """
+  archive = archive_before if archive_after is None else archive_after
+  if archive is not None:
+    the_history.RecordArchive(archive)
+
+
+def RestorablePayload(the_history, number, archive_loader):
+  """Returns the given version of the to-do list with its archived actions.
+
+  Each archived action comes from the archive as it was at the time (see
+  history.History.ArchiveAt) or, failing that, from the archive as it is now.
+  Placeholders for archived actions that neither holds remain.
+
+  Args:
+    the_history: history.History
+    number: int  # see history.History.Snapshot
+    archive_loader: None|callable  # see tdl.ToDoList.SetArchiveLoader
+  Returns:
+    bytes  # serialized pyatdl_pb2.ToDoList
+  Raises:
+    history.Error
+    DeserializationError
+  """
+  pb = pyatdl_pb2.ToDoList.FromString(  # pylint: disable=no-member
+    the_history.Snapshot(number))
+  then = _ParsedArchive(the_history.ArchiveAt(number),
+                        'archive as of version %s' % number)
+  for loader in (lambda: then, archive_loader):
+    if not any(prj.IsArchivedActionStub(a)
+               for p in _ProjectsOf(pb) for a in p.actions):
+      break
+    archive = None if loader is None else loader()
+    if archive is not None:
+      _JoinArchive(pb, archive)
+  return pb.SerializeToString()
+
+
+def _WriteAtomically(path, contents):
+  """Replaces the named file's contents, removing the file if contents is empty.
+
+  Args:
+    path: str
+    contents: bytes
+  """
+  if not contents:
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+    return
+  with open(path + '.tmp', 'w') as tmp_file:
+    tmp_file.write(contents)
+  os.rename(path + '.tmp', path)
 
 
 def DeserializeToDoList2(reader, tdl_factory):
   """Deserializes a to-do list from the given file.
 
+  With --pyatdl_lazy_deserialization, a shard is read only when its project is
+  used (see tdl.ToDoList.FetchProjects), so read_shards may be called after
+  this returns and may then raise DeserializationError or StaleReadError.
+
   Args:
-    reader: object with 'read(self)' method and 'name' attribute
+    reader: object with 'read(self)' method and 'name' attribute and, if it
+      stores shards written by SerializeToDoList2, 'read_shards(self, uids)'
+      returning {int: bytes} and, if it stores the archive, 'read_archive(self)'
+      returning bytes and, if it keeps history, 'history(self)' returning
+      history.History
     tdl_factory: callable function ()->tdl.ToDoList
   Returns:
     tdl.ToDoList
   Raises:
     DeserializationError
+    StaleReadError
   """
   uid.singleton_factory = uid.Factory()
+  payload = None
   try:
-    file_contents = reader.read()
-    if not file_contents:
+    payload, uids = _ReadRootPayload(reader)
+    if payload is None:
       todolist = tdl_factory()
+    elif uids and FLAGS.pyatdl_lazy_deserialization:
+      fetcher = _ShardFetcher(reader, payload)
+      # Placeholders written before they held the actions' UIDs look like
+      # those of empty projects. Either way, the UIDs must be known now:
+      pb = pyatdl_pb2.ToDoList.FromString(payload)  # pylint: disable=no-member
+      actionless = [p for p in _ProjectsOf(pb)
+                    if prj.IsPlaceholder(p) and not p.actions]
+      if actionless:
+        fetched = fetcher([p.common.uid for p in actionless])
+        for p in actionless:
+          p.CopyFrom(fetched[p.common.uid])
+        payload = pb.SerializeToString()
+      todolist = tdl.ToDoList.DeserializedProtobuf(payload,
+                                                   fetch_projects=fetcher)
+      payload = fetcher.Payload
     else:
-      todolist = tdl.ToDoList.DeserializedProtobuf(
-        _GetPayloadAfterVerifyingChecksum(file_contents, reader.name))
+      if uids:
+        payload = _ShardFetcher(reader, payload).Payload()
+      todolist = tdl.ToDoList.DeserializedProtobuf(payload)
   except IOError as e:
     raise DeserializationError(
       'Cannot deserialize to-do list from %s. See the "reset_database" command '
@@ -167,9 +788,19 @@ def DeserializeToDoList2(reader, tdl_factory):
       % (reader.name, repr(e)))
   except EOFError:
     todolist = tdl_factory()
+  if hasattr(reader, 'read_archive'):
+    todolist.SetArchiveLoader(
+      lambda: _ParsedArchive(reader.read_archive(),
+                             reader.name + _ARCHIVE_SUFFIX))
+  if hasattr(reader, 'history'):
+    the_history = reader.history()
+    the_history.SetBase(payload, archive=getattr(reader, 'read_archive', None))
+    todolist.SetHistory(the_history)
   try:
-    str(todolist)  # calls unicode(todolist)
-    str(todolist.AsProto())
+    if not FLAGS.pyatdl_lazy_deserialization:
+      # These would deserialize every project.
+      str(todolist)  # calls unicode(todolist)
+      str(todolist.AsProto())
     todolist.CheckIsWellFormed()
   except:
     print ('Serialization error?  Reset by rerunning with the "reset_database" '
@@ -190,6 +821,7 @@ def DeserializeToDoList(path, tdl_factory):
     DeserializationError
   """
   uid.singleton_factory = uid.Factory()
+  payload = None
   if not os.path.exists(path):
     todolist = tdl_factory()
   else:
@@ -199,8 +831,8 @@ def DeserializeToDoList(path, tdl_factory):
         if not file_contents:
           todolist = tdl_factory()
         else:
-          todolist = tdl.ToDoList.DeserializedProtobuf(
-            _GetPayloadAfterVerifyingChecksum(file_contents, path))
+          payload = _GetPayloadAfterVerifyingChecksum(file_contents, path)
+          todolist = tdl.ToDoList.DeserializedProtobuf(payload)
     except IOError as e:
       raise DeserializationError(
         'Cannot deserialize to-do list from %s. See the "reset_database" command '
@@ -208,9 +840,18 @@ def DeserializeToDoList(path, tdl_factory):
         % (path, repr(e)))
     except EOFError:
       todolist = tdl_factory()
+  todolist.SetArchiveLoader(_FileArchiveLoader(path + _ARCHIVE_SUFFIX))
+  the_history = history.History(
+    history.FileStore(path + _HISTORY_SUFFIX),
+    archive_store=history.FileStore(
+      os.path.join(path + _HISTORY_SUFFIX, _ARCHIVE_HISTORY_DIRNAME)))
+  the_history.SetBase(payload,
+                      archive=lambda: _ReadFile(path + _ARCHIVE_SUFFIX))
+  todolist.SetHistory(the_history)
   try:
-    str(todolist)
-    str(todolist.AsProto())
+    if not FLAGS.pyatdl_lazy_deserialization:
+      str(todolist)
+      str(todolist.AsProto())
     todolist.CheckIsWellFormed()
   except:
     print ('Serialization error?  Reset by rerunning with the "reset_database" '
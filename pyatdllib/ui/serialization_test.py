@@ -0,0 +1,519 @@
+"""Unittests for module 'serialization'."""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import gflags as flags  # https://code.google.com/p/python-gflags/
+
+from pyatdllib.core import jsonlines
+from pyatdllib.core import pyatdl_pb2
+from pyatdllib.core import uid
+from pyatdllib.core import unitjest
+from pyatdllib.ui import appcommandsutil
+from pyatdllib.ui import lexer
+from pyatdllib.ui import serialization
+from pyatdllib.ui import state
+from pyatdllib.ui import uicmd
+uicmd.RegisterAppcommands(False, uicmd.APP_NAMESPACE)
+
+FLAGS = flags.FLAGS
+
+
+class _Writer(object):
+  def __init__(self):
+    self.written = None
+
+  def write(self, b):
+    self.written = b
+
+
+class _ShardedWriter(object):
+  def __init__(self):
+    self.root = None
+    self.shards = None
+
+  def write_shards(self, root, shards):
+    self.root = root
+    self.shards = shards
+
+
+class _ArchivingWriter(_Writer):
+  def __init__(self):
+    super(_ArchivingWriter, self).__init__()
+    self.archive = b''
+    self.calls = []
+
+  def write(self, b):
+    super(_ArchivingWriter, self).write(b)
+    self.calls.append('write')
+
+  def write_archive(self, b):
+    self.archive = b
+    self.calls.append('write_archive')
+
+
+class _ConflictingWriter(_Writer):
+  """Raises WriteConflictError the first few times."""
+  def __init__(self, conflicts, base, latest):
+    super(_ConflictingWriter, self).__init__()
+    self.conflicts = conflicts
+    self._base = base
+    self._latest = latest
+
+  def write(self, b):
+    if self.conflicts:
+      self.conflicts -= 1
+      raise serialization.WriteConflictError(base=self._base,
+                                             latest=self._latest)
+    super(_ConflictingWriter, self).write(b)
+
+
+class _Reader(object):
+  def __init__(self, b):
+    self._b = b
+    self.name = 'test reader'
+
+  def read(self):
+    return self._b
+
+
+class _ShardedReader(_Reader):
+  def __init__(self, root, shards):
+    super(_ShardedReader, self).__init__(root)
+    self._shards = shards
+    self.uids_read = []
+
+  def read_shards(self, uids):
+    self.uids_read.extend(uids)
+    return dict((u, self._shards[u]) for u in uids if u in self._shards)
+
+
+class _ArchivingReader(_Reader):
+  def __init__(self, writer):
+    super(_ArchivingReader, self).__init__(writer.written)
+    self._writer = writer
+    self.archive_reads = 0
+
+  def read_archive(self):
+    self.archive_reads += 1
+    return self._writer.archive
+
+
+# pylint: disable=missing-docstring,too-many-public-methods
+class SerializationTestCase(unitjest.TestCase):
+
+  def setUp(self):
+    super(SerializationTestCase, self).setUp()
+    time.time = lambda: 1337
+    uid.singleton_factory = uid.Factory()
+    FLAGS.pyatdl_show_uid = True
+    FLAGS.pyatdl_separator = '/'
+    FLAGS.seed_upon_creation = False
+    self._the_state = state.State(
+      lambda _: None, uicmd.NewToDoList(), uicmd.APP_NAMESPACE)
+    for argv in ['mkctx @home',
+                 'mkact /inbox/i0',
+                 'mkdir /F0',
+                 'mkdir /F0/F1',
+                 'mkprj /F0/F1/P0',
+                 'mkprj /P1',
+                 'mkact --context=@home /P1/a0',
+                 'mkprj /F0/P2',
+                 'chctx @home /inbox/i0']:
+      uicmd.APP_NAMESPACE.FindCmdAndExecute(
+        self._the_state, lexer.SplitCommandLineIntoArgv(argv))
+
+  def _Unsharded(self):
+    w = _Writer()
+    serialization.SerializeToDoList2(self._the_state.ToDoList(), w)
+    return w.written
+
+  def testShardsRoundTrip(self):
+    w = _ShardedWriter()
+    serialization.SerializeToDoList2(self._the_state.ToDoList(), w)
+    self.assertEqual(sorted(w.shards), [1, 8, 9, 11])
+    reader = _ShardedReader(w.root, w.shards)
+    lst = serialization.DeserializeToDoList2(reader, lambda: None)
+    self.assertEqual(sorted(reader.uids_read), [1, 8, 9, 11])
+    self.assertEqual(lst.AsProto().SerializeToString(),
+                     self._the_state.ToDoList().AsProto().SerializeToString())
+    self.assertEqual(
+      serialization.GetSingleBlob(_ShardedReader(w.root, w.shards)),
+      self._Unsharded())
+
+  def testRootHoldsOnlyPlaceholders(self):
+    w = _ShardedWriter()
+    serialization.SerializeToDoList2(self._the_state.ToDoList(), w)
+    root = pyatdl_pb2.ToDoList.FromString(
+      serialization._GetPayloadAfterVerifyingChecksum(w.root, 'x'))  # pylint: disable=protected-access
+    self.assertEqual(serialization.ShardUIDs(root), [1, 9, 11, 8])
+    self.assertEqual([str(a).split() for a in root.inbox.actions],
+                     [['common', '{', 'uid:', '5', '}', 'is_complete:',
+                       'false']])
+    self.assertEqual([f.common.metadata.name for f in root.root.folders],
+                     ['F0'])
+    self.assertEqual([c.common.metadata.name for c in root.ctx_list.contexts],
+                     ['@home'])
+
+  def testUnchangedShardsAreIdentical(self):
+    w0 = _ShardedWriter()
+    serialization.SerializeToDoList2(self._the_state.ToDoList(), w0)
+    uicmd.APP_NAMESPACE.FindCmdAndExecute(
+      self._the_state, lexer.SplitCommandLineIntoArgv('complete /P1/a0'))
+    w1 = _ShardedWriter()
+    serialization.SerializeToDoList2(self._the_state.ToDoList(), w1)
+    self.assertEqual(
+      sorted(u for u in w1.shards if w1.shards[u] != w0.shards[u]),
+      [9])
+
+  def testUnshardedReaderWithReadShards(self):
+    reader = _ShardedReader(self._Unsharded(), {})
+    lst = serialization.DeserializeToDoList2(reader, lambda: None)
+    self.assertEqual(reader.uids_read, [])
+    self.assertEqual(lst.AsProto().SerializeToString(),
+                     self._the_state.ToDoList().AsProto().SerializeToString())
+    self.assertEqual(serialization.GetSingleBlob(reader), self._Unsharded())
+
+  def testMissingShard(self):
+    w = _ShardedWriter()
+    serialization.SerializeToDoList2(self._the_state.ToDoList(), w)
+    del w.shards[9]
+    with self.assertRaisesRegexp(serialization.DeserializationError,
+                                 r'Missing shard for project with UID 9'):
+      serialization.DeserializeToDoList2(_ShardedReader(w.root, w.shards),
+                                         lambda: None)
+
+  def testLazyDeserialization(self):
+    FLAGS.pyatdl_lazy_deserialization = True
+    try:
+      w = _ShardedWriter()
+      serialization.SerializeToDoList2(self._the_state.ToDoList(), w)
+      lst = serialization.DeserializeToDoList2(
+        _ShardedReader(w.root, w.shards), lambda: None)
+      self.assertEqual(
+        [p.uid for p, _ in lst.Projects() if p.IsDecoded()], [])
+      a, p = lst.ActionByUID(10)
+      self.assertEqual((a.name, p.uid), ('a0', 9))
+      self.assertEqual(
+        [p.uid for p, _ in lst.Projects() if p.IsDecoded()], [9])
+      self.assertEqual(lst.AsProto().SerializeToString(),
+                       self._the_state.ToDoList().AsProto().SerializeToString())
+      w2 = _ShardedWriter()
+      serialization.SerializeToDoList2(lst, w2)
+      self.assertEqual(w2.shards, w.shards)
+      # New UIDs must not collide with those of undeserialized actions:
+      self.assertEqual(uid.singleton_factory.NextUID(), 12)
+    finally:
+      FLAGS.pyatdl_lazy_deserialization = False
+
+  def testShardsAreFetchedOnlyWhenUsed(self):
+    FLAGS.pyatdl_lazy_deserialization = True
+    try:
+      w = _ShardedWriter()
+      serialization.SerializeToDoList2(self._the_state.ToDoList(), w)
+      reader = _ShardedReader(w.root, w.shards)
+      lst = serialization.DeserializeToDoList2(reader, lambda: None)
+      # Only the empty projects, whose placeholders look like old ones:
+      self.assertEqual(sorted(reader.uids_read), [8, 11])
+      self.assertEqual(uid.singleton_factory.NextUID(), 12)
+      a, unused_p = lst.ActionByUID(10)
+      self.assertEqual(a.name, 'a0')
+      self.assertEqual(sorted(reader.uids_read), [8, 9, 11])
+      w2 = _Writer()
+      w2.accepts_placeholders = True
+      serialization.SerializeToDoList2(lst, w2)
+      self.assertEqual(sorted(reader.uids_read), [8, 9, 11])
+      self.assertNotEqual(w2.written, self._Unsharded())
+      serialization.SerializeToDoList2(lst, w2)
+      w2.accepts_placeholders = False
+      serialization.SerializeToDoList2(lst, w2)
+      self.assertEqual(sorted(reader.uids_read), [1, 8, 9, 11])
+      self.assertEqual(w2.written, self._Unsharded())
+    finally:
+      FLAGS.pyatdl_lazy_deserialization = False
+
+  def testPlaceholdersWithoutActions(self):
+    # Roots written before placeholders held the actions' UIDs:
+    FLAGS.pyatdl_lazy_deserialization = True
+    try:
+      w = _ShardedWriter()
+      serialization.SerializeToDoList2(self._the_state.ToDoList(), w)
+      root = pyatdl_pb2.ToDoList.FromString(
+        serialization._GetPayloadAfterVerifyingChecksum(w.root, 'x'))  # pylint: disable=protected-access
+      for p in [root.inbox] + list(root.root.projects):
+        del p.actions[:]
+      reader = _ShardedReader(
+        serialization._SerializedWithChecksum(root.SerializeToString()),  # pylint: disable=protected-access
+        w.shards)
+      lst = serialization.DeserializeToDoList2(reader, lambda: None)
+      self.assertEqual(sorted(reader.uids_read), [1, 8, 9, 11])
+      self.assertEqual(uid.singleton_factory.NextUID(), 12)
+      self.assertEqual(lst.AsProto().SerializeToString(),
+                       self._the_state.ToDoList().AsProto().SerializeToString())
+    finally:
+      FLAGS.pyatdl_lazy_deserialization = False
+
+  def testUndoKeepsProjectsUnfetched(self):
+    FLAGS.pyatdl_lazy_deserialization = True
+    try:
+      w = _ShardedWriter()
+      serialization.SerializeToDoList2(self._the_state.ToDoList(), w)
+      reader = _ShardedReader(w.root, w.shards)
+      the_state = state.State(
+        lambda _: None,
+        serialization.DeserializeToDoList2(reader, lambda: None),
+        uicmd.APP_NAMESPACE)
+      self._Run('mkctx @work', the_state)
+      self._Run('undo', the_state)
+      self.assertEqual(sorted(reader.uids_read), [8, 11])
+      self._Run('complete /P1/a0', the_state)
+      self._Run('undo', the_state)
+      self.assertEqual(sorted(reader.uids_read), [8, 9, 11])
+      self.assertEqual(
+        the_state.ToDoList().AsProto().SerializeToString(),
+        self._the_state.ToDoList().AsProto().SerializeToString())
+    finally:
+      FLAGS.pyatdl_lazy_deserialization = False
+
+  def testExportKeepsProjectsUnfetched(self):
+    FLAGS.pyatdl_lazy_deserialization = True
+    try:
+      w = _ShardedWriter()
+      serialization.SerializeToDoList2(self._the_state.ToDoList(), w)
+      FLAGS.pyatdl_lazy_deserialization = False
+      expected = [json.loads(line) for line in jsonlines.Export(
+        serialization.DeserializeToDoList2(_ShardedReader(w.root, w.shards),
+                                           lambda: None))]
+      FLAGS.pyatdl_lazy_deserialization = True
+      reader = _ShardedReader(w.root, w.shards)
+      lst = serialization.DeserializeToDoList2(reader, lambda: None)
+      self.assertEqual([json.loads(line) for line in jsonlines.Export(lst)],
+                       expected)
+      self.assertEqual(sorted(reader.uids_read), [1, 8, 9, 11])
+      self.assertEqual(
+        [p.uid for p, _ in lst.Projects() if not p.IsFetched()], [1, 9])
+      self.assertEqual(sorted(lst.ProjectFetcher()._projects), [8, 11])  # pylint: disable=protected-access
+    finally:
+      FLAGS.pyatdl_lazy_deserialization = False
+
+  def _Run(self, argv, the_state=None):
+    uicmd.APP_NAMESPACE.FindCmdAndExecute(
+      the_state or self._the_state, lexer.SplitCommandLineIntoArgv(argv))
+
+  def _Archived(self):
+    """Archives i0 and a0 and returns the writer that saved them."""
+    self._Run('complete /P1/a0')
+    self._Run('rm /inbox/i0')
+    self._the_state.ToDoList().SetArchiveLoader(lambda: None)
+    time.time = lambda: 1337 + 2 * 24 * 3600
+    self._Run('archive --days 1')
+    w = _ArchivingWriter()
+    serialization.SerializeToDoList2(self._the_state.ToDoList(), w)
+    self.assertEqual(w.calls, ['write_archive', 'write'])
+    return w
+
+  def testArchive(self):
+    self._Run('complete /P1/a0')
+    self._Run('rm /inbox/i0')
+    unarchived = self._Unsharded()
+    w = self._Archived()
+    reader = _ArchivingReader(w)
+    lst = serialization.DeserializeToDoList2(reader, lambda: None)
+    self.assertEqual(reader.archive_reads, 0)
+    self.assertIsNone(lst.ActionByUID(10))
+    self.assertEqual(lst.inbox.items, [])
+    self.assertEqual(sorted(p.ArchivedActionUIDs() for p, _ in lst.Projects()),
+                     [[], [], [5], [10]])
+    # New UIDs must not collide with those of archived actions:
+    self.assertEqual(uid.singleton_factory.NextUID(), 12)
+    self.assertEqual(serialization.GetSingleBlob(_ArchivingReader(w)),
+                     unarchived)
+
+  def testViewAllEvenDeletedLoadsArchive(self):
+    w = self._Archived()
+    reader = _ArchivingReader(w)
+    the_state = state.State(
+      lambda _: None, serialization.DeserializeToDoList2(reader, lambda: None),
+      uicmd.APP_NAMESPACE)
+    main_writer = _Writer()
+    serialization.SerializeToDoList2(the_state.ToDoList(), main_writer)
+    main = main_writer.written
+    self._Run('view --noinclude_archived all_even_deleted', the_state)
+    self.assertEqual(reader.archive_reads, 0)
+    self._Run('view all_even_deleted', the_state)
+    self.assertEqual(reader.archive_reads, 1)
+    a, p = the_state.ToDoList().ActionByUID(10)
+    self.assertEqual((a.name, a.is_complete, p.uid), ('a0', True, 9))
+    # Unchanged, so back into the archive it goes:
+    w.calls = []
+    serialization.SerializeToDoList2(the_state.ToDoList(), w)
+    self.assertEqual(w.calls, ['write'])
+    self.assertEqual(w.written, main)
+
+  def testUnarchive(self):
+    w = self._Archived()
+    the_state = state.State(
+      lambda _: None,
+      serialization.DeserializeToDoList2(_ArchivingReader(w), lambda: None),
+      uicmd.APP_NAMESPACE)
+    self._Run('unarchive', the_state)
+    a, unused_p = the_state.ToDoList().ActionByUID(5)
+    self.assertEqual((a.name, a.is_deleted), ('i0', True))
+    w.calls = []
+    serialization.SerializeToDoList2(the_state.ToDoList(), w)
+    # The archive shrinks only after the actions are saved elsewhere:
+    self.assertEqual(w.calls, ['write', 'write_archive'])
+    self.assertEqual(w.archive, b'')
+    lst = serialization.DeserializeToDoList2(_ArchivingReader(w), lambda: None)
+    self.assertEqual([p.ArchivedActionUIDs() for p, _ in lst.Projects()
+                      if p.ArchivedActionUIDs()], [])
+    self.assertEqual(lst.ActionByUID(10)[0].name, 'a0')
+
+  def testArchiveFile(self):
+    tmpdir = tempfile.mkdtemp()
+    try:
+      path = os.path.join(tmpdir, 'x.dat')
+      self._Run('complete /P1/a0')
+      lst = self._the_state.ToDoList()
+      serialization.SerializeToDoList(lst, path)
+      self.assertFalse(os.path.exists(path + '.archive'))
+      time.time = lambda: 1337 + 2 * 24 * 3600
+      self._Run('archive --days 1')
+      serialization.SerializeToDoList(lst, path)
+      self.assertTrue(os.path.exists(path + '.archive'))
+      lst = serialization.DeserializeToDoList(path, lambda: None)
+      self.assertIsNone(lst.ActionByUID(10))
+      self.assertEqual(lst.Unarchive(), 1)
+      self.assertEqual(lst.ActionByUID(10)[0].name, 'a0')
+      lst = serialization.DeserializeToDoList(path, lambda: None)
+      # Archived UIDs count toward the UID well-formedness check:
+      del lst.ProjectByUID(9)[0].archived_uids[:]
+      with self.assertRaisesRegexp(AssertionError, r'Max seen=11'):
+        lst.CheckIsWellFormed()
+    finally:
+      shutil.rmtree(tmpdir)
+
+  def testHistoryAndRestore(self):
+    tmpdir = tempfile.mkdtemp()
+    try:
+      path = os.path.join(tmpdir, 'x.dat')
+      for argv in [None, 'complete /P1/a0', 'purgedeleted', 'rmact /P1/a0',
+                   'purgedeleted']:
+        lst = serialization.DeserializeToDoList(
+          path, lambda: self._the_state.ToDoList())
+        the_state = state.State(lambda _: None, lst, uicmd.APP_NAMESPACE)
+        if argv is not None:
+          self._Run(argv, the_state)
+        serialization.SerializeToDoList(the_state.ToDoList(), path)
+      printed = []
+      the_state = state.State(
+        printed.append, serialization.DeserializeToDoList(path, lambda: None),
+        uicmd.APP_NAMESPACE)
+      self._Run('history', the_state)
+      self.assertEqual([p.split()[0] for p in printed],
+                       ['5', '4', '3', '2', '1'])
+      self.assertIn('keyframe', printed[-1])
+      self.assertIn('delta', printed[0])
+      self.assertIsNone(the_state.ToDoList().ActionByUID(10))
+      self._Run('restore --at 2', the_state)
+      self.assertEqual(the_state.ToDoList().ActionByUID(10)[0].name, 'a0')
+      serialization.SerializeToDoList(the_state.ToDoList(), path)
+      lst = serialization.DeserializeToDoList(path, lambda: None)
+      self.assertEqual(lst.ActionByUID(10)[0].name, 'a0')
+      self.assertEqual([v.number for v in lst.History().Versions()],
+                       [1, 2, 3, 4, 5, 6])
+      with self.assertRaisesRegexp(appcommandsutil.InvalidUsageError,
+                                   r'No version 7'):
+        self._Run('restore --at 7', the_state)
+    finally:
+      shutil.rmtree(tmpdir)
+
+  def testRestoreBringsBackPurgedArchivedActions(self):
+    tmpdir = tempfile.mkdtemp()
+    try:
+      path = os.path.join(tmpdir, 'x.dat')
+      for argv in [None, 'rmact /P1/a0', 'archive --days 0', 'purgedeleted']:
+        if argv == 'archive --days 0':
+          time.time = lambda: 2000
+        lst = serialization.DeserializeToDoList(
+          path, lambda: self._the_state.ToDoList())
+        the_state = state.State(lambda _: None, lst, uicmd.APP_NAMESPACE)
+        if argv is not None:
+          self._Run(argv, the_state)
+        serialization.SerializeToDoList(the_state.ToDoList(), path)
+      self.assertFalse(os.path.exists(path + '.archive'))
+      the_state = state.State(
+        lambda _: None, serialization.DeserializeToDoList(path, lambda: None),
+        uicmd.APP_NAMESPACE)
+      self.assertEqual(
+        [v.number for v in the_state.ToDoList().History().archive_store.Versions()],
+        [3, 4])
+      self._Run('restore --at 3', the_state)
+      a, p = the_state.ToDoList().ActionByUID(10)
+      self.assertEqual((a.name, a.is_deleted, p.uid), ('a0', True, 9))
+      the_state.ToDoList().CheckIsWellFormed()
+    finally:
+      shutil.rmtree(tmpdir)
+
+  def testArchiveWithoutStorage(self):
+    with self.assertRaisesRegexp(appcommandsutil.InvalidUsageError,
+                                 r'not stored with an archive'):
+      self._Run('archive')
+
+  def testEmpty(self):
+    reader = _ShardedReader(b'', {})
+    self.assertEqual(serialization.GetSingleBlob(reader), b'')
+    lst = serialization.DeserializeToDoList2(reader, uicmd.NewToDoList)
+    self.assertEqual(lst.inbox.items, [])
+
+  def testItemCounts(self):
+    class CountingWriter(_Writer):
+      counts = None
+
+      def note_item_counts(self, counts):
+        self.counts = counts
+
+    w = CountingWriter()
+    serialization.SerializeToDoList2(self._the_state.ToDoList(), w)
+    self.assertEqual(w.counts, {'actions': 2, 'projects': 3, 'contexts': 1})
+
+  def testWriteConflict(self):
+    base = self._Unsharded()
+    uid.singleton_factory = uid.Factory()
+    time.time = lambda: 1338
+    their_state = state.State(
+      lambda _: None,
+      serialization.DeserializeToDoList2(_Reader(base), lambda: None),
+      uicmd.APP_NAMESPACE)
+    self._Run('mkact /inbox/theirs', their_state)
+    self._Run('complete /P1/a0', their_state)
+    w = _Writer()
+    serialization.SerializeToDoList2(their_state.ToDoList(), w)
+    theirs = w.written
+    uid.singleton_factory = uid.Factory()
+    self._the_state.SetToDoList(
+      serialization.DeserializeToDoList2(_Reader(base), lambda: None))
+    self._Run('mkact /inbox/ours')
+    w = _ConflictingWriter(1, _Reader(base), _Reader(theirs))
+    serialization.SerializeToDoList2(self._the_state.ToDoList(), w)
+    self.assertEqual(w.conflicts, 0)
+    uid.singleton_factory = uid.Factory()
+    lst = serialization.DeserializeToDoList2(_Reader(w.written), lambda: None)
+    self.assertEqual([a.name for a in lst.inbox.items],
+                     ['i0', 'theirs', 'ours'])
+    self.assertTrue(lst.ActionByUID(10)[0].is_complete)
+    self.assertEqual(
+      [a.name for a in self._the_state.ToDoList().inbox.items], ['i0', 'ours'])
+
+    w = _ConflictingWriter(FLAGS.pyatdl_max_merges_per_write + 1,
+                           _Reader(base), _Reader(theirs))
+    with self.assertRaises(serialization.WriteConflictError):
+      serialization.SerializeToDoList2(self._the_state.ToDoList(), w)
+    self.assertIsNone(w.written)
+
+
+if __name__ == '__main__':
+  unitjest.main()
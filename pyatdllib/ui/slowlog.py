@@ -0,0 +1,216 @@
+"""Logs slow UICmds and slow batches of commands.
+
+With --pyatdl_slow_command_seconds or --pyatdl_slow_batch_seconds positive,
+each UICmd or batch (see immaculater.ApplyBatchOfCommands) taking at least
+that long is logged as a dict like so:
+
+  {'kind': 'command'|'batch',
+   'seconds': float,
+   'precheck_seconds': float,  # --pyatdl_paranoia's well-formedness checks
+   'run_seconds': float,  # the UICmd's Run method
+   'postcheck_seconds': float,
+   'failed': bool,  # True iff it raised an exception
+   'argv': [str],  # for a command; user data is redacted, see RedactedArgv
+   'commands': [str],  # for a batch, the name of each command
+   'other_seconds': float,  # for a batch, e.g. loading and saving
+   'counts': {'actions': int, 'projects': int, 'contexts': int},
+   'view_filter': str,
+   ...}  # anything given to Context, e.g. a hash of the username
+
+The logger defaults to writing a line of JSON to stderr; see SetLogger.
+"""
+
+import json
+import re
+import sys
+import threading
+import time
+
+import gflags as flags  # https://code.google.com/p/python-gflags/
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_float(
+  'pyatdl_slow_command_seconds',
+  0,
+  'If positive, log each UICmd taking at least this many seconds. See module '
+  'slowlog.',
+  lower_bound=0)
+flags.DEFINE_float(
+  'pyatdl_slow_batch_seconds',
+  0,
+  'If positive, log each batch of commands taking at least this many seconds. '
+  'See module slowlog.',
+  lower_bound=0)
+
+_local = threading.local()
+
+
+def _WriteToStderr(record):
+  sys.stderr.write('slow %s\n' % json.dumps(record, sort_keys=True))
+
+
+_logger = _WriteToStderr
+
+
+def SetLogger(logger):
+  """Sets the function that receives each slow command or batch.
+
+  Args:
+    logger: function(dict)->None|None  # None restores the default
+  """
+  global _logger  # pylint: disable=global-statement
+  _logger = logger if logger is not None else _WriteToStderr
+
+
+class Context(object):
+  """Context manager adding the given fields to what this thread logs."""
+
+  def __init__(self, **fields):
+    self._fields = fields
+    self._saved = None
+
+  def __enter__(self):
+    self._saved = getattr(_local, 'context', {})
+    _local.context = dict(self._saved, **self._fields)
+    return self
+
+  def __exit__(self, *unused_args):
+    _local.context = self._saved
+    return False
+
+
+# The name of a flag, e.g. '--context' or '-c':
+_FLAG_RE = re.compile(r'^--?[A-Za-z_]+')
+
+
+def RedactedArgv(argv):
+  """Returns argv sans user data, e.g. names of actions.
+
+  The command name, flag names, and UIDs remain. Everything else becomes its
+  length, including anything that merely starts with '-', e.g. '-$5 refund',
+  and everything after '--'.
+
+  Args:
+    argv: [str]
+  Returns:
+    [str]
+  """
+  def Redacted(s):
+    return '<%d chars>' % len(s)
+
+  result = list(argv[:1])
+  for i, arg in enumerate(argv[1:]):
+    if arg == '--':
+      result.append(arg)
+      result.extend(Redacted(a) for a in argv[i+2:])
+      break
+    match = _FLAG_RE.match(arg)
+    if match:
+      value = arg[match.end():]
+      if value.startswith('='):
+        result.append(match.group() + '=' + Redacted(value[1:]))
+      else:
+        result.append(match.group() + (Redacted(value) if value else ''))
+    elif arg.startswith('uid=') and arg[len('uid='):].isdigit():
+      result.append(arg)
+    else:
+      result.append(Redacted(arg))
+  return result
+
+
+def _Counts(todolist):
+  """Counts without deserializing lazily deserialized projects."""
+  num_actions = num_projects = 0
+  for p, unused_path in todolist.Projects():
+    num_projects += 1
+    num_actions += len(p.ActionUIDs())
+  return {'actions': num_actions,
+          'projects': num_projects - 1,  # sans /inbox
+          'contexts': len(todolist.ctx_list.items)}
+
+
+def _Log(the_state, record):
+  if the_state is not None:
+    record['counts'] = _Counts(the_state.ToDoList())
+    record['view_filter'] = the_state.ViewFilter().ViewFilterUINames()[0]
+  record.update(getattr(_local, 'context', {}))
+  _logger(record)
+
+
+def _Seconds(seconds):
+  return round(seconds, 6)
+
+
+def NoteCommand(the_state, argv, precheck_seconds, run_seconds,
+                postcheck_seconds, failed=False):
+  """Called after each UICmd, even one that fails; logs it if it was slow.
+
+  Args:
+    the_state: state.State
+    argv: [str]
+    precheck_seconds: float
+    run_seconds: float
+    postcheck_seconds: float
+    failed: bool  # True iff the UICmd or a check raised an exception
+  """
+  batch = getattr(_local, 'batch', None)
+  if batch is not None:
+    batch.AddCommand(argv[0], precheck_seconds, run_seconds,
+                     postcheck_seconds)
+  seconds = precheck_seconds + run_seconds + postcheck_seconds
+  if 0 < FLAGS.pyatdl_slow_command_seconds <= seconds:
+    _Log(the_state, {'kind': 'command',
+                     'seconds': _Seconds(seconds),
+                     'precheck_seconds': _Seconds(precheck_seconds),
+                     'run_seconds': _Seconds(run_seconds),
+                     'postcheck_seconds': _Seconds(postcheck_seconds),
+                     'failed': failed,
+                     'argv': RedactedArgv(argv)})
+
+
+class Batch(object):
+  """Context manager around a batch of commands; logs the batch if slow, even
+  if it fails.
+
+  Call SetState once there is a state.State.
+  """
+
+  def __init__(self):
+    self._state = None
+    self._start = None
+    self._saved = None
+    self._commands = []
+    self._precheck_seconds = self._run_seconds = self._postcheck_seconds = 0.0
+
+  def SetState(self, the_state):
+    self._state = the_state
+
+  def AddCommand(self, name, precheck_seconds, run_seconds,
+                 postcheck_seconds):
+    self._commands.append(name)
+    self._precheck_seconds += precheck_seconds
+    self._run_seconds += run_seconds
+    self._postcheck_seconds += postcheck_seconds
+
+  def __enter__(self):
+    self._saved = getattr(_local, 'batch', None)
+    _local.batch = self
+    self._start = time.time()
+    return self
+
+  def __exit__(self, exc_type, *unused_args):
+    seconds = time.time() - self._start
+    _local.batch = self._saved
+    if 0 < FLAGS.pyatdl_slow_batch_seconds <= seconds:
+      checked_and_run = (self._precheck_seconds + self._run_seconds +
+                         self._postcheck_seconds)
+      _Log(self._state, {'kind': 'batch',
+                         'seconds': _Seconds(seconds),
+                         'precheck_seconds': _Seconds(self._precheck_seconds),
+                         'run_seconds': _Seconds(self._run_seconds),
+                         'postcheck_seconds': _Seconds(self._postcheck_seconds),
+                         'other_seconds': _Seconds(seconds - checked_and_run),
+                         'failed': exc_type is not None,
+                         'commands': self._commands})
+    return False
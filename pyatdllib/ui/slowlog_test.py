@@ -0,0 +1,129 @@
+"""Unittests for module 'slowlog'."""
+
+import StringIO
+import time
+
+import gflags as flags  # https://code.google.com/p/python-gflags/
+
+from pyatdllib.core import uid
+from pyatdllib.core import unitjest
+from pyatdllib.ui import immaculater
+from pyatdllib.ui import slowlog
+from pyatdllib.ui import uicmd
+immaculater.RegisterUICmds(cloud_only=False)
+
+FLAGS = flags.FLAGS
+
+
+class _SlowReader(object):
+  """Reads nothing, slowly."""
+  name = 'slow reader'
+
+  def __init__(self, test_case):
+    self._test_case = test_case
+
+  def read(self):
+    self._test_case.Sleep(4)
+    return b''
+
+
+class _Writer(object):
+  def write(self, b):
+    pass
+
+
+# pylint: disable=missing-docstring,too-many-public-methods
+class SlowlogTestCase(unitjest.TestCase):
+
+  def setUp(self):
+    super(SlowlogTestCase, self).setUp()
+    self._now = 1000.0
+    self._saved_time = time.time
+    time.time = lambda: self._now
+    uid.singleton_factory = uid.Factory()
+    FLAGS.pyatdl_separator = '/'
+    FLAGS.pyatdl_paranoia = True
+    FLAGS.pyatdl_allow_exceptions_in_batch_mode = False
+    FLAGS.seed_upon_creation = False
+    FLAGS.database_filename = None
+    FLAGS.pyatdl_slow_command_seconds = 2
+    FLAGS.pyatdl_slow_batch_seconds = 5
+    self._logged = []
+    slowlog.SetLogger(self._logged.append)
+    self._saved_touch = uicmd.UICmdTouch.Run
+
+  def tearDown(self):
+    uicmd.UICmdTouch.Run = self._saved_touch
+    slowlog.SetLogger(None)
+    FLAGS.pyatdl_slow_command_seconds = 0
+    FLAGS.pyatdl_slow_batch_seconds = 0
+    time.time = self._saved_time
+    super(SlowlogTestCase, self).tearDown()
+
+  def Sleep(self, seconds):
+    self._now += seconds
+
+  def testRedactedArgv(self):
+    self.assertEqual(
+      slowlog.RedactedArgv(['mkact', '--context=@home', '-a', '/P1/secret',
+                            'uid=42', 'uid=x']),
+      ['mkact', '--context=<5 chars>', '-a', '<10 chars>', 'uid=42',
+       '<5 chars>'])
+    self.assertEqual(
+      slowlog.RedactedArgv(['do', '-$5 refund', '-- x', '--', '--secret',
+                            'uid=7']),
+      ['do', '<10 chars>', '<4 chars>', '--', '<8 chars>', '<5 chars>'])
+    self.assertEqual(slowlog.RedactedArgv(['do', '-']), ['do', '<1 chars>'])
+
+  def testSlowCommandAndBatch(self):
+    test_case = self
+
+    def SlowTouch(self, args):
+      test_case.Sleep(3)
+      return test_case._saved_touch(self, args)
+
+    uicmd.UICmdTouch.Run = SlowTouch
+    with slowlog.Context(user_hash='abc'):
+      immaculater.ApplyBatchOfCommands(
+        StringIO.StringIO(
+          'mkprj /P1\nmkact /P1/secret\nview all_even_deleted\n'),
+        printer=lambda _: None, reader=_SlowReader(self), writer=_Writer())
+    self.assertEqual(len(self._logged), 2, self._logged)
+    self.assertEqual(self._logged[0], {
+      'kind': 'command', 'seconds': 3, 'precheck_seconds': 0, 'run_seconds': 3,
+      'postcheck_seconds': 0, 'failed': False, 'argv': ['mkact', '<10 chars>'],
+      'counts': {'actions': 1, 'projects': 1, 'contexts': 0},
+      'view_filter': 'all', 'user_hash': 'abc'})
+    self.assertEqual(self._logged[1], {
+      'kind': 'batch', 'seconds': 7, 'precheck_seconds': 0, 'run_seconds': 3,
+      'postcheck_seconds': 0, 'other_seconds': 4, 'failed': False,
+      'commands': ['mkprj', 'mkact', 'view'],
+      'counts': {'actions': 1, 'projects': 1, 'contexts': 0},
+      'view_filter': 'all_even_deleted', 'user_hash': 'abc'})
+
+  def testFailures(self):
+    test_case = self
+
+    def SlowFailingTouch(unused_self, unused_args):
+      test_case.Sleep(3)
+      raise uicmd.BadArgsError('no')
+
+    uicmd.UICmdTouch.Run = SlowFailingTouch
+    with self.assertRaises(immaculater.BadArgsForCommandError):
+      immaculater.ApplyBatchOfCommands(
+        StringIO.StringIO('mkprj /P1\nmkact /P1/secret\n'),
+        printer=lambda _: None, reader=_SlowReader(self), writer=_Writer())
+    self.assertEqual(
+      [(r['kind'], r['seconds'], r['failed']) for r in self._logged],
+      [('command', 3, True), ('batch', 7, True)])
+
+  def testFastBatch(self):
+    immaculater.ApplyBatchOfCommands(StringIO.StringIO('mkprj /P1\n'),
+                                     printer=lambda _: None,
+                                     reader=_SlowReader(self),
+                                     writer=_Writer())
+    self.assertEqual(self._logged, [])
+
+
+if __name__ == '__main__':
+  unitjest.main()
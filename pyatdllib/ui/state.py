@@ -91,7 +91,9 @@ class State(object):  # pylint: disable=too-many-instance-attributes,too-many-pu
     self._todolist = td
     self._current_working_container = self._todolist.root
     self._view_filter = self.NewViewFilter()
-    self._serialized_tdl_we_rewind_to = td.AsProto().SerializeToString()
+    # Projects not yet fetched stay that way; see tdl.ToDoList.FetchProjects.
+    self._serialized_tdl_we_rewind_to = td.AsProto(
+      fetch=False).SerializeToString()
     self._class_to_deserialize_into = td.__class__
 
   def ResetUndoStack(self):
@@ -418,13 +420,19 @@ class State(object):  # pylint: disable=too-many-instance-attributes,too-many-pu
     """
     return self._view_filter
 
-  def SetViewFilter(self, vf):
+  def SetViewFilter(self, vf, include_archived=True):
     """Sets the current ViewFilter.
 
+    Showing everything means showing the archive (see tdl.ToDoList.Archive),
+    too, unless include_archived is False.
+
     Args:
       vf: ViewFilter
+      include_archived: bool
     """
     self._view_filter = vf
+    if include_archived and isinstance(vf, view_filter.ShowAll):
+      self._todolist.LoadArchive()
 
   def Print(self, s):  # pylint: disable=no-self-use
     """Shows the given string to the User.
@@ -477,7 +485,10 @@ class State(object):  # pylint: disable=too-many-instance-attributes,too-many-pu
     if self._view_filter is not None:
       old_view_filter_name = self._view_filter.ViewFilterUINames()[0]
     t = self._class_to_deserialize_into.DeserializedProtobuf(
-      self._serialized_tdl_we_rewind_to)
+      self._serialized_tdl_we_rewind_to,
+      fetch_projects=self._todolist.ProjectFetcher())
+    t.SetArchiveLoader(self._todolist.ArchiveLoader())
+    t.SetHistory(self._todolist.History())
     self._serialized_tdl_we_rewind_to = None
     self.SetToDoList(t)
     if old_view_filter_name is not None:
@@ -8,12 +8,17 @@ You must call RegisterAppcommands before using this module.
 
 from __future__ import absolute_import
 import base64
+import binascii
+import codecs
+import collections
 import datetime
+import heapq
 import json
 import pipes
 import pytz
 import random
 import re
+import sys
 import time  # pylint: disable=wrong-import-order
 
 import gflags as flags  # https://github.com/gflags/python-gflags
@@ -28,11 +33,16 @@ from ..core import common
 from ..core import container
 from ..core import ctx
 from ..core import folder
+from ..core import jsonlines
 from ..core import prj
+from ..core import pyatdl_pb2
+from ..core import taskpaper
 from ..core import tdl
 from ..core import uid
 from ..core import view_filter
 from . import appcommandsutil
+from . import changes
+from . import history
 from . import lexer
 from . import serialization
 from . import state as state_module
@@ -165,7 +175,7 @@ def _ListingForOneItem(show_uid, show_timestamps, item, to_do_list, name_overrid
 
 def _JsonForOneItem(item, to_do_list, number_of_items,
                     name_override=None, in_context_override=None,
-                    path_leaf_first=None, in_prj=None):
+                    path_leaf_first=None, in_prj=None, ctx_by_uid=None):
   """Returns a JSON-friendly object representing the given item.
 
   Args:
@@ -174,6 +184,7 @@ def _JsonForOneItem(item, to_do_list, number_of_items,
     in_context_override: str
     path_leaf_first: [str]
     in_prj: str
+    ctx_by_uid: None|{int: Ctx}  # see _ContextsByUID; saves a linear search
   Returns:
     dict  # not JSON, but ready to be
   """
@@ -198,7 +209,10 @@ def _JsonForOneItem(item, to_do_list, number_of_items,
     if item.ctx is None:
       in_context = FLAGS.no_context_display_string
     else:
-      context = to_do_list.ContextByUID(item.ctx.uid)
+      if ctx_by_uid is not None:
+        context = ctx_by_uid.get(item.ctx.uid)
+      else:
+        context = to_do_list.ContextByUID(item.ctx.uid)
       if context is not None:
         in_context = context.name
       else:
@@ -218,6 +232,123 @@ def _JsonForOneItem(item, to_do_list, number_of_items,
       rv['path'] = FLAGS.pyatdl_separator
   return rv
 
+def _ContextsByUID(to_do_list):
+  """Returns {int: Ctx} for use with _JsonForOneItem."""
+  return dict((c.uid, c) for c in to_do_list.ctx_list.items)
+
+
+def _DefinePaginationFlags(flag_values):
+  """Defines --limit and --cursor; see _Paginated."""
+  flags.DEFINE_integer('limit', None,
+                       'With --json, outputs at most this many items as '
+                       '{"items": [...], "next_cursor": str|null}. Pass '
+                       'next_cursor to --cursor to get the next page. Items are '
+                       'ordered by UID, or by name and then UID if sorting '
+                       'alphabetically (see "help sort").',
+                       flag_values=flag_values)
+  flags.DEFINE_string('cursor', '',
+                      'With --json, outputs the page that follows this '
+                      'cursor, i.e. the "next_cursor" of the previous page; '
+                      'see --limit',
+                      flag_values=flag_values)
+
+
+def _Paginating(require_json=True):
+  """Returns True iff --limit or --cursor was given; see _DefinePaginationFlags."""
+  if FLAGS.limit is None and not FLAGS.cursor:
+    return False
+  if FLAGS.limit is not None and FLAGS.limit < 1:
+    raise BadArgsError('--limit must be positive')
+  if require_json and not FLAGS.json:
+    raise BadArgsError('--limit and --cursor require --json')
+  return True
+
+
+def _SortKeyForPagination(state, item, name_override=None):
+  """Returns a key for _Paginated that orders items stably.
+
+  Args:
+    state: State
+    item: AuditableObject|None  # None is 'Actions Without Context'
+    name_override: None|unicode
+  Returns:
+    [int]|[unicode, int]
+  """
+  the_uid = 0 if item is None else item.uid
+  if state.CurrentSorting() == 'alpha':
+    if name_override is not None:
+      return [name_override, the_uid]
+    # As in 'ls', /inbox and 'Actions Without Context' come first:
+    return [u'' if item is None or item.uid == 1 else item.name, the_uid]
+  return [the_uid]
+
+
+def _RaiseIfPaginating():
+  if FLAGS.limit is not None or FLAGS.cursor:
+    raise BadArgsError('--limit and --cursor require zero arguments')
+
+
+def _EncodedCursor(key):
+  return base64.urlsafe_b64encode(
+    json.dumps(key, separators=(',', ':')).encode('utf-8'))
+
+
+def _DecodedCursor(cursor):
+  """Returns the sort key encoded by _EncodedCursor.
+
+  Raises:
+    BadArgsError
+  """
+  try:
+    key = json.loads(base64.urlsafe_b64decode(str(cursor)).decode('utf-8'))
+  except (TypeError, ValueError, UnicodeError, binascii.Error):
+    raise BadArgsError('Invalid --cursor %s' % pipes.quote(cursor))
+  if not isinstance(key, list) or not key or not isinstance(key[-1], int):
+    raise BadArgsError('Invalid --cursor %s' % pipes.quote(cursor))
+  return key
+
+
+def _Paginated(items, sort_key, limit, cursor):
+  """Returns one page of items, ordered by sort_key.
+
+  Only the items on the page are sorted, so the cost is O(N log limit) where N
+  is len(items), and the caller need only convert the page to JSON.
+
+  Args:
+    items: iterable
+    sort_key: function(item) -> list  # must be unique per item
+    limit: None|int  # None means no limit
+    cursor: str  # '' for the first page
+  Returns:
+    ([item], str|None)  # the page and the cursor for the next page, if any
+  Raises:
+    BadArgsError: cursor is invalid
+  """
+  if cursor:
+    after = _DecodedCursor(cursor)
+
+    def IsAfter(x):  # pylint: disable=missing-docstring
+      key = sort_key(x)
+      if len(key) != len(after):
+        raise BadArgsError(
+          '--cursor is from a page sorted differently; see "help sort"')
+      return key > after
+
+    items = (x for x in items if IsAfter(x))
+  if limit is None:
+    return sorted(items, key=sort_key), None
+  page = heapq.nsmallest(limit + 1, items, key=sort_key)
+  if len(page) <= limit:
+    return page, None
+  page = page[:limit]
+  return page, _EncodedCursor(sort_key(page[-1]))
+
+
+def _PrintPage(state, page_json, next_cursor):
+  state.Print(json.dumps({'items': page_json, 'next_cursor': next_cursor},
+                         sort_keys=True, separators=(',', ':')))
+
+
 def _TimestampStr(epoch_sec_or_none):  # pylint:disable=missing-docstring
   if epoch_sec_or_none is None:
     # not yet deleted.
@@ -775,11 +906,13 @@ class UICmdLsctx(UICmd):
                       'Additionally lists timestamps ctime, dtime, mtime',
                       short_name='l', flag_values=flag_values)
     flags.DEFINE_bool('json', False, 'Output JSON', flag_values=flag_values)
+    _DefinePaginationFlags(flag_values)
 
   def Run(self, args):  # pylint: disable=missing-docstring,no-self-use
     state = FLAGS.pyatdl_internal_state
     to_be_json = []
     if len(args) == 2:
+      _RaiseIfPaginating()
       context = _LookupContext(state, args[-1])
       if context is None:
         raise BadArgsError('No such Context "%s"' % args[-1])
@@ -796,32 +929,49 @@ class UICmdLsctx(UICmd):
       if len(args) != 1:
         raise BadArgsError(
           'Takes zero or one arguments; found these arguments: %s' % repr(args[1:]))
-      if FLAGS.json:
-        to_be_json.append(_JsonForOneItem(
-          None,
-          state.ToDoList(),
-          sum(1 for a, _ in state.ToDoList().ActionsInContext(None)
-              if state.ViewFilter().ShowAction(a))))
-      else:
-        state.Print(_ListingForContext(FLAGS.pyatdl_show_uid,
-            FLAGS.show_timestamps, None))
+      if _Paginating() or FLAGS.json:
+        self._RunJson(state)
+        return
+      state.Print(_ListingForContext(FLAGS.pyatdl_show_uid,
+          FLAGS.show_timestamps, None))
       sorted_contexts = list(state.ToDoList().ctx_list.items)
       if state.CurrentSorting() == 'alpha':
         sorted_contexts.sort(key=lambda c: c.name)
       for c in sorted_contexts:
         if state.ViewFilter().ShowContext(c):
-          if FLAGS.json:
-            to_be_json.append(_JsonForOneItem(
-              c,
-              state.ToDoList(),
-              sum(1 for a, _ in state.ToDoList().ActionsInContext(c.uid)
-                  if state.ViewFilter().ShowAction(a))))
-          else:
-            state.Print(_ListingForContext(FLAGS.pyatdl_show_uid,
-                FLAGS.show_timestamps, c))
+          state.Print(_ListingForContext(FLAGS.pyatdl_show_uid,
+              FLAGS.show_timestamps, c))
     if FLAGS.json:
       state.Print(json.dumps(to_be_json, sort_keys=True, separators=(',', ':')))
 
+  def _RunJson(self, state):  # pylint: disable=no-self-use
+    """Prints all contexts as JSON, or one page of them."""
+    # Count the visible actions in each context in a single pass:
+    number_of_items = {}
+    for a, _ in state.ToDoList().Actions():
+      if state.ViewFilter().ShowAction(a):
+        ctx_uid = None if a.ctx is None else a.ctx.uid
+        number_of_items[ctx_uid] = number_of_items.get(ctx_uid, 0) + 1
+    visible_contexts = [c for c in state.ToDoList().ctx_list.items
+                        if state.ViewFilter().ShowContext(c)]
+    if _Paginating():
+      page, next_cursor = _Paginated(
+        [None] + visible_contexts,
+        lambda c: _SortKeyForPagination(state, c),
+        FLAGS.limit, FLAGS.cursor)
+    else:
+      if state.CurrentSorting() == 'alpha':
+        visible_contexts.sort(key=lambda c: c.name)
+      page = [None] + visible_contexts
+    to_be_json = [
+      _JsonForOneItem(c, state.ToDoList(),
+                      number_of_items.get(None if c is None else c.uid, 0))
+      for c in page]
+    if _Paginating():
+      _PrintPage(state, to_be_json, next_cursor)
+    else:
+      state.Print(json.dumps(to_be_json, sort_keys=True, separators=(',', ':')))
+
 
 class UICmdLsprj(UICmd):
   """Without arguments, lists all Projects. Or takes one argument, a Project, and lists its details.
@@ -831,10 +981,12 @@ class UICmdLsprj(UICmd):
   def __init__(self, name, flag_values, **kargs):
     super(UICmdLsprj, self).__init__(name, flag_values, **kargs)
     flags.DEFINE_bool('json', False, 'Output JSON', flag_values=flag_values)
+    _DefinePaginationFlags(flag_values)
 
   def Run(self, args):  # pylint: disable=missing-docstring,no-self-use
     state = FLAGS.pyatdl_internal_state
     if len(args) == 2:
+      _RaiseIfPaginating()
       try:
         the_project, parent_container = _LookupProject(state, args[-1])
       except NoSuchContainerError as e:
@@ -856,6 +1008,21 @@ class UICmdLsprj(UICmd):
       if len(args) != 1:  # $0 isn't an argument
         raise BadArgsError(
           'Takes zero or one arguments; found these arguments: %s' % repr(args[1:]))
+      if _Paginating():
+        page, next_cursor = _Paginated(
+          [(p, path) for p, path in state.ToDoList().Projects()
+           if state.ViewFilter().ShowProject(p)],
+          lambda (p, path): _SortKeyForPagination(state, p),
+          FLAGS.limit, FLAGS.cursor)
+        _PrintPage(
+          state,
+          [_JsonForOneItem(
+            p,
+            state.ToDoList(),
+            sum(1 for a in p.items if state.ViewFilter().ShowAction(a)),
+            path_leaf_first=path) for p, path in page],
+          next_cursor)
+        return
       to_be_json = []  # pylint: disable=redefined-variable-type
       sorted_projects = list(state.ToDoList().Projects())
       if state.CurrentSorting() == 'alpha':
@@ -991,6 +1158,51 @@ class UICmdDump(UICmd):
       state.Print(text)
 
 
+def _CapturedActionName(args):
+  """Returns the name of the action that 'do' or 'maybe' creates.
+
+  Args:
+    args: [unicode]  # argv, including $0
+  Returns:
+    unicode
+  Raises:
+    BadArgsError
+  """
+  if len(args) == 1:  # $0 isn't an argument
+    raise BadArgsError('Found no arguments.')
+  if len(args) == 2:
+    return args[-1]
+  return u' '.join(pipes.quote(arg) for arg in args[1:])
+
+
+def _TouchInInbox(state, argv):
+  """Runs the 'touch' command with the Inbox as the working directory.
+
+  Args:
+    state: State
+    argv: [unicode]  # the arguments to 'touch'
+  Raises:
+    BadArgsError
+  """
+  cwc = state.CurrentWorkingContainer()
+  state.SetCurrentWorkingContainer(state.GetContainerFromPath('uid=1'))
+  try:
+    APP_NAMESPACE.FindCmdAndExecute(state, ['touch'] + argv)  # mkact
+  finally:
+    state.SetCurrentWorkingContainer(cwc)
+
+
+# Arguments to 'touch', sans the action's name, keyed by command:
+_CAPTURE_TOUCH_ARGV = {
+  'do': ['--autoprj', '--allow_slashes'],
+  'maybe': ['--autoprj', '-c', '@someday/maybe', '--allow_slashes'],
+}
+
+
+# Commands that MergeCaptures can apply to an existing action:
+_QUEUEABLE_TOGGLES = ('complete', 'uncomplete')
+
+
 class UICmdDo(UICmd):  # TODO(chandler): UndoableUICmd, correct?
   """Creates an action in the Inbox, allowing forward slashes.
 
@@ -1003,23 +1215,8 @@ class UICmdDo(UICmd):  # TODO(chandler): UndoableUICmd, correct?
   """
   def Run(self, args):  # pylint: disable=missing-docstring,no-self-use
     state = FLAGS.pyatdl_internal_state
-    if len(args) == 1:  # $0 isn't an argument
-      raise BadArgsError('Found no arguments.')
-    if len(args) == 2:
-      action_name = args[-1]
-    else:
-      action_name = u' '.join(pipes.quote(arg) for arg in args[1:])
-    cwc = state.CurrentWorkingContainer()
-    state.SetCurrentWorkingContainer(state.GetContainerFromPath('uid=1'))
-    try:
-      APP_NAMESPACE.FindCmdAndExecute(
-        state,
-        ['touch',  # mkact
-         '--autoprj',
-         '--allow_slashes',
-         action_name])
-    finally:
-      state.SetCurrentWorkingContainer(cwc)
+    action_name = _CapturedActionName(args)
+    _TouchInInbox(state, _CAPTURE_TOUCH_ARGV['do'] + [action_name])
 
 
 class UICmdMaybe(UICmd):  # aspire, maybe TODO(chandler): UndoableUICmd, correct?
@@ -1033,25 +1230,157 @@ class UICmdMaybe(UICmd):  # aspire, maybe TODO(chandler): UndoableUICmd, correct
   """
   def Run(self, args):  # pylint: disable=missing-docstring,no-self-use
     state = FLAGS.pyatdl_internal_state
-    if len(args) == 1:  # $0 isn't an argument
-      raise BadArgsError('Found no arguments.')
-    if len(args) == 2:
-      action_name = args[-1]
-    else:
-      action_name = u' '.join(pipes.quote(arg) for arg in args[1:])
-    cwc = state.CurrentWorkingContainer()
-    state.SetCurrentWorkingContainer(state.GetContainerFromPath('uid=1'))
-    try:
-      APP_NAMESPACE.FindCmdAndExecute(
-        state,
-        ['touch',  # mkact
-         '--autoprj',
-         '-c',
-         '@someday/maybe',
-         '--allow_slashes',
-         action_name])
-    finally:
-      state.SetCurrentWorkingContainer(cwc)
+    action_name = _CapturedActionName(args)
+    _TouchInInbox(state, _CAPTURE_TOUCH_ARGV['maybe'] + [action_name])
+
+
+# An action queued by the 'do' or 'maybe' command without loading the to-do
+# list, or a queued 'complete' or 'uncomplete' of an action; see ParseCapture
+# and MergeCaptures.
+#
+# key: object  # identifies the capture to whoever queued it
+# timestamp: float  # seconds since the epoch
+# command: str  # 'do', 'maybe', 'complete', or 'uncomplete'
+# name: unicode  # the action's name, or, e.g., 'uid=42' for 'complete'
+Capture = collections.namedtuple(
+  'Capture', ['key', 'timestamp', 'command', 'name'])
+
+
+def ParseCapture(space_delimited_argv):
+  """Tells whether a command can be queued instead of executed right away.
+
+  Only simple invocations of 'do' and 'maybe' qualify. Anything else, e.g. an
+  invocation with flags or an action name that would be rejected, must be
+  executed against the loaded to-do list so that the user sees any error.
+
+  Args:
+    space_delimited_argv: unicode
+  Returns:
+    None|(str, unicode)  # (command, action name) if it can be queued
+  """
+  try:
+    argv = lexer.SplitCommandLineIntoArgv(space_delimited_argv)
+  except lexer.Error:
+    return None
+  if len(argv) < 2 or argv[0] not in _CAPTURE_TOUCH_ARGV:
+    return None
+  if any(arg.startswith(u'-') for arg in argv[1:]):
+    return None  # gflags would parse it
+  name = _CapturedActionName(argv)
+  if any(not n.strip() or n.startswith(u'uid=')
+         for n in _NamesAutoprjMightLeave(name)):
+    return None
+  return str(argv[0]), name
+
+
+def _NamesAutoprjMightLeave(basename):
+  """Returns every name 'touch --autoprj' might give the action, whatever
+  projects exist.
+
+  See _ContainerFromActionName.
+
+  Args:
+    basename: unicode
+  Returns:
+    [unicode]  # including basename itself
+  """
+  names = [basename]
+  for i, c in enumerate(basename):
+    if c == u':':  # 'Project Name: rest'
+      names.append(basename[i+1:].strip())
+  split_basename = basename.split(u' ')
+  for i, split in enumerate(split_basename):
+    if split.startswith(u'+'):  # '+ProjectName'
+      names.append(u' '.join(split_basename[:i] + split_basename[i+1:]))
+  return names
+
+
+def _WriteToStderr(message):
+  sys.stderr.write('%s\n' % message)
+
+
+_logger = _WriteToStderr
+
+
+def SetLogger(logger):
+  """Sets the function that receives each line we log, e.g. when MergeCaptures
+  drops a capture.
+
+  Args:
+    logger: function(str)->None|None  # None restores the default
+  """
+  global _logger  # pylint: disable=global-statement
+  _logger = logger if logger is not None else _WriteToStderr
+
+
+def _MergeToggle(state, capture):
+  """Performs a queued 'complete' or 'uncomplete' as of the time it was queued.
+
+  Until a write dequeues the toggle, every batch merges it anew, so it must
+  leave the same mtimes each time.
+
+  Args:
+    state: State
+    capture: Capture
+  """
+  try:
+    a, containing_prj = _LookupAction(state, capture.name)
+  except (BadArgsError, NoSuchContainerError):
+    return  # e.g., 'purgedeleted' removed it after the toggle was queued
+  mtimes = [(x, x.mtime) for x in (a, containing_prj)]
+  _PerformComplete(state, capture.name,
+                   mark_complete=capture.command == 'complete', force=False)
+  for x, mtime in mtimes:
+    if x.mtime != mtime:
+      x.__dict__['mtime'] = max(mtime, capture.timestamp)
+
+
+def MergeCaptures(state, captures):
+  """Adds queued actions to the to-do list as if they were never queued.
+
+  Each action is created just as the 'do' or 'maybe' command would create it,
+  so it gets the next UID, but its ctime is the time of its capture.
+
+  A queued 'complete' or 'uncomplete' of an action is ignored if the action is
+  gone and otherwise modifies it (and its project) as of the time of its
+  capture. A queued action that cannot be created as queued is created without
+  its context or its project, if need be, and is otherwise dropped; see
+  SetLogger.
+
+  Args:
+    state: State
+    captures: [Capture]  # oldest first
+  """
+  printed = []
+  saved_printer = state.Printer()
+  state.SetPrinter(printed.append)
+  try:
+    for capture in captures:
+      del printed[:]
+      if capture.command in _QUEUEABLE_TOGGLES:
+        _MergeToggle(state, capture)
+        continue
+      # E.g., the user deleted @someday/maybe after queueing. Dropping the
+      # action would be worse than dropping its context or its project:
+      touch_argvs = [_CAPTURE_TOUCH_ARGV[capture.command],
+                     _CAPTURE_TOUCH_ARGV['do'],
+                     ['--allow_slashes']]  # the literal name
+      for touch_argv in touch_argvs:
+        try:
+          _TouchInInbox(state, ['--verbose'] + touch_argv + [capture.name])
+          break
+        except BadArgsError:
+          continue
+      else:
+        # A capture that cannot be merged must not block those after it, nor
+        # every later batch of commands:
+        _logger('Dropping the %s capture %r' % (capture.command, capture.key))
+        continue
+      assert len(printed) == 1, printed
+      a = state.ToDoList().ActionByUID(int(printed[0]))[0]
+      a.ctime = min(capture.timestamp, a.ctime)
+  finally:
+    state.SetPrinter(saved_printer)
 
 
 class UICmdAsTaskPaper(UICmd):  # astaskpaper a.k.a. txt
@@ -1072,6 +1401,30 @@ class UICmdAsTaskPaper(UICmd):  # astaskpaper a.k.a. txt
         state.Print(line)
 
 
+class UICmdImporttaskpaper(UndoableUICmd):
+  """Adds the contents of a TaskPaper file to your to-do list.
+
+  Understands what "astaskpaper" writes, including the @done, @deleted, and
+  @inactive tags, Contexts, and notes. Folders and Contexts are reused if they
+  exist and made otherwise.
+
+  Usage: A single argument, a path to a UTF-8 file
+  """
+  def Run(self, args):  # pylint: disable=missing-docstring,no-self-use
+    state = FLAGS.pyatdl_internal_state
+    self.RaiseUnlessNArgumentsGiven(1, args)
+    try:
+      with codecs.open(args[-1], encoding='utf-8') as f:
+        counts = taskpaper.Import(state.ToDoList(), f)
+    except IOError as e:
+      raise BadArgsError('Cannot read %s: %s' % (args[-1], e.strerror))
+    except (UnicodeDecodeError, taskpaper.Error) as e:
+      raise BadArgsError(e)
+    state.Print(
+      'Imported %d Folders, %d Projects, %d Actions, and %d Contexts.'
+      % (counts.folders, counts.projects, counts.actions, counts.contexts))
+
+
 class UICmdHypertext(UICmd):
   """Prints a hypertext version of your to-do list."""
   def __init__(self, name, flag_values, **kargs):
@@ -1281,12 +1634,13 @@ class UICmdSort(UICmd):
     state.SetSorting(setting_name)
 
 
-def _SetViewFilterByName(filter_name, state):
+def _SetViewFilterByName(filter_name, state, include_archived=True):
   the_view_filter = view_filter.CLS_BY_UI_NAME.get(filter_name, None)
   if the_view_filter is None:
     raise BadArgsError(
       'No such view filter "%s": See "help view".' % filter_name)
-  state.SetViewFilter(state.NewViewFilter(the_view_filter))
+  state.SetViewFilter(state.NewViewFilter(the_view_filter),
+                      include_archived=include_archived)
 
 
 class UICmdTodo(UICmd):
@@ -1345,14 +1699,24 @@ class UICmdView(UICmd):
 
   Without arguments, prints the current filter. Note that 'default' is an alias.
   With a single argument, sets the filter.
+
+  all_even_deleted also shows archived actions (see "help archive") unless you
+  pass --noinclude_archived.
   """
+  def __init__(self, name, flag_values, **kargs):
+    super(UICmdView, self).__init__(name, flag_values, **kargs)
+    flags.DEFINE_bool('include_archived', True,
+                      'With all_even_deleted, load archived actions',
+                      flag_values=flag_values)
+
   def Run(self, args):  # pylint: disable=missing-docstring,no-self-use
     state = FLAGS.pyatdl_internal_state
     if len(args) == 1:
       state.Print(state.ViewFilter().ViewFilterUINames()[0])
       return
     self.RaiseUnlessNArgumentsGiven(1, args)
-    _SetViewFilterByName(args[-1], state)
+    _SetViewFilterByName(args[-1], state,
+                         include_archived=FLAGS.include_archived)
 
 
 class UICmdInctx(UICmd):
@@ -1363,9 +1727,10 @@ class UICmdInctx(UICmd):
     flags.DEFINE_enum('sort_by', 'natural', ['natural', 'uid'],
                       'Sort by what? Sorting by uid sorts by time of '
                       'creation. Sorting naturally gives an arbitrary but '
-                      'deterministic order.',
+                      'deterministic order. Ignored with --limit or --cursor.',
                       short_name='s', flag_values=flag_values)
-    
+    _DefinePaginationFlags(flag_values)
+
   def Run(self, args):  # pylint: disable=missing-docstring,no-self-use
     state = FLAGS.pyatdl_internal_state
     self.RaiseUnlessNArgumentsGiven(1, args)
@@ -1383,6 +1748,19 @@ class UICmdInctx(UICmd):
           ctx_uid = state.ToDoList().ctx_list.ContextUIDFromName(ctx_name)
         except ctx.NoSuchNameError as e:
           raise BadArgsError(e)
+    ctx_by_uid = _ContextsByUID(state.ToDoList())
+    if _Paginating():
+      page, next_cursor = _Paginated(
+        ((a, p) for a, p in state.ToDoList().ActionsInContext(ctx_uid)
+         if state.ViewFilter().ShowAction(a)),
+        lambda (a, p): _SortKeyForPagination(state, a),
+        FLAGS.limit, FLAGS.cursor)
+      _PrintPage(
+        state,
+        [_JsonForOneItem(a, state.ToDoList(), 1, in_prj=p.name,
+                         ctx_by_uid=ctx_by_uid) for a, p in page],
+        next_cursor)
+      return
     action_prj_tuples = list(state.ToDoList().ActionsInContext(ctx_uid))
     if FLAGS.sort_by == 'uid':
       action_prj_tuples.sort(key=lambda (a, p): a.uid)
@@ -1391,7 +1769,7 @@ class UICmdInctx(UICmd):
       if state.ViewFilter().ShowAction(a):
         if FLAGS.json:
           to_be_json.append(_JsonForOneItem(
-            a, state.ToDoList(), 1, in_prj=p.name))
+            a, state.ToDoList(), 1, in_prj=p.name, ctx_by_uid=ctx_by_uid))
         else:
           state.Print(_ListingForOneItem(
             show_uid=FLAGS.pyatdl_show_uid, show_timestamps=False, item=a,
@@ -1405,6 +1783,7 @@ class UICmdInprj(UICmd):
   def __init__(self, name, flag_values, **kargs):
     super(UICmdInprj, self).__init__(name, flag_values, **kargs)
     flags.DEFINE_bool('json', False, 'Output JSON', flag_values=flag_values)
+    _DefinePaginationFlags(flag_values)
 
   def Run(self, args):  # pylint: disable=missing-docstring,no-self-use
     state = FLAGS.pyatdl_internal_state
@@ -1413,11 +1792,24 @@ class UICmdInprj(UICmd):
       the_project, unused_parent_container = _LookupProject(state, args[-1])
     except NoSuchContainerError as e:
       raise BadArgsError(e)
+    ctx_by_uid = _ContextsByUID(state.ToDoList())
+    if _Paginating():
+      page, next_cursor = _Paginated(
+        (a for a in the_project.items if state.ViewFilter().ShowAction(a)),
+        lambda a: _SortKeyForPagination(state, a),
+        FLAGS.limit, FLAGS.cursor)
+      _PrintPage(
+        state,
+        [_JsonForOneItem(a, state.ToDoList(), 1, ctx_by_uid=ctx_by_uid)
+         for a in page],
+        next_cursor)
+      return
     to_be_json = []
     for a in the_project.items:
       if state.ViewFilter().ShowAction(a):
         if FLAGS.json:
-          to_be_json.append(_JsonForOneItem(a, state.ToDoList(), 1))
+          to_be_json.append(_JsonForOneItem(a, state.ToDoList(), 1,
+                                            ctx_by_uid=ctx_by_uid))
         else:
           state.Print(_ListingForOneItem(
             show_uid=FLAGS.pyatdl_show_uid, show_timestamps=False, item=a,
@@ -1426,6 +1818,228 @@ class UICmdInprj(UICmd):
       state.Print(json.dumps(to_be_json, sort_keys=True, separators=(',', ':')))
 
 
+class _PageDataIndex(object):
+  """Indexes a ToDoList so that 'pagedata' walks it only once.
+
+  Also creates view filters that use these indices instead of
+  ToDoList.ActionByUID and that memoize their decisions.
+  """
+  def __init__(self, to_do_list):
+    self.to_do_list = to_do_list
+    self.ctx_by_uid = _ContextsByUID(to_do_list)
+    self.projects = list(to_do_list.Projects())  # [(Prj, [Folder])]
+    self.action_by_uid = {}  # {int: (Action, Prj)}
+    self.actions_by_ctx_uid = {}  # {int|None: [(Action, Prj)]}
+    for p, _ in self.projects:
+      for a in p.items:
+        self.action_by_uid[a.uid] = (a, p)
+        self.actions_by_ctx_uid.setdefault(
+          None if a.ctx is None else a.ctx.uid, []).append((a, p))
+    self._view_filters = {}
+
+  def ViewFilter(self, cls):
+    """Like State.NewViewFilter, but faster.
+
+    Args:
+      cls: type  # a subclass of ViewFilter other than SearchFilter
+    Returns:
+      ViewFilter
+    """
+    if cls not in self._view_filters:
+      def ActionToProject(an_action):  # pylint: disable=missing-docstring
+        a = self.action_by_uid.get(an_action.uid)
+        if a is None:
+          raise ValueError('No action with uid "%s" exists.' % an_action.uid)
+        return a[1]
+
+      def ActionToContext(an_action):  # pylint: disable=missing-docstring
+        if an_action.ctx is None:
+          return None
+        c = self.ctx_by_uid.get(an_action.ctx.uid)
+        if c is None:
+          raise ValueError(
+            'No Context found for action "%s" even though that action has a context UID of "%s"'
+            % (an_action.uid, an_action.ctx.uid))
+        return c
+
+      vf = cls(ActionToProject, ActionToContext)
+      memo = {}
+
+      def ShowAction(an_action, show_action=vf.ShowAction):  # pylint: disable=missing-docstring
+        if an_action.uid not in memo:
+          memo[an_action.uid] = show_action(an_action)
+        return memo[an_action.uid]
+
+      vf.ShowAction = ShowAction
+      self._view_filters[cls] = vf
+    return self._view_filters[cls]
+
+  def NumberOfActionsShown(self, vf, actions):
+    return sum(1 for a in actions if vf.ShowAction(a))
+
+  def ContextsJson(self, vf):
+    """Returns what 'sort alpha' and 'lsctx --json' would."""
+    contexts = [c for c in self.to_do_list.ctx_list.items if vf.ShowContext(c)]
+    contexts.sort(key=lambda c: c.name)
+    return [
+      _JsonForOneItem(
+        c, self.to_do_list,
+        self.NumberOfActionsShown(
+          vf,
+          (a for a, _ in self.actions_by_ctx_uid.get(
+            None if c is None else c.uid, []))))
+      for c in [None] + contexts]
+
+  def ProjectsJson(self, vf, sorting):
+    """Returns what 'lsprj --json' would."""
+    projects = [(p, path) for p, path in self.projects if vf.ShowProject(p)]
+    if sorting == 'alpha':
+      projects.sort(key=lambda (p, path): '' if p.uid == 1 else p.name)
+    return [
+      _JsonForOneItem(p, self.to_do_list,
+                      self.NumberOfActionsShown(vf, p.items),
+                      path_leaf_first=path)
+      for p, path in projects]
+
+  def NeedsreviewJson(self):
+    """Returns what 'needsreview --json' would."""
+    vf = self.ViewFilter(view_filter.ShowNeedingReview)
+    now = time.time()
+    return [_JsonForOneItem(p, self.to_do_list, len(p.items))
+            for p, _ in self.projects
+            if p.NeedsReview(now) and vf.ShowProject(p)]
+
+
+class UICmdPagedata(UICmd):
+  """Prints, as a single JSON object, everything a page of the web UI needs.
+
+  The sole positional argument is the kind of page: 'action', 'context',
+  'project', or 'projects'. All but 'projects' also take a UID, e.g.
+  'pagedata project uid=4'.
+
+  This is equivalent to running several commands such as 'inprj --json',
+  'lsprj --json', 'needsreview --json', and 'note', but it traverses the to-do
+  list only once.
+
+  Sections named 'undeleted_*' use the 'incomplete' view filter and
+  alphabetical sorting regardless of the current ones.
+  """
+  def __init__(self, name, flag_values, **kargs):
+    super(UICmdPagedata, self).__init__(name, flag_values, **kargs)
+    _DefinePaginationFlags(flag_values)
+
+  def Run(self, args):  # pylint: disable=missing-docstring,no-self-use
+    state = FLAGS.pyatdl_internal_state
+    kinds = ('action', 'context', 'project', 'projects')
+    if len(args) < 2 or args[1] not in kinds:
+      raise BadArgsError('Needs a page kind, one of %s' % ', '.join(kinds))
+    kind = args[1]
+    if kind == 'projects':
+      self.RaiseUnlessNArgumentsGiven(1, args)
+    else:
+      self.RaiseUnlessNArgumentsGiven(2, args)
+      try:
+        # As in _LookupContext, UID 0 means "Actions Without Context":
+        if kind == 'context' and args[-1] == 'uid=0':
+          the_uid = 0
+        else:
+          the_uid = lexer.ParseSyntaxForUID(args[-1])
+      except lexer.Error as e:
+        raise BadArgsError(e)
+      if the_uid is None:
+        raise BadArgsError('Needs a UID, e.g. "uid=4"; found %s' % args[-1])
+    if kind != 'context' and _Paginating(require_json=False):
+      raise BadArgsError('--limit and --cursor apply only to context pages')
+    index = _PageDataIndex(state.ToDoList())
+    if isinstance(state.ViewFilter(), view_filter.SearchFilter):
+      vf = state.ViewFilter()
+    else:
+      vf = index.ViewFilter(type(state.ViewFilter()))
+    undeleted_vf = index.ViewFilter(view_filter.ShowNotFinalized)
+    if kind == 'projects':
+      result = {'lsprj': index.ProjectsJson(vf, state.CurrentSorting()),
+                'needsreview': index.NeedsreviewJson()}
+    elif kind == 'project':
+      result = self._ProjectPageData(state, index, vf, the_uid)
+    elif kind == 'action':
+      result = self._ActionPageData(state, index, the_uid)
+    else:
+      result = self._ContextPageData(state, index, vf, the_uid)
+    if kind in ('action', 'project'):
+      result['undeleted_lsctx'] = index.ContextsJson(undeleted_vf)
+    if kind == 'action':
+      result['undeleted_lsprj'] = index.ProjectsJson(undeleted_vf, 'alpha')
+    state.Print(json.dumps(result, sort_keys=True, separators=(',', ':')))
+
+  def _ProjectPageData(self, state, index, vf, the_uid):  # pylint: disable=no-self-use
+    for p, path in index.projects:
+      if p.uid == the_uid:
+        the_project, parent_container = p, (path[0] if path else None)
+        break
+    else:
+      raise BadArgsError('No Project exists with UID %s' % the_uid)
+    lsprj = _JsonForOneItem(the_project, state.ToDoList(),
+                            index.NumberOfActionsShown(vf, the_project.items))
+    lsprj['max_seconds_before_review'] = the_project.max_seconds_before_review
+    # /inbox is weird:
+    lsprj['parent_path'] = state.ContainerAbsolutePath(
+      state.ToDoList().root if parent_container is None else parent_container)
+    return {
+      'inprj': [_JsonForOneItem(a, state.ToDoList(), 1,
+                                ctx_by_uid=index.ctx_by_uid)
+                for a in the_project.items if vf.ShowAction(a)],
+      'lsprj': lsprj,
+      'needsreview': index.NeedsreviewJson(),
+      'note': the_project.note}
+
+  def _ActionPageData(self, state, index, the_uid):  # pylint: disable=no-self-use
+    if the_uid not in index.action_by_uid:
+      raise BadArgsError('No Action with UID %s exists.' % the_uid)
+    an_action, a_project = index.action_by_uid[the_uid]
+    lsact = _JsonForOneItem(an_action, state.ToDoList(), 1,
+                            ctx_by_uid=index.ctx_by_uid)
+    lsact['project_uid'] = a_project.uid
+    lsact['project_path'] = state.ContainerAbsolutePath(a_project)
+    lsact['display_project_path'] = state.ContainerAbsolutePath(
+      a_project, display=True)
+    return {'lsact': lsact, 'note': an_action.note}
+
+  def _ContextPageData(self, state, index, vf, the_uid):  # pylint: disable=no-self-use
+    if the_uid == 0:
+      context = None
+      lsctx = {'ctime': None, 'dtime': None, 'is_active': True,
+               'is_complete': False, 'is_deleted': False, 'mtime': None,
+               'name': FLAGS.no_context_display_string, 'uid': 0}
+      note = state.ToDoList().note_list.notes.get(
+        ':__actions_without_context', u'')
+    else:
+      context = index.ctx_by_uid.get(the_uid)
+      if context is None:
+        raise BadArgsError('No such Context "uid=%s"' % the_uid)
+      lsctx = _JsonForOneItem(
+        context, state.ToDoList(),
+        index.NumberOfActionsShown(
+          vf, (a for a, _ in index.actions_by_ctx_uid.get(the_uid, []))))
+      note = context.note
+    action_prj_tuples = [(a, p) for a, p in index.actions_by_ctx_uid.get(
+      None if context is None else context.uid, []) if vf.ShowAction(a)]
+    if _Paginating(require_json=False):
+      page, next_cursor = _Paginated(
+        action_prj_tuples,
+        lambda (a, p): _SortKeyForPagination(state, a),
+        FLAGS.limit, FLAGS.cursor)
+      inctx = {'items': [
+        _JsonForOneItem(a, state.ToDoList(), 1, in_prj=p.name,
+                        ctx_by_uid=index.ctx_by_uid) for a, p in page],
+               'next_cursor': next_cursor}
+    else:
+      action_prj_tuples.sort(key=lambda (a, p): a.uid)
+      inctx = [_JsonForOneItem(a, state.ToDoList(), 1, in_prj=p.name,
+                               ctx_by_uid=index.ctx_by_uid)
+               for a, p in action_prj_tuples]
+    return {'inctx': inctx, 'lsctx': lsctx, 'note': note}
+
+
 class UICmdCd(UndoableUICmd):  # undoable because 'mkact A' must know its CWD
   """Changes current working directory to the named directory. See cd(1).
   Special locations include ".." (parent directory), "/" (root directory).
@@ -1888,6 +2502,10 @@ class UICmdTouch(UndoableUICmd):  # 'mkact', 'touch'
         containr = c
     if containr.is_deleted:
       raise BadArgsError('Cannot add an Action to a deleted Project')
+    if basename.startswith(u'uid='):
+      # Checked before action.Action() takes a UID that would go unused, which
+      # ToDoList.CheckIsWellFormed forbids:
+      raise BadArgsError('Names starting with "uid=" are prohibited.')
     try:
       a = action.Action(name=basename)
     except auditable_object.IllegalNameError as e:
@@ -2141,6 +2759,157 @@ class UICmdLoad(UICmd):
     state.Print('Load complete.')
 
 
+class UICmdLoadjsonl(UICmd):
+  """Discards the current to-do list and loads one saved by "savejsonl".
+
+  Cannot be undone (all information about undo/redo is obliterated).
+
+  Usage: A single argument, a path to a file
+  """
+  def Run(self, args):  # pylint: disable=missing-docstring,no-self-use
+    state = FLAGS.pyatdl_internal_state
+    self.RaiseUnlessNArgumentsGiven(1, args)
+    saved_factory = uid.singleton_factory
+    uid.singleton_factory = uid.Factory()
+    todolist = None
+    try:
+      with open(args[-1], 'rb') as f:
+        todolist = jsonlines.Import(f)
+    except IOError as e:
+      raise BadArgsError('Cannot read %s: %s' % (args[-1], e.strerror))
+    except jsonlines.Error as e:
+      raise BadArgsError(e)
+    finally:
+      if todolist is None:  # keep the UIDs of the current to-do list
+        uid.singleton_factory = saved_factory
+    state.SetToDoList(todolist)
+    state.ResetUndoStack()
+    state.Print('Load complete.')
+
+
+class UICmdChanges(UICmd):
+  """Lists the Folders, Projects, Actions, and Contexts changed since a given time.
+
+  Each is listed as created, modified, deleted (see "help rm"), or removed
+  (e.g., by "purgedeleted" or "archive"), oldest modification first.
+
+  --since is either seconds since the epoch or a version number as shown by
+  "history" with a leading 'v', e.g. v42. If the history reaches back that far,
+  we compare with that version and can list removed objects. Otherwise we go by
+  each object's timestamps and cannot.
+
+  With --json, outputs {"changes": [...], "includes_removed": bool,
+  "next_since": float}. Pass next_since to --since next time.
+
+  E.g., changes --json --since 1500000000.5
+  """
+  def __init__(self, name, flag_values, **kargs):
+    super(UICmdChanges, self).__init__(name, flag_values, **kargs)
+    flags.DEFINE_string('since', None,
+                        'Seconds since the epoch or, e.g., v42 for version 42 '
+                        'as shown by "history"',
+                        flag_values=flag_values)
+    flags.DEFINE_bool('json', False, 'Output JSON', flag_values=flag_values)
+
+  def Run(self, args):  # pylint: disable=missing-docstring,no-self-use
+    state = FLAGS.pyatdl_internal_state
+    self.RaiseIfAnyArgumentsGiven(args)
+    if not FLAGS.since:
+      raise BadArgsError('Specify --since; see "help changes".')
+    the_history = state.ToDoList().History()
+    version = None
+    since = None
+    try:
+      if FLAGS.since.startswith('v'):
+        version = int(FLAGS.since[1:])
+      else:
+        since = float(FLAGS.since)
+    except ValueError:
+      raise BadArgsError('Invalid --since %s' % pipes.quote(FLAGS.since))
+    if version is None and the_history is not None:
+      version = changes.VersionAt(the_history.Versions(), since)
+    earlier_pb = None
+    if version is not None:
+      if the_history is None:
+        raise BadArgsError('This to-do list is not stored with a history.')
+      try:
+        earlier_pb = pyatdl_pb2.ToDoList.FromString(  # pylint: disable=no-member
+          the_history.Snapshot(version))
+      except history.Error as e:
+        raise BadArgsError(str(e))
+    pb = state.ToDoList().AsProto()
+    the_changes, next_since = changes.Changes(pb, since, earlier_pb=earlier_pb)
+    if FLAGS.json:
+      if since is not None:
+        next_since = max(next_since, since)
+      state.Print(json.dumps(
+        {'changes': [changes.JsonForChange(c) for c in the_changes],
+         'includes_removed': earlier_pb is not None,
+         'next_since': next_since},
+        sort_keys=True, separators=(',', ':')))
+      return
+    for c in the_changes:
+      state.Print(u'%s --%s-- uid=%d %s' % (
+        c.change, c.kind, c.uid, pipes.quote(c.pb.common.metadata.name)))
+
+
+class UICmdHistory(UICmd):
+  """Lists the saved versions of the to-do list, newest first.
+
+  Each line shows the version number (see "restore"), when it was saved, and
+  how many bytes it occupies. A keyframe is a full copy; the rest are deltas.
+  """
+  def Run(self, args):  # pylint: disable=missing-docstring,no-self-use
+    state = FLAGS.pyatdl_internal_state
+    self.RaiseIfAnyArgumentsGiven(args)
+    the_history = state.ToDoList().History()
+    if the_history is None:
+      raise BadArgsError('This to-do list is not stored with a history.')
+    for v in reversed(the_history.Versions()):
+      state.Print(u'%d %s %s %d bytes' % (
+        v.number, _TimestampStr(v.timestamp),
+        u'keyframe' if v.is_keyframe else u'delta', v.size))
+
+
+class UICmdRestore(UICmd):
+  """Replaces the to-do list with a saved version; see "history".
+
+  Cannot be undone with "undo", but the version replaced stays in the history
+  so that you can restore it in turn. Actions archived at the time return as
+  ordinary actions; see "archive".
+
+  E.g., restore --at 42
+  """
+  def __init__(self, name, flag_values, **kargs):
+    super(UICmdRestore, self).__init__(name, flag_values, **kargs)
+    flags.DEFINE_integer('at', None,
+                         'The version number, as shown by "history"',
+                         flag_values=flag_values)
+
+  def Run(self, args):  # pylint: disable=missing-docstring,no-self-use
+    state = FLAGS.pyatdl_internal_state
+    self.RaiseIfAnyArgumentsGiven(args)
+    if FLAGS.at is None:
+      raise BadArgsError('Specify the version with --at; see "history".')
+    old = state.ToDoList()
+    the_history = old.History()
+    if the_history is None:
+      raise BadArgsError('This to-do list is not stored with a history.')
+    try:
+      payload = serialization.RestorablePayload(the_history, FLAGS.at,
+                                                old.ArchiveLoader())
+    except (history.Error, serialization.DeserializationError) as e:
+      raise BadArgsError(str(e))
+    the_history.Record(old.AsProto().SerializeToString())
+    uid.singleton_factory = uid.Factory()
+    todolist = tdl.ToDoList.DeserializedProtobuf(payload)
+    todolist.SetArchiveLoader(old.ArchiveLoader())
+    todolist.SetHistory(the_history)
+    state.SetToDoList(todolist)
+    state.ResetUndoStack()
+    state.Print(u'Restored version %d.' % FLAGS.at)
+
+
 class UICmdSave(UICmd):
   """Saves a copy of the current to-do list to a file.
 
@@ -2157,6 +2926,23 @@ class UICmdSave(UICmd):
     state.Print('Save complete.')
 
 
+class UICmdSavejsonl(UICmd):
+  """Saves a copy of the entire to-do list, including the archive, to a file
+  of JSON Lines, one object per line. See "loadjsonl".
+
+  Usage: A single argument, a path to a file
+  """
+  def Run(self, args):  # pylint: disable=missing-docstring,no-self-use
+    state = FLAGS.pyatdl_internal_state
+    self.RaiseUnlessNArgumentsGiven(1, args)
+    try:
+      with open(args[-1], 'wb') as f:
+        f.writelines(jsonlines.Export(state.ToDoList()))
+    except IOError as e:
+      raise BadArgsError('Cannot write %s: %s' % (args[-1], e.strerror))
+    state.Print('Save complete.')
+
+
 def _RunCmd(cmd, args):
   """Only works because FLAGS.pyatdl_internal_state is already defined. See
   also APP_NAMESPACE.FindCmdAndExecute.
@@ -2386,6 +3172,36 @@ class UICmdDeletecompleted(UICmd):
     state.ToDoList().DeleteCompleted()
 
 
+class UICmdArchive(UICmd):
+  """Moves actions completed or deleted long ago to the archive.
+
+  Archived actions are loaded only when needed, e.g. by "view
+  all_even_deleted", purgedeleted, or deletecompleted. See also unarchive.
+  """
+  def __init__(self, name, flag_values, **kargs):
+    super(UICmdArchive, self).__init__(name, flag_values, **kargs)
+    flags.DEFINE_float('days', 30,
+                       'Archive actions unmodified for this many days',
+                       lower_bound=0, flag_values=flag_values)
+
+  def Run(self, args):  # pylint: disable=missing-docstring,no-self-use
+    state = FLAGS.pyatdl_internal_state
+    self.RaiseIfAnyArgumentsGiven(args)
+    if state.ToDoList().ArchiveLoader() is None:
+      raise BadArgsError('This to-do list is not stored with an archive.')
+    n = state.ToDoList().Archive(time.time() - FLAGS.days * 24 * 3600)
+    state.Print(u'Archived %d action%s.' % (n, u'' if n == 1 else u's'))
+
+
+class UICmdUnarchive(UICmd):
+  """Moves all archived actions back. See also archive."""
+  def Run(self, args):  # pylint: disable=missing-docstring,no-self-use
+    state = FLAGS.pyatdl_internal_state
+    self.RaiseIfAnyArgumentsGiven(args)
+    n = state.ToDoList().Unarchive()
+    state.Print(u'Unarchived %d action%s.' % (n, u'' if n == 1 else u's'))
+
+
 class UICmdPrjify(UICmd):
   """Converts an Action to a Project under the root Folder, deleting the Action."""
   def Run(self, args):  # pylint: disable=missing-docstring,no-self-use
@@ -2455,10 +3271,12 @@ def RegisterAppcommands(cloud_only, appcommands_namespace):  # pylint: disable=t
   appcommands_namespace.AddCmd('?', UICmdHelp)
   appcommands_namespace.AddCmd('activatectx', UICmdActivatectx)
   appcommands_namespace.AddCmd('activateprj', UICmdActivateprj)
+  appcommands_namespace.AddCmd('archive', UICmdArchive)
   appcommands_namespace.AddCmd('aspire', UICmdMaybe)
   appcommands_namespace.AddCmd('astaskpaper', UICmdAsTaskPaper)
   appcommands_namespace.AddCmd('cat', UICmdCat)
   appcommands_namespace.AddCmd('cd', UICmdCd)
+  appcommands_namespace.AddCmd('changes', UICmdChanges)
   if not cloud_only:
     appcommands_namespace.AddCmd('chclock', UICmdChclock)
   appcommands_namespace.AddCmd('chctx', UICmdChctx)
@@ -2478,11 +3296,16 @@ def RegisterAppcommands(cloud_only, appcommands_namespace):  # pylint: disable=t
   if not cloud_only:
     appcommands_namespace.AddCmd('exit', UICmdExit)
   appcommands_namespace.AddCmd('help', UICmdHelp)
+  appcommands_namespace.AddCmd('history', UICmdHistory)
   appcommands_namespace.AddCmd('hypertext', UICmdHypertext)
+  if not cloud_only:
+    appcommands_namespace.AddCmd('importtaskpaper', UICmdImporttaskpaper)
   appcommands_namespace.AddCmd('inctx', UICmdInctx)
   appcommands_namespace.AddCmd('inprj', UICmdInprj)
   if not cloud_only:
     appcommands_namespace.AddCmd('load', UICmdLoad)
+  if not cloud_only:
+    appcommands_namespace.AddCmd('loadjsonl', UICmdLoadjsonl)
   appcommands_namespace.AddCmd('loadtest', UICmdLoadtest)
   appcommands_namespace.AddCmd('ls', UICmdLs)
   appcommands_namespace.AddCmd('lsact', UICmdLsact)
@@ -2496,6 +3319,7 @@ def RegisterAppcommands(cloud_only, appcommands_namespace):  # pylint: disable=t
   appcommands_namespace.AddCmd('mv', UICmdMv)
   appcommands_namespace.AddCmd('needsreview', UICmdNeedsreview)
   appcommands_namespace.AddCmd('note', UICmdNote)
+  appcommands_namespace.AddCmd('pagedata', UICmdPagedata)
   appcommands_namespace.AddCmd('prjify', UICmdPrjify)
   appcommands_namespace.AddCmd('purgedeleted', UICmdPurgedeleted)
   appcommands_namespace.AddCmd('pwd', UICmdPwd)
@@ -2506,6 +3330,7 @@ def RegisterAppcommands(cloud_only, appcommands_namespace):  # pylint: disable=t
   appcommands_namespace.AddCmd('rename', UICmdRename)
   appcommands_namespace.AddCmd('renamectx', UICmdRenamectx)
   appcommands_namespace.AddCmd('reset', UICmdReset)
+  appcommands_namespace.AddCmd('restore', UICmdRestore)
   appcommands_namespace.AddCmd('roll', UICmdRoll)
   appcommands_namespace.AddCmd('rm', UICmdRmact)
   appcommands_namespace.AddCmd('rmact', UICmdRmact)
@@ -2514,11 +3339,14 @@ def RegisterAppcommands(cloud_only, appcommands_namespace):  # pylint: disable=t
   appcommands_namespace.AddCmd('rmprj', UICmdRmprj)
   if not cloud_only:
     appcommands_namespace.AddCmd('save', UICmdSave)
+  if not cloud_only:
+    appcommands_namespace.AddCmd('savejsonl', UICmdSavejsonl)
   appcommands_namespace.AddCmd('seed', UICmdSeed)
   appcommands_namespace.AddCmd('sort', UICmdSort)
   appcommands_namespace.AddCmd('todo', UICmdTodo)
   appcommands_namespace.AddCmd('touch', UICmdTouch)
   appcommands_namespace.AddCmd('txt', UICmdAsTaskPaper)
+  appcommands_namespace.AddCmd('unarchive', UICmdUnarchive)
   appcommands_namespace.AddCmd('uncomplete', UICmdUncomplete)
   if not cloud_only:
     appcommands_namespace.AddCmd('undo', UICmdUndo)
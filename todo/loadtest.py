@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""Measures requests per second and latency of the Django app, offline.
+
+Creates users in a throwaway SQLite database, gives each a generated to-do
+list (see pyatdllib.benchmarks.generate), and then has concurrent workers
+drive /todo/api, /todo/home, /todo/project, /todo/context, and /todo/cli
+(update_todolist) through Django's test client. E.g., from the top-level
+directory:
+
+  python -m todo.loadtest --users 4 --items 1000 --workers 4 --seconds 30
+
+Each worker is a process that sends one request at a time, like one of
+gunicorn's default sync workers. (Threads would not do: pyatdllib keeps the
+state of the command being run in globals such as FLAGS.) Requests go through
+all the middleware, password hashing for the API's basic auth included, so
+compare numbers from the same machine only.
+
+The report gives throughput and latency percentiles for each kind of request.
+It goes to stdout as JSON (or to --output) with a summary on stderr.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import base64
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+_PASSWORD = 'loadtest-password'
+
+# (name, is_a_write); see _request:
+_KINDS = (
+  ('api_read', False),
+  ('home', False),
+  ('project', False),
+  ('context', False),
+  ('api_write', True),
+  ('update_todolist', True),
+)
+
+
+def _configure_environment(database_path):
+  """Points Django at a throwaway database; call before django.setup()."""
+  os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'immaculater.settings')
+  os.environ['DATABASE_URL'] = 'sqlite:///%s' % database_path
+  if os.environ.get('DJANGO_DEBUG', '').lower() != 'true':
+    from cryptography.fernet import Fernet
+    os.environ.setdefault('FERNET_COOKIE_KEY', Fernet.generate_key().decode('ascii'))
+    os.environ.setdefault('FERNET_PROTOBUF_KEY', Fernet.generate_key().decode('ascii'))
+
+
+def _create_users(num_users, num_items, shape):
+  """Creates users with generated to-do lists.
+
+  Returns:
+    [(str, {'project': int, 'context': int, ...})]  # username and UIDs
+  """
+  from django.contrib.auth.models import User
+
+  from pyatdllib.benchmarks import generate
+  from pyatdllib.core import tdl
+  from pyatdllib.core import uid
+  from pyatdllib.ui import serialization
+
+  from . import views
+
+  users = []
+  for i in range(num_users):
+    username = 'loadtest%d' % i
+    user = User.objects.create_user(username, '%s@example.com' % username, _PASSWORD)
+    pb = generate.ToDoList(shape, num_items, seed=i)
+    uid.singleton_factory = uid.Factory()
+    serialization.SerializeToDoList2(
+      tdl.ToDoList.DeserializedProtobuf(pb.SerializeToString()),
+      views.SerializationWriter(user, {}))
+    users.append((username, generate.SampleUIDs(pb)))
+  return users
+
+
+def _request(clients, username, uids, kind, counter):
+  """Sends one request; returns its status code."""
+  from django.test import Client
+
+  if username not in clients:
+    client = Client()
+    assert client.login(username=username, password=_PASSWORD)
+    clients[username] = client
+  client = clients[username]
+  auth = 'Basic ' + base64.b64encode(
+    ('%s:%s' % (username, _PASSWORD)).encode('utf-8')).decode('ascii')
+  new_action = '/inbox/loadtest%d' % counter
+  if kind == 'api_read':
+    response = client.post('/todo/api', {'cmdro': ['lsprj --json']},
+                           HTTP_AUTHORIZATION=auth, secure=True)
+  elif kind == 'home':
+    response = client.get('/todo/home', secure=True)
+  elif kind == 'project':
+    response = client.get('/todo/project/%d' % uids['project'], secure=True)
+  elif kind == 'context':
+    response = client.get('/todo/context/%d' % uids['context'], secure=True)
+  elif kind == 'api_write':
+    response = client.post('/todo/api', {'cmd': ['mkact %s' % new_action]},
+                           HTTP_AUTHORIZATION=auth, secure=True)
+  else:
+    assert kind == 'update_todolist', kind
+    response = client.post('/todo/cli', {'command': 'mkact %s' % new_action},
+                           secure=True)
+  return response.status_code
+
+
+def _work(worker_index, users, write_fraction, deadline, seed):
+  """Sends requests until the deadline.
+
+  Returns:
+    [(str, float, str|None)]  # (kind, seconds, error)
+  """
+  rng = random.Random('%s-%d' % (seed, worker_index))
+  reads = [k for k, is_a_write in _KINDS if not is_a_write]
+  writes = [k for k, is_a_write in _KINDS if is_a_write]
+  clients = {}
+  samples = []
+  counter = 0
+  while time.time() < deadline:
+    username, uids = rng.choice(users)
+    kind = rng.choice(writes if rng.random() < write_fraction else reads)
+    counter += 1
+    error = None
+    start = time.time()
+    try:
+      status = _request(clients, username, uids, kind,
+                        worker_index * 10**6 + counter)
+      if status >= 400:
+        error = 'HTTP %d' % status
+    except Exception as e:  # pylint: disable=broad-except
+      error = '%s: %s' % (type(e).__name__, e)
+    samples.append((kind, time.time() - start, error))
+  return samples
+
+
+def _work_in_process(args):
+  from django.db import connections
+  connections.close_all()  # never share the parent's connection
+  return _work(*args)
+
+
+def _percentile(sorted_values, fraction):
+  """Nearest-rank percentile of a non-empty sorted list."""
+  index = int(math.ceil(fraction * len(sorted_values))) - 1
+  return sorted_values[min(max(index, 0), len(sorted_values) - 1)]
+
+
+def _summary(samples, seconds, num_workers):
+  """Returns throughput and latency statistics in milliseconds."""
+  def stats(subset):
+    latencies = sorted(s for _, s, _ in subset)
+    result = {'count': len(subset),
+              'errors': sum(1 for _, _, e in subset if e is not None),
+              'requests_per_second': len(subset) / seconds}
+    if latencies:
+      result.update(
+        dict(('p%d_ms' % p, 1000 * _percentile(latencies, p / 100.0))
+             for p in (50, 90, 99)))
+      result['max_ms'] = 1000 * latencies[-1]
+      result['mean_ms'] = 1000 * sum(latencies) / len(latencies)
+    return result
+
+  by_kind = dict((kind, stats([s for s in samples if s[0] == kind]))
+                 for kind, _ in _KINDS)
+  errors = {}
+  for _, _, error in samples:
+    if error is not None:
+      errors[error] = errors.get(error, 0) + 1
+  total = stats(samples)
+  total['requests_per_second_per_worker'] = total['requests_per_second'] / num_workers
+  return {'total': total,
+          'by_kind': dict((k, v) for k, v in by_kind.items() if v['count']),
+          'errors': errors}
+
+
+def _print_summary(summary, out):
+  out.write('%-16s %8s %7s %9s %9s %9s %9s\n'
+            % ('kind', 'count', 'errors', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms'))
+  rows = sorted(summary['by_kind'].items()) + [('TOTAL', summary['total'])]
+  for kind, s in rows:
+    out.write('%-16s %8d %7d %9.1f %9.1f %9.1f %9.1f\n'
+              % (kind, s['count'], s['errors'], s.get('p50_ms', 0),
+                 s.get('p90_ms', 0), s.get('p99_ms', 0), s.get('max_ms', 0)))
+  out.write('%.1f requests/second, %.1f per worker\n'
+            % (summary['total']['requests_per_second'],
+               summary['total']['requests_per_second_per_worker']))
+  for error, count in sorted(summary['errors'].items()):
+    out.write('%6d x %s\n' % (count, error))
+
+
+def _parse_args(argv):
+  parser = argparse.ArgumentParser(
+    description=__doc__.split('\n')[0],
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument('--users', type=int, default=4,
+                      help='Users, each with a to-do list of --items items')
+  parser.add_argument('--items', type=int, default=1000,
+                      help='Size of each generated to-do list')
+  parser.add_argument('--shape', default='realistic',
+                      help='See pyatdllib.benchmarks.generate.SHAPES')
+  parser.add_argument('--workers', type=int, default=4,
+                      help='Worker processes, each sending one request at a time')
+  parser.add_argument('--seconds', type=float, default=20,
+                      help='How long to send requests')
+  parser.add_argument('--write-fraction', type=float, default=0.2,
+                      help='Fraction of requests that change a to-do list')
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--database',
+                      help='SQLite file to create; a temporary file by default')
+  parser.add_argument('--output', help='Write the JSON report here, not stdout')
+  args = parser.parse_args(argv)
+  if args.users < 1 or args.workers < 1 or not 0 <= args.write_fraction <= 1:
+    parser.error('Need --users and --workers positive and --write-fraction in [0, 1]')
+  return args
+
+
+def main(argv=None):
+  args = _parse_args(sys.argv[1:] if argv is None else argv)
+  database_path = args.database
+  if database_path is None:
+    fd, database_path = tempfile.mkstemp(prefix='immaculater-loadtest-', suffix='.sqlite3')
+    os.close(fd)
+  elif os.path.exists(database_path):
+    sys.exit('Refusing to overwrite %s' % database_path)
+  _configure_environment(database_path)
+  import django
+  django.setup()
+  from django.conf import settings
+  from django.core.management import call_command
+  from django.db import connections
+
+  # Spare us 'collectstatic'; the manifest's absence would break every page.
+  settings.STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+
+  real_stdout = sys.stdout
+  # The app logs each request to stdout; see views._debug_log.
+  sys.stdout = open(os.devnull, 'w')
+  try:
+    call_command('migrate', verbosity=0)
+    sys.stderr.write('Creating %d users with %d items each in %s\n'
+                     % (args.users, args.items, database_path))
+    users = _create_users(args.users, args.items, args.shape)
+    connections.close_all()
+    deadline = time.time() + args.seconds
+    start = time.time()
+    work = [(i, users, args.write_fraction, deadline, args.seed)
+            for i in range(args.workers)]
+    samples = []
+    pool = multiprocessing.Pool(args.workers)
+    try:
+      for result in pool.map(_work_in_process, work):
+        samples.extend(result)
+    finally:
+      pool.close()
+      pool.join()
+    seconds = time.time() - start
+  finally:
+    sys.stdout.close()
+    sys.stdout = real_stdout
+    if args.database is None:
+      os.remove(database_path)
+  report = {'config': vars(args),
+            'seconds': seconds,
+            'summary': _summary(samples, seconds, args.workers)}
+  _print_summary(report['summary'], sys.stderr)
+  serialized = json.dumps(report, indent=2, sort_keys=True)
+  if args.output is None:
+    print(serialized)
+  else:
+    with open(args.output, 'w') as f:
+      f.write(serialized + '\n')
+
+
+if __name__ == '__main__':
+  main()
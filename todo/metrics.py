@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""An in-process metrics registry exported in the Prometheus text format.
+
+See https://prometheus.io/docs/instrumenting/exposition_formats/
+
+Each process (e.g., each gunicorn worker) keeps its own registry. If
+IMMACULATER_METRICS_DIR is set, every process saves a snapshot of its registry
+there now and then (see save_if_due), and text() sums up the snapshots of all
+the processes, removing those of processes that are gone. Otherwise text()
+reports only the process that calls it.
+"""
+from __future__ import unicode_literals
+
+import bisect
+import errno
+import glob
+import json
+import os
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+_BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+_ITEMS_BUCKETS = (10, 30, 100, 300, 1000, 3000, 10000, 30000)
+
+ITEM_KINDS = ('actions', 'projects', 'contexts')
+
+# The size of a to-do list counts toward immaculater_todolist_items for this
+# long after its latest use:
+_ITEM_COUNTS_SECONDS = 7 * 24 * 3600
+# Each process remembers the sizes of at most this many to-do lists, the most
+# recently used:
+_MAX_ITEM_COUNTS = 10000
+# A snapshot this many save intervals old is presumed to be that of a process
+# that is gone even if its PID is in use (see _is_alive):
+_MAX_SNAPSHOT_AGE_SAVES = 360
+
+# name => (type, help, label names, buckets if a histogram)
+_METRICS = {
+  'immaculater_cache_requests_total': (
+    'counter', 'Lookups in each cache; result is hit or miss.',
+    ('cache', 'result'), None),
+  'immaculater_phase_bytes': (
+    'histogram', 'Bytes handled per request by each phase that counts them.',
+    ('phase',), _BYTES_BUCKETS),
+  'immaculater_phase_seconds': (
+    'histogram', 'Seconds spent per request in each phase other than UICmds.',
+    ('phase',), _SECONDS_BUCKETS),
+  'immaculater_todolist_items': (
+    'histogram', "Items in each user's to-do list as of its latest use.",
+    ('kind',), _ITEMS_BUCKETS),
+  'immaculater_uicmd_seconds': (
+    'histogram', 'Seconds spent per request in each UICmd.',
+    ('cmd',), _SECONDS_BUCKETS),
+  'immaculater_view_seconds': (
+    'histogram', 'Latency of each view.', ('view',), _SECONDS_BUCKETS),
+  'immaculater_write_conflicts_total': (
+    'counter', 'Writes that found a concurrent write and merged with it.',
+    (), None),
+}
+
+
+def _metrics_dir():
+  """Returns the directory shared by all processes, or None."""
+  return os.environ.get('IMMACULATER_METRICS_DIR') or None
+
+
+def _save_seconds():
+  """Returns how often each process saves its snapshot."""
+  return float(os.environ.get('IMMACULATER_METRICS_SAVE_SECONDS', 10))
+
+
+class Registry(object):
+  """Counters and histograms for one process."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._counters = {}  # (name, label values) => float
+    # (name, label values) => [count for each bucket and +Inf, sum]:
+    self._histograms = {}
+    # {user key: (timestamp, {kind: int})} for each user whose to-do list this
+    # process used lately; see note_item_counts:
+    self._item_counts = {}
+    self._saved_at = 0
+
+  def inc(self, name, labels=(), amount=1):
+    assert _METRICS[name][0] == 'counter', name
+    key = (name, tuple(labels))
+    with self._lock:
+      self._counters[key] = self._counters.get(key, 0) + amount
+
+  def observe(self, name, value, labels=()):
+    buckets = _METRICS[name][3]
+    key = (name, tuple(labels))
+    with self._lock:
+      h = self._histograms.get(key)
+      if h is None:
+        h = self._histograms[key] = [0] * (len(buckets) + 2)
+      h[bisect.bisect_left(buckets, value)] += 1
+      h[-1] += value
+
+  def note_item_counts(self, user_key, counts):
+    """Records the size of a user's to-do list; see serialization.ItemCounts.
+
+    Args:
+      user_key: unicode  # the same for every use by the same user; saved to
+                         # disk, so it should not identify the user
+      counts: {str: int}
+    """
+    with self._lock:
+      self._item_counts[user_key] = (time.time(), dict(counts))
+      if len(self._item_counts) > _MAX_ITEM_COUNTS:
+        oldest = min(self._item_counts,
+                     key=lambda k: self._item_counts[k][0])
+        del self._item_counts[oldest]
+
+  def _expire_item_counts(self):
+    """Forgets item counts too old for _merged. Call with self._lock held."""
+    cutoff = time.time() - _ITEM_COUNTS_SECONDS
+    for k, (ts, unused_counts) in list(self._item_counts.items()):
+      if ts < cutoff:
+        del self._item_counts[k]
+
+  def snapshot(self):
+    """Returns a JSON-friendly copy of the registry."""
+    with self._lock:
+      self._expire_item_counts()
+      return {
+        'counters': [[n, list(l), v] for (n, l), v in self._counters.items()],
+        'histograms': [[n, list(l), list(h)]
+                       for (n, l), h in self._histograms.items()],
+        'item_counts': dict((unicode(k), [ts, c])
+                            for k, (ts, c) in self._item_counts.items()),
+      }
+
+  def save_if_due(self):
+    """Saves a snapshot in IMMACULATER_METRICS_DIR if it has been a while."""
+    if _metrics_dir() is not None and (
+        time.time() - self._saved_at >= _save_seconds()):
+      self.save()
+
+  def save(self):
+    """Saves a snapshot in IMMACULATER_METRICS_DIR, atomically."""
+    directory = _metrics_dir()
+    self._saved_at = time.time()
+    path = os.path.join(directory, 'worker-%d.json' % os.getpid())
+    try:
+      if not os.path.isdir(directory):
+        os.makedirs(directory)
+      with open(path + '.tmp', 'w') as f:
+        json.dump(self.snapshot(), f)
+      os.rename(path + '.tmp', path)
+    except (IOError, OSError) as e:
+      # Metrics are not worth a 500.
+      _debug_log('Cannot save metrics to %s: %s' % (path, e))
+
+  def text(self):
+    """Returns all processes' metrics in the Prometheus text format."""
+    snapshots = [self.snapshot()]
+    if _metrics_dir() is not None:
+      self.save()
+      snapshots = []
+      for path in glob.glob(os.path.join(_metrics_dir(), 'worker-*.json')):
+        try:
+          if _is_stale(path):
+            os.remove(path)
+            continue
+          with open(path) as f:
+            snapshots.append(json.load(f))
+        except (IOError, OSError, ValueError) as e:
+          _debug_log('Cannot read metrics from %s: %s' % (path, e))
+    return _text(*_merged(snapshots))
+
+
+def _debug_log(the_string):
+  """See views._debug_log, which we cannot import at first; views imports us."""
+  from . import views
+  views._debug_log(the_string)
+
+
+def _is_alive(pid):
+  """Returns False if no process has the given PID."""
+  try:
+    os.kill(pid, 0)
+  except OSError as e:
+    return e.errno != errno.ESRCH
+  return True
+
+
+def _is_stale(path):
+  """Returns True iff the named snapshot is that of a process that is gone.
+
+  Raises:
+    OSError
+  """
+  pid = int(os.path.basename(path)[len('worker-'):-len('.json')])
+  if pid == os.getpid():
+    return False
+  return (not _is_alive(pid) or
+          os.path.getmtime(path) < (
+            time.time() - _MAX_SNAPSHOT_AGE_SAVES * _save_seconds()))
+
+
+def _merged(snapshots):
+  """Sums the snapshots, keeping the latest recent item counts for each user.
+
+  Returns:
+    ({(name, labels): float}, {(name, labels): [number]})
+  """
+  counters = {}
+  histograms = {}
+  item_counts = {}
+  cutoff = time.time() - _ITEM_COUNTS_SECONDS
+  for s in snapshots:
+    for name, labels, value in s['counters']:
+      key = (name, tuple(labels))
+      counters[key] = counters.get(key, 0) + value
+    for name, labels, h in s['histograms']:
+      key = (name, tuple(labels))
+      if key in histograms:
+        histograms[key] = [a + b for a, b in zip(histograms[key], h)]
+      else:
+        histograms[key] = list(h)
+    for user_key, (ts, counts) in s['item_counts'].items():
+      if ts < cutoff:
+        continue
+      if user_key not in item_counts or item_counts[user_key][0] < ts:
+        item_counts[user_key] = (ts, counts)
+  buckets = _METRICS['immaculater_todolist_items'][3]
+  for kind in ITEM_KINDS:
+    h = [0] * (len(buckets) + 2)
+    for unused_ts, counts in item_counts.values():
+      h[bisect.bisect_left(buckets, counts[kind])] += 1
+      h[-1] += counts[kind]
+    if item_counts:
+      histograms[('immaculater_todolist_items', (kind,))] = h
+  return counters, histograms
+
+
+def _escaped(label_value):
+  return (unicode(label_value).replace('\\', r'\\').replace('\n', r'\n')
+          .replace('"', r'\"'))
+
+
+def _labels(names, values, extra=()):
+  pairs = list(zip(names, values)) + list(extra)
+  if not pairs:
+    return ''
+  return '{%s}' % ','.join('%s="%s"' % (n, _escaped(v)) for n, v in pairs)
+
+
+def _number(x):
+  return repr(float(x)) if isinstance(x, float) else unicode(x)
+
+
+def _text(counters, histograms):
+  lines = []
+  for name in sorted(_METRICS):
+    kind, the_help, label_names, buckets = _METRICS[name]
+    lines.append('# HELP %s %s' % (name, the_help))
+    lines.append('# TYPE %s %s' % (name, kind))
+    if kind == 'counter':
+      for (n, labels), value in sorted(counters.items()):
+        if n == name:
+          lines.append('%s%s %s' % (name, _labels(label_names, labels),
+                                    _number(value)))
+      continue
+    for (n, labels), h in sorted(histograms.items()):
+      if n != name:
+        continue
+      cumulative = 0
+      for le, count in zip(list(buckets) + ['+Inf'], h[:-1]):
+        cumulative += count
+        lines.append('%s_bucket%s %d' % (
+          name, _labels(label_names, labels, [('le', le)]), cumulative))
+      lines.append('%s_sum%s %s' % (name, _labels(label_names, labels),
+                                    _number(h[-1])))
+      lines.append('%s_count%s %d' % (name, _labels(label_names, labels),
+                                      cumulative))
+  return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
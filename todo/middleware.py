@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import time
+
+from pyatdllib.core import timing
+
+from . import metrics
+from . import profiles
+from . import views
+
+
+def _server_timing_enabled():
+  """Returns False iff IMMACULATER_SERVER_TIMING is 'false'; on by default."""
+  return os.environ.get('IMMACULATER_SERVER_TIMING', '').lower() != 'false'
+
+
+def _server_timing_header_wanted(request):
+  """Returns True iff the response should carry a Server-Timing header.
+
+  The header tells anyone how long we spent on what, so by default only staff
+  users see it. IMMACULATER_SERVER_TIMING=all shows it to everyone.
+  """
+  if os.environ.get('IMMACULATER_SERVER_TIMING', '').lower() == 'all':
+    return True
+  user = getattr(request, 'user', None)
+  return user is not None and user.is_staff
+
+
+class ServerTimingMiddleware(object):
+  """Reports where each request touching a to-do list spent its time.
+
+  The phases (DB read, decrypt, decompress, protobuf parse, object build,
+  validation, each UICmd, AsProto, serialize, compress, encrypt, DB write) are
+  timed by pyatdllib.core.timing. We write their durations and byte counts as
+  one line of JSON to the log, which Heroku keeps (see views._debug_log), and
+  send them to staff users' browsers in a Server-Timing header (see
+  https://www.w3.org/TR/server-timing/).
+
+  Requests that time no phases, e.g. for static files, are left alone.
+  """
+  def __init__(self, get_response):
+    self.get_response = get_response
+
+  def __call__(self, request):
+    if not _server_timing_enabled():
+      return self.get_response(request)
+    with timing.Recording() as recorder:
+      response = self.get_response(request)
+    if recorder.Phases():
+      if _server_timing_header_wanted(request):
+        response['Server-Timing'] = recorder.ServerTimingHeader()
+      views._debug_log('server_timing %s' % recorder.AsJson(
+        method=request.method, path=request.path,
+        status=response.status_code))
+    return response
+
+
+class MetricsMiddleware(object):
+  """Feeds the timings of each request into metrics.registry.
+
+  Uses the ServerTimingMiddleware's recording if there is one.
+  """
+  def __init__(self, get_response):
+    self.get_response = get_response
+
+  def __call__(self, request):
+    start = time.time()
+    recorder = timing.ActiveRecorder()
+    if recorder is None:
+      with timing.Recording() as recorder:
+        response = self.get_response(request)
+    else:
+      response = self.get_response(request)
+    registry = metrics.registry
+    match = getattr(request, 'resolver_match', None)
+    if match is not None:
+      registry.observe('immaculater_view_seconds', time.time() - start,
+                       [match.url_name or match.view_name])
+    for p in recorder.Phases():
+      if p.name.startswith('cmd.'):
+        registry.observe('immaculater_uicmd_seconds', p.seconds,
+                         [p.name[len('cmd.'):]])
+      else:
+        registry.observe('immaculater_phase_seconds', p.seconds, [p.name])
+      if p.num_bytes is not None:
+        registry.observe('immaculater_phase_bytes', p.num_bytes, [p.name])
+    if ('HTTP_IF_NONE_MATCH' in request.META and
+        getattr(request, '_todolist_etag_computed', False)):
+      registry.inc('immaculater_cache_requests_total',
+                   ['etag', 'hit' if response.status_code == 304 else 'miss'])
+    registry.save_if_due()
+    return response
+
+
+class ProfilingMiddleware(object):
+  """Notes whether the request asks for a profile; see module profiles.
+
+  Comes after AuthenticationMiddleware, which sets request.user.
+  """
+  def __init__(self, get_response):
+    self.get_response = get_response
+
+  def __call__(self, request):
+    with profiles.Requested(profiles.is_requested(request)):
+      return self.get_response(request)
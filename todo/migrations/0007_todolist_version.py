@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 09:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0006_share'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='todolist',
+            name='version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
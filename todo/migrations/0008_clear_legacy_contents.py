@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 10:41
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def clear_legacy_contents(apps, schema_editor):
+    """Drops payloads that nothing reads.
+
+    'contents' is read only if 'encrypted_contents2' is empty, and
+    'encrypted_contents' is never read.
+    """
+    ToDoList = apps.get_model('todo', 'ToDoList')
+    (ToDoList.objects
+     .exclude(encrypted_contents2__isnull=True)
+     .exclude(encrypted_contents2='')
+     .update(contents=b''))
+    ToDoList.objects.filter(
+        encrypted_contents__isnull=False).update(encrypted_contents=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0007_todolist_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_legacy_contents,
+                             migrations.RunPython.noop),
+    ]
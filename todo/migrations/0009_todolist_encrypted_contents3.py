@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 11:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0008_clear_legacy_contents'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='todolist',
+            name='encrypted_contents3',
+            field=models.BinaryField(null=True),
+        ),
+    ]
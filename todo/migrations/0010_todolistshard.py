@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 11:38
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('todo', '0009_todolist_encrypted_contents3'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ToDoListShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('project_uid', models.BigIntegerField()),
+                ('encrypted_contents', models.BinaryField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='todolist',
+            name='is_sharded',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterUniqueTogether(
+            name='todolistshard',
+            unique_together=set([('user', 'project_uid')]),
+        ),
+    ]
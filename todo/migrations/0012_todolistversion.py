@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 11:57
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('todo', '0011_todolistarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ToDoListVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.IntegerField()),
+                ('created_at', models.FloatField()),
+                ('is_keyframe', models.BooleanField(default=False)),
+                ('sha1', models.CharField(max_length=40)),
+                ('size', models.IntegerField()),
+                ('encrypted_contents', models.BinaryField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='todolistversion',
+            unique_together=set([('user', 'number')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 12:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0013_quickcapture'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='quickcapture',
+            name='command',
+            field=models.CharField(max_length=16),
+        ),
+    ]
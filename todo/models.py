@@ -9,8 +9,73 @@ class ToDoList(models.Model):
     contents = models.BinaryField()
     encrypted_contents = models.BinaryField(null=True)
     encrypted_contents2 = models.TextField(editable=False, null=True, blank=True)
+    # Supersedes encrypted_contents2, which SerializationWriter clears. See
+    # todo.views._encrypted_todolist_protobuf for the format:
+    encrypted_contents3 = models.BinaryField(null=True)
     created_at = models.DateTimeField('date created', auto_now_add=True)
     updated_at = models.DateTimeField('date updated', auto_now=True)
+    # Incremented upon every write so that readers can tell whether anything
+    # changed without decrypting or deserializing the contents:
+    version = models.BigIntegerField(default=0)
+    # If True, encrypted_contents3 holds only the root of the to-do list and
+    # each project lives in a ToDoListShard; see
+    # pyatdllib.ui.serialization.SplitIntoShards:
+    is_sharded = models.BooleanField(default=False)
+
+
+class ToDoListShard(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    project_uid = models.BigIntegerField()
+    encrypted_contents = models.BinaryField()
+
+    class Meta:
+        unique_together = (('user', 'project_uid'),)
+
+
+class ToDoListArchive(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    encrypted_contents = models.BinaryField()
+
+
+# A past version of a to-do list, either in full or as a delta against the
+# previous version; see pyatdllib.ui.history:
+class ToDoListVersion(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    number = models.IntegerField()
+    created_at = models.FloatField()  # seconds since the epoch
+    is_keyframe = models.BooleanField(default=False)
+    sha1 = models.CharField(max_length=40)
+    size = models.IntegerField()
+    encrypted_contents = models.BinaryField()
+
+    class Meta:
+        unique_together = (('user', 'number'),)
+
+
+# A past version of a to-do list's archive, numbered like the ToDoListVersion
+# with which it was saved; see pyatdllib.ui.history.History.ArchiveAt:
+class ToDoListArchiveVersion(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    number = models.IntegerField()
+    created_at = models.FloatField()  # seconds since the epoch
+    is_keyframe = models.BooleanField(default=False)
+    sha1 = models.CharField(max_length=40)
+    size = models.IntegerField()
+    encrypted_contents = models.BinaryField()
+
+    class Meta:
+        unique_together = (('user', 'number'),)
+
+
+# An action queued by a quick capture (the 'do' or 'maybe' command), or a
+# queued 'complete' or 'uncomplete' of an action, without reading the to-do
+# list; see pyatdllib.ui.uicmd.MergeCaptures. Merged, in the order of id, and
+# deleted the next time the to-do list is written:
+class QuickCapture(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    created_at = models.FloatField()  # seconds since the epoch
+    command = models.CharField(max_length=16)  # e.g., 'do' or 'uncomplete'
+    encrypted_name = models.BinaryField()
 
 
 class Share(models.Model):
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Decides which batches of commands to profile; see pyatdllib.ui.profiling.
+
+A batch (see views._apply_batch_of_commands) is profiled if
+
+- the request carries a valid X-Immaculater-Profile header (see
+  signed_header_value),
+- a staff user asked with the query parameter profile=1,
+- the user is listed in IMMACULATER_PROFILE_USERNAMES (comma-separated), or
+- a coin flip comes up heads given IMMACULATER_PROFILE_SAMPLE_RATE, a
+  probability that defaults to zero.
+
+Profiles go in IMMACULATER_PROFILE_DIR, which keeps the latest
+IMMACULATER_PROFILE_MAX_FILES of them.
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import hmac
+import os
+import random
+import tempfile
+import threading
+import time
+
+from pyatdllib.ui import profiling
+
+HEADER = 'HTTP_X_IMMACULATER_PROFILE'
+
+_local = threading.local()
+
+
+def _profile_key():
+  """Returns the key that signs X-Immaculater-Profile headers, or None."""
+  return os.environ.get('IMMACULATER_PROFILE_KEY') or None
+
+
+def _profile_usernames():
+  return set(u.strip() for u in
+             os.environ.get('IMMACULATER_PROFILE_USERNAMES', '').split(',')
+             if u.strip())
+
+
+def _profile_sample_rate():
+  return float(os.environ.get('IMMACULATER_PROFILE_SAMPLE_RATE', 0))
+
+
+def _profile_dir():
+  return os.environ.get(
+    'IMMACULATER_PROFILE_DIR',
+    os.path.join(tempfile.gettempdir(), 'immaculater-profiles'))
+
+
+def _profile_max_files():
+  return int(os.environ.get('IMMACULATER_PROFILE_MAX_FILES', 100))
+
+
+def _signature(key, expires):
+  return hmac.new(key.encode('utf-8'), str(expires).encode('utf-8'),
+                  hashlib.sha256).hexdigest()
+
+
+def signed_header_value(expires):
+  """Returns an X-Immaculater-Profile header value good until then.
+
+  E.g., heroku run python -c 'from todo import profiles; import time;
+  print(profiles.signed_header_value(int(time.time()) + 3600))'
+
+  Args:
+    expires: int  # seconds since the epoch
+  Returns:
+    str
+  """
+  key = _profile_key()
+  assert key, 'Set IMMACULATER_PROFILE_KEY'
+  return '%d:%s' % (expires, _signature(key, expires))
+
+
+def _has_valid_signed_header(request):
+  key = _profile_key()
+  value = request.META.get(HEADER)
+  if key is None or not value or ':' not in value:
+    return False
+  expires, signature = value.split(':', 1)
+  try:
+    if int(expires) < time.time():
+      return False
+  except ValueError:
+    return False
+  return hmac.compare_digest(_signature(key, int(expires)).encode('utf-8'),
+                             signature.encode('utf-8'))
+
+
+def is_requested(request):
+  """Returns True iff the request itself asks to be profiled."""
+  if _has_valid_signed_header(request):
+    return True
+  user = getattr(request, 'user', None)
+  return bool(request.GET.get('profile') == '1' and user is not None and
+              user.is_authenticated and user.is_staff)
+
+
+class Requested(object):
+  """Context manager marking this thread's batches for profiling, or not."""
+
+  def __init__(self, requested):
+    self._requested = requested
+    self._saved = None
+
+  def __enter__(self):
+    self._saved = getattr(_local, 'requested', False)
+    _local.requested = self._requested
+
+  def __exit__(self, *unused_args):
+    _local.requested = self._saved
+    return False
+
+
+class _NotProfiled(object):
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *unused_args):
+    return False
+
+
+def _path_for(user):
+  return profiling.PathInDirectory(_profile_dir(), 'user%d' % user.id,
+                                   _profile_max_files())
+
+
+def batch_profiler(user):
+  """Returns a context manager that profiles a batch of the user's commands
+  if warranted.
+
+  Args:
+    user: models.User
+  Returns:
+    object
+  """
+  rate = _profile_sample_rate()
+  if (getattr(_local, 'requested', False) or
+      user.username in _profile_usernames() or
+      (rate > 0 and random.random() < rate)):
+    return profiling.Profiled(lambda: _path_for(user))
+  return _NotProfiled()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Records anonymized batches of commands; see pyatdllib.benchmarks.replay.
+
+Off unless IMMACULATER_RECORD_DIR is set. Then each batch of commands run by
+views._apply_batch_of_commands for a recorded user becomes a line of JSON in
+IMMACULATER_RECORD_DIR/commands-PID.jsonl like so:
+
+  {"user": str,  # a keyed hash of the username
+   "time": float,  # seconds since the epoch
+   "seconds": float,  # how long the batch took
+   "read_only": bool,
+   "failed": bool,
+   "version": int|null,  # models.ToDoList.version before the batch
+   "batch": [[str]]}  # each command's argv; see pyatdllib.ui.anonymize
+
+After we first record a user, we also save their to-do list, anonymized the
+same way, in IMMACULATER_RECORD_DIR/lists/USER-VERSION.pb as a serialized
+pyatdl_pb2.ToDoList (sans the archive). Replays start there, skipping batches
+recorded before that version.
+
+Recording never fails a request; errors saving the recording are logged.
+
+IMMACULATER_RECORD_SAMPLE_RATE (default 1) is the fraction of users recorded,
+chosen by a hash of the username so that every process agrees. Names are
+hashed with HMAC-SHA256 keyed by IMMACULATER_RECORD_KEY, or by the Django
+SECRET_KEY if that is unset. Quick captures queued by views._queued_capture
+are not recorded.
+"""
+from __future__ import unicode_literals
+
+import glob
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from pyatdllib.ui import anonymize
+from pyatdllib.ui import lexer
+
+_LOCK = threading.Lock()
+
+# The hashed usernames whose to-do lists this process knows to be saved; see
+# _save_snapshot:
+_snapshotted = set()
+
+
+def _record_dir():
+  return os.environ.get('IMMACULATER_RECORD_DIR') or None
+
+
+def _record_sample_rate():
+  return float(os.environ.get('IMMACULATER_RECORD_SAMPLE_RATE', 1))
+
+
+def _record_key():
+  return (os.environ.get('IMMACULATER_RECORD_KEY') or settings.SECRET_KEY).encode('utf-8')
+
+
+def _hexdigest(prefix, s):
+  return hmac.new(_record_key(), (prefix + s).encode('utf-8'),
+                  hashlib.sha256).hexdigest()[:16]
+
+
+def _rename(name):
+  return anonymize.Renamed(name, lambda n: _hexdigest('name:', n))
+
+
+def _anonymized_argv(line):
+  try:
+    argv = lexer.SplitCommandLineIntoArgv(line)
+  except lexer.Error:
+    return ['<unparseable>']
+  return anonymize.AnonymizedArgv(argv, _rename) if argv else argv
+
+
+def _is_recorded(user_hash):
+  rate = _record_sample_rate()
+  return rate >= 1 or int(user_hash[:8], 16) < rate * 2**32
+
+
+def _save_snapshot(directory, user_hash, snapshot_func):
+  """Saves the anonymized to-do list unless we have one for this user.
+
+  Only the first call for each user in this process looks for one.
+  """
+  with _LOCK:
+    if user_hash in _snapshotted:
+      return
+    _snapshotted.add(user_hash)
+  lists_dir = os.path.join(directory, 'lists')
+  if glob.glob(os.path.join(lists_dir, '%s-*.pb' % user_hash)):
+    return
+  if not os.path.isdir(lists_dir):
+    try:
+      os.makedirs(lists_dir)
+    except OSError:
+      pass  # a concurrent recorder made it
+  version, pb = snapshot_func()
+  anonymize.AnonymizedProtobuf(pb, _rename)
+  path = os.path.join(lists_dir, '%s-%d.pb' % (user_hash, version or 0))
+  with open(path + '.tmp', 'wb') as f:
+    f.write(pb.SerializeToString())
+  os.rename(path + '.tmp', path)
+
+
+class _NotRecorded(object):
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *unused_args):
+    return False
+
+
+class _Recorder(object):
+  def __init__(self, directory, user_hash, lines, read_only, version_func,
+               snapshot_func):
+    self._directory = directory
+    self._user_hash = user_hash
+    self._lines = lines
+    self._read_only = read_only
+    self._version_func = version_func
+    self._snapshot_func = snapshot_func
+    self._start = None
+
+  def __enter__(self):
+    self._start = time.time()
+    return self
+
+  def __exit__(self, exc_type, *unused_args):
+    seconds = time.time() - self._start
+    try:
+      record = {'user': self._user_hash,
+                'time': self._start,
+                'seconds': seconds,
+                'read_only': self._read_only,
+                'failed': exc_type is not None,
+                'version': self._version_func(),
+                'batch': [_anonymized_argv(line) for line in self._lines]}
+      path = os.path.join(self._directory, 'commands-%d.jsonl' % os.getpid())
+      with _LOCK:
+        with open(path, 'a') as f:
+          f.write(json.dumps(record, sort_keys=True) + '\n')
+      _save_snapshot(self._directory, self._user_hash, self._snapshot_func)
+    except Exception as e:  # pylint: disable=broad-except
+      # A recording is not worth a 500, nor worth hiding the batch's exception.
+      _debug_log('Cannot record to %s: %s' % (self._directory, e))
+    return False
+
+
+def _debug_log(the_string):
+  """See views._debug_log, which we cannot import at first; views imports us."""
+  from . import views
+  views._debug_log(the_string)
+
+
+def batch_recorder(user, lines, read_only, version_func, snapshot_func):
+  """Returns a context manager that records the batch if warranted.
+
+  Args:
+    user: models.User
+    lines: [unicode]  # the commands
+    read_only: bool
+    version_func: function()->int|None  # the version the batch read
+    snapshot_func: function()->(int|None, pyatdl_pb2.ToDoList)  # reads the
+      # version and the whole to-do list
+  Returns:
+    object
+  """
+  directory = _record_dir()
+  if directory is None:
+    return _NotRecorded()
+  user_hash = _hexdigest('user:', user.username)
+  if not _is_recorded(user_hash):
+    return _NotRecorded()
+  return _Recorder(directory, user_hash, lines, read_only, version_func,
+                   snapshot_func)
@@ -1,6 +1,402 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import base64
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from pyatdllib.ui import serialization
+from todo import metrics
+from todo import models
+from todo import recording
+from todo import views
+
+
+# The manifest exists only after collectstatic:
+@override_settings(
+  STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class _LoggedInTestCase(TestCase):
+
+  def setUp(self):
+    self.user = User.objects.create_user('alice', 'alice@example.com', 'pw')
+    self.client.login(username='alice', password='pw')
+    self._real_time = time.time
+    self._real_environ = dict(os.environ)
+    # Keeps the log lines of todo.middleware.ServerTimingMiddleware quiet:
+    os.environ['IMMACULATER_SERVER_TIMING'] = 'false'
+
+  def tearDown(self):
+    time.time = self._real_time
+    os.environ.clear()
+    os.environ.update(self._real_environ)
+
+  def _advance_clock(self, seconds):
+    now = time.time() + seconds
+    time.time = lambda: now
+
+  def _run(self, command):
+    """Runs the command via the command-line page, saving the to-do list."""
+    response = self.client.post('/todo/cli', {'command': command})
+    self.assertEqual(response.status_code, 200)
+    self.assertNotIn(b'An error occurred', response.content)
+
+
+class ConditionalGetTestCase(_LoggedInTestCase):
+
+  def test_not_modified(self):
+    self._run('mkctx @test')
+    for i, path in enumerate(('/todo/txt', '/todo/contexts', '/todo/projects')):
+      etag = self.client.get(path)['ETag']
+      response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+      self.assertEqual(response.status_code, 304, path)
+      self._run('mkctx @test%d' % i)
+      response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+      self.assertEqual(response.status_code, 200, path)
+
+  def test_last_modified(self):
+    self._run('mkctx @test')
+    last_modified = self.client.get('/todo/txt')['Last-Modified']
+    response = self.client.get('/todo/txt',
+                               HTTP_IF_MODIFIED_SINCE=last_modified)
+    self.assertEqual(response.status_code, 304)
+
+  def test_review_clock(self):
+    self._run('mkctx @test')
+    paths = ('/todo/txt', '/todo/txt.needing_review', '/todo/projects')
+    etags = dict((path, self.client.get(path)['ETag']) for path in paths)
+    last_modified = self.client.get(
+      '/todo/txt.needing_review')['Last-Modified']
+    self._advance_clock(61)
+    # Reviews come due as time passes:
+    for path, expected in (('/todo/txt', 304),
+                           ('/todo/txt.needing_review', 200),
+                           ('/todo/projects', 200)):
+      response = self.client.get(path, HTTP_IF_NONE_MATCH=etags[path])
+      self.assertEqual(response.status_code, expected, path)
+    response = self.client.get('/todo/txt.needing_review',
+                               HTTP_IF_MODIFIED_SINCE=last_modified)
+    self.assertEqual(response.status_code, 200)
+
+
+  def test_api_review_clock(self):
+    self._run('mkctx @test')
+    auth = 'Basic ' + base64.b64encode(b'alice:pw').decode('ascii')
+    for data in ({'cmdro': 'needsreview'}, {'changes_since': '0'}):
+      etag = self.client.post('/todo/api', data,
+                              HTTP_AUTHORIZATION=auth)['ETag']
+      response = self.client.post('/todo/api', data, HTTP_AUTHORIZATION=auth,
+                                  HTTP_IF_NONE_MATCH=etag)
+      self.assertEqual(response.status_code, 304, data)
+      self._advance_clock(61)
+      response = self.client.post('/todo/api', data, HTTP_AUTHORIZATION=auth,
+                                  HTTP_IF_NONE_MATCH=etag)
+      self.assertEqual(response.status_code, 200, data)
+
+
+class ShardedStorageTestCase(_LoggedInTestCase):
+
+  def setUp(self):
+    super(ShardedStorageTestCase, self).setUp()
+    os.environ['IMMACULATER_SHARDED_STORAGE'] = 'true'
+
+  def test_read_only_batch_reads_only_used_shards(self):
+    self._run('mkprj /P0')
+    self._run('mkact /P0/a0')
+    self._run('mkprj /P1')
+    self._run('mkact /P1/a1')
+    self.assertEqual(models.ToDoList.objects.get(user=self.user).is_sharded,
+                     True)
+    p0, p1 = views._todolist_protobuf(self.user).root.projects[-2:]
+    result = views._apply_batch_of_commands(
+      self.user, ['ls uid=%d' % p1.common.uid], read_only=True)
+    self.assertIn('a1', '\n'.join(result['printed']))
+    saved_read = result['saved_read']
+    # Projects without actions are read up front:
+    self.assertIn(p1.common.uid, saved_read.shards)
+    self.assertNotIn(p0.common.uid, saved_read.shards)
+    num_shards = models.ToDoListShard.objects.filter(user=self.user).count()
+    self.assertGreater(num_shards, 2)
+    # Reusing the read fetches the rest from the DB:
+    result = views._apply_batch_of_commands(
+      self.user, ['ls -R /'], read_only=True, saved_read=saved_read)
+    self.assertIn('a1', '\n'.join(result['printed']))
+    self.assertEqual(len(result['saved_read'].shards), num_shards)
+
+  def test_one_action_edit_touches_one_shard(self):
+    for i in range(3):
+      self._run('mkprj /P%d' % i)
+      self._run('mkact /P%d/a%d' % (i, i))
+    p1 = views._todolist_protobuf(self.user).root.projects[-2]
+    with CaptureQueriesContext(connection) as queries:
+      views._apply_batch_of_commands(
+        self.user, ['complete uid=%d' % p1.actions[0].common.uid],
+        read_only=False)
+    shard_queries = [q['sql'].split()[0] for q in queries.captured_queries
+                     if 'todo_todolistshard' in q['sql']]
+    # The empty projects are read up front, then P1:
+    self.assertEqual(shard_queries, ['SELECT', 'SELECT', 'UPDATE'])
+    p1 = views._todolist_protobuf(self.user).root.projects[-2]
+    self.assertTrue(p1.actions[0].is_complete)
+
+  def test_jsonl_download_reads_before_streaming(self):
+    self._run('mkprj /P0')
+    self._run('mkact /P0/a0')
+    with CaptureQueriesContext(connection) as queries:
+      response = self.client.post('/todo/dl', {'command': 'dljsonl'})
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(any('todo_todolistshard' in q['sql']
+                        for q in queries.captured_queries))
+    with CaptureQueriesContext(connection) as queries:
+      lines = [json.loads(line) for line in
+               b''.join(response.streaming_content).splitlines()]
+    self.assertEqual(queries.captured_queries, [])
+    self.assertIn('a0', [x.get('name') for x in lines])
+
+  def test_stale_read(self):
+    self._run('mkprj /P0')
+    reader = views.SerializationReader(self.user)
+    reader.read()
+    uids = list(models.ToDoListShard.objects.filter(
+      user=self.user).values_list('project_uid', flat=True))
+    self.assertEqual(list(reader.read_shards(uids[:1])), uids[:1])
+    self._run('mkprj /P1')
+    self.assertEqual(list(reader.read_shards(uids[:1])), uids[:1])  # memoized
+    with self.assertRaises(serialization.StaleReadError):
+      reader.read_shards(uids)
+
+
+class ArchiveTestCase(_LoggedInTestCase):
+
+  def test_archive_is_written_with_the_rest(self):
+    self._run('mkctx @test')
+    place_to_save_read = {}
+    contents = views.SerializationReader(self.user, place_to_save_read).read()
+    saved_read = place_to_save_read['saved_read']
+    self._run('mkctx @concurrent')
+    writer = views.SerializationWriter(self.user, place_to_save_read)
+    place_to_save_read['saved_read'] = saved_read
+    writer.write_archive(b'archive')
+    with self.assertRaises(serialization.WriteConflictError) as cm:
+      writer.write(contents)
+    self.assertFalse(models.ToDoListArchive.objects.filter(user=self.user))
+    cm.exception.latest.read()  # as the merge would
+    writer.write(contents)
+    self.assertEqual(views._read_archive(self.user), b'archive')
+
+
+class HistoryTestCase(_LoggedInTestCase):
+
+  def test_history_is_opt_in(self):
+    self._run('mkctx @test')
+    self.assertFalse(models.ToDoListVersion.objects.filter(user=self.user))
+    real_max_versions = views.FLAGS.pyatdl_history_max_versions
+    views.FLAGS.pyatdl_history_max_versions = 10
+    try:
+      self._run('mkctx @test2')
+      self._run('mkctx @test3')
+    finally:
+      views.FLAGS.pyatdl_history_max_versions = real_max_versions
+    self.assertEqual(
+      models.ToDoListVersion.objects.filter(user=self.user).count(), 2)
+
+
+class QuickCaptureTestCase(_LoggedInTestCase):
+
+  def test_reads_flush_a_long_queue(self):
+    self._run('mkctx @test')
+    for i in range(views._MAX_QUEUED_CAPTURES - 1):
+      views._queue_capture(self.user, 'do', 'a%d' % i)
+    self.client.get('/todo/txt')
+    self.assertEqual(models.QuickCapture.objects.filter(user=self.user).count(),
+                     views._MAX_QUEUED_CAPTURES - 1)
+    views._queue_capture(self.user, 'do', 'Work: uid=5')  # as queued before
+    self.assertIn(b'Work: uid=5', self.client.get('/todo/txt').content)
+    self.assertFalse(models.QuickCapture.objects.filter(user=self.user))
+
+
+class WatchTestCase(_LoggedInTestCase):
+
+  def test_short_poll(self):
+    self._run('mkctx @test')
+    response = self.client.get('/todo/watch')
+    version = response.json()['version']
+    self.assertEqual(response['ETag'], '"%s"' % version)
+    self.assertEqual(
+      self.client.get('/todo/watch', {'version': version}).json(),
+      {'version': version, 'changed': False})
+    response = self.client.get('/todo/watch',
+                               HTTP_IF_NONE_MATCH=response['ETag'])
+    self.assertEqual(response.status_code, 304)
+    self._run('mkctx @test2')
+    response = self.client.get('/todo/watch',
+                               HTTP_IF_NONE_MATCH='"%s"' % version)
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(response.json()['changed'])
+    self.assertNotEqual(response.json()['version'], version)
+
+
+class ServerTimingTestCase(_LoggedInTestCase):
+
+  def test_header_is_for_staff(self):
+    os.environ['IMMACULATER_SERVER_TIMING'] = 'true'
+    self._run('mkctx @test')
+    self.assertNotIn('Server-Timing', self.client.get('/todo/txt'))
+    self.user.is_staff = True
+    self.user.save()
+    self.assertIn('db_read', self.client.get('/todo/txt')['Server-Timing'])
+    os.environ['IMMACULATER_SERVER_TIMING'] = 'false'
+    self.assertNotIn('Server-Timing', self.client.get('/todo/txt'))
+
+
+class WriteConflictTestCase(_LoggedInTestCase):
+
+  def test_concurrent_writes_merge(self):
+    self._run('mkctx @test')
+    saved_read = views._apply_batch_of_commands(
+      self.user, ['lsctx'], read_only=True)['saved_read']
+    self._run('mkctx @theirs')
+    registry = metrics.registry
+    metrics.registry = metrics.Registry()
+    try:
+      views._apply_batch_of_commands(self.user, ['mkctx @ours'],
+                                     read_only=False, saved_read=saved_read)
+      self.assertEqual(
+        metrics.registry.snapshot()['counters'],
+        [['immaculater_write_conflicts_total', [], 1]])
+    finally:
+      metrics.registry = registry
+    printed = '\n'.join(views._apply_batch_of_commands(
+      self.user, ['lsctx'], read_only=True)['printed'])
+    self.assertIn('@theirs', printed)
+    self.assertIn('@ours', printed)
+
+
+class MetricsTestCase(_LoggedInTestCase):
+
+  def test_merged_text(self):
+    snapshots = []
+    now = time.time()
+    for user_key, num_actions, ts in (('1', 5, now - 100), ('1', 50, now),
+                                      ('2', 5000, now - 50),
+                                      # Too old to count:
+                                      ('3', 7, now - 30 * 24 * 3600)):
+      registry = metrics.Registry()
+      registry.inc('immaculater_cache_requests_total', ['etag', 'hit'])
+      registry.observe('immaculater_view_seconds', 0.2, ['a "view"'])
+      registry.note_item_counts(user_key, {'actions': num_actions,
+                                           'projects': 1, 'contexts': 0})
+      snapshot = registry.snapshot()
+      snapshot['item_counts'][user_key][0] = ts
+      snapshots.append(snapshot)
+    lines = metrics._text(*metrics._merged(snapshots)).splitlines()
+    self.assertIn('# TYPE immaculater_view_seconds histogram', lines)
+    self.assertIn('immaculater_cache_requests_total{cache="etag",result="hit"} 4',
+                  lines)
+    self.assertIn('immaculater_view_seconds_bucket{view="a \\"view\\"",le="0.1"} 0',
+                  lines)
+    self.assertIn('immaculater_view_seconds_bucket{view="a \\"view\\"",le="0.25"} 4',
+                  lines)
+    self.assertIn('immaculater_view_seconds_count{view="a \\"view\\""} 4',
+                  lines)
+    # The latest counts of users 1 and 2:
+    self.assertIn('immaculater_todolist_items_bucket{kind="actions",le="30"} 0',
+                  lines)
+    self.assertIn('immaculater_todolist_items_bucket{kind="actions",le="100"} 1',
+                  lines)
+    self.assertIn(
+      'immaculater_todolist_items_bucket{kind="actions",le="+Inf"} 2', lines)
+    self.assertIn('immaculater_todolist_items_sum{kind="actions"} 5050', lines)
+
+  def test_snapshots_of_dead_processes_are_removed(self):
+    directory = tempfile.mkdtemp()
+    try:
+      os.environ['IMMACULATER_METRICS_DIR'] = directory
+      child = subprocess.Popen(['true'])
+      child.wait()
+      dead = os.path.join(directory, 'worker-%d.json' % child.pid)
+      with open(dead, 'w') as f:
+        json.dump(metrics.Registry().snapshot(), f)
+      metrics.Registry().text()
+      self.assertEqual(os.listdir(directory), ['worker-%d.json' % os.getpid()])
+    finally:
+      shutil.rmtree(directory)
+
+  def test_etag_lookups(self):
+    def Count(result):
+      return metrics.registry._counters.get(
+        ('immaculater_cache_requests_total', ('etag', result)), 0)
+    self._run('mkctx @test')
+    hits, misses = Count('hit'), Count('miss')
+    etag = self.client.get('/todo/txt')['ETag']
+    self.client.get('/todo/txt', HTTP_IF_NONE_MATCH=etag)
+    self.client.get('/todo/txt', HTTP_IF_NONE_MATCH='"other"')
+    # Not a conditional view:
+    self.client.get('/todo/help', HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual((Count('hit'), Count('miss')), (hits + 1, misses + 1))
+
+  def test_view(self):
+    os.environ['IMMACULATER_METRICS_TOKEN'] = 'secret'
+    self.assertEqual(self.client.get('/todo/metrics').status_code, 403)
+    response = self.client.get('/todo/metrics',
+                               HTTP_AUTHORIZATION='Bearer wrong')
+    self.assertEqual(response.status_code, 403)
+    response = self.client.get('/todo/metrics',
+                               HTTP_AUTHORIZATION='Bearer secret')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+    self.assertIn(b'# TYPE immaculater_view_seconds histogram',
+                  response.content)
+    self.user.is_staff = True
+    self.user.save()
+    self.assertEqual(self.client.get('/todo/metrics').status_code, 200)
+
+
+class RecordingTestCase(_LoggedInTestCase):
+
+  def setUp(self):
+    super(RecordingTestCase, self).setUp()
+    self._tmpdir = tempfile.mkdtemp()
+    os.environ['IMMACULATER_RECORD_DIR'] = self._tmpdir
+    recording._snapshotted.clear()
+
+  def tearDown(self):
+    shutil.rmtree(self._tmpdir)
+    super(RecordingTestCase, self).tearDown()
+
+  def test_record(self):
+    self._run('mkctx @test')
+    self._run('mkctx @test2')
+    path = os.path.join(self._tmpdir, 'commands-%d.jsonl' % os.getpid())
+    with open(path) as f:
+      records = [json.loads(line) for line in f]
+    self.assertEqual([r['version'] for r in records], [None, 1])
+    # Saved once, after the first batch, so replays skip that batch:
+    self.assertEqual(os.listdir(os.path.join(self._tmpdir, 'lists')),
+                     ['%s-1.pb' % records[0]['user']])
+
+  def test_errors_are_not_fatal(self):
+    not_a_directory = os.path.join(self._tmpdir, 'file')
+    open(not_a_directory, 'w').close()
+    os.environ['IMMACULATER_RECORD_DIR'] = not_a_directory
+    self._run('mkctx @test')
 
-# Create your tests here.
+  def test_failing_reads_are_not_fatal(self):
+    def Fail():
+      raise ValueError('the DB is down')
+    with recording.batch_recorder(self.user, ['mkctx @test'], False, Fail,
+                                  Fail):
+      pass
+    with self.assertRaises(KeyError):
+      with recording.batch_recorder(self.user, ['mkctx @test'], False, Fail,
+                                    Fail):
+        raise KeyError('the batch failed')
@@ -10,6 +10,7 @@ urlpatterns = [
     url(r'^view/(?P<slug>.*)$', views.view, name='view'),
     url(r'^action/(?P<uid>\d+)$', views.action, name='action'),
     url(r'^context/(?P<uid>\d+)$', views.context, name='context'),
+    url(r'^context/(?P<uid>\d+)/json$', views.context_json, name='context_json'),
     url(r'^contexts$', views.contexts, name='contexts'),
     url(r'^dl$', views.dl, name='dl'),
     url(r'^weekly_review$', views.weekly_review, name='weekly_review'),
@@ -20,6 +21,8 @@ urlpatterns = [
     url(r'^projects$', views.projects, name='projects'),
     url(r'^api$', views.api, name='api'),
     url(r'^slackapi$', views.slackapi, name='slackapi'),
+    url(r'^watch$', views.watch, name='watch'),
+    url(r'^metrics$', views.prometheus_metrics, name='metrics'),
     url(r'^help$', views.help, name='help'),
     url(r'^login$', views.login, name='login'),
     url(r'^txt(\.(?P<the_view_filter>.*)|)$', views.as_text, name='as_text'),
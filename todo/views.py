@@ -2,14 +2,20 @@
 from __future__ import unicode_literals
 
 import base64
+import binascii
 import codecs
+import collections
 import datetime
+import gzip
 import hashlib
+import hmac
 import json
 import os
 import pipes
 import random
 import re
+import threading
+import time
 try:
   import cStringIO as StringIO
 except ImportError:
@@ -20,34 +26,61 @@ import gflags as flags  # https://code.google.com/p/python-gflags/
 from third_party.django_pjax import djpjax
 from pyatdllib.ui import immaculater
 immaculater.RegisterUICmds(cloud_only=True)
+from pyatdllib.core import jsonlines
 from pyatdllib.core import pyatdl_pb2
+from pyatdllib.core import timing
 from pyatdllib.core import view_filter
+from pyatdllib.ui import history
+from pyatdllib.ui import serialization
+from pyatdllib.ui import slowlog
+from pyatdllib.ui import uicmd
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth import logout
 from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth import views
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
+from django.db import IntegrityError
 from django.db import transaction
+from django.db.models import F
+from django.db.models import Max
 from django.http import Http404
 from django.http import HttpResponse
 from django.http import HttpResponseBadRequest
+from django.http import HttpResponseNotModified
 from django.http import JsonResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import redirect
 from django.shortcuts import render
 from django.template import RequestContext
 from django.template.response import TemplateResponse
 from django.utils.decorators import method_decorator
+from django.utils import timezone
 from django.utils.encoding import escape_uri_path
+from django.utils.cache import patch_vary_headers
 from django.utils.html import escape
+from django.utils.http import parse_etags
+from django.utils.http import quote_etag
+from django.views.decorators.cache import cache_control
 from django.views.decorators.cache import never_cache
 from django.views.decorators.clickjacking import xframe_options_sameorigin
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
+from cryptography.exceptions import InvalidTag
 from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from google.protobuf import message
 
+from . import metrics
 from . import models
+from . import profiles
+from . import recording
 
 import sys
 if not hasattr(sys.stdout, 'isatty'):
@@ -59,10 +92,60 @@ FLAGS.pyatdl_show_uid = True
 FLAGS.database_filename = None
 FLAGS.seed_upon_creation = True
 FLAGS.no_context_display_string = 'Actions Without Context'
+FLAGS.pyatdl_lazy_deserialization = True
+FLAGS.pyatdl_archive_after_days = int(
+  os.environ.get('IMMACULATER_ARCHIVE_AFTER_DAYS', '0'))
+# Recording a version costs a write the whole to-do list (every shard, too)
+# and a delta, so history is opt-in; see serialization.SerializeToDoList2:
+FLAGS.pyatdl_history_max_versions = int(
+  os.environ.get('IMMACULATER_HISTORY_MAX_VERSIONS', '0'))
+# Zero turns off logging slow commands or batches; see module slowlog:
+FLAGS.pyatdl_slow_command_seconds = float(
+  os.environ.get('IMMACULATER_SLOW_COMMAND_SECONDS', '1'))
+FLAGS.pyatdl_slow_batch_seconds = float(
+  os.environ.get('IMMACULATER_SLOW_BATCH_SECONDS', '3'))
 
 _COOKIE_NAME = 'VISITOR_INFO0'
 _SANITY_CHECK = 37
 
+# Bump this if the format of what we cache for shared to-do lists changes:
+_SHARE_CACHE_KEY_PREFIX = 'share2'
+
+# The first byte of what _encrypted_todolist_protobuf returns. The second is the
+# key ID, then comes the nonce, then the AES-GCM ciphertext and tag:
+_AEAD_ENVELOPE_VERSION = 1
+_AEAD_NONCE_LENGTH = 12
+
+# SerializationReader fetches these shards one query at a time and all the
+# user's shards in one query if asked for more:
+_MAX_SHARDS_PER_QUERY = 100
+
+# A batch that reads shards after a concurrent write (see
+# serialization.StaleReadError) starts over, at most this many times:
+_MAX_STALE_READ_RETRIES = 2
+
+# Memoized by the environment variables' values; see _protobuf_aead_keys:
+_AEAD_KEYS = {}
+_FERNETS = {}
+
+# The context page shows this many actions at first and fetches the rest
+# lazily; see context_json:
+_ACTIONS_PER_PAGE = 100
+
+# Projects come due for review as time passes, so a page showing which projects
+# need review can change while the to-do list does not. Such pages' ETags
+# include the time rounded down to this many seconds; see _review_clock:
+_REVIEW_CLOCK_SECONDS = 60
+
+# See django.middleware.gzip.GZipMiddleware:
+_ACCEPTS_GZIP_RE = re.compile(r'\bgzip\b')
+
+# Requests long-polling via watch wait on this. It guards _write_counts, {user
+# ID: number of writes by this process}; see _note_write. Writes by other
+# processes are noticed by polling the DB.
+_write_condition = threading.Condition()
+_write_counts = collections.Counter()
+
 
 # TODO(chandler): Support redo/undo. Put the commands in the protobuf.
 
@@ -73,19 +156,242 @@ def _logo():
 
 
 def _encrypted_todolist_protobuf(some_bytes):
-  return bytes(_protobuf_fernet().encrypt(some_bytes))
+  """Returns bytes, an envelope holding some_bytes encrypted with the current key.
+
+  The envelope is one version byte, one key ID byte, the nonce, and then the
+  AES-GCM ciphertext and tag. Unlike a Fernet token it is not base64-encoded.
+  """
+  key_id, ciphers = _protobuf_aead_keys()
+  nonce = os.urandom(_AEAD_NONCE_LENGTH)
+  header = bytes(bytearray([_AEAD_ENVELOPE_VERSION, key_id]))
+  with timing.Phase('encrypt') as phase:
+    phase.num_bytes = len(some_bytes)
+    return header + nonce + ciphers[key_id].encrypt(nonce, some_bytes, header)
+
+
+def _unencrypted_todolist_protobuf(envelope):
+  """Inverts _encrypted_todolist_protobuf.
+
+  Any key in IMMACULATER_PROTOBUF_AEAD_KEYS will do, not just the current one,
+  so rows remain readable after a key rotation until they are next written.
+  """
+  # We should never see a bad envelope. If we see one, let it become a 500.
+  envelope = bytes(envelope)
+  header_length = 2 + _AEAD_NONCE_LENGTH
+  header = bytearray(envelope[:2])
+  if len(envelope) < header_length or header[0] != _AEAD_ENVELOPE_VERSION:
+    _debug_log('Invalid encrypted pb envelope')
+    raise InvalidTag()
+  _, ciphers = _protobuf_aead_keys()
+  if header[1] not in ciphers:
+    _debug_log('Unknown key ID %d for encrypted pb' % header[1])
+    raise InvalidTag()
+  try:
+    with timing.Phase('decrypt') as phase:
+      phase.num_bytes = len(envelope)
+      return ciphers[header[1]].decrypt(
+        envelope[2:header_length], envelope[header_length:], envelope[:2])
+  except InvalidTag:
+    _debug_log('Invalid encrypted pb')
+    raise
 
 
-def _unencrypted_todolist_protobuf(pb):
+def _fernet_unencrypted_todolist_protobuf(pb):
+  """Decrypts the legacy ToDoList.encrypted_contents2."""
   # We should never see InvalidToken. If we see it, let it become a 500.
   try:
-    return _protobuf_fernet().decrypt(pb)
+    with timing.Phase('decrypt') as phase:
+      phase.num_bytes = len(pb)
+      return _protobuf_fernet().decrypt(pb)
   except InvalidToken:
     _debug_log('Invalid encrypted pb')
     raise
 
 
+# The saved_read for a sharded to-do list. root is the decrypted root and
+# shards is {project UID: decrypted shard} for those of the user's
+# ToDoListShards read so far; see serialization.DeserializeToDoList2.
+# version is ToDoList.version as read, which the next write expects to find.
+_ShardedRead = collections.namedtuple('_ShardedRead',
+                                      ['root', 'shards', 'version'])
+
+# The saved_read for an unsharded to-do list. contents is decrypted.
+_UnshardedRead = collections.namedtuple('_UnshardedRead',
+                                        ['contents', 'version'])
+
+
+def _sharded_storage():
+  """Returns True iff to-do lists should be written in the sharded layout.
+
+  Either way, we read both layouts.
+  """
+  return os.environ.get('IMMACULATER_SHARDED_STORAGE', '').lower() == 'true'
+
+
+def _read_shards(user, uids, version):
+  """Returns {project UID: decrypted shard} for the user's given shards.
+
+  Shards are read in the same query as ToDoList.version, so they match the
+  root read at the given version.
+
+  Raises:
+    serialization.StaleReadError
+  """
+  shards = models.ToDoListShard.objects.filter(
+    user__id=user.id, user__todolist__version=version)
+  if len(uids) <= _MAX_SHARDS_PER_QUERY:
+    shards = shards.filter(project_uid__in=uids)
+  with timing.Phase('db_read') as phase:
+    rows = list(shards.values_list('project_uid', 'encrypted_contents'))
+    phase.num_bytes = sum(len(e) for _, e in rows)
+  if len(rows) < len(set(uids)) and _todolist_version(user) != version:
+    _debug_log('the to-do list changed while we read its shards')
+    raise serialization.StaleReadError(
+      'Version %s of the to-do list is gone' % version)
+  return dict(
+    (project_uid, _unencrypted_todolist_protobuf(encrypted_contents))
+    for project_uid, encrypted_contents in rows)
+
+
+def _history(user):
+  """Returns the history.History of the user's to-do list and archive."""
+  return history.History(
+    HistoryStore(user),
+    archive_store=HistoryStore(user, models.ToDoListArchiveVersion))
+
+
+def _read_archive(user):
+  """Returns the user's archive (see the 'archive' command) or b''."""
+  with timing.Phase('db_read'):
+    encrypted_contents = models.ToDoListArchive.objects.filter(
+      user__id=user.id).values_list('encrypted_contents', flat=True).first()
+  if not encrypted_contents:
+    return b''
+  return _unencrypted_todolist_protobuf(encrypted_contents)
+
+
+def _read_captures(user):
+  """Returns the user's queued quick captures, [uicmd.Capture], oldest first."""
+  with timing.Phase('db_read'):
+    rows = list(models.QuickCapture.objects.filter(user__id=user.id).order_by(
+      'id').values_list('id', 'created_at', 'command', 'encrypted_name'))
+  return [uicmd.Capture(key=capture_id,
+                        timestamp=created_at,
+                        command=str(command),
+                        name=_unencrypted_todolist_protobuf(
+                          encrypted_name).decode('utf-8'))
+          for capture_id, created_at, command, encrypted_name in rows]
+
+
+def _queued_capture(user, command_line):
+  """Queues command_line instead of executing it if it is a quick capture.
+
+  A quick capture ('do' or 'maybe') is our most frequent write. Queueing it is
+  a single INSERT; the next read of the to-do list merges it.
+
+  Args:
+    user: models.User
+    command_line: unicode
+  Returns:
+    bool  # True iff queued
+  """
+  capture = uicmd.ParseCapture(command_line)
+  if capture is None:
+    return False
+  command, name = capture
+  _queue_capture(user, command, name)
+  return True
+
+
+def _queue_capture(user, command, name):
+  """Queues a uicmd.Capture with a single INSERT; see uicmd.MergeCaptures."""
+  models.QuickCapture.objects.create(
+    user=user,
+    created_at=time.time(),
+    command=command,
+    encrypted_name=_encrypted_todolist_protobuf(name.encode('utf-8')))
+  _note_write(user.id)
+
+
+def _write_behind_seconds():
+  """Returns how long a toggle may stay queued, or 0 to never queue toggles.
+
+  Queued toggles (see _execute_cmd) and quick captures are merged by every
+  read and written along with the next write. A read that finds one queued
+  longer than this writes them all.
+  """
+  return float(os.environ.get('IMMACULATER_WRITE_BEHIND_SECONDS', 0))
+
+
+# Every read merges every queued capture, so a read that merges this many
+# writes them all lest reads grow ever slower:
+_MAX_QUEUED_CAPTURES = 20
+
+
+def _flush_is_due(captures):
+  """Returns True iff a read that merged the [uicmd.Capture] should write."""
+  if len(captures) >= _MAX_QUEUED_CAPTURES:
+    return True
+  seconds = _write_behind_seconds()
+  return bool(seconds > 0 and captures and
+              min(c.timestamp for c in captures) <= time.time() - seconds)
+
+
+def _note_write(user_id):
+  """Wakes this process's requests watching user_id's to-do list; see watch."""
+  with _write_condition:
+    _write_counts[user_id] += 1
+    _write_condition.notify_all()
+
+
+class HistoryStore(object):
+  """Stores the versions (see pyatdllib.ui.history) of a user's to-do list or,
+  given models.ToDoListArchiveVersion, of its archive."""
+  def __init__(self, user, model=models.ToDoListVersion):
+    self._user = user
+    self._model = model
+
+  def Versions(self):
+    with timing.Phase('db_history'):
+      return [history.VersionInfo(*row)
+              for row in self._model.objects.filter(
+                user__id=self._user.id).order_by('number').values_list(
+                  'number', 'created_at', 'is_keyframe', 'sha1', 'size')]
+
+  def Read(self, numbers):
+    with timing.Phase('db_history'):
+      rows = list(self._model.objects.filter(
+        user__id=self._user.id, number__in=numbers).values_list(
+          'number', 'encrypted_contents'))
+    return dict(
+      (number, _unencrypted_todolist_protobuf(encrypted_contents))
+      for number, encrypted_contents in rows)
+
+  def Append(self, info, data):
+    try:
+      with timing.Phase('db_history'), transaction.atomic():
+        self._model.objects.create(
+          user=self._user,
+          number=info.number,
+          created_at=info.timestamp,
+          is_keyframe=info.is_keyframe,
+          sha1=info.sha1,
+          size=info.size,
+          encrypted_contents=_encrypted_todolist_protobuf(data))
+    except IntegrityError:
+      # A concurrent request recorded its version first. Ours is lost from
+      # the history but not from the to-do list.
+      _debug_log('lost the race to record version %s' % info.number)
+
+  def Delete(self, numbers):
+    with timing.Phase('db_history'):
+      self._model.objects.filter(
+        user__id=self._user.id, number__in=numbers).delete()
+
+
 class SerializationWriter(object):
+  keeps_history = True  # see serialization.SerializeToDoList2
+
   def __init__(self, user, place_to_save_read):
     """Init.
 
@@ -95,64 +401,240 @@ class SerializationWriter(object):
         the result of the write
     """
     self._user = user
+    self._merged_capture_ids = []
+    self._pending_archive = None  # see write_archive
+    self._wrote = False
     if place_to_save_read is None:
       self._place_to_save_read = {}
     else:
       self._place_to_save_read = place_to_save_read
       self._place_to_save_read['saved_read'] = None
   def write(self, b):
+    previous = self._place_to_save_read['saved_read']
+    with timing.Phase('db_write'), transaction.atomic():
+      version = self._write_row(b, is_sharded=False, previous=previous)
+      if previous is None or isinstance(previous, _ShardedRead):
+        models.ToDoListShard.objects.filter(user__id=self._user.id).delete()
+      self._delete_merged_captures()
+      self._write_pending_archive()
+    self._wrote = True
+    cache.delete(_share_cache_key(self._user.id))
+    _note_write(self._user.id)
+    self._place_to_save_read['saved_read'] = _UnshardedRead(b, version)
+
+  def write_archive(self, b):
+    """Called by serialization.SerializeToDoList2 if the archive changed.
+
+    An archive given before the write is written within the write's
+    transaction, so it is written iff the rest is.
+
+    Args:
+      b: bytes  # empty iff the archive is empty
+    """
+    if not self._wrote:
+      self._pending_archive = b
+      return
+    with timing.Phase('db_write'), transaction.atomic():
+      self._write_archive_row(b)
+
+  def _write_pending_archive(self):
+    """Writes the archive given before the write. Call within its transaction."""
+    if self._pending_archive is not None:
+      self._write_archive_row(self._pending_archive)
+      self._pending_archive = None
+
+  def _write_archive_row(self, b):
+    """Replaces the ToDoListArchive row. Call within a transaction."""
+    user_id = self._user.id
+    if not b:
+      models.ToDoListArchive.objects.filter(user__id=user_id).delete()
+      return
+    encrypted_contents = _encrypted_todolist_protobuf(b)
+    updated = models.ToDoListArchive.objects.filter(user__id=user_id).update(
+      encrypted_contents=encrypted_contents)
+    if updated:
+      return
+    try:
+      with transaction.atomic():
+        models.ToDoListArchive.objects.create(
+          user=self._user, encrypted_contents=encrypted_contents)
+    except IntegrityError:
+      # A concurrent request created the row first.
+      models.ToDoListArchive.objects.filter(user__id=user_id).update(
+        encrypted_contents=encrypted_contents)
+
+  def note_merged_captures(self, captures):
+    """Called by immaculater.ApplyBatchOfCommands before the write.
+
+    Args:
+      captures: [uicmd.Capture]  # from SerializationReader.read_captures
+    """
+    self._merged_capture_ids = [c.key for c in captures]
+
+  def note_item_counts(self, counts):
+    """Called by serialization.SerializeToDoList2 after the write."""
+    metrics.registry.note_item_counts(_user_key(self._user), counts)
+
+  def _delete_merged_captures(self):
+    """Dequeues the merged quick captures. Call within the write's transaction."""
+    if self._merged_capture_ids:
+      models.QuickCapture.objects.filter(
+        user__id=self._user.id, id__in=self._merged_capture_ids).delete()
+
+  def _write_row(self, b, is_sharded, previous):
+    """Writes the ToDoList row unless another request wrote it since we read.
+
+    Args:
+      b: bytes
+      is_sharded: bool
+      previous: None|_ShardedRead|_UnshardedRead  # what we read
+    Returns:
+      int  # the new version
+    Raises:
+      serialization.WriteConflictError
+    """
     user_id = self._user.id
     email = self._user.email
     assert user_id, 'FAILwhale email=%s' % (email,)
-    x = models.ToDoList.objects.filter(user__id=user_id)
     encrypted_contents = _encrypted_todolist_protobuf(b)
-    if len(x):
-      x[0].encrypted_contents2 = encrypted_contents
-      x[0].contents = b''
-      x[0].save()
-    else:
-      new_model = models.ToDoList(user=self._user,
-                                  contents=b'',
-                                  encrypted_contents=None,
-                                  encrypted_contents2=None)
-      # HACK why can't we set encrypted_contents2 to encrypted_contents above?
-      # If we do, we get a TypeError:
-      # :   File "/app/todo/views.py", line 108, in write 
-      # :     new_model.save() 
-      # :   File "/app/.heroku/python/lib/python2.7/site-packages/django/db/models/base.py", line 806, in save 
-      # :     force_update=force_update, update_fields=update_fields) 
-      # :   File "/app/.heroku/python/lib/python2.7/site-packages/django/db/models/base.py", line 836, in save_base 
-      # :     updated = self._save_table(raw, cls, force_insert, force_update, using, update_fields) 
-      # :   File "/app/.heroku/python/lib/python2.7/site-packages/django/db/models/base.py", line 903, in _save_table 
-      # :     forced_update) 
-      # :   File "/app/.heroku/python/lib/python2.7/site-packages/django/db/models/base.py", line 953, in _do_update 
-      # :     return filtered._update(values) > 0 
-      # :   File "/app/.heroku/python/lib/python2.7/site-packages/django/db/models/query.py", line 662, in _update 
-      # :     return query.get_compiler(self.db).execute_sql(CURSOR) 
-      # :   File "/app/.heroku/python/lib/python2.7/site-packages/django/db/models/sql/compiler.py", line 1191, in execute_sql 
-      # :     cursor = super(SQLUpdateCompiler, self).execute_sql(result_type) 
-      # :   File "/app/.heroku/python/lib/python2.7/site-packages/django/db/models/sql/compiler.py", line 886, in execute_sql 
-      # :     raise original_exception 
-      # : TypeError: can't escape unicode to binary 
-      new_model.save()
-      new_model.encrypted_contents2 = encrypted_contents
-      new_model.contents = b''
-      new_model.save()
-      x = models.ToDoList.objects.filter(user__id=user_id)
-      assert len(x) == 1, user_id
-    self._place_to_save_read['saved_read'] = b
+    if previous is not None and previous.version is not None:
+      # One UPDATE that touches only the columns that change. (update() skips
+      # auto_now, hence updated_at.) Clearing encrypted_contents2 migrates rows
+      # away from Fernet tokens lazily. Matching the version makes it a
+      # compare-and-swap.
+      updated = models.ToDoList.objects.filter(
+        user__id=user_id, version=previous.version).update(
+          encrypted_contents3=encrypted_contents,
+          encrypted_contents2=None,
+          is_sharded=is_sharded,
+          version=F('version') + 1,
+          updated_at=timezone.now())
+      if not updated:
+        self._raise_conflict(previous)
+      return previous.version + 1
+    try:
+      with transaction.atomic():
+        models.ToDoList.objects.create(user=self._user,
+                                       contents=b'',
+                                       encrypted_contents=None,
+                                       encrypted_contents2=None,
+                                       encrypted_contents3=encrypted_contents,
+                                       is_sharded=is_sharded,
+                                       version=1)
+    except IntegrityError:
+      # A concurrent request created the row first.
+      self._raise_conflict(None)
+    return 1
+
+  def _raise_conflict(self, previous):
+    """Tells serialization.SerializeToDoList2 to merge with the latest version."""
+    _debug_log('merging with a concurrent write')
+    metrics.registry.inc('immaculater_write_conflicts_total')
+    base = None
+    if previous is not None:
+      base = SavedSerializationReader(self._user, previous)
+    # This forgets previous, so the retry will expect the version read here:
+    latest = SerializationReader(self._user, self._place_to_save_read)
+    raise serialization.WriteConflictError(base=base, latest=latest)
+
+
+class ShardedSerializationWriter(SerializationWriter):
+  """Writes the root of the to-do list and only those projects that changed."""
+  @property
+  def accepts_placeholders(self):
+    """See serialization.SerializeToDoList2. Unfetched shards are unchanged."""
+    return isinstance(self._place_to_save_read['saved_read'], _ShardedRead)
+
+  def write_shards(self, root, shards):
+    """Called by serialization.SerializeToDoList2.
+
+    Args:
+      root: bytes
+      shards: {int: None|bytes}  # project UID => serialized project, or None
+                                 # if we never read the project's shard
+    """
+    user_id = self._user.id
+    previous = self._place_to_save_read['saved_read']
+    with timing.Phase('db_write'), transaction.atomic():
+      version = self._write_row(root, is_sharded=True, previous=previous)
+      if isinstance(previous, _ShardedRead):
+        for project_uid, shard in shards.items():
+          if shard is None or previous.shards.get(project_uid) == shard:
+            continue
+          encrypted_contents = _encrypted_todolist_protobuf(shard)
+          updated = models.ToDoListShard.objects.filter(
+            user__id=user_id, project_uid=project_uid).update(
+              encrypted_contents=encrypted_contents)
+          if not updated:
+            models.ToDoListShard.objects.create(
+              user=self._user, project_uid=project_uid,
+              encrypted_contents=encrypted_contents)
+        # Removing a project means decoding it (to see that it is deleted,
+        # say), so we read the shard of every project that is gone:
+        deleted = [u for u in previous.shards if u not in shards]
+        if deleted:
+          models.ToDoListShard.objects.filter(
+            user__id=user_id, project_uid__in=deleted).delete()
+      else:
+        # We don't know what is stored, so replace it all.
+        assert None not in shards.values(), 'no sharded read to keep shards of'
+        models.ToDoListShard.objects.filter(user__id=user_id).delete()
+        models.ToDoListShard.objects.bulk_create(
+          [models.ToDoListShard(
+            user=self._user, project_uid=project_uid,
+            encrypted_contents=_encrypted_todolist_protobuf(shard))
+           for project_uid, shard in shards.items()])
+      self._delete_merged_captures()
+      self._write_pending_archive()
+    self._wrote = True
+    cache.delete(_share_cache_key(user_id))
+    _note_write(user_id)
+    # The shards we did not read are still stored and match this version:
+    self._place_to_save_read['saved_read'] = _ShardedRead(
+      root, dict((u, s) for u, s in shards.items() if s is not None), version)
 
 
 class SerializationNonWriter(object):
   """A writer that doesn't write, useful for read-only commands, e.g. 'lsctx'.
 
-  This avoids the race condition where we read, someone else writes, and we then
-  overwrite stale data. TODO(chandler): Eliminate the race condition.
+  Writers that do write detect concurrent writes by ToDoList.version and merge;
+  see serialization.WriteConflictError.
+
+  The exception: Given a user, we write if we merged captures that have been
+  queued too long (see _write_behind_seconds) or too many captures.
   """
-  def __init__(self, place_to_save_read):
+  def __init__(self, place_to_save_read, user=None):
     self._place_to_save_read = place_to_save_read
+    self._user = user
+    self._merged_captures = []
+  @property
+  def accepts_placeholders(self):
+    """See serialization.SerializeToDoList2. Unless we write, why fetch?"""
+    return not self._flush_is_due()
+  def _flush_is_due(self):
+    return self._user is not None and _flush_is_due(self._merged_captures)
+  def note_merged_captures(self, captures):
+    self._merged_captures = captures
+  def note_item_counts(self, counts):
+    if self._user is not None:
+      metrics.registry.note_item_counts(_user_key(self._user), counts)
   def write(self, b):
-    self._place_to_save_read['saved_read'] = b
+    previous = self._place_to_save_read['saved_read']
+    if self._flush_is_due():
+      writer = SerializationWriter(self._user, self._place_to_save_read)
+      self._place_to_save_read['saved_read'] = previous  # for the version
+      writer.note_merged_captures(self._merged_captures)
+      writer.write(b)
+      return
+    # The captures remain queued, so b must not be reused as a read of the DB:
+    if self._merged_captures or previous is None:
+      self._place_to_save_read['saved_read'] = None
+    elif isinstance(previous, _ShardedRead):
+      # b may hold placeholders for the shards we did not read:
+      self._place_to_save_read['saved_read'] = _ShardedRead(
+        b, previous.shards, previous.version)
+    else:
+      self._place_to_save_read['saved_read'] = _UnshardedRead(b, previous.version)
 
 
 class SerializationReader(object):
@@ -170,32 +652,103 @@ class SerializationReader(object):
     else:
       self._place_to_save_read = place_to_save_read
       self._place_to_save_read['saved_read'] = None
+    self._read = None  # the saved_read of our read, or None
     self.name = u'DB entity for %s' % user.email
   def read(self):
     user_id = self._user.id
-    x = models.ToDoList.objects.filter(user__id=user_id)
-    if len(x) > 0:
-      if x[0].encrypted_contents2:
-        unencrypted_contents = _unencrypted_todolist_protobuf(
-          bytes(x[0].encrypted_contents2))
-      else:
-        _debug_log('reading old unencrypted contents')
-        unencrypted_contents = x[0].contents
-      self._place_to_save_read['saved_read'] = unencrypted_contents
-      return unencrypted_contents
-    else:
-      self._place_to_save_read['saved_read'] = None
+    # Select only the columns we need; the legacy columns are usually empty but
+    # there's no sense in transferring them.
+    with timing.Phase('db_read') as phase:
+      x = models.ToDoList.objects.filter(user__id=user_id).values_list(
+        'encrypted_contents3', 'encrypted_contents2', 'is_sharded',
+        'version').first()
+      if x is not None:
+        phase.num_bytes = len(x[0] or x[1] or b'')
+    if x is None:
+      self._read = self._place_to_save_read['saved_read'] = None
       return ''
+    if x[0]:
+      unencrypted_contents = _unencrypted_todolist_protobuf(x[0])
+    elif x[1]:
+      _debug_log('reading Fernet-encrypted contents')
+      unencrypted_contents = _fernet_unencrypted_todolist_protobuf(bytes(x[1]))
+    else:
+      _debug_log('reading old unencrypted contents')
+      unencrypted_contents = bytes(
+        models.ToDoList.objects.filter(user__id=user_id).values_list(
+          'contents', flat=True).first())
+    if x[2]:
+      self._read = _ShardedRead(unencrypted_contents, {}, x[3])
+    else:
+      self._read = _UnshardedRead(unencrypted_contents, x[3])
+    self._place_to_save_read['saved_read'] = self._read
+    return unencrypted_contents
+
+  def read_shards(self, uids):
+    """Called by serialization.DeserializeToDoList2 if read() returned a root,
+    perhaps later on when the projects are used.
+
+    Args:
+      uids: [int]  # project UIDs
+    Returns:
+      {int: bytes}
+    Raises:
+      serialization.StaleReadError
+    """
+    shards = self._read.shards
+    unread = [u for u in uids if u not in shards]
+    if unread:
+      shards.update(_read_shards(self._user, unread, self._read.version))
+    return dict((u, shards[u]) for u in uids if u in shards)
+
+  def read_archive(self):
+    """Called by serialization.DeserializeToDoList2's archive loader."""
+    return _read_archive(self._user)
+
+  def read_captures(self):
+    """Called by immaculater.ApplyBatchOfCommands."""
+    return _read_captures(self._user)
+
+  def history(self):
+    return _history(self._user)
+
+  def version(self):
+    """Returns models.ToDoList.version as of our read, or None."""
+    return None if self._read is None else self._read.version
 
 
 class SavedSerializationReader(object):
-  """Skips expensive deserialization from the DB and reuses a previous read."""
-  def __init__(self, saved_read):
+  """Skips expensive deserialization from the DB and reuses a previous read.
+
+  The archive, needed only rarely, is read from the DB, as are the quick
+  captures, which may have arrived since the previous read, and any shards the
+  previous read did not read.
+  """
+  def __init__(self, user, saved_read):
+    self._user = user
     self._saved_read = saved_read
     assert saved_read is not None
     self.name = 'Previous DB read'
   def read(self):
-    return self._saved_read
+    if isinstance(self._saved_read, _ShardedRead):
+      return self._saved_read.root
+    return self._saved_read.contents
+  def read_shards(self, uids):
+    if not isinstance(self._saved_read, _ShardedRead):
+      return {}
+    shards = self._saved_read.shards
+    unread = [u for u in uids if u not in shards]
+    if unread:
+      shards.update(_read_shards(self._user, unread, self._saved_read.version))
+    return dict((u, shards[u]) for u in uids if u in shards)
+  def read_archive(self):
+    return _read_archive(self._user)
+  def read_captures(self):
+    return _read_captures(self._user)
+  def history(self):
+    return _history(self._user)
+  def version(self):
+    return self._saved_read.version
 
 
 class LogoutView(views.LogoutView):
@@ -221,6 +774,11 @@ def _debug_log(the_string):
   print(the_string)
 
 
+slowlog.SetLogger(
+  lambda record: _debug_log('slow %s' % json.dumps(record, sort_keys=True)))
+uicmd.SetLogger(_debug_log)
+
+
 def _get_uid(request, param_name):
   uid = request.POST.get(param_name, '')
   if uid:
@@ -312,13 +870,16 @@ def _execute_cmd(request, uid, template_dict, cookie_value=None):
       target_uid = _get_uid(request, 'target_uid')
       if target_uid is None:
         return None, _error_page(request, 'Needs integer POST arg "target_uid"')
+      command = "complete" if cmd == "togglecomplete" else "uncomplete"
+      template_dict["Flash"] = "<strong>Marked Action %s %s.</strong>" % (target_uid, "Complete" if cmd == "togglecomplete" else "Incomplete")
+      if _write_behind_seconds() > 0:
+        # Users toggle in bursts. The page we render next merges this.
+        _queue_capture(request.user, command, 'uid=%s' % target_uid)
+        return None, None
       cmd_result = _apply_batch_of_commands(
           request.user,
-          ['%s uid=%s'
-           % ("complete" if cmd == "togglecomplete" else "uncomplete",
-              target_uid)],
+          ['%s uid=%s' % (command, target_uid)],
           read_only=False)
-      template_dict["Flash"] = "<strong>Marked Action %s %s.</strong>" % (target_uid, "Complete" if cmd == "togglecomplete" else "Incomplete")
     elif cmd == 'chdefaultctx':
       new_default_uid = _get_uid(request, 'new_default_uid')
       if new_default_uid is None:
@@ -413,6 +974,30 @@ def _execute_cmd(request, uid, template_dict, cookie_value=None):
   return saved_read, None
 
 
+def _todolist_version(user):
+  """Returns models.ToDoList.version, or None if the user has no to-do list."""
+  return models.ToDoList.objects.filter(user__id=user.id).values_list(
+    'version', flat=True).first()
+
+
+def _todolist_snapshot(user):
+  """Returns (models.ToDoList.version, _todolist_protobuf(user)) from one read."""
+  reader = SerializationReader(user)
+  pb = serialization.DeserializeToDoList2(
+    reader, tdl_factory=uicmd.NewToDoList).AsProto()
+  return reader.version(), pb
+
+
+def _todolist_protobuf(user):
+  """Reads the user's entire to-do list, sans the archive, from the DB.
+
+  Returns:
+    pyatdl_pb2.ToDoList
+  """
+  return serialization.DeserializeToDoList2(
+    SerializationReader(user), tdl_factory=uicmd.NewToDoList).AsProto()
+
+
 def _apply_batch_of_commands(user, batch, read_only, saved_read=None, cookie=None):
   """Apply a list of commands, reading from and writing to the DB.
 
@@ -435,31 +1020,55 @@ def _apply_batch_of_commands(user, batch, read_only, saved_read=None, cookie=Non
   codecinfo = codecs.lookup("utf8")
   wrapper = codecs.StreamReaderWriter(
       f, codecinfo.streamreader, codecinfo.streamwriter)
+  lines = []
   if cookie is not None:
     # Swallow errors if we have a bad cookie.
-    wrapper.write('cd --swallow_errors uid=%d\n' % cookie.cwc_uid)
-    wrapper.write('view %s\n' % pipes.quote(cookie.view))
-    wrapper.write('sort %s\n' % pipes.quote(cookie.sort))
+    lines.append('cd --swallow_errors uid=%d' % cookie.cwc_uid)
+    lines.append('view %s' % pipes.quote(cookie.view))
+    lines.append('sort %s' % pipes.quote(cookie.sort))
   for b in batch:
     assert not b.endswith('\n'), b
-    wrapper.write(b)
+    lines.append(b)
+  for line in lines:
+    wrapper.write(line)
     wrapper.write('\n')
   wrapper.seek(0)
   printed = []
   def Print(s):
     printed.append(s)
   place_to_save_read = {'saved_read': saved_read}
+  stale_reads = 0
   try:
-    if saved_read is not None:
-      reader = SavedSerializationReader(saved_read)
-    else:
-      reader = SerializationReader(user, place_to_save_read)
-    if read_only:
-      writer = SerializationNonWriter(place_to_save_read)
-    else:
-      writer = SerializationWriter(user, place_to_save_read)
-    result_dict = immaculater.ApplyBatchOfCommands(
-      wrapper, Print, reader, writer, html_escaper=escape)
+    while True:
+      if saved_read is not None:
+        reader = SavedSerializationReader(user, saved_read)
+      else:
+        reader = SerializationReader(user, place_to_save_read)
+      if read_only:
+        writer = SerializationNonWriter(place_to_save_read, user=user)
+      elif _sharded_storage():
+        writer = ShardedSerializationWriter(user, place_to_save_read)
+      else:
+        writer = SerializationWriter(user, place_to_save_read)
+      if saved_read is not None:
+        # The writers forget saved_read, but ShardedSerializationWriter needs it.
+        place_to_save_read['saved_read'] = saved_read
+      try:
+        with profiles.batch_profiler(user), slowlog.Context(
+            user_hash=_user_key(user)), \
+            recording.batch_recorder(user, lines, read_only, reader.version,
+                                     lambda: _todolist_snapshot(user)):
+          result_dict = immaculater.ApplyBatchOfCommands(
+            wrapper, Print, reader, writer, html_escaper=escape)
+        break
+      except serialization.StaleReadError:
+        if stale_reads >= _MAX_STALE_READ_RETRIES:
+          raise
+        stale_reads += 1
+        _debug_log('rerunning the batch after a stale read')
+        wrapper.seek(0)
+        del printed[:]
+        saved_read = None
   finally:
     wrapper.close()
   return {'pwd': result_dict['cwc'],
@@ -469,6 +1078,31 @@ def _apply_batch_of_commands(user, batch, read_only, saved_read=None, cookie=Non
           'view': result_dict['view']}
 
 
+def _page_data(user, command_line, cookie=None):
+  """Runs a 'pagedata' command and returns its sections.
+
+  Args:
+    user: models.User
+    command_line: str  # e.g., 'pagedata project uid=4'
+    cookie: None|pyatdl_pb2.VisitorInfo0
+  Returns:
+    {str: unicode}  # JSON for each section except for 'note', which is plain
+                    # text. See 'help pagedata'.
+  Raises:
+    immaculater.Error
+  """
+  x = _apply_batch_of_commands(user, [command_line], read_only=True,
+                               cookie=cookie)
+  assert len(x['printed']) == 1, x['printed']
+  result = {}
+  for section, value in json.loads(x['printed'][0]).items():
+    if section == 'note':
+      result[section] = value
+    else:
+      result[section] = json.dumps(value, sort_keys=True, separators=(',', ':'))
+  return result
+
+
 def _username_hash(username):
   """Returns bytes, a cryptographically safe one-way hash of the username.
 
@@ -481,6 +1115,11 @@ def _username_hash(username):
   return hashlib.sha256(username.encode('utf-8')).digest()
 
 
+def _user_key(user):
+  """Returns a hexadecimal _username_hash for logs and metrics."""
+  return binascii.hexlify(_username_hash(user.username))
+
+
 def _default_cookie_value(username):
   p = pyatdl_pb2.VisitorInfo0()
   p.sanity_check = _SANITY_CHECK
@@ -533,7 +1172,48 @@ def _protobuf_fernet():
   key = os.environ.get('FERNET_PROTOBUF_KEY', _default_debug_encryption_key())
   assert key is not None, 'No value set for environment variable FERNET_PROTOBUF_KEY; see .env file'
   assert len(key) > 40, 'Bad value of env var FERNET_PROTOBUF_KEY; use Fernet.generate_key() and heroku config:set'
-  return Fernet(key.encode('ascii'))
+  if key not in _FERNETS:
+    _FERNETS[key] = Fernet(key.encode('ascii'))
+  return _FERNETS[key]
+
+
+def _protobuf_aead_keys():
+  """Returns the ID of the key to encrypt with and a dict of all the ciphers.
+
+  IMMACULATER_PROTOBUF_AEAD_KEYS is a comma-separated list of ID:KEY where ID
+  is in [1, 255] and KEY is the url-safe base64 encoding of
+  AESGCM.generate_key(bit_length=256). The first is used for encryption. To
+  rotate keys, prepend a new one; the others remain for decryption.
+
+  Key ID 0 is derived from FERNET_PROTOBUF_KEY and is what we encrypt with if
+  IMMACULATER_PROTOBUF_AEAD_KEYS is unset.
+
+  Returns:
+    (int, {int: AESGCM})
+  """
+  fernet_key = os.environ.get('FERNET_PROTOBUF_KEY', _default_debug_encryption_key())
+  spec = os.environ.get('IMMACULATER_PROTOBUF_AEAD_KEYS', '').strip()
+  memo_key = (fernet_key, spec)
+  if memo_key not in _AEAD_KEYS:
+    ciphers = {}
+    current = None
+    if fernet_key is not None:
+      ciphers[0] = AESGCM(HKDF(algorithm=hashes.SHA256(),
+                               length=32,
+                               salt=None,
+                               info=b'immaculater todolist protobuf aead').derive(
+                                 fernet_key.encode('ascii')))
+      current = 0
+    for i, item in enumerate(x for x in spec.split(',') if x.strip()):
+      key_id, _, key = item.strip().partition(':')
+      assert key_id.isdigit() and 1 <= int(key_id) <= 255 and int(key_id) not in ciphers, (
+        'Bad key ID %r in env var IMMACULATER_PROTOBUF_AEAD_KEYS' % key_id)
+      ciphers[int(key_id)] = AESGCM(base64.urlsafe_b64decode(key.encode('ascii')))
+      if i == 0:
+        current = int(key_id)
+    assert current is not None, 'No value set for environment variable FERNET_PROTOBUF_KEY; see .env file'
+    _AEAD_KEYS[memo_key] = (current, ciphers)
+  return _AEAD_KEYS[memo_key]
 
 
 def _serialized_cookie_value(cookie_value):
@@ -585,11 +1265,218 @@ def _set_cookie(response, key, value, days_expire = 365):
   response.set_cookie(key, value, max_age=max_age, expires=expires)
 
 
+def _todolist_stamp(request, user):
+  """Returns (version, updated_at) for the user's to-do list, or None.
+
+  This is a cheap query -- nothing is decrypted or deserialized -- so it is
+  all we do when answering a conditional GET with 304 Not Modified. The result
+  is memoized on the request because both the ETag and the Last-Modified
+  functions need it.
+
+  Queued quick captures (see _queued_capture) count as changes because every
+  read merges them.
+
+  Args:
+    request: HTTPRequest
+    user: models.User
+  Returns:
+    ((int, int|None), datetime.datetime)|None  # None if the user has no
+        # to-do list yet. The version is the ToDoList's version and the ID of
+        # the latest queued capture.
+  """
+  memo = getattr(request, '_todolist_stamps', None)
+  if memo is None:
+    memo = request._todolist_stamps = {}
+  if user.id not in memo:
+    x = models.ToDoList.objects.filter(user__id=user.id).annotate(
+      latest_capture_id=Max('user__quickcapture__id'),
+      latest_capture_at=Max('user__quickcapture__created_at')).values_list(
+        'version', 'updated_at', 'latest_capture_id',
+        'latest_capture_at').first()
+    if x is not None:
+      version, updated_at, latest_capture_id, latest_capture_at = x
+      if latest_capture_at is not None:
+        updated_at = max(updated_at,
+                         datetime.datetime.fromtimestamp(latest_capture_at,
+                                                         timezone.utc))
+      x = ((version, latest_capture_id), updated_at)
+    memo[user.id] = x
+  return memo[user.id]
+
+
+def _todolist_etag(request, user, inputs):
+  """Returns an ETag (unquoted) for a read of user's to-do list, or None.
+
+  Args:
+    request: HTTPRequest
+    user: models.User
+    inputs: tuple  # everything besides the to-do list that affects the output,
+                   # e.g. the view filter
+  Returns:
+    str|None
+  """
+  stamp = _todolist_stamp(request, user)
+  if stamp is None:
+    return None
+  # See middleware.MetricsMiddleware:
+  request._todolist_etag_computed = True
+  version, updated_at = stamp
+  h = hashlib.sha1()
+  # A deploy may change our templates or the output of our commands:
+  for x in ((os.environ.get('HEROKU_SLUG_COMMIT', ''), user.id, version,
+             updated_at.isoformat())
+            + tuple(inputs)):
+    h.update(unicode(x).encode('utf-8'))
+    h.update(b'\0')
+  return h.hexdigest()
+
+
+def _review_clock():
+  """Returns the time rounded down to _REVIEW_CLOCK_SECONDS.
+
+  An ETag input for output that depends on which projects need review. As
+  the Last-Modified time, too, it makes If-Modified-Since fail once a new
+  period begins.
+
+  Returns:
+    datetime.datetime
+  """
+  now = int(time.time())
+  return datetime.datetime.fromtimestamp(now - now % _REVIEW_CLOCK_SECONDS,
+                                         timezone.utc)
+
+
+def _view_filter_inputs(the_view_filter):
+  """Returns the ETag inputs for output filtered by the named view filter."""
+  if the_view_filter == 'needing_review':
+    return (the_view_filter, _review_clock())
+  return (the_view_filter,)
+
+
+def _api_etag_inputs(cmd_list):
+  """Returns the ETag inputs for the output of an API batch of commands.
+
+  Any batch may show which projects need review, e.g. via 'view
+  needing_review' or the 'needsreview' field of JSON output, so the review
+  clock is always an input.
+  """
+  return ('api', _review_clock()) + tuple(cmd_list)
+
+
+def _html_etag_inputs(request, cookie_value=None):
+  """Returns the inputs, besides the to-do list, that affect a rendered page.
+
+  Args:
+    request: HTTPRequest
+    cookie_value: None|pyatdl_pb2.VisitorInfo0
+  Returns:
+    tuple
+  """
+  inputs = (bool(_using_pjax(request)),
+            request.user.username,
+            request.user.email,
+            # A new CSRF secret invalidates the tokens in our forms:
+            request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''))
+  if cookie_value is not None:
+    inputs += (cookie_value.cwc_uid, cookie_value.sort)
+    inputs += _view_filter_inputs(cookie_value.view)
+  return inputs
+
+
+def _conditional_read(inputs_func, use_last_modified=False):
+  """Decorator answering conditional GETs without reading the to-do list.
+
+  The ETag is derived from the to-do list's version and inputs_func's result.
+  POSTs are never conditional. If the inputs include a datetime (see
+  _review_clock), the Last-Modified time is no earlier than it.
+
+  Args:
+    inputs_func: function(request, *args, **kwargs) -> (models.User, tuple)|None
+      # None means no ETag.
+    use_last_modified: bool  # Only for views whose output depends on nothing
+                             # but the URL and the to-do list; otherwise
+                             # If-Modified-Since would wrongly yield a 304 after,
+                             # e.g., a change to the view filter.
+  Returns:
+    function
+  """
+  def EtagFunc(request, *args, **kwargs):
+    if request.method not in ('GET', 'HEAD'):
+      return None
+    x = inputs_func(request, *args, **kwargs)
+    if x is None:
+      return None
+    user, inputs = x
+    return _todolist_etag(request, user, inputs)
+
+  def LastModifiedFunc(request, *args, **kwargs):
+    if request.method not in ('GET', 'HEAD'):
+      return None
+    x = inputs_func(request, *args, **kwargs)
+    if x is None:
+      return None
+    stamp = _todolist_stamp(request, x[0])
+    if stamp is None:
+      return None
+    return max([stamp[1]] + [i for i in x[1]
+                             if isinstance(i, datetime.datetime)])
+
+  return condition(
+    etag_func=EtagFunc,
+    last_modified_func=LastModifiedFunc if use_last_modified else None)
+
+
+# Unlike never_cache, this lets the browser keep a private copy that it must
+# revalidate (see _conditional_read) before each use:
+_revalidate = cache_control(private=True, no_cache=True, max_age=0)
+
+
+def _as_text_etag_inputs(request, the_view_filter):
+  return request.user, ('as_text',) + _view_filter_inputs(the_view_filter)
+
+
+def _as_text2_etag_inputs(request):
+  return request.user, ('as_text2',) + _html_etag_inputs(
+    request, _cookie_value(request))
+
+
+def _search_includes_archived(request):
+  """Does the search opt in to archived actions (see the 'archive' command)?"""
+  return (request.GET.get('archived', '') or
+          request.POST.get('archived', '')) == '1'
+
+
+def _search_etag_inputs(request):
+  return request.user, ('search', request.GET.get('q', ''),
+                        _search_includes_archived(request)) + _html_etag_inputs(
+    request)
+
+
+def _contexts_etag_inputs(request):
+  return request.user, ('contexts',) + _html_etag_inputs(
+    request, _cookie_value(request))
+
+
+def _projects_etag_inputs(request):
+  # The page shows which projects need review regardless of the view filter:
+  return request.user, ('projects', _review_clock()) + _html_etag_inputs(
+    request, _cookie_value(request))
+
+
+def _view_etag_inputs(request, slug):
+  user = _shared_user(slug)
+  if user is None:
+    return None
+  # Each Content-Encoding needs its own strong ETag:
+  return user, ('view', _accepts_gzip(request))
+
+
 # TODO(chandler): For inactive, incomplete i'm not seeing 'foo @someday/maybe'
 # in the inbox; i see only inactive projects.
 @xframe_options_sameorigin
-@never_cache
+@_revalidate
 @login_required
+@_conditional_read(_as_text_etag_inputs, use_last_modified=True)
 def as_text(request, the_view_filter):
   if request.method != 'GET':
     raise Http404()
@@ -608,8 +1495,10 @@ def as_text(request, the_view_filter):
 
 
 @djpjax.pjax()
-@never_cache
+@_revalidate
+@vary_on_headers('X-PJAX')
 @login_required
+@_conditional_read(_as_text2_etag_inputs)
 def as_text2(request):
   if request.method != 'GET' and request.method != 'POST':
     raise Http404()
@@ -640,17 +1529,21 @@ def as_text2(request):
 
 
 @djpjax.pjax()
-@never_cache
+@_revalidate
+@vary_on_headers('X-PJAX')
 @login_required
+@_conditional_read(_search_etag_inputs)
 def search(request):
   if request.method != 'GET' and request.method != 'POST':
     raise Http404()
   search_query = request.GET.get('q', '') or request.POST.get('q', '')
+  include_archived = _search_includes_archived(request)
   template_dict = {"Flash": "", "Title": "Search"}
   try:
     x = _apply_batch_of_commands(
       request.user,
-      ["view all_even_deleted",
+      ["view --%sinclude_archived all_even_deleted"
+       % ('' if include_archived else 'no'),
        "sort alpha",
        "hypertext --search_query %s /todo" % pipes.quote(search_query) if search_query else "hypertext /todo"],
       read_only=True)
@@ -703,8 +1596,10 @@ def update_todolist(request): # /todo/cli
 
 
 @djpjax.pjax()
-@never_cache
+@_revalidate
+@vary_on_headers('X-PJAX')
 @login_required
+@_conditional_read(_contexts_etag_inputs)
 def contexts(request):
   cookie_value = _cookie_value(request)
   template_dict = {"Flash": ""}
@@ -733,7 +1628,6 @@ def contexts(request):
 def _contexts_get(request, template_dict, cookie_value):  # mutates template_dict
   lsctx = _apply_batch_of_commands(request.user, ['lsctx --json'], read_only=True,
                                    saved_read=None, cookie=cookie_value)
-  assert lsctx['saved_read'] is not None
   assert len(lsctx['printed']) == 1, lsctx['printed']
   template_dict.update({
     "ContextsJSON": lsctx['printed'][0],
@@ -779,35 +1673,41 @@ def context(request, uid):
   return _context_get(request, uid, template_dict, cookie_value)
 
 
-def _context_get(request, uid, template_dict, cookie_value):  # mutates template_dict
-  inctx = _apply_batch_of_commands(
-    request.user, ['inctx --sort_by uid --json %s' % ('uid=%d' % uid)],
-    read_only=True,
-    saved_read=None, cookie=cookie_value)
+@_revalidate
+@login_required
+def context_json(request, uid):
+  """Returns JSON for one page of the actions in a context.
+
+  GET parameter 'cursor' is the 'next_cursor' of the previous page. See 'help
+  inctx'.
+  """
+  if request.method != 'GET':
+    raise Http404()
+  cookie_value = _cookie_value(request)
+  uid = int(uid, 10)
+  try:
+    inctx = _apply_batch_of_commands(
+      request.user,
+      ['inctx --json --limit %d --cursor %s uid=%d'
+       % (_ACTIONS_PER_PAGE, pipes.quote(request.GET.get('cursor', '')), uid)],
+      read_only=True, cookie=cookie_value)
+  except immaculater.Error as e:
+    return JsonResponse({'error': unicode(e)}, status=422)
   assert len(inctx['printed']) == 1, inctx['printed']
-  saved_read = inctx['saved_read']
-  if uid == 0:
-    lsctx = {'printed':
-             ['{"ctime":null,"dtime":null,"is_active":true,"is_complete":false,"is_deleted":false,"mtime":null,"name":"%s","uid":0}'
-              % FLAGS.no_context_display_string]}
-  else:
-    lsctx = _apply_batch_of_commands(
-      request.user, ['lsctx --json uid=%d' % uid],
-      read_only=True,
-      saved_read=saved_read, cookie=cookie_value)
-    assert len(lsctx['printed']) == 1, lsctx['printed']
-  if uid == 0:
-    note = _apply_batch_of_commands(request.user, ['note :__actions_without_context'],
-                                    read_only=True, saved_read=saved_read)
-  else:
-    note = _apply_batch_of_commands(request.user, ['note uid=%d' % uid],
-                                    read_only=True, saved_read=saved_read)
+  return HttpResponse(inctx['printed'][0], content_type='application/json')
+
+
+def _context_get(request, uid, template_dict, cookie_value):  # mutates template_dict
+  page_data = _page_data(
+    request.user,
+    'pagedata --limit %d context uid=%d' % (_ACTIONS_PER_PAGE, uid),
+    cookie=cookie_value)
   template_dict.update(
-    {"InctxJSON": inctx['printed'][0],
-     "LsctxJSON": lsctx['printed'][0],
+    {"InctxJSON": page_data['inctx'],
+     "LsctxJSON": page_data['lsctx'],
      "UID": unicode(uid),
      "ViewFilter": cookie_value.view,
-     "Note": '\n'.join(note['printed']),
+     "Note": page_data['note'],
      "Title": "Context"})
   response = _render(
     request,
@@ -818,8 +1718,10 @@ def _context_get(request, uid, template_dict, cookie_value):  # mutates template
 
 
 @djpjax.pjax()
-@never_cache
+@_revalidate
+@vary_on_headers('X-PJAX')
 @login_required
+@_conditional_read(_projects_etag_inputs)
 def projects(request):
   cookie_value = _cookie_value(request)
   template_dict = {"Flash": ""}
@@ -871,19 +1773,11 @@ def projects(request):
 
 
 def _projects_get(request, template_dict, cookie_value):  # mutates template_dict
-  lsprj = _apply_batch_of_commands(request.user, ['lsprj --json'],
-                                   read_only=True, saved_read=None,
-                                   cookie=cookie_value)
-  saved_read = lsprj['saved_read']
-  assert saved_read is not None
-  assert len(lsprj['printed']) == 1, lsprj['printed']
-  needsreview = _apply_batch_of_commands(request.user, ['needsreview --json'],
-                                         read_only=True, saved_read=saved_read,
-                                         cookie=cookie_value)
-  assert len(needsreview['printed']) == 1, needsreview['printed']
+  page_data = _page_data(request.user, 'pagedata projects',
+                         cookie=cookie_value)
   template_dict.update(
-    {"ProjectsJSON": lsprj['printed'][0],
-     "NeedsreviewJSON": needsreview['printed'][0],
+    {"ProjectsJSON": page_data['lsprj'],
+     "NeedsreviewJSON": page_data['needsreview'],
      "ViewFilter": cookie_value.view,
      "Title": "Projects"})
   response = _render(
@@ -927,35 +1821,17 @@ def project(request, uid):
 
 
 def _project_get(request, uid, template_dict, cookie_value):
-  inprj = _apply_batch_of_commands(request.user, ['inprj --json uid=%s' % uid],
-                                   read_only=True, saved_read=None,
-                                   cookie=cookie_value)
-  saved_read = inprj['saved_read']
-  assert saved_read is not None
-  assert len(inprj['printed']) == 1, inprj['printed']
-  needsreview = _apply_batch_of_commands(request.user, ['needsreview --json'],
-                                         read_only=True, saved_read=saved_read,
-                                         cookie=cookie_value)
-  assert len(needsreview['printed']) == 1, needsreview['printed']
-  lsprj = _apply_batch_of_commands(request.user, ['lsprj --json uid=%s' % uid],
-                                 read_only=True, saved_read=saved_read,
-                                 cookie=cookie_value)
-  assert len(lsprj['printed']) == 1, lsprj['printed']
-  note = _apply_batch_of_commands(request.user, ['note uid=%d' % uid],
-                                  read_only=True, saved_read=saved_read)
-  lsctx = _apply_batch_of_commands(request.user,
-                                   ['view incomplete', 'sort alpha', 'lsctx --json'],
-                                   read_only=True, saved_read=saved_read)
-  assert len(lsctx['printed']) == 1, lsctx['printed']
+  page_data = _page_data(request.user, 'pagedata project uid=%d' % uid,
+                         cookie=cookie_value)
   template_dict.update(
-    {"InprjJSON": inprj['printed'][0],
-     "NeedsreviewJSON": needsreview['printed'][0],
-     "LsprjJSON": lsprj['printed'][0],
-     "UndeletedLsctxJSON": lsctx['printed'][0],
+    {"InprjJSON": page_data['inprj'],
+     "NeedsreviewJSON": page_data['needsreview'],
+     "LsprjJSON": page_data['lsprj'],
+     "UndeletedLsctxJSON": page_data['undeleted_lsctx'],
      "UID": unicode(uid),
      "ViewFilter": cookie_value.view,
      "Title": "Project",
-     "Note": '\n'.join(note['printed'])})
+     "Note": page_data['note']})
   response = _render(
     request,
     "project.html",
@@ -968,23 +1844,102 @@ def _using_pjax(request):
   return request.META.get('HTTP_X_PJAX', False)
 
 
+def _share_cache_key(user_id):
+  return '%s:%d' % (_SHARE_CACHE_KEY_PREFIX, user_id)
+
+
+def _share_cache_max_bytes():
+  """Rendered shares larger than this are not cached.
+
+  The default is below memcached's default limit of 1 MB per item.
+  """
+  return int(os.environ.get('IMMACULATER_SHARE_CACHE_MAX_BYTES', 900 * 1000))
+
+
+def _accepts_gzip(request):
+  return bool(_ACCEPTS_GZIP_RE.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+
+
+def _gzipped(some_bytes):
+  f = StringIO.StringIO()
+  # mtime=0 makes the output a function of the input alone.
+  with gzip.GzipFile(mode='wb', fileobj=f, mtime=0) as g:
+    g.write(some_bytes)
+  return f.getvalue()
+
+
+def _rendered_share(request, user):
+  """Returns the shared to-do list as plain text and gzipped plain text.
+
+  The result is cached along with the version of the to-do list it reflects,
+  so we deserialize at most once per version (modulo cache eviction and
+  concurrent misses). SerializationWriter invalidates the cache. Because the cache may be a shared
+  memcached, what we cache is encrypted just like the to-do list is in the DB.
+
+  Args:
+    request: HTTPRequest
+    user: models.User
+  Returns:
+    (bytes, bytes)  # (utf-8, gzipped utf-8)
+  Raises:
+    immaculater.Error
+  """
+  stamp = _todolist_stamp(request, user)
+  version = None if stamp is None else stamp[0]
+  key = _share_cache_key(user.id)
+  if version is not None:
+    cached = cache.get(key)
+    if cached is not None and cached[0] == version:
+      try:
+        result = tuple(_unencrypted_todolist_protobuf(c) for c in cached[1:])
+        metrics.registry.inc('immaculater_cache_requests_total',
+                             ['share', 'hit'])
+        return result
+      except InvalidTag:
+        _debug_log('Invalid cached share %s' % key)
+    metrics.registry.inc('immaculater_cache_requests_total', ['share', 'miss'])
+  xx = _apply_batch_of_commands(
+    user,
+    ["view all", "sort alpha", "astaskpaper"],
+    read_only=True)
+  text = u'\n'.join(xx['printed']).encode('utf-8')
+  gzipped = _gzipped(text)
+  if version is not None and len(text) + len(gzipped) <= _share_cache_max_bytes():
+    cache.set(key,
+              (version,
+               _encrypted_todolist_protobuf(text),
+               _encrypted_todolist_protobuf(gzipped)),
+              24 * 60 * 60)
+  return text, gzipped
+
+
+def _shared_user(slug):
+  """Returns the models.User sharing their to-do list as slug, or None."""
+  x = models.Share.objects.filter(slug=slug).select_related('user')
+  if not x or not x[0].is_active or not x[0].user.is_active:
+    return None
+  return x[0].user
+
+
 # no login required to view a shared to-do list:
-@never_cache
+@_revalidate
+@_conditional_read(_view_etag_inputs, use_last_modified=True)
 def view(request, slug):
   if request.method != 'GET':
     raise Http404()
-  x = models.Share.objects.filter(slug=slug)
-  if not x or not x[0].is_active or not x[0].user.is_active:
+  user = _shared_user(slug)
+  if user is None:
     raise PermissionDenied()
-  response = HttpResponse(content_type='text/plain;charset=utf-8')
   try:
-    xx = _apply_batch_of_commands(
-      x[0].user,
-      ["view all", "sort alpha", "astaskpaper"],
-      read_only=True)
-    response.write(u'\n'.join(xx['printed']))
+    text, gzipped = _rendered_share(request, user)
   except immaculater.Error as e:
     return _error_page(request, unicode(e))
+  if _accepts_gzip(request):
+    response = HttpResponse(gzipped, content_type='text/plain;charset=utf-8')
+    response['Content-Encoding'] = 'gzip'
+  else:
+    response = HttpResponse(text, content_type='text/plain;charset=utf-8')
+  patch_vary_headers(response, ('Accept-Encoding',))
   return response
 
 
@@ -1018,29 +1973,14 @@ def action(request, uid):
 
 def _action_get(request, uid, template_dict):  # mutates template_dict
   try:
-    lsact = _apply_batch_of_commands(
-        request.user,
-        ['lsact --json uid=%d' % uid],
-        read_only=True, saved_read=None)
+    page_data = _page_data(request.user, 'pagedata action uid=%d' % uid)
   except immaculater.Error as e:
     return _error_page(request, unicode(e))
-  assert len(lsact['printed']) == 1, lsact['printed']
-  saved_read = lsact['saved_read']
-  lsctx = _apply_batch_of_commands(request.user,
-                                   ['view incomplete', 'sort alpha', 'lsctx --json'],
-                                   read_only=True, saved_read=saved_read)
-  assert len(lsctx['printed']) == 1, lsctx['printed']
-  lsprj = _apply_batch_of_commands(request.user,
-                                   ['view incomplete', 'sort alpha', 'lsprj --json'],
-                                   read_only=True, saved_read=saved_read)
-  assert len(lsprj['printed']) == 1, lsprj['printed']
-  note = _apply_batch_of_commands(request.user, ['note uid=%d' % uid],
-                                  read_only=True, saved_read=saved_read)
   template_dict.update(
-    {"LsactJSON": lsact['printed'][0],
-     "UndeletedLsctxJSON": lsctx['printed'][0],
-     "UndeletedLsprjJSON": lsprj['printed'][0],
-     "Note": '\n'.join(note['printed']),
+    {"LsactJSON": page_data['lsact'],
+     "UndeletedLsctxJSON": page_data['undeleted_lsctx'],
+     "UndeletedLsprjJSON": page_data['undeleted_lsprj'],
+     "Note": page_data['note'],
      "Title": "Action",
      "UID": unicode(uid)})
   return _render(
@@ -1052,6 +1992,10 @@ def _action_get(request, uid, template_dict):  # mutates template_dict
 def _create_new_action(request, template_dict, var_name='new_action'):
   new_action = request.POST.get(var_name, '').strip()
   if new_action:
+    # 'do' is 'cd uid=1; mkact --autoprj --allow_slashes' and we can queue it:
+    if _queued_capture(request.user, u'do %s' % (pipes.quote(new_action),)):
+      template_dict['Flash'] = '<a href="/todo/project/1"><strong>Action captured in your Inbox.</strong></a>'
+      return True, None
     try:
        result = _apply_batch_of_commands(
            request.user,
@@ -1143,7 +2087,29 @@ def dl(request):
       assert not _using_pjax(request)
       response = HttpResponse(content_type='application/octet-stream')
       response['Content-Disposition'] = 'attachment; filename="immaculater.dat"'
-      response.write(SerializationReader(request.user).read())
+      # Sharded or not, we export the single-blob format that 'load' reads:
+      response.write(serialization.GetSingleBlob(
+        SerializationReader(request.user)))
+      return response
+    elif request.POST.get('command') == 'dljsonl':
+      assert not _using_pjax(request)
+      reader = SerializationReader(request.user)
+      todolist = serialization.DeserializeToDoList2(
+        reader, tdl_factory=uicmd.NewToDoList)
+      # Once we have begun streaming we can no longer report an error, so we
+      # read every shard and the archive now. We keep only their stored bytes;
+      # jsonlines.Export builds the objects one project at a time.
+      unfetched = [p.uid for p, unused_path in todolist.Projects()
+                   if not p.IsFetched()]
+      if unfetched:
+        reader.read_shards(unfetched)
+      loader = todolist.ArchiveLoader()
+      if loader is not None:
+        archive = loader()
+        todolist.SetArchiveLoader(lambda: archive)
+      response = StreamingHttpResponse(jsonlines.Export(todolist),
+                                       content_type='application/x-ndjson')
+      response['Content-Disposition'] = 'attachment; filename="immaculater.jsonl"'
       return response
     elif request.POST.get('command') == 'purgedeleted':
       _apply_batch_of_commands(  # will not throw an exception
@@ -1340,11 +2306,30 @@ def api(request):
   curl -X POST -d 'cmd=view needing_review' -d 'cmd=ls' -u foo:bar http://127.0.0.1:5000/todo/api
 
   curl -X POST -d 'cmdro=cd /inbox' -d 'cmdro=ls' -u foo:bar http://127.0.0.1:5000/todo/api
+
+  The JSON-emitting commands take --limit and --cursor, e.g. 'lsprj --json
+  --limit 50'; pass the 'next_cursor' of one page as the --cursor of the next.
+
+  Read-only responses carry an ETag. Send it back as If-None-Match and you'll
+  get 304 Not Modified if your to-do list has not changed.
+
+  A lone 'do' or 'maybe' command is queued (see _queued_capture), so its
+  action's UID is assigned when the next command reads the to-do list.
+
+  Sync clients can fetch just what changed (see 'help changes') like so:
+
+  curl -X POST -d 'changes_since=1500000000.5' -u foo:bar http://127.0.0.1:5000/todo/api
+
+  The response is the output of 'changes --json'; pass its 'next_since' as
+  changes_since next time.
   """
   if request.method != 'POST':
     raise Http404()
   user = _authenticated_user_via_basic_auth(request)
   assert user is not None
+  changes_since = request.POST.get('changes_since')
+  if changes_since:
+    return _api_changes(request, user, changes_since)
   read_only = False
   cmd_list = request.POST.getlist('cmdro', [])
   if cmd_list:
@@ -1379,14 +2364,53 @@ def api(request):
         else:
           return JsonResponse({"error": "read_only must be True/False/'true'/'false'"},
                               status=422)
+  etag = None
+  if read_only:
+    # Pollers send If-None-Match so that we can skip the deserialization.
+    etag = _todolist_etag(request, user, _api_etag_inputs(cmd_list))
+    if etag is not None and quote_etag(etag) in parse_etags(
+        request.META.get('HTTP_IF_NONE_MATCH', '')):
+      response = HttpResponseNotModified()
+      response['ETag'] = quote_etag(etag)
+      return response
+  if not read_only and len(cmd_list) == 1 and _queued_capture(user, cmd_list[0]):
+    # Just what the batch would have returned; 'do' and 'maybe' print nothing.
+    return JsonResponse({'pwd': FLAGS.pyatdl_separator,
+                         'printed': [],
+                         'view': view_filter.CLS_BY_UI_NAME[
+                           'default'].ViewFilterUINames()[0]})
   try:
     results = _apply_batch_of_commands(user, cmd_list, read_only=read_only)
-    return JsonResponse({'pwd': results['pwd'],
-                         'printed': results['printed'],
-                         'view': results['view']})
+    response = JsonResponse({'pwd': results['pwd'],
+                             'printed': results['printed'],
+                             'view': results['view']})
+    if etag is not None:
+      response['ETag'] = quote_etag(etag)
+    return response
   except immaculater.Error as error:
     _debug_log(u'api command failed: %s' % unicode(error))
-return JsonResponse({'error': 'Command failed. Please try again.', 'immaculater_error': 'Command failed. Please try again.'}, status=422)
+  return JsonResponse({'error': 'Command failed. Please try again.', 'immaculater_error': 'Command failed. Please try again.'}, status=422)
+
+
+def _api_changes(request, user, since):
+  """Returns the JSON output of the 'changes' command; see api."""
+  cmd_list = ['changes --json --since %s' % pipes.quote(since)]
+  etag = _todolist_etag(request, user, _api_etag_inputs(cmd_list))
+  if etag is not None and quote_etag(etag) in parse_etags(
+      request.META.get('HTTP_IF_NONE_MATCH', '')):
+    response = HttpResponseNotModified()
+    response['ETag'] = quote_etag(etag)
+    return response
+  try:
+    results = _apply_batch_of_commands(user, cmd_list, read_only=True)
+  except immaculater.Error as error:
+    _debug_log(u'api changes failed: %s' % unicode(error))
+    return JsonResponse({'error': 'Command failed. Please try again.', 'immaculater_error': 'Command failed. Please try again.'}, status=422)
+  response = HttpResponse(results['printed'][-1],
+                          content_type='application/json')
+  if etag is not None:
+    response['ETag'] = quote_etag(etag)
+  return response
 
 
 def _slackapi(request):
@@ -1401,6 +2425,8 @@ def _slackapi(request):
   cmd = request.POST.get(u'text')
   if not cmd:
     cmd = u'help'
+  if _queued_capture(user, cmd):
+    return HttpResponse(u'Command succeeded.', content_type="text/plain")
   try:
     results = _apply_batch_of_commands(user, [cmd], read_only=False)
     _debug_log(u'we have a batch')
@@ -1411,6 +2437,151 @@ def _slackapi(request):
     return HttpResponse(u'Command failed. Please try again.', content_type="text/plain")
 
 
+def _watch_max_seconds():
+  """Returns the longest a watch request may wait; see watch.
+
+  The default, zero, suits gunicorn's default sync workers, each of which a
+  waiting request would tie up. We cannot use threaded or gevent workers
+  instead because the commands keep their state in gflags, which are global.
+  """
+  return float(os.environ.get('IMMACULATER_WATCH_MAX_SECONDS', 0))
+
+
+def _watch_poll_seconds():
+  """Returns how often a watch request checks the DB for other processes' writes."""
+  return float(os.environ.get('IMMACULATER_WATCH_POLL_SECONDS', 2))
+
+
+def _watch_version(request, user):
+  """Returns the version of the user's to-do list as watch reports it."""
+  getattr(request, '_todolist_stamps', {}).pop(user.id, None)
+  stamp = _todolist_stamp(request, user)
+  if stamp is None:
+    return '0.0'
+  version, latest_capture_id = stamp[0]
+  return '%d.%d' % (version, latest_capture_id or 0)
+
+
+@never_cache
+@csrf_exempt
+def watch(request):
+  """Tells whether the to-do list changed; cheaper than polling a page.
+
+  Returns
+
+  {"version": str, "changed": bool, "changed_uids": [int], "next_since": float}
+
+  where changed tells whether the version differs from the 'version'
+  parameter. Pass version back next time, or send the response's ETag in an
+  If-None-Match header instead and get a 304 if nothing changed. Omit both to
+  get the current version. changed_uids and next_since are present only if it
+  changed and you gave a 'since' parameter; they are as for 'changes --json
+  --since', which see.
+
+  By default we answer right away, and the client polls. If
+  IMMACULATER_WATCH_MAX_SECONDS is positive, we instead long-poll, waiting
+  until it changes or 'timeout' seconds (at most that) pass. Waiting costs a
+  cheap DB query every IMMACULATER_WATCH_POLL_SECONDS, which is how we notice
+  writes by other processes. Writes by this process wake us right away.
+
+  Example usage:
+
+  curl -u foo:bar 'http://127.0.0.1:5000/todo/watch?version=12.0&since=1500000000.5'
+
+  The browser may use its session instead of basic auth.
+  """
+  if request.user.is_authenticated:
+    user = request.user
+  else:
+    user = _authenticated_user_via_basic_auth(request)
+  known_version = request.GET.get('version')
+  etag_given = known_version is None and _watched_version_etag(request)
+  if etag_given:
+    known_version = etag_given
+  try:
+    timeout = min(float(request.GET.get('timeout', _watch_max_seconds())),
+                  _watch_max_seconds())
+  except ValueError:
+    return HttpResponseBadRequest('Invalid timeout')
+  deadline = time.time() + timeout
+  while True:
+    # Reading the count first means we miss no write made after the query.
+    with _write_condition:
+      count = _write_counts[user.id]
+    version = _watch_version(request, user)
+    if version != known_version or known_version is None:
+      break
+    now = time.time()
+    if now >= deadline:
+      if etag_given:
+        response = HttpResponseNotModified()
+      else:
+        response = JsonResponse({'version': version, 'changed': False})
+      response['ETag'] = quote_etag(version)
+      return response
+    wake_up = min(deadline, now + _watch_poll_seconds())
+    with _write_condition:
+      while _write_counts[user.id] == count and time.time() < wake_up:
+        _write_condition.wait(wake_up - time.time())
+  result = {'version': version, 'changed': known_version is not None}
+  since = request.GET.get('since')
+  if since and result['changed']:
+    try:
+      results = _apply_batch_of_commands(
+        user, ['changes --json --since %s' % pipes.quote(since)],
+        read_only=True)
+    except immaculater.Error as error:
+      _debug_log(u'watch failed: %s' % unicode(error))
+      return HttpResponseBadRequest('Invalid since')
+    changes = json.loads(results['printed'][-1])
+    result['changed_uids'] = sorted(set(c['uid'] for c in changes['changes']))
+    result['next_since'] = changes['next_since']
+  response = JsonResponse(result)
+  response['ETag'] = quote_etag(version)
+  return response
+
+
+def _watched_version_etag(request):
+  """Returns the version in the request's If-None-Match header, or None."""
+  for etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+    match = re.match(r'^(?:W/)?"(.*)"$', etag)
+    if match:
+      return match.group(1)
+  return None
+
+
+def _metrics_token():
+  """Returns the bearer token with which Prometheus may scrape metrics, or None."""
+  return os.environ.get('IMMACULATER_METRICS_TOKEN') or None
+
+
+@never_cache
+def prometheus_metrics(request):
+  """Our metrics in Prometheus's text format; see module metrics.
+
+  Send 'Authorization: Bearer <IMMACULATER_METRICS_TOKEN>' or be a staff user,
+  signed in or using basic auth.
+
+  Example usage:
+
+  curl -H "Authorization: Bearer $IMMACULATER_METRICS_TOKEN" http://127.0.0.1:5000/todo/metrics
+  """
+  auth = request.META.get('HTTP_AUTHORIZATION', '').split()
+  if len(auth) == 2 and auth[0].lower() == 'bearer':
+    token = _metrics_token()
+    if token is None or not hmac.compare_digest(auth[1].encode('utf-8'),
+                                                token.encode('utf-8')):
+      raise PermissionDenied()
+  else:
+    if request.user.is_authenticated:
+      user = request.user
+    else:
+      user = _authenticated_user_via_basic_auth(request)
+    if not user.is_staff:
+      raise PermissionDenied()
+  return HttpResponse(metrics.registry.text(), content_type=metrics.CONTENT_TYPE)
+
+
 @never_cache
 @csrf_exempt
 def slackapi(request):